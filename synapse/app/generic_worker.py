@@ -17,6 +17,7 @@
 import contextlib
 import logging
 import sys
+from typing import Dict
 
 from twisted.internet import defer, reactor
 from twisted.web.resource import NoResource
@@ -45,6 +46,12 @@ from synapse.http.site import SynapseSite
 from synapse.logging.context import LoggingContext, run_in_background
 from synapse.metrics import METRICS_PREFIX, MetricsResource, RegistryProxy
 from synapse.metrics.background_process_metrics import run_as_background_process
+from synapse.replication.http import REPLICATION_PREFIX
+from synapse.replication.http.federation import (
+    ReplicationCleanRoomRestServlet,
+    ReplicationFederationSendEventsRestServlet,
+)
+from synapse.replication.http.send_event import ReplicationSendEventRestServlet
 from synapse.replication.slave.storage._base import BaseSlavedStore, __func__
 from synapse.replication.slave.storage.account_data import SlavedAccountDataStore
 from synapse.replication.slave.storage.appservice import SlavedApplicationServiceStore
@@ -65,6 +72,7 @@ from synapse.replication.slave.storage.registration import SlavedRegistrationSto
 from synapse.replication.slave.storage.room import RoomStore
 from synapse.replication.slave.storage.transactions import SlavedTransactionStore
 from synapse.replication.tcp.client import ReplicationClientHandler
+from synapse.replication.tcp.commands import WriterPositionCommand
 from synapse.replication.tcp.streams._base import (
     DeviceListsStream,
     ReceiptsStream,
@@ -103,6 +111,7 @@ from synapse.rest.client.v2_alpha.register import RegisterRestServlet
 from synapse.rest.client.versions import VersionsRestServlet
 from synapse.rest.key.v2 import KeyApiV2Resource
 from synapse.server import HomeServer
+from synapse.storage.data_stores.main import DataStore
 from synapse.storage.data_stores.main.media_repository import MediaRepositoryStore
 from synapse.storage.data_stores.main.monthly_active_users import (
     MonthlyActiveUsersWorkerStore,
@@ -280,6 +289,11 @@ class GenericWorkerPresence(object):
         # TODO Hows this supposed to work?
         return defer.succeed(None)
 
+    async def bump_presence_active_time(self, user):
+        # Event persisters send messages on behalf of the process the client
+        # is talking to, which is the one which should keep track of presence.
+        pass
+
     get_states = __func__(PresenceHandler.get_states)
     get_state = __func__(PresenceHandler.get_state)
     current_state_for_users = __func__(PresenceHandler.current_state_for_users)
@@ -438,6 +452,53 @@ class GenericWorkerSlavedStore(
         return rows[0][0] if rows else -1
 
 
+class GenericWorkerEventPersisterStore(DataStore):
+    """The store used by event persisters.
+
+    Event persisters write to the same tables as the main process when they
+    persist events, so they use the main process's store. However, they follow
+    the updates of the other processes over replication.
+    """
+
+    def stream_positions(self):
+        pos = {
+            "events": self._stream_id_gen.get_current_token(),
+            "backfill": -self._backfill_id_gen.get_current_token(),
+        }
+        if self._cache_id_gen:
+            pos["caches"] = self._cache_id_gen.get_current_token()
+        return pos
+
+    def process_replication_rows(self, stream_name, token, rows):
+        # Our positions in the streams with multiple writers are advanced by
+        # the writers' WRITER_POSITION commands rather than by the streams
+        # themselves.
+        if stream_name == "events":
+            for row in rows:
+                self._process_event_stream_row(token, row)
+        elif stream_name == "backfill":
+            for row in rows:
+                self.invalidate_caches_for_event(
+                    -token,
+                    row.event_id,
+                    row.room_id,
+                    row.type,
+                    row.state_key,
+                    row.redacts,
+                    row.relates_to,
+                    backfilled=True,
+                )
+        elif stream_name == "caches":
+            for row in rows:
+                if row.is_bulk:
+                    for keys in row.keys:
+                        self._invalidate_cache_from_replication(row.cache_func, keys)
+                else:
+                    self._invalidate_cache_from_replication(row.cache_func, row.keys)
+
+    _process_event_stream_row = __func__(SlavedEventStore._process_event_stream_row)
+
+
 class GenericWorkerServer(HomeServer):
     DATASTORE_CLASS = GenericWorkerSlavedStore
 
@@ -530,6 +591,26 @@ class GenericWorkerServer(HomeServer):
                 if name in ["keys", "federation"]:
                     resources[SERVER_KEY_V2_PREFIX] = KeyApiV2Resource(self)
 
+                if name == "replication":
+                    if (
+                        self.config.worker.instance_name
+                        in self.config.worker.writers.events
+                    ):
+                        # The other processes send the events which we are
+                        # responsible for persisting here.
+                        resource = JsonResource(self, canonical_json=False)
+                        ReplicationSendEventRestServlet(self).register(resource)
+                        ReplicationFederationSendEventsRestServlet(self).register(
+                            resource
+                        )
+                        ReplicationCleanRoomRestServlet(self).register(resource)
+                        resources[REPLICATION_PREFIX] = resource
+                    else:
+                        logger.warning(
+                            "A 'replication' listener is configured but this"
+                            " worker is not an event persister. Ignoring."
+                        )
+
         root_resource = create_resource_tree(resources, NoResource())
 
         _base.listen_tcp(
@@ -587,6 +668,10 @@ class GenericWorkerServer(HomeServer):
         return GenericWorkerTyping(self)
 
 
+class GenericWorkerEventPersisterServer(GenericWorkerServer):
+    DATASTORE_CLASS = GenericWorkerEventPersisterStore
+
+
 class GenericWorkerReplicationHandler(ReplicationClientHandler):
     def __init__(self, hs):
         super(GenericWorkerReplicationHandler, self).__init__(hs.get_datastore())
@@ -605,6 +690,14 @@ class GenericWorkerReplicationHandler(ReplicationClientHandler):
         else:
             self.send_handler = None
 
+        # If we persist events, we tell the other processes which write to the
+        # main store's streams our positions whenever they change.
+        self._instance_name = hs.config.worker.instance_name
+        self._is_event_writer = hs.config.worker.sends_writer_positions
+        self._last_sent_writer_positions = {}  # type: Dict[str, int]
+        if self._is_event_writer:
+            self.notifier.add_replication_callback(self._send_own_writer_positions)
+
     async def on_rdata(self, stream_name, token, rows):
         await super(GenericWorkerReplicationHandler, self).on_rdata(
             stream_name, token, rows
@@ -621,6 +714,44 @@ class GenericWorkerReplicationHandler(ReplicationClientHandler):
     def get_currently_syncing_users(self):
         return self.presence_handler.get_currently_syncing_users()
 
+    def update_connection(self, connection):
+        super(GenericWorkerReplicationHandler, self).update_connection(connection)
+
+        if connection and self._is_event_writer:
+            # The other end may not know where we are, e.g. if it restarted.
+            self._last_sent_writer_positions = {}
+            self._send_own_writer_positions()
+
+    def on_writer_position(self, stream_name, instance_name, token):
+        if not self._is_event_writer or instance_name == self._instance_name:
+            # Other workers follow the events stream from the main process.
+            return
+
+        prev_token = self.store.get_room_max_stream_ordering()
+        self.store.advance_writer_position(stream_name, instance_name, token)
+        new_token = self.store.get_room_max_stream_ordering()
+
+        if new_token > prev_token:
+            self.notifier.on_room_stream_advanced(new_token)
+
+        # If we were idle our own position will have moved on too.
+        self._send_own_writer_positions()
+
+    def _send_own_writer_positions(self):
+        if not self.connection:
+            # We'll send them when we reconnect.
+            return
+
+        positions = self.store.get_writer_positions(self._instance_name)
+        for stream_name, token in positions.items():
+            if self._last_sent_writer_positions.get(stream_name) == token:
+                continue
+            self._last_sent_writer_positions[stream_name] = token
+
+            self.send_command(
+                WriterPositionCommand(stream_name, self._instance_name, token)
+            )
+
     async def process_and_notify(self, stream_name, token, rows):
         try:
             if self.send_handler:
@@ -902,7 +1033,12 @@ def start(config_options):
 
     synapse.events.USE_FROZEN_DICTS = config.use_frozen_dicts
 
-    ss = GenericWorkerServer(
+    if config.worker.instance_name in config.worker.writers.events:
+        server_class = GenericWorkerEventPersisterServer
+    else:
+        server_class = GenericWorkerServer
+
+    ss = server_class(
         config.server_name,
         config=config,
         version_string="Synapse/" + get_version_string(synapse),
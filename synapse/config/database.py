@@ -59,6 +59,30 @@ class DatabaseConfig(Config):
     def read_config(self, config, **kwargs):
         self.event_cache_size = self.parse_size(config.get("event_cache_size", "10K"))
 
+        # Whether to defer decoding the bodies of events fetched from the
+        # database until they are needed.
+        self.lazy_event_decoding = config.get("lazy_event_decoding", True)
+
+        self.event_fetch_threads = config.get("event_fetch_threads", 3)
+        if self.event_fetch_threads < 1:
+            raise ConfigError("'event_fetch_threads' must be at least 1")
+
+        # An optional second-level event cache, shared by the processes on this
+        # host through a memory-mapped file.
+        self.shared_event_cache_path = config.get("shared_event_cache_path")
+        self.shared_event_cache_size = self.parse_size(
+            config.get("shared_event_cache_size", "256M")
+        )
+
+        # How long to wait for more events to persist in the same transaction.
+        self.event_persistence_batch_latency_ms = config.get(
+            "event_persistence_batch_latency_ms", 0
+        )
+        if self.event_persistence_batch_latency_ms < 0:
+            raise ConfigError(
+                "'event_persistence_batch_latency_ms' must not be negative"
+            )
+
         # We *experimentally* support specifying multiple databases via the
         # `databases` key. This is a map from a label to database config in the
         # same format as the `database` config option, plus an extra
@@ -122,6 +146,44 @@ class DatabaseConfig(Config):
         # Number of events to cache in memory.
         #
         #event_cache_size: 10K
+
+        # Whether to defer decoding the JSON body of events loaded from the
+        # database until their content is needed. This reduces CPU and memory
+        # usage when only the type, sender or state key of an event is used,
+        # as is the case when loading room state. Defaults to 'true'.
+        #
+        #lazy_event_decoding: false
+
+        # The maximum number of threads used to fetch events from the
+        # database and build them into event objects. Each thread holds a
+        # database connection while it is running, so this should be less
+        # than the size of the database connection pool (`cp_max`).
+        # Defaults to 3.
+        #
+        #event_fetch_threads: 5
+
+        # The path of a file through which the processes on this host (the
+        # main process and its workers) share a cache of events loaded from
+        # the database, in addition to each process's own event cache. Every
+        # process on the host should use the same path and size. The file is
+        # memory-mapped, so it is best placed on a tmpfs such as /dev/shm.
+        # By default no shared cache is used.
+        #
+        #shared_event_cache_path: /dev/shm/synapse-event-cache
+
+        # The size of the shared event cache file. Defaults to 256M.
+        #
+        #shared_event_cache_size: 1024M
+
+        # New events for different rooms are persisted together in one
+        # database transaction when they are waiting to be persisted at the
+        # same time. This sets how long, in milliseconds, to wait for more
+        # events to arrive before persisting the events which are waiting,
+        # trading a little latency for fewer, larger transactions on busy
+        # servers. Events are persisted straight away once 100 are waiting.
+        # Defaults to 0, i.e. not to wait.
+        #
+        #event_persistence_batch_latency_ms: 10
         """
             % locals()
         )
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from synapse.python_dependencies import DependencyException, check_requirements
+
+from ._base import Config, ConfigError
+
+
+class RedisConfig(Config):
+    section = "redis"
+
+    def read_config(self, config, **kwargs):
+        redis_config = config.get("redis") or {}
+        self.redis_enabled = redis_config.get("enabled", False)
+
+        if not self.redis_enabled:
+            return
+
+        try:
+            check_requirements("redis")
+        except DependencyException as e:
+            raise ConfigError(e.message)
+
+        self.redis_host = redis_config.get("host", "localhost")
+        self.redis_port = redis_config.get("port", 6379)
+        self.redis_password = redis_config.get("password")
+
+    def generate_config_section(self, **kwargs):
+        return """\
+        # Configuration for sending replication traffic between the main process
+        # and workers over a Redis pub/sub bus, rather than over a TCP connection
+        # from each worker to the main process. This means the main process only
+        # has to send each update once, however many workers there are.
+        #
+        # This must be set the same way on the main process and on every worker.
+        # Workers still need worker_replication_host and
+        # worker_replication_http_port, which they use to catch up with updates
+        # they missed while they weren't connected.
+        #
+        redis:
+          # Uncomment the below to enable Redis support.
+          #
+          #enabled: true
+
+          # Optional host and port to use to connect to redis. Defaults to
+          # localhost and 6379
+          #
+          #host: localhost
+          #port: 6379
+
+          # Optional password if configured on the Redis instance
+          #
+          #password: <secret_password>
+        """
@@ -157,6 +157,23 @@ class ServerConfig(Config):
 
         self.filter_timeline_limit = config.get("filter_timeline_limit", -1)
 
+        # How long to keep completed sync responses, so that clients which
+        # retry a request get the same response rather than us calculating it
+        # again, and how many to keep at most.
+        self.sync_response_cache_duration = self.parse_duration(
+            config.get("sync_response_cache_duration", "2m")
+        )
+        self.sync_response_cache_max_entries = config.get(
+            "sync_response_cache_max_entries", 1000
+        )
+
+        self.initial_sync_room_cache_duration = self.parse_duration(
+            config.get("initial_sync_room_cache_duration", "30m")
+        )
+        self.initial_sync_room_cache_max_entries = config.get(
+            "initial_sync_room_cache_max_entries", 50000
+        )
+
         # Whether we should block invites sent to users on this server
         # (other than those sent by local server admins)
         self.block_non_admin_invites = config.get("block_non_admin_invites", False)
@@ -233,6 +250,16 @@ class ServerConfig(Config):
                 "Invalid range(s) provided in federation_ip_range_blacklist: %s" % e
             )
 
+        # How long to hold back an outgoing federation transaction which isn't
+        # full, waiting for more to send in it. 0 disables batching.
+        self.federation_transaction_max_latency_ms = config.get(
+            "federation_transaction_max_latency_ms", 0
+        )
+        if self.federation_transaction_max_latency_ms < 0:
+            raise ConfigError(
+                "'federation_transaction_max_latency_ms' must not be negative"
+            )
+
         if self.public_baseurl is not None:
             if self.public_baseurl[-1] != "/":
                 self.public_baseurl += "/"
@@ -672,6 +699,33 @@ class ServerConfig(Config):
         #
         #filter_timeline_limit: 5000
 
+        # How long to keep the response to an incremental /sync request after
+        # it completes. Clients which repeat the request, with the same sync
+        # token, filter and timeout, in that time are given the same response
+        # rather than one being calculated again, which helps when many
+        # clients reconnect after a network outage. Set to 0 to disable.
+        # Defaults to 2m.
+        #
+        #sync_response_cache_duration: 5m
+
+        # The maximum number of /sync responses to keep, as above. Defaults to
+        # 1000.
+        #
+        #sync_response_cache_max_entries: 5000
+
+        # How long to keep the timeline and state calculated for each joined
+        # room in an initial /sync. Later initial syncs by the same user, with
+        # the same filter, reuse them for any rooms which haven't changed
+        # since, rather than loading every room again. Set to 0 to disable.
+        # Defaults to 30m.
+        #
+        #initial_sync_room_cache_duration: 1h
+
+        # The maximum number of rooms to keep initial /sync entries for, as
+        # above, across all users. Defaults to 50000.
+        #
+        #initial_sync_room_cache_max_entries: 100000
+
         # Whether room invites to users on this server should be blocked
         # (except those sent by local server admins). The default is False.
         #
@@ -716,6 +770,16 @@ class ServerConfig(Config):
           - 'fe80::/64'
           - 'fc00::/7'
 
+        # Outgoing federation transactions are normally sent as soon as there
+        # is anything to send. If this is set, transactions which aren't full
+        # are held back to collect more events and EDUs, for a window sized
+        # from each destination's recent round trip time and success rate, so
+        # that slow or distant servers get fewer, larger transactions. This
+        # sets the longest, in milliseconds, that anything is held back.
+        # Defaults to 0, i.e. not to hold transactions back.
+        #
+        #federation_transaction_max_latency_ms: 500
+
         # List of ports that Synapse should listen on, their purpose and their
         # configuration.
         #
@@ -13,7 +13,33 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from ._base import Config
+from hashlib import sha256
+from typing import List
+
+import attr
+
+from ._base import Config, ConfigError
+
+
+@attr.s
+class InstanceLocationConfig(object):
+    """The host and port of a process's HTTP replication listener"""
+
+    host = attr.ib(type=str)
+    port = attr.ib(type=int)
+
+
+@attr.s
+class WriterLocations(object):
+    """Which processes write to each of the streams which can have more than
+    one writer.
+
+    Attributes:
+        events: The processes which persist events. Rooms are shared out
+            between them by `WorkerConfig.get_event_writer_for_room`.
+    """
+
+    events = attr.ib(default=attr.Factory(lambda: ["master"]), type=List[str])
 
 
 class WorkerConfig(Config):
@@ -48,6 +74,50 @@ class WorkerConfig(Config):
 
         self.worker_main_http_uri = config.get("worker_main_http_uri", None)
 
+        # The name which identifies this process to the others. The main
+        # process is always called "master".
+        if self.worker_app:
+            self.instance_name = self.worker_name
+        else:
+            self.instance_name = "master"
+
+        # Where to find the HTTP replication listeners of the other processes
+        # (other than the main process, which is given by
+        # worker_replication_host and worker_replication_http_port).
+        instance_map = config.get("instance_map") or {}
+        self.instance_map = {
+            name: InstanceLocationConfig(**c) for name, c in instance_map.items()
+        }
+
+        writers = config.get("stream_writers") or {}
+        self.writers = WriterLocations(**writers)
+
+        if not self.writers.events:
+            raise ConfigError("Must specify at least one writer for events")
+
+        for writer in self.writers.events:
+            if writer != "master" and writer not in self.instance_map:
+                raise ConfigError(
+                    "Instance %r is configured to write events but does not appear"
+                    " in `instance_map` config." % (writer,)
+                )
+
+        # The processes which run the main process's store (the main process
+        # and the event persisters), all of which write to the streams it
+        # writes to as a side effect, such as the cache invalidation stream.
+        self.main_store_writers = ["master"] + [
+            writer for writer in self.writers.events if writer != "master"
+        ]
+
+        # Whether this process persists events while other processes also write
+        # to the main store's streams, in which case it must tell them its
+        # positions in those streams. This is so even with a single event
+        # persister, as the main process still writes to some of them.
+        self.sends_writer_positions = (
+            len(self.main_store_writers) > 1
+            and self.instance_name in self.writers.events
+        )
+
         # This option is really only here to support `--manhole` command line
         # argument.
         manhole = config.get("worker_manhole")
@@ -71,6 +141,20 @@ class WorkerConfig(Config):
                 elif not bind_addresses:
                     bind_addresses.append("")
 
+    def get_event_writer_for_room(self, room_id: str) -> str:
+        """Gets the name of the process which persists the events in the given
+        room.
+
+        Rooms are shared out between the event writers by a hash of the room ID,
+        which is the same in every process.
+        """
+        writers = self.writers.events
+        if len(writers) == 1:
+            return writers[0]
+
+        digest = sha256(room_id.encode("utf8")).digest()
+        return writers[int.from_bytes(digest, "little") % len(writers)]
+
     def read_arguments(self, args):
         # We support a bunch of command line arguments that override options in
         # the config. A lot of these options have a worker_* prefix when running
@@ -18,7 +18,7 @@
 import abc
 import os
 from distutils.util import strtobool
-from typing import Dict, Optional, Type
+from typing import Dict, Optional, Tuple, Type
 
 import six
 
@@ -26,8 +26,9 @@ from unpaddedbase64 import encode_base64
 
 from synapse.api.room_versions import EventFormatVersions, RoomVersion, RoomVersions
 from synapse.types import JsonDict
-from synapse.util.caches import intern_dict
+from synapse.util.caches import intern_dict, intern_string
 from synapse.util.frozenutils import freeze
+from synapse.util.json import json_decoder
 
 # Whether we should use frozen_dict in FrozenEvent. Using frozen_dicts prevents
 # bugs where we accidentally share e.g. signature dicts. However, converting a
@@ -38,6 +39,16 @@ from synapse.util.frozenutils import freeze
 # homeserver object itself.
 USE_FROZEN_DICTS = strtobool(os.environ.get("SYNAPSE_USE_FROZEN_DICTS", "0"))
 
+# The keys of an event which must be supplied up front when constructing an
+# event whose body is decoded lazily (see `make_event_from_json`). Accessing
+# any other key causes the body to be decoded.
+#
+# `state_key` is included as its *absence* is significant: the header of a
+# non-state event must not include it.
+LAZY_EVENT_HEADER_KEYS = frozenset(
+    ("event_id", "room_id", "sender", "type", "state_key")
+)
+
 
 class DictProperty:
     """An object property which delegates to the `_dict` within its parent object."""
@@ -98,6 +109,93 @@ class DefaultDictProperty(DictProperty):
         return instance._dict.get(self.key, self.default)
 
 
+class _EventDictProperty(DictProperty):
+    """A DictProperty for events, which decodes the body of a lazily-constructed
+    event if the key is not part of its header.
+    """
+
+    __slots__ = []  # type: list
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        if instance._lazy_json is not None and self.key not in LAZY_EVENT_HEADER_KEYS:
+            instance._decode_lazy_json()
+        return super().__get__(instance, owner)
+
+    def __set__(self, instance, v):
+        if instance._lazy_json is not None:
+            instance._decode_lazy_json()
+        super().__set__(instance, v)
+
+    def __delete__(self, instance):
+        if instance._lazy_json is not None:
+            instance._decode_lazy_json()
+        super().__delete__(instance)
+
+
+class _EventDefaultDictProperty(DefaultDictProperty):
+    """A DefaultDictProperty for events. See `_EventDictProperty`."""
+
+    __slots__ = []  # type: list
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        if instance._lazy_json is not None and self.key not in LAZY_EVENT_HEADER_KEYS:
+            instance._decode_lazy_json()
+        return super().__get__(instance, owner)
+
+
+def _compact_event_references(refs):
+    """Converts the `prev_events` or `auth_events` of an event to tuples,
+    interning the event IDs.
+
+    For V1 events each reference is a pair of `[event_id, hashes]`, for later
+    versions it is just an event ID.
+    """
+    return tuple(
+        intern_string(ref)
+        if isinstance(ref, str)
+        else (intern_string(ref[0]),) + tuple(ref[1:])
+        for ref in refs
+    )
+
+
+def _split_event_dict(
+    event_dict: JsonDict,
+) -> Tuple[JsonDict, Dict[str, Dict[str, str]], JsonDict]:
+    """Splits the signatures and unsigned data out of an event dict, and
+    converts the remainder into the compact form we hold in memory.
+
+    Returns:
+        A tuple of the remaining event dict, the signatures and unsigned data.
+    """
+    event_dict = dict(event_dict)
+
+    # Signatures is a dict of dicts, and this is faster than doing a
+    # copy.deepcopy
+    signatures = {
+        name: {sig_id: sig for sig_id, sig in sigs.items()}
+        for name, sigs in event_dict.pop("signatures", {}).items()
+    }
+
+    unsigned = dict(event_dict.pop("unsigned", {}))
+
+    # We intern these strings because they turn up a lot (especially when
+    # caching).
+    event_dict = intern_dict(event_dict)
+
+    for key in ("prev_events", "auth_events"):
+        if key in event_dict:
+            event_dict[key] = _compact_event_references(event_dict[key])
+
+    if USE_FROZEN_DICTS:
+        event_dict = freeze(event_dict)
+
+    return event_dict, signatures, unsigned
+
+
 class _EventInternalMetadata(object):
     __slots__ = ["_dict"]
 
@@ -201,6 +299,28 @@ class _EventInternalMetadata(object):
 
 
 class EventBase(metaclass=abc.ABCMeta):
+    """The base class for events.
+
+    Events are held in a compact form: the event dict has its well-known keys
+    and values interned, `prev_events` and `auth_events` are stored as tuples,
+    and the instances use slots rather than a `__dict__`.
+
+    An event may also be constructed lazily (see `make_event_from_json`), in
+    which case only the keys in `LAZY_EVENT_HEADER_KEYS` are available up
+    front, and the rest of the event (including its content) is held as JSON
+    until it is first accessed.
+    """
+
+    __slots__ = [
+        "room_version",
+        "rejected_reason",
+        "internal_metadata",
+        "_dict",
+        "_signatures",
+        "_unsigned",
+        "_lazy_json",
+    ]
+
     @property
     @abc.abstractmethod
     def format_version(self) -> int:
@@ -215,31 +335,63 @@ class EventBase(metaclass=abc.ABCMeta):
         unsigned: JsonDict,
         internal_metadata_dict: JsonDict,
         rejected_reason: Optional[str],
+        lazy_json: Optional[str] = None,
     ):
         assert room_version.event_format == self.format_version
 
         self.room_version = room_version
-        self.signatures = signatures
-        self.unsigned = unsigned
+        self._signatures = signatures
+        self._unsigned = unsigned
         self.rejected_reason = rejected_reason
 
         self._dict = event_dict
+        self._lazy_json = lazy_json
 
         self.internal_metadata = _EventInternalMetadata(internal_metadata_dict)
 
-    auth_events = DictProperty("auth_events")
-    depth = DictProperty("depth")
-    content = DictProperty("content")
-    hashes = DictProperty("hashes")
-    origin = DictProperty("origin")
-    origin_server_ts = DictProperty("origin_server_ts")
-    prev_events = DictProperty("prev_events")
-    redacts = DefaultDictProperty("redacts", None)
-    room_id = DictProperty("room_id")
-    sender = DictProperty("sender")
-    state_key = DictProperty("state_key")
-    type = DictProperty("type")
-    user_id = DictProperty("sender")
+    def _decode_lazy_json(self):
+        """Decodes the body of a lazily-constructed event."""
+        event_dict, signatures, unsigned = _split_event_dict(
+            json_decoder.decode(self._lazy_json)
+        )
+        self._lazy_json = None
+
+        self._dict = event_dict
+        self._signatures = signatures
+        self._unsigned = unsigned
+
+    def _ensure_decoded(self):
+        if self._lazy_json is not None:
+            self._decode_lazy_json()
+
+    @property
+    def signatures(self) -> Dict[str, Dict[str, str]]:
+        self._ensure_decoded()
+        return self._signatures
+
+    @property
+    def unsigned(self) -> JsonDict:
+        self._ensure_decoded()
+        return self._unsigned
+
+    @unsigned.setter
+    def unsigned(self, unsigned: JsonDict):
+        self._ensure_decoded()
+        self._unsigned = unsigned
+
+    auth_events = _EventDictProperty("auth_events")
+    depth = _EventDictProperty("depth")
+    content = _EventDictProperty("content")
+    hashes = _EventDictProperty("hashes")
+    origin = _EventDictProperty("origin")
+    origin_server_ts = _EventDictProperty("origin_server_ts")
+    prev_events = _EventDictProperty("prev_events")
+    redacts = _EventDefaultDictProperty("redacts", None)
+    room_id = _EventDictProperty("room_id")
+    sender = _EventDictProperty("sender")
+    state_key = _EventDictProperty("state_key")
+    type = _EventDictProperty("type")
+    user_id = _EventDictProperty("sender")
 
     @property
     def event_id(self) -> str:
@@ -253,12 +405,15 @@ class EventBase(metaclass=abc.ABCMeta):
         return hasattr(self, "state_key") and self.state_key is not None
 
     def get_dict(self) -> JsonDict:
+        self._ensure_decoded()
         d = dict(self._dict)
         d.update({"signatures": self.signatures, "unsigned": dict(self.unsigned)})
 
         return d
 
     def get(self, key, default=None):
+        if key not in LAZY_EVENT_HEADER_KEYS:
+            self._ensure_decoded()
         return self._dict.get(key, default)
 
     def get_internal_metadata_dict(self):
@@ -281,15 +436,21 @@ class EventBase(metaclass=abc.ABCMeta):
         raise AttributeError("Unrecognized attribute %s" % (instance,))
 
     def __getitem__(self, field):
+        if field not in LAZY_EVENT_HEADER_KEYS:
+            self._ensure_decoded()
         return self._dict[field]
 
     def __contains__(self, field):
+        if field not in LAZY_EVENT_HEADER_KEYS:
+            self._ensure_decoded()
         return field in self._dict
 
     def items(self):
+        self._ensure_decoded()
         return list(self._dict.items())
 
     def keys(self):
+        self._ensure_decoded()
         return six.iterkeys(self._dict)
 
     def prev_event_ids(self):
@@ -312,6 +473,8 @@ class EventBase(metaclass=abc.ABCMeta):
 
 
 class FrozenEvent(EventBase):
+    __slots__ = ["_event_id"]
+
     format_version = EventFormatVersions.V1  # All events of this type are V1
 
     def __init__(
@@ -320,36 +483,27 @@ class FrozenEvent(EventBase):
         room_version: RoomVersion,
         internal_metadata_dict: JsonDict = {},
         rejected_reason: Optional[str] = None,
+        lazy_json: Optional[str] = None,
     ):
-        event_dict = dict(event_dict)
-
-        # Signatures is a dict of dicts, and this is faster than doing a
-        # copy.deepcopy
-        signatures = {
-            name: {sig_id: sig for sig_id, sig in sigs.items()}
-            for name, sigs in event_dict.pop("signatures", {}).items()
-        }
-
-        unsigned = dict(event_dict.pop("unsigned", {}))
-
-        # We intern these strings because they turn up a lot (especially when
-        # caching).
-        event_dict = intern_dict(event_dict)
-
-        if USE_FROZEN_DICTS:
-            frozen_dict = freeze(event_dict)
+        if lazy_json is None:
+            event_dict, signatures, unsigned = _split_event_dict(event_dict)
         else:
-            frozen_dict = event_dict
+            # we only have the header for now: the rest gets filled in when
+            # lazy_json is decoded.
+            event_dict = intern_dict(event_dict)
+            signatures = {}
+            unsigned = {}
 
         self._event_id = event_dict["event_id"]
 
         super().__init__(
-            frozen_dict,
+            event_dict,
             room_version=room_version,
             signatures=signatures,
             unsigned=unsigned,
             internal_metadata_dict=internal_metadata_dict,
             rejected_reason=rejected_reason,
+            lazy_json=lazy_json,
         )
 
     @property
@@ -368,6 +522,8 @@ class FrozenEvent(EventBase):
 
 
 class FrozenEventV2(EventBase):
+    __slots__ = ["_event_id"]
+
     format_version = EventFormatVersions.V2  # All events of this type are V2
 
     def __init__(
@@ -376,38 +532,30 @@ class FrozenEventV2(EventBase):
         room_version: RoomVersion,
         internal_metadata_dict: JsonDict = {},
         rejected_reason: Optional[str] = None,
+        lazy_json: Optional[str] = None,
     ):
-        event_dict = dict(event_dict)
-
-        # Signatures is a dict of dicts, and this is faster than doing a
-        # copy.deepcopy
-        signatures = {
-            name: {sig_id: sig for sig_id, sig in sigs.items()}
-            for name, sigs in event_dict.pop("signatures", {}).items()
-        }
-
-        assert "event_id" not in event_dict
-
-        unsigned = dict(event_dict.pop("unsigned", {}))
-
-        # We intern these strings because they turn up a lot (especially when
-        # caching).
-        event_dict = intern_dict(event_dict)
+        if lazy_json is None:
+            assert "event_id" not in event_dict
 
-        if USE_FROZEN_DICTS:
-            frozen_dict = freeze(event_dict)
+            event_dict, signatures, unsigned = _split_event_dict(event_dict)
+            self._event_id = None
         else:
-            frozen_dict = event_dict
-
-        self._event_id = None
+            # The event ID isn't part of the event dict for this format, so
+            # has to be calculated from the full event; we rely on the header
+            # of a lazy event supplying it instead.
+            event_dict = intern_dict(event_dict)
+            self._event_id = event_dict.pop("event_id")
+            signatures = {}
+            unsigned = {}
 
         super().__init__(
-            frozen_dict,
+            event_dict,
             room_version=room_version,
             signatures=signatures,
             unsigned=unsigned,
             internal_metadata_dict=internal_metadata_dict,
             rejected_reason=rejected_reason,
+            lazy_json=lazy_json,
         )
 
     @property
@@ -428,7 +576,7 @@ class FrozenEventV2(EventBase):
         Returns:
             list[str]: The list of event IDs of this event's prev_events
         """
-        return self.prev_events
+        return list(self.prev_events)
 
     def auth_event_ids(self):
         """Returns the list of auth event IDs. The order matches the order
@@ -437,7 +585,7 @@ class FrozenEventV2(EventBase):
         Returns:
             list[str]: The list of event IDs of this event's auth_events
         """
-        return self.auth_events
+        return list(self.auth_events)
 
     def __str__(self):
         return self.__repr__()
@@ -454,6 +602,8 @@ class FrozenEventV2(EventBase):
 class FrozenEventV3(FrozenEventV2):
     """FrozenEventV3, which differs from FrozenEventV2 only in the event_id format"""
 
+    __slots__ = []  # type: list
+
     format_version = EventFormatVersions.V3  # All events of this type are V3
 
     @property
@@ -501,3 +651,36 @@ def make_event_from_dict(
     """Construct an EventBase from the given event dict"""
     event_type = _event_type_from_format_version(room_version.event_format)
     return event_type(event_dict, room_version, internal_metadata_dict, rejected_reason)
+
+
+def make_event_from_json(
+    event_json: str,
+    header: JsonDict,
+    room_version: RoomVersion = RoomVersions.V1,
+    internal_metadata_dict: JsonDict = {},
+    rejected_reason: Optional[str] = None,
+) -> EventBase:
+    """Construct an EventBase from the given JSON, which is decoded lazily.
+
+    Until a key outside of `LAZY_EVENT_HEADER_KEYS` is accessed, the event is
+    held as its encoded JSON plus a small header dict. This makes it cheap to
+    construct (and hold in memory) events of which only the header is used.
+
+    Args:
+        event_json: the JSON encoding of the full event
+        header: the keys from LAZY_EVENT_HEADER_KEYS, which must match those in
+            the JSON. `event_id` must be included even for room versions where
+            it is not part of the event. `state_key` must be included if and
+            only if the event is a state event.
+        room_version
+        internal_metadata_dict
+        rejected_reason
+    """
+    event_type = _event_type_from_format_version(room_version.event_format)
+    return event_type(
+        header,
+        room_version,
+        internal_metadata_dict,
+        rejected_reason,
+        lazy_json=event_json,
+    )
@@ -16,7 +16,7 @@
 import logging
 from typing import Dict, Hashable, Iterable, List, Optional, Set
 
-from six import itervalues
+from six import iteritems, itervalues
 
 from prometheus_client import Counter
 
@@ -47,6 +47,14 @@ from synapse.util.metrics import Measure, measure_func
 
 logger = logging.getLogger(__name__)
 
+# Time (in s) after startup that we start waking up destinations which have
+# missed events, so that they are caught up.
+CATCH_UP_STARTUP_DELAY_SEC = 15
+
+# Time (in s) to wait between waking up each of those destinations, so as not
+# to send a burst of catch-up transactions at once.
+CATCH_UP_STARTUP_INTERVAL_SEC = 5
+
 sent_pdus_destination_dist_count = Counter(
     "synapse_federation_client_sent_pdu_destinations:count",
     "Number of PDUs queued for sending to one or more destinations",
@@ -126,6 +134,16 @@ class FederationSender(object):
             1000.0 / hs.config.federation_rr_transactions_per_room_per_second
         )
 
+        # Destinations which missed events before we were restarted won't be
+        # caught up until we next have something to send them, so wake them
+        # up after a short delay.
+        self.clock.call_later(
+            CATCH_UP_STARTUP_DELAY_SEC,
+            run_as_background_process,
+            "wake_destinations_needing_catchup",
+            self._wake_destinations_needing_catchup,
+        )
+
     def _get_per_destination_queue(self, destination: str) -> PerDestinationQueue:
         """Get or create a PerDestinationQueue for the given destination
 
@@ -203,7 +221,7 @@ class FederationSender(object):
 
                     logger.debug("Sending %s to %r", event, destinations)
 
-                    self._send_pdu(event, destinations)
+                    await self._send_pdu(event, destinations)
 
                 async def handle_room_events(events: Iterable[EventBase]) -> None:
                     with Measure(self.clock, "handle_room_events"):
@@ -252,7 +270,7 @@ class FederationSender(object):
         finally:
             self._is_processing = False
 
-    def _send_pdu(self, pdu: EventBase, destinations: Iterable[str]) -> None:
+    async def _send_pdu(self, pdu: EventBase, destinations: Iterable[str]) -> None:
         # We loop through all destinations to see whether we already have
         # a transaction in progress. If we do, stick it in the pending_pdus
         # table and we'll get back to it later.
@@ -270,6 +288,13 @@ class FederationSender(object):
         sent_pdus_destination_dist_total.inc(len(destinations))
         sent_pdus_destination_dist_count.inc()
 
+        # Record that this is the latest event in the room for each destination,
+        # so that a destination which is unreachable for a while can be caught
+        # up on the rooms it missed.
+        await self.store.store_destination_rooms_entries(
+            destinations, pdu.room_id, pdu.internal_metadata.stream_ordering
+        )
+
         for destination in destinations:
             self._get_per_destination_queue(destination).send_pdu(pdu, order)
 
@@ -429,13 +454,12 @@ class FederationSender(object):
         """Given a list of states populate self.pending_presence_by_dest and
         poke to send a new transaction to each destination
         """
-        hosts_and_states = yield get_interested_remotes(self.store, states, self.state)
+        states_by_destination = yield get_interested_remotes(self.store, states)
 
-        for destinations, states in hosts_and_states:
-            for destination in destinations:
-                if destination == self.server_name:
-                    continue
-                self._get_per_destination_queue(destination).send_presence(states)
+        for destination, states in iteritems(states_by_destination):
+            if destination == self.server_name:
+                continue
+            self._get_per_destination_queue(destination).send_presence(states)
 
     def build_and_send_edu(
         self,
@@ -500,3 +524,26 @@ class FederationSender(object):
 
     def get_current_token(self) -> int:
         return 0
+
+    async def _wake_destinations_needing_catchup(self) -> None:
+        """Wakes up the destinations which missed events and aren't backing off,
+        one at a time, so that they are caught up.
+        """
+        last_processed = None  # type: Optional[str]
+
+        while True:
+            destinations_to_wake = await self.store.get_catch_up_outstanding_destinations(
+                last_processed
+            )
+
+            if not destinations_to_wake:
+                break
+
+            last_processed = destinations_to_wake[-1]
+
+            for destination in destinations_to_wake:
+                logger.info(
+                    "Destination %s has outstanding catch-up, waking up.", destination
+                )
+                self.wake_destination(destination)
+                await self.clock.sleep(CATCH_UP_STARTUP_INTERVAL_SEC)
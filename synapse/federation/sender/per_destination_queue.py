@@ -15,9 +15,9 @@
 # limitations under the License.
 import datetime
 import logging
-from typing import Dict, Hashable, Iterable, List, Tuple
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
 
-from prometheus_client import Counter
+from prometheus_client import Counter, Histogram
 
 import synapse.server
 from synapse.api.errors import (
@@ -37,6 +37,17 @@ from synapse.util.retryutils import NotRetryingDestination, get_retry_limiter
 # This is defined in the Matrix spec and enforced by the receiver.
 MAX_EDUS_PER_TRANSACTION = 100
 
+# The most PDUs we send in one transaction, also defined in the spec.
+MAX_PDUS_PER_TRANSACTION = 50
+
+# When batching, the fraction of a destination's round trip time to hold a
+# transaction back for.
+BATCH_WINDOW_RTT_FRACTION = 0.5
+
+# The weight given to each new sample in the moving averages of a
+# destination's round trip time and success rate.
+_EWMA_ALPHA = 0.2
+
 logger = logging.getLogger(__name__)
 
 
@@ -50,6 +61,21 @@ sent_edus_by_type = Counter(
     ["type"],
 )
 
+# The number of PDUs in each transaction sent to a destination.
+transaction_pdus = Histogram(
+    "synapse_federation_client_transaction_pdus",
+    "Number of PDUs in each transaction sent",
+    buckets=(0, 1, 2, 5, 10, 20, 50, "+Inf"),
+)
+
+# How long the oldest item in each transaction waited in its destination's
+# queue.
+transaction_queue_delay = Histogram(
+    "synapse_federation_client_transaction_queue_delay_seconds",
+    "Time the oldest item in each transaction sent waited in the queue",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, "+Inf"),
+)
+
 
 class PerDestinationQueue(object):
     """
@@ -100,6 +126,34 @@ class PerDestinationQueue(object):
         # stream_id of last successfully sent device list update.
         self._last_device_list_stream_id = 0
 
+        # The longest to hold back a transaction which isn't full. 0 disables
+        # batching.
+        self._max_batch_latency_ms = hs.config.federation_transaction_max_latency_ms
+
+        # When the oldest item which hasn't been sent yet was queued, or None
+        # if nothing is waiting.
+        self._first_pending_ts = None  # type: Optional[int]
+
+        # True while we are sending the destination the events it missed while
+        # it was unreachable. We start in this state, so that a destination is
+        # caught up after a restart. New PDUs are not queued while this is set;
+        # they are picked up by the catch-up instead.
+        self._catching_up = True
+
+        # The stream ordering of the latest PDU which wasn't queued because we
+        # were catching up.
+        self._catchup_last_skipped = 0
+
+        # The stream ordering of the latest event which was successfully sent to
+        # the destination, or None if we don't know (yet). We are the only
+        # process which updates this, so it is safe to cache.
+        self._last_successful_stream_ordering = None  # type: Optional[int]
+
+        # Moving averages of the round trip time of successful transactions, in
+        # ms, and of the fraction of transactions which succeed.
+        self._rtt_ms = None  # type: Optional[float]
+        self._success_rate = 1.0
+
     def __str__(self) -> str:
         return "PerDestinationQueue[%s]" % self._destination
 
@@ -120,7 +174,14 @@ class PerDestinationQueue(object):
             pdu: pdu to send
             order
         """
-        self._pending_pdus.append((pdu, order))
+        if not self._catching_up or self._last_successful_stream_ordering is None:
+            # queue the PDU unless we are catching up. (If we don't know yet
+            # whether we need to catch up, queue it anyway: the queue is
+            # dropped if it turns out that we do.)
+            self._pending_pdus.append((pdu, order))
+        else:
+            self._catchup_last_skipped = pdu.internal_metadata.stream_ordering
+
         self.attempt_new_transaction()
 
     def send_presence(self, states: Iterable[UserPresenceState]) -> None:
@@ -166,6 +227,9 @@ class PerDestinationQueue(object):
         returns immediately. Otherwise kicks off the process of sending a
         transaction in the background.
         """
+        if self._first_pending_ts is None:
+            self._first_pending_ts = self._clock.time_msec()
+
         # list of (pending_pdu, deferred, order)
         if self.transmission_loop_running:
             # XXX: this can get stuck on by a never-ending
@@ -192,8 +256,17 @@ class PerDestinationQueue(object):
             # hence why we throw the result away.
             await get_retry_limiter(self._destination, self._clock, self._store)
 
+            if self._catching_up:
+                # send the destination what it missed before anything new
+                await self._catch_up_transmission_loop()
+                if self._catching_up:
+                    # we failed to catch up; try again next time
+                    return
+
             pending_pdus = []
             while True:
+                await self._wait_for_batch()
+
                 # We have to keep 2 free slots for presence and rr_edus
                 limit = MAX_EDUS_PER_TRANSACTION - 2
 
@@ -222,7 +295,10 @@ class PerDestinationQueue(object):
                 pending_pdus = self._pending_pdus
 
                 # We can only include at most 50 PDUs per transactions
-                pending_pdus, self._pending_pdus = pending_pdus[:50], pending_pdus[50:]
+                pending_pdus, self._pending_pdus = (
+                    pending_pdus[:MAX_PDUS_PER_TRANSACTION],
+                    pending_pdus[MAX_PDUS_PER_TRANSACTION:],
+                )
 
                 pending_edus.extend(self._get_rr_edus(force_flush=False))
                 pending_presence = self._pending_presence
@@ -264,6 +340,7 @@ class PerDestinationQueue(object):
                 if not pending_pdus and not pending_edus:
                     logger.debug("TX [%s] Nothing to send", self._destination)
                     self._last_device_stream_id = device_stream_id
+                    self._first_pending_ts = None
                     return
 
                 # if we've decided to send a transaction anyway, and we have room, we
@@ -273,9 +350,23 @@ class PerDestinationQueue(object):
 
                 # END CRITICAL SECTION
 
+                now = self._clock.time_msec()
+                if self._first_pending_ts is not None:
+                    transaction_queue_delay.observe(
+                        (now - self._first_pending_ts) / 1000.0
+                    )
+                transaction_pdus.observe(len(pending_pdus))
+
+                # Anything left over has already waited out the batch window, so
+                # keep its queue time. Otherwise the next thing queued starts a
+                # new window.
+                if not self._pending_pdus and not self.pending_edu_count():
+                    self._first_pending_ts = None
+
                 success = await self._transaction_manager.send_new_transaction(
                     self._destination, pending_pdus, pending_edus
                 )
+                self._record_transaction_result(success, self._clock.time_msec() - now)
                 if success:
                     sent_transactions_counter.inc()
                     sent_edus_counter.inc(len(pending_edus))
@@ -299,7 +390,17 @@ class PerDestinationQueue(object):
 
                     self._last_device_stream_id = device_stream_id
                     self._last_device_list_stream_id = dev_list_id
+
+                    if pending_pdus:
+                        final_pdu, _ = pending_pdus[-1]
+                        self._last_successful_stream_ordering = (
+                            final_pdu.internal_metadata.stream_ordering
+                        )
+                        await self._store.set_destination_last_successful_stream_ordering(
+                            self._destination, self._last_successful_stream_ordering
+                        )
                 else:
+                    self._start_catching_up()
                     break
         except NotRetryingDestination as e:
             logger.debug(
@@ -310,16 +411,24 @@ class PerDestinationQueue(object):
                     (e.retry_last_ts + e.retry_interval) / 1000.0
                 ),
             )
+
+            # don't hold on to PDUs while the destination is backing off: it
+            # can be caught up on them once it is reachable again.
+            self._start_catching_up()
         except FederationDeniedError as e:
             logger.info(e)
         except HttpResponseException as e:
+            self._record_transaction_result(False)
             logger.warning(
                 "TX [%s] Received %d response to transaction: %s",
                 self._destination,
                 e.code,
                 e,
             )
+
+            self._start_catching_up()
         except RequestSendFailed as e:
+            self._record_transaction_result(False)
             logger.warning(
                 "TX [%s] Failed to send transaction: %s", self._destination, e
             )
@@ -328,16 +437,170 @@ class PerDestinationQueue(object):
                 logger.info(
                     "Failed to send event %s to %s", p.event_id, self._destination
                 )
+
+            self._start_catching_up()
         except Exception:
             logger.exception("TX [%s] Failed to send transaction", self._destination)
             for p, _ in pending_pdus:
                 logger.info(
                     "Failed to send event %s to %s", p.event_id, self._destination
                 )
+
+            self._start_catching_up()
         finally:
             # We want to be *very* sure we clear this after we stop processing
             self.transmission_loop_running = False
 
+    async def _catch_up_transmission_loop(self) -> None:
+        """Sends the destination the latest event of each room it missed while
+        it was unreachable, in transactions of up to 50 rooms.
+
+        Older events in those rooms are not sent: the destination can backfill
+        them if it wants them. Leaves catch-up mode once there is nothing left
+        to send.
+        """
+        first_catch_up_check = self._last_successful_stream_ordering is None
+
+        if first_catch_up_check:
+            try:
+                self._last_successful_stream_ordering = await self._store.get_destination_last_successful_stream_ordering(
+                    self._destination
+                )
+            except Exception:
+                # don't let this hold up (or drop) what is already queued: send
+                # it as normal, and check again the next time we catch up.
+                logger.exception(
+                    "TX [%s] Failed to look up whether to catch up", self._destination
+                )
+                self._catching_up = False
+                return
+
+        if self._last_successful_stream_ordering is None:
+            # we have never successfully sent the destination an event, so we
+            # don't know what it has missed.
+            self._catching_up = False
+            return
+
+        while True:
+            last_skipped = self._catchup_last_skipped
+            rows = await self._store.get_catch_up_room_events(
+                self._destination,
+                self._last_successful_stream_ordering,
+                limit=MAX_PDUS_PER_TRANSACTION,
+            )
+
+            if not rows:
+                # we have sent everything, unless a PDU was skipped while we
+                # were looking.
+                if self._catchup_last_skipped > last_skipped:
+                    continue
+
+                self._catching_up = False
+                break
+
+            if first_catch_up_check:
+                # anything queued before we knew that we needed to catch up will
+                # be sent by the catch-up.
+                self._start_catching_up()
+
+            events = await self._store.get_events_as_list(
+                [event_id for event_id, _ in rows]
+            )
+
+            # the transaction manager wants (pdu, order) pairs, like the queue
+            stream_orderings = dict(rows)
+            catchup_pdus = [
+                (event, stream_orderings[event.event_id]) for event in events
+            ]
+
+            if catchup_pdus:
+                logger.info(
+                    "TX [%s] Catching up %d rooms", self._destination, len(catchup_pdus)
+                )
+
+                success = await self._transaction_manager.send_new_transaction(
+                    self._destination, catchup_pdus, []
+                )
+                self._record_transaction_result(success)
+                if not success:
+                    return
+
+                sent_transactions_counter.inc()
+                transaction_pdus.observe(len(catchup_pdus))
+
+            # `get_events_as_list` omits events which have since been rejected
+            # or purged, so take the stream ordering from the rows.
+            _, self._last_successful_stream_ordering = rows[-1]
+            await self._store.set_destination_last_successful_stream_ordering(
+                self._destination, self._last_successful_stream_ordering
+            )
+
+    def _start_catching_up(self) -> None:
+        """Puts the destination into catch-up mode.
+
+        If we know what the destination has received, the queued PDUs are
+        dropped: they are recorded in the database and will be sent by the
+        catch-up. Otherwise they are kept until we find out.
+        """
+        self._catching_up = True
+        if self._last_successful_stream_ordering is not None:
+            self._pending_pdus = []
+
+    async def _wait_for_batch(self) -> None:
+        """If batching is enabled, holds the next transaction back until the
+        oldest pending item has waited for the batch window, unless there is
+        already enough pending to fill a transaction.
+        """
+        if not self._max_batch_latency_ms or self._first_pending_ts is None:
+            return
+
+        if (
+            len(self._pending_pdus) >= MAX_PDUS_PER_TRANSACTION
+            or self.pending_edu_count() >= MAX_EDUS_PER_TRANSACTION
+        ):
+            return
+
+        delay_ms = (
+            self._first_pending_ts + self._batch_window_ms() - self._clock.time_msec()
+        )
+        if delay_ms > 0:
+            await self._clock.sleep(delay_ms / 1000.0)
+
+    def _batch_window_ms(self) -> float:
+        """How long to hold back a transaction which isn't full.
+
+        Distant servers get a longer window, since a transaction to them costs
+        more time, as do servers which often fail transactions. Until we have
+        sent a transaction we know nothing about the destination, so don't
+        hold anything back.
+        """
+        if self._rtt_ms is None:
+            return 0
+
+        window_ms = (
+            self._rtt_ms * BATCH_WINDOW_RTT_FRACTION / max(self._success_rate, 0.1)
+        )
+        return min(window_ms, self._max_batch_latency_ms)
+
+    def _record_transaction_result(
+        self, success: bool, rtt_ms: Optional[int] = None
+    ) -> None:
+        """Updates the moving averages used to size the batch window.
+
+        Args:
+            success: whether the transaction was accepted
+            rtt_ms: how long the transaction took, if known
+        """
+        self._success_rate += _EWMA_ALPHA * (float(success) - self._success_rate)
+
+        # Failures often take as long as the request timeout, so only
+        # successful transactions tell us the round trip time.
+        if success and rtt_ms is not None:
+            if self._rtt_ms is None:
+                self._rtt_ms = float(rtt_ms)
+            else:
+                self._rtt_ms += _EWMA_ALPHA * (rtt_ms - self._rtt_ms)
+
     def _get_rr_edus(self, force_flush: bool) -> Iterable[Edu]:
         if not self._pending_rrs:
             return
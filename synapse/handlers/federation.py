@@ -147,9 +147,8 @@ class FederationHandler(BaseHandler):
         self.config = hs.config
         self.http_client = hs.get_simple_http_client()
 
-        self._send_events_to_master = ReplicationFederationSendEventsRestServlet.make_client(
-            hs
-        )
+        self._instance_name = hs.config.worker.instance_name
+        self._send_events = ReplicationFederationSendEventsRestServlet.make_client(hs)
         self._notify_user_membership_change = ReplicationUserJoinedLeftRoomRestServlet.make_client(
             hs
         )
@@ -2863,24 +2862,36 @@ class FederationHandler(BaseHandler):
             backfilled: Whether these events are a result of
                 backfilling or not
         """
-        if self.config.worker_app:
-            await self._send_events_to_master(
-                store=self.store,
-                event_and_contexts=event_and_contexts,
-                backfilled=backfilled,
+        # Events are persisted by the process responsible for their room, which
+        # may not be us.
+        instance_events = {}  # type: Dict[str, List[Tuple[EventBase, EventContext]]]
+        for event, context in event_and_contexts:
+            writer_instance = self.config.worker.get_event_writer_for_room(
+                event.room_id
             )
-        else:
+            instance_events.setdefault(writer_instance, []).append((event, context))
+
+        for writer_instance, events in instance_events.items():
+            if writer_instance != self._instance_name:
+                await self._send_events(
+                    instance_name=writer_instance,
+                    store=self.store,
+                    event_and_contexts=events,
+                    backfilled=backfilled,
+                )
+                continue
+
             max_stream_id = await self.storage.persistence.persist_events(
-                event_and_contexts, backfilled=backfilled
+                events, backfilled=backfilled
             )
 
             if self._ephemeral_messages_enabled:
-                for (event, context) in event_and_contexts:
+                for (event, context) in events:
                     # If there's an expiry timestamp on the event, schedule its expiry.
                     self._message_handler.maybe_schedule_expiry(event)
 
             if not backfilled:  # Never notify for backfilled events
-                for event, _ in event_and_contexts:
+                for event, _ in events:
                     await self._notify_persisted_event(event, max_stream_id)
 
     async def _notify_persisted_event(
@@ -2924,8 +2935,11 @@ class FederationHandler(BaseHandler):
         Args:
             room_id
         """
-        if self.config.worker_app:
-            await self._clean_room_for_join_client(room_id)
+        writer_instance = self.config.worker.get_event_writer_for_room(room_id)
+        if writer_instance != self._instance_name:
+            await self._clean_room_for_join_client(
+                instance_name=writer_instance, room_id=room_id
+            )
         else:
             await self.store.clean_room_for_join(room_id)
 
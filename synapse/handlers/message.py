@@ -19,7 +19,7 @@ from typing import Optional
 
 from six import iteritems, itervalues, string_types
 
-from canonicaljson import encode_canonical_json, json
+from canonicaljson import encode_canonical_json
 
 from twisted.internet import defer
 from twisted.internet.defer import succeed
@@ -50,7 +50,7 @@ from synapse.storage.data_stores.main.events_worker import EventRedactBehaviour
 from synapse.storage.state import StateFilter
 from synapse.types import Collection, RoomAlias, UserID, create_requester
 from synapse.util.async_helpers import Linearizer
-from synapse.util.frozenutils import frozendict_json_encoder
+from synapse.util.json import json_decoder, json_encoder
 from synapse.util.metrics import measure_func
 from synapse.visibility import filter_events_for_client
 
@@ -370,7 +370,8 @@ class EventCreationHandler(object):
 
         self.room_invite_state_types = self.hs.config.room_invite_state_types
 
-        self.send_event_to_master = ReplicationSendEventRestServlet.make_client(hs)
+        self._instance_name = hs.config.worker.instance_name
+        self.send_event = ReplicationSendEventRestServlet.make_client(hs)
 
         # This is only used to get at ratelimit function, and maybe_kick_guest_users
         self.base_handler = BaseHandler(hs)
@@ -812,8 +813,8 @@ class EventCreationHandler(object):
 
         # Ensure that we can round trip before trying to persist in db
         try:
-            dump = frozendict_json_encoder.encode(event.content)
-            json.loads(dump)
+            dump = json_encoder.encode(event.content)
+            json_decoder.decode(dump)
         except Exception:
             logger.exception("Failed to encode content: %r", event.content)
             raise
@@ -824,9 +825,14 @@ class EventCreationHandler(object):
         # hack around with a try/finally instead.
         success = False
         try:
-            # If we're a worker we need to hit out to the master.
-            if self.config.worker_app:
-                yield self.send_event_to_master(
+            # If we're not the process which persists events in this room, we
+            # need to hit out to the one that is.
+            writer_instance = self.config.worker.get_event_writer_for_room(
+                event.room_id
+            )
+            if writer_instance != self._instance_name:
+                yield self.send_event(
+                    instance_name=writer_instance,
                     event_id=event.event_id,
                     store=self.store,
                     requester=requester,
@@ -858,9 +864,13 @@ class EventCreationHandler(object):
         """Called when we have fully built the event, have already
         calculated the push actions for the event, and checked auth.
 
-        This should only be run on master.
+        This should only be run on the process which persists events in the
+        room.
         """
-        assert not self.config.worker_app
+        assert (
+            self.config.worker.get_event_writer_for_room(event.room_id)
+            == self._instance_name
+        )
 
         if ratelimit:
             # We check if this is a room admin redacting an event so that we
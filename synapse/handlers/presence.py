@@ -44,8 +44,8 @@ from synapse.storage.presence import UserPresenceState
 from synapse.types import UserID, get_domain_from_id
 from synapse.util.async_helpers import Linearizer
 from synapse.util.caches.descriptors import cached
+from synapse.util.heap_timer import HeapTimer
 from synapse.util.metrics import Measure
-from synapse.util.wheel_timer import WheelTimer
 
 MYPY = False
 if MYPY:
@@ -106,7 +106,8 @@ class PresenceHandler(object):
         self.server_name = hs.hostname
         self.clock = hs.get_clock()
         self.store = hs.get_datastore()
-        self.wheel_timer = WheelTimer()
+        # When to next check each user's presence for timeouts.
+        self.timeout_timer = HeapTimer()
         self.notifier = hs.get_notifier()
         self.federation = hs.get_federation_sender()
         self.state = hs.get_state_handler()
@@ -131,22 +132,22 @@ class PresenceHandler(object):
 
         now = self.clock.time_msec()
         for state in active_presence:
-            self.wheel_timer.insert(
+            self.timeout_timer.insert(
                 now=now, obj=state.user_id, then=state.last_active_ts + IDLE_TIMER
             )
-            self.wheel_timer.insert(
+            self.timeout_timer.insert(
                 now=now,
                 obj=state.user_id,
                 then=state.last_user_sync_ts + SYNC_ONLINE_TIMEOUT,
             )
             if self.is_mine_id(state.user_id):
-                self.wheel_timer.insert(
+                self.timeout_timer.insert(
                     now=now,
                     obj=state.user_id,
                     then=state.last_federation_update_ts + FEDERATION_PING_INTERVAL,
                 )
             else:
-                self.wheel_timer.insert(
+                self.timeout_timer.insert(
                     now=now,
                     obj=state.user_id,
                     then=state.last_federation_update_ts + FEDERATION_TIMEOUT,
@@ -204,7 +205,7 @@ class PresenceHandler(object):
             "synapse_handlers_presence_wheel_timer_size",
             "",
             [],
-            lambda: len(self.wheel_timer),
+            lambda: len(self.timeout_timer),
         )
 
         # Used to handle sending of presence to newly joined users/servers
@@ -294,7 +295,7 @@ class PresenceHandler(object):
                     prev_state,
                     new_state,
                     is_mine=self.is_mine_id(user_id),
-                    wheel_timer=self.wheel_timer,
+                    wheel_timer=self.timeout_timer,
                     now=now,
                 )
 
@@ -336,7 +337,7 @@ class PresenceHandler(object):
         # Fetch the list of users that *may* have timed out. Things may have
         # changed since the timeout was set, so we won't necessarily have to
         # take any action.
-        users_to_check = set(self.wheel_timer.fetch(now))
+        users_to_check = set(self.timeout_timer.fetch(now))
 
         # Check whether the lists of syncing processes from an external
         # process have expired.
@@ -368,6 +369,16 @@ class PresenceHandler(object):
             now=now,
         )
 
+        # The timer only keeps the next timeout of each user, so we need to
+        # set the later ones again. (The timeouts of the users which have
+        # changed are set when their new states are handled.)
+        changed_user_ids = {state.user_id for state in changes}
+        for state in states:
+            if state.user_id not in changed_user_ids:
+                schedule_timeouts(
+                    state, self.is_mine_id(state.user_id), self.timeout_timer, now
+                )
+
         return await self._update_states(changes)
 
     async def bump_presence_active_time(self, user):
@@ -1176,6 +1187,38 @@ def handle_timeout(state, is_mine, syncing_user_ids, now):
     return state if changed else None
 
 
+def schedule_timeouts(state, is_mine, timer, now):
+    """Sets a timer for the next of the user's timeouts which hasn't passed
+    yet, if any, so that `handle_timeout` is called for them again then.
+
+    Args:
+        state (UserPresenceState)
+        is_mine (bool): Whether the user is ours
+        timer (HeapTimer)
+        now (int): Time now in ms
+    """
+    if state.state == PresenceState.OFFLINE:
+        # No timeouts are associated with offline states.
+        return
+
+    if is_mine:
+        sync_or_active = max(state.last_user_sync_ts, state.last_active_ts)
+        timeouts = [
+            sync_or_active + SYNC_ONLINE_TIMEOUT,
+            state.last_federation_update_ts + FEDERATION_PING_INTERVAL,
+        ]
+        if state.state == PresenceState.ONLINE:
+            timeouts.append(state.last_active_ts + IDLE_TIMER)
+            if state.currently_active:
+                timeouts.append(state.last_active_ts + LAST_ACTIVE_GRANULARITY)
+    else:
+        timeouts = [state.last_federation_update_ts + FEDERATION_TIMEOUT]
+
+    future_timeouts = [then for then in timeouts if then >= now]
+    if future_timeouts:
+        timer.insert(now=now, obj=state.user_id, then=min(future_timeouts))
+
+
 def handle_update(prev_state, new_state, is_mine, wheel_timer, now):
     """Given a presence update:
         1. Add any appropriate timers.
@@ -1185,7 +1228,7 @@ def handle_update(prev_state, new_state, is_mine, wheel_timer, now):
         prev_state (UserPresenceState)
         new_state (UserPresenceState)
         is_mine (bool): Whether the user is ours
-        wheel_timer (WheelTimer)
+        wheel_timer (HeapTimer)
         now (int): Time now in ms
 
     Returns:
@@ -1273,7 +1316,7 @@ def get_interested_parties(store, states):
 
 
 @defer.inlineCallbacks
-def get_interested_remotes(store, states, state_handler):
+def get_interested_remotes(store, states):
     """Given a list of presence states figure out which remote servers
     should be sent which.
 
@@ -1284,23 +1327,17 @@ def get_interested_remotes(store, states, state_handler):
         states (list(UserPresenceState))
 
     Returns:
-        Deferred list of ([destinations], [UserPresenceState]), where for
-        each row the list of UserPresenceState should be sent to each
-        destination
+        Deferred[dict[str, list[UserPresenceState]]]: map from destination to
+        the states which should be sent to it
     """
-    hosts_and_states = []
-
-    # First we look up the rooms each user is in (as well as any explicit
-    # subscriptions), then for each distinct room we look up the remote
-    # hosts in those rooms.
-    room_ids_to_states, users_to_states = yield get_interested_parties(store, states)
+    states_by_destination = {}  # type: Dict[str, List[UserPresenceState]]
 
-    for room_id, states in iteritems(room_ids_to_states):
-        hosts = yield state_handler.get_current_hosts_in_room(room_id)
-        hosts_and_states.append((hosts, states))
-
-    for user_id, states in iteritems(users_to_states):
-        host = get_domain_from_id(user_id)
-        hosts_and_states.append(([host], states))
+    # The hosts each user shares a room with are cached until the user's
+    # rooms or the membership of one of those rooms changes, and the hosts in
+    # each room are only looked up once for all the users in it.
+    for state in states:
+        hosts = yield store.get_hosts_sharing_room_with_user(state.user_id)
+        for host in hosts:
+            states_by_destination.setdefault(host, []).append(state)
 
-    return hosts_and_states
+    return states_by_destination
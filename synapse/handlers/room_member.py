@@ -999,7 +999,9 @@ class RoomMemberMasterHandler(RoomMemberHandler):
             #
             logger.warning("Failed to reject invite: %s", e)
 
-            yield self.store.locally_reject_invite(target.to_string(), room_id)
+            yield defer.ensureDeferred(
+                self.store.locally_reject_invite(target.to_string(), room_id)
+            )
             return {}
 
     def _user_joined_room(self, target, room_id):
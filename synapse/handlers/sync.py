@@ -21,6 +21,7 @@ from typing import Any, Dict, FrozenSet, List, Optional, Set, Tuple
 from six import iteritems, itervalues
 
 import attr
+from canonicaljson import encode_canonical_json
 from prometheus_client import Counter
 
 from synapse.api.constants import EventTypes, Membership
@@ -191,6 +192,20 @@ class _RoomChanges:
     newly_left_rooms = attr.ib(type=List[str])
 
 
+@attr.s(slots=True, frozen=True)
+class _InitialSyncRoomSnapshot:
+    """The parts of a joined room's entry in an initial sync which only change
+    when there are new events in the room.
+    """
+
+    # The room stream ordering the entry was calculated at
+    stream_ordering = attr.ib(type=int)
+    ignored_users = attr.ib(type=FrozenSet[str])
+    timeline = attr.ib(type=TimelineBatch)
+    state = attr.ib(type=StateMap[EventBase])
+    summary = attr.ib(type=Optional[JsonDict])
+
+
 @attr.s(slots=True, frozen=True)
 class SyncResult:
     """
@@ -247,6 +262,30 @@ class SyncHandler(object):
         self.event_sources = hs.get_event_sources()
         self.clock = hs.get_clock()
         self.response_cache = ResponseCache(hs, "sync")
+
+        # Completed sync results, kept for a while so that clients which retry
+        # a request (e.g. because their connection dropped before they got the
+        # response) don't make us calculate it again.
+        self._sync_result_cache = None  # type: Optional[ExpiringCache]
+        if hs.config.sync_response_cache_duration:
+            self._sync_result_cache = ExpiringCache(
+                "sync_result_cache",
+                self.clock,
+                max_len=hs.config.sync_response_cache_max_entries,
+                expiry_ms=hs.config.sync_response_cache_duration,
+            )
+
+        # The timeline and state of each joined room in an initial sync, keyed
+        # by (user, filter, room), so that later initial syncs only have to
+        # load the rooms which have changed since.
+        self._initial_sync_room_cache = None  # type: Optional[ExpiringCache]
+        if hs.config.initial_sync_room_cache_duration:
+            self._initial_sync_room_cache = ExpiringCache(
+                "initial_sync_room_cache",
+                self.clock,
+                max_len=hs.config.initial_sync_room_cache_max_entries,
+                expiry_ms=hs.config.initial_sync_room_cache_duration,
+            )
         self.state = hs.get_state_handler()
         self.auth = hs.get_auth()
         self.storage = hs.get_storage()
@@ -277,6 +316,18 @@ class SyncHandler(object):
         user_id = sync_config.user.to_string()
         await self.auth.check_auth_blocking(user_id)
 
+        # Only incremental syncs are kept, since clients expect a new initial
+        # sync to reflect any changes they have just made.
+        sync_result_cache = self._sync_result_cache if since_token else None
+
+        if sync_result_cache is not None:
+            res = sync_result_cache.get(sync_config.request_key)
+            if res is not None:
+                logger.info(
+                    "Using completed sync result for [%s]", sync_config.request_key
+                )
+                return res
+
         res = await self.response_cache.wrap(
             sync_config.request_key,
             self._wait_for_sync_for_user,
@@ -285,6 +336,12 @@ class SyncHandler(object):
             timeout,
             full_state,
         )
+
+        # Empty results are cheap to calculate, and are usually the result of a
+        # request timing out, so we don't bother keeping those.
+        if sync_result_cache is not None and res:
+            sync_result_cache[sync_config.request_key] = res
+
         return res
 
     async def _wait_for_sync_for_user(
@@ -1789,14 +1846,33 @@ class SyncHandler(object):
         since_token = room_builder.since_token
         upto_token = room_builder.upto_token
 
-        batch = await self._load_filtered_recents(
-            room_id,
-            sync_config,
-            now_token=upto_token,
-            since_token=since_token,
-            potential_recents=events,
-            newly_joined_room=newly_joined,
-        )
+        # Joined rooms in an initial sync can be served from an earlier initial
+        # sync, if nothing has happened in the room since.
+        snapshot_key = None
+        snapshot = None
+        if (
+            self._initial_sync_room_cache is not None
+            and since_token is None
+            and room_builder.rtype == "joined"
+        ):
+            snapshot_key = (
+                sync_config.user.to_string(),
+                encode_canonical_json(sync_config.filter_collection.get_filter_json()),
+                room_id,
+            )
+            snapshot = self._get_initial_sync_room_snapshot(snapshot_key, ignored_users)
+
+        if snapshot is not None:
+            batch = snapshot.timeline
+        else:
+            batch = await self._load_filtered_recents(
+                room_id,
+                sync_config,
+                now_token=upto_token,
+                since_token=since_token,
+                potential_recents=events,
+                newly_joined_room=newly_joined,
+            )
 
         # Note: `batch` can be both empty and limited here in the case where
         # `_load_filtered_recents` can't find any events the user should see
@@ -1841,33 +1917,55 @@ class SyncHandler(object):
         ):
             return
 
-        state = await self.compute_state_delta(
-            room_id, batch, sync_config, since_token, now_token, full_state=full_state
-        )
-
-        summary = {}  # type: Optional[JsonDict]
-
-        # we include a summary in room responses when we're lazy loading
-        # members (as the client otherwise doesn't have enough info to form
-        # the name itself).
-        if sync_config.filter_collection.lazy_load_members() and (
-            # we recalulate the summary:
-            #   if there are membership changes in the timeline, or
-            #   if membership has changed during a gappy sync, or
-            #   if this is an initial sync.
-            any(ev.type == EventTypes.Member for ev in batch.events)
-            or (
-                # XXX: this may include false positives in the form of LL
-                # members which have snuck into state
-                batch.limited
-                and any(t == EventTypes.Member for (t, k) in state)
-            )
-            or since_token is None
-        ):
-            summary = await self.compute_summary(
-                room_id, sync_config, batch, state, now_token
+        if snapshot is not None:
+            state = snapshot.state
+            summary = snapshot.summary
+            self._add_lazy_loaded_members_from_snapshot(sync_config, snapshot)
+        else:
+            state = await self.compute_state_delta(
+                room_id,
+                batch,
+                sync_config,
+                since_token,
+                now_token,
+                full_state=full_state,
             )
 
+            summary = {}
+
+            # we include a summary in room responses when we're lazy loading
+            # members (as the client otherwise doesn't have enough info to form
+            # the name itself).
+            if sync_config.filter_collection.lazy_load_members() and (
+                # we recalulate the summary:
+                #   if there are membership changes in the timeline, or
+                #   if membership has changed during a gappy sync, or
+                #   if this is an initial sync.
+                any(ev.type == EventTypes.Member for ev in batch.events)
+                or (
+                    # XXX: this may include false positives in the form of LL
+                    # members which have snuck into state
+                    batch.limited
+                    and any(t == EventTypes.Member for (t, k) in state)
+                )
+                or since_token is None
+            ):
+                summary = await self.compute_summary(
+                    room_id, sync_config, batch, state, now_token
+                )
+
+            if snapshot_key is not None:
+                assert self._initial_sync_room_cache is not None
+                self._initial_sync_room_cache[snapshot_key] = _InitialSyncRoomSnapshot(
+                    stream_ordering=RoomStreamToken.parse_stream_token(
+                        upto_token.room_key
+                    ).stream,
+                    ignored_users=frozenset(ignored_users),
+                    timeline=batch,
+                    state=state,
+                    summary=summary,
+                )
+
         if room_builder.rtype == "joined":
             unread_notifications = {}  # type: Dict[str, str]
             room_sync = JoinedSyncResult(
@@ -1907,6 +2005,61 @@ class SyncHandler(object):
         else:
             raise Exception("Unrecognized rtype: %r", room_builder.rtype)
 
+    def _get_initial_sync_room_snapshot(
+        self, snapshot_key: Tuple[str, bytes, str], ignored_users: Set[str]
+    ) -> Optional[_InitialSyncRoomSnapshot]:
+        """Get the entry calculated for a room in an earlier initial sync, if
+        it is still correct.
+
+        Args:
+            snapshot_key: the (user_id, filter, room_id) the entry is stored
+                under.
+            ignored_users: Set of users ignored by user.
+
+        Returns:
+            The entry, or None if there isn't one or the room has changed
+            since it was calculated.
+        """
+        cache = self._initial_sync_room_cache
+        assert cache is not None
+
+        snapshot = cache.get(snapshot_key)
+        if snapshot is None:
+            return None
+
+        room_id = snapshot_key[2]
+        if (
+            snapshot.ignored_users != ignored_users
+            or self.store.has_room_changed_since(room_id, snapshot.stream_ordering)
+        ):
+            cache.pop(snapshot_key, None)
+            return None
+
+        return snapshot
+
+    def _add_lazy_loaded_members_from_snapshot(
+        self, sync_config: SyncConfig, snapshot: _InitialSyncRoomSnapshot
+    ):
+        """Records the members sent down with a room from an earlier initial
+        sync in the lazy-loaded members cache, as `compute_state_delta` does
+        for the rooms it calculates.
+        """
+        if not sync_config.filter_collection.lazy_load_members():
+            return
+        if sync_config.filter_collection.include_redundant_members():
+            return
+
+        cache_key = (sync_config.user.to_string(), sync_config.device_id)
+        cache = self.get_lazy_loaded_members_cache(cache_key)
+
+        # this is a new sync sequence, so the client has forgotten about any
+        # members it had before.
+        cache.clear()
+
+        for event in itertools.chain(snapshot.state.values(), snapshot.timeline.events):
+            if event.type == EventTypes.Member and event.is_state():
+                cache.set(event.state_key, event.event_id)
+
     async def get_rooms_for_user_at(
         self, user_id: str, stream_ordering: int
     ) -> FrozenSet[str]:
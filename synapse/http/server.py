@@ -20,19 +20,19 @@ import http.client
 import logging
 import types
 import urllib
+from collections.abc import Mapping
 from io import BytesIO
 
-from canonicaljson import encode_canonical_json, encode_pretty_printed_json, json
+from canonicaljson import encode_canonical_json, encode_pretty_printed_json
+from zope.interface import implementer
 
-from twisted.internet import defer
+from twisted.internet import defer, interfaces
 from twisted.python import failure
 from twisted.web import resource
 from twisted.web.server import NOT_DONE_YET
 from twisted.web.static import NoRangeStaticProducer
 from twisted.web.util import redirectTo
 
-import synapse.events
-import synapse.metrics
 from synapse.api.errors import (
     CodeMessageException,
     Codes,
@@ -43,9 +43,18 @@ from synapse.api.errors import (
 from synapse.logging.context import preserve_fn
 from synapse.logging.opentracing import trace_servlet
 from synapse.util.caches import intern_dict
+from synapse.util.json import json_encoder
 
 logger = logging.getLogger(__name__)
 
+# When streaming a JSON response, how many levels of nested objects and arrays
+# to walk down, encoding the values below that level in one go.
+STREAMING_JSON_DEPTH = 4
+
+# The minimum number of bytes to write to a streamed response at once.
+STREAMING_CHUNK_SIZE = 64 * 1024
+
+
 HTML_ERROR_TEMPLATE = """<!DOCTYPE html>
 <html lang=en>
   <head>
@@ -252,7 +261,7 @@ class JsonResource(HttpServer, resource.Resource):
     isLeaf = True
 
     _PathEntry = collections.namedtuple(
-        "_PathEntry", ["pattern", "callback", "servlet_classname"]
+        "_PathEntry", ["pattern", "callback", "servlet_classname", "stream_response"]
     )
 
     def __init__(self, hs, canonical_json=True):
@@ -264,7 +273,13 @@ class JsonResource(HttpServer, resource.Resource):
         self.hs = hs
 
     def register_paths(
-        self, method, path_patterns, callback, servlet_classname, trace=True
+        self,
+        method,
+        path_patterns,
+        callback,
+        servlet_classname,
+        trace=True,
+        stream_response=False,
     ):
         """
         Registers a request handler against a regular expression. Later request URLs are
@@ -283,6 +298,10 @@ class JsonResource(HttpServer, resource.Resource):
                 and opentracing logs.
 
             trace (bool): Whether we should start a span to trace the servlet.
+
+            stream_response (bool): Whether to encode the JSON responses
+                returned by the callback as they are written, rather than all
+                at once. This is worthwhile for potentially large responses.
         """
         method = method.encode("utf-8")  # method is bytes on py3
 
@@ -294,7 +313,9 @@ class JsonResource(HttpServer, resource.Resource):
         for path_pattern in path_patterns:
             logger.debug("Registering for %s %s", method, path_pattern.pattern)
             self.path_regexs.setdefault(method, []).append(
-                self._PathEntry(path_pattern, callback, servlet_classname)
+                self._PathEntry(
+                    path_pattern, callback, servlet_classname, stream_response
+                )
             )
 
     def render(self, request):
@@ -309,10 +330,11 @@ class JsonResource(HttpServer, resource.Resource):
             This checks if anyone has registered a callback for that method and
             path.
         """
-        callback, servlet_classname, group_dict = self._get_handler_for_request(request)
+        path_entry, group_dict = self._get_handler_for_request(request)
+        callback = path_entry.callback
 
         # Make sure we have a name for this handler in prometheus.
-        request.request_metrics.name = servlet_classname
+        request.request_metrics.name = path_entry.servlet_classname
 
         # Now trigger the callback. If it returns a response, we send it
         # here. If it throws an exception, that is handled by the wrapper
@@ -332,7 +354,9 @@ class JsonResource(HttpServer, resource.Resource):
 
         if callback_return is not None:
             code, response = callback_return
-            self._send_response(request, code, response)
+            self._send_response(
+                request, code, response, stream_response=path_entry.stream_response
+            )
 
     def _get_handler_for_request(self, request):
         """Finds a callback method to handle the given request
@@ -341,17 +365,17 @@ class JsonResource(HttpServer, resource.Resource):
             request (twisted.web.http.Request):
 
         Returns:
-            Tuple[Callable, str, dict[unicode, unicode]]: callback method, the
-                label to use for that method in prometheus metrics, and the
-                dict mapping keys to path components as specified in the
-                handler's path match regexp.
+            Tuple[_PathEntry, dict[unicode, unicode]]: the entry for the
+                callback method, with the label to use for that method in
+                prometheus metrics, and the dict mapping keys to path
+                components as specified in the handler's path match regexp.
 
                 The callback will normally be a method registered via
                 register_paths, so will return (possibly via Deferred) either
                 None, or a tuple of (http code, response body).
         """
         if request.method == b"OPTIONS":
-            return _options_handler, "options_request_handler", {}
+            return _OPTIONS_PATH_ENTRY, {}
 
         request_path = request.path.decode("ascii")
 
@@ -361,13 +385,18 @@ class JsonResource(HttpServer, resource.Resource):
             m = path_entry.pattern.match(request_path)
             if m:
                 # We found a match!
-                return path_entry.callback, path_entry.servlet_classname, m.groupdict()
+                return path_entry, m.groupdict()
 
         # Huh. No one wanted to handle that? Fiiiiiine. Send 400.
-        return _unrecognised_request_handler, "unrecognised_request_handler", {}
+        return _UNRECOGNISED_PATH_ENTRY, {}
 
     def _send_response(
-        self, request, code, response_json_object, response_code_message=None
+        self,
+        request,
+        code,
+        response_json_object,
+        response_code_message=None,
+        stream_response=False,
     ):
         # TODO: Only enable CORS for the requests that need it.
         respond_with_json(
@@ -378,6 +407,7 @@ class JsonResource(HttpServer, resource.Resource):
             response_code_message=response_code_message,
             pretty_print=_request_user_agent_is_curl(request),
             canonical_json=self.canonical_json,
+            stream_response=stream_response,
         )
 
 
@@ -432,6 +462,14 @@ def _unrecognised_request_handler(request):
     raise UnrecognizedRequestError()
 
 
+_OPTIONS_PATH_ENTRY = JsonResource._PathEntry(
+    None, _options_handler, "options_request_handler", False
+)
+_UNRECOGNISED_PATH_ENTRY = JsonResource._PathEntry(
+    None, _unrecognised_request_handler, "unrecognised_request_handler", False
+)
+
+
 class RootRedirect(resource.Resource):
     """Redirects the root '/' path to another path."""
 
@@ -456,7 +494,26 @@ def respond_with_json(
     response_code_message=None,
     pretty_print=False,
     canonical_json=True,
+    stream_response=False,
 ):
+    """Sends a JSON object in response to the given request.
+
+    Args:
+        request (twisted.web.http.Request): The http request to respond to.
+        code (int): The HTTP response code.
+        json_object (object): The JSON object to send.
+        send_cors (bool): Whether to send Cross-Origin Resource Sharing headers
+            http://www.w3.org/TR/cors/
+        response_code_message (str|None): The message to send with the
+            response code.
+        pretty_print (bool): Whether to indent the JSON for humans.
+        canonical_json (bool): Whether to encode the object as canonical
+            JSON, for responses which may need to be signed or verified.
+        stream_response (bool): Whether to encode the object as it is
+            written, with chunked transfer encoding, rather than all at once.
+            Pretty printed responses are never streamed.
+    Returns:
+        twisted.web.server.NOT_DONE_YET"""
     # could alternatively use request.notifyFinish() and flip a flag when
     # the Deferred fires, but since the flag is RIGHT THERE it seems like
     # a waste.
@@ -468,12 +525,35 @@ def respond_with_json(
 
     if pretty_print:
         json_bytes = encode_pretty_printed_json(json_object) + b"\n"
-    else:
-        if canonical_json or synapse.events.USE_FROZEN_DICTS:
-            # canonicaljson already encodes to bytes
-            json_bytes = encode_canonical_json(json_object)
+    elif stream_response:
+        if canonical_json:
+            pieces = iterencode_json(
+                json_object,
+                encode_canonical_json,
+                STREAMING_JSON_DEPTH,
+                sort_keys=True,
+            )
         else:
-            json_bytes = json.dumps(json_object).encode("utf-8")
+            pieces = iterencode_json(
+                json_object, json_encoder.encode_bytes, STREAMING_JSON_DEPTH
+            )
+
+        request.setResponseCode(code, message=response_code_message)
+        request.setHeader(b"Content-Type", b"application/json")
+        request.setHeader(b"Cache-Control", b"no-cache, no-store, must-revalidate")
+
+        if send_cors:
+            set_cors_headers(request)
+
+        # We don't know the length of the response, so twisted will use
+        # chunked transfer encoding.
+        _JsonStreamProducer(request, pieces)
+        return NOT_DONE_YET
+    elif canonical_json:
+        # canonicaljson already encodes to bytes
+        json_bytes = encode_canonical_json(json_object)
+    else:
+        json_bytes = json_encoder.encode_bytes(json_object)
 
     return respond_with_json_bytes(
         request,
@@ -515,6 +595,131 @@ def respond_with_json_bytes(
     return NOT_DONE_YET
 
 
+def iterencode_json(json_object, encode, depth, sort_keys=False):
+    """Encodes a JSON object in pieces, so that large objects can be written as
+    they are encoded.
+
+    The top `depth` levels of objects and arrays are walked here, and the
+    values below them are each encoded in one go, which is much quicker than
+    using `JSONEncoder.iterencode` to walk the whole object.
+
+    Args:
+        json_object (object): the object to encode.
+        encode (Callable[[object], bytes]): encodes a value in one go.
+            Functions which indent their output are not supported.
+        depth (int): the number of levels of objects and arrays to walk.
+        sort_keys (bool): whether to sort the keys of the objects we walk,
+            which must match what `encode` does.
+
+    Returns:
+        Iterator[bytes]: the pieces of the encoded object.
+    """
+    if depth > 0:
+        if isinstance(json_object, Mapping) and all(
+            isinstance(key, str) for key in json_object
+        ):
+            keys = list(json_object)
+            if sort_keys:
+                keys.sort()
+
+            yield b"{"
+            for i, key in enumerate(keys):
+                prefix = b"," if i else b""
+                yield prefix + encode(key) + b":"
+                yield from iterencode_json(
+                    json_object[key], encode, depth - 1, sort_keys
+                )
+            yield b"}"
+            return
+
+        if isinstance(json_object, (list, tuple)):
+            yield b"["
+            for i, value in enumerate(json_object):
+                if i:
+                    yield b","
+                yield from iterencode_json(value, encode, depth - 1, sort_keys)
+            yield b"]"
+            return
+
+    yield encode(json_object)
+
+
+@implementer(interfaces.IPushProducer)
+class _JsonStreamProducer(object):
+    """Writes the pieces of an encoded JSON object to a request, pausing while
+    the connection can't keep up, and then finishes the request.
+
+    The producer starts writing as soon as it is created.
+    """
+
+    def __init__(self, request, iterator):
+        """
+        Args:
+            request (twisted.web.http.Request): the request to write to.
+            iterator (Iterator[bytes]): the pieces of the response body.
+        """
+        self._request = request
+        self._iterator = iterator
+        self._paused = False
+        self._started_writing = False
+
+        request.registerProducer(self, True)
+        self.resumeProducing()
+
+    def pauseProducing(self):
+        self._paused = True
+
+    def resumeProducing(self):
+        self._paused = False
+
+        # The request will pause us if the connection's write buffer fills up,
+        # which is also when we go back to the reactor.
+        while not self._paused and self._request is not None:
+            chunk = []
+            length = 0
+            try:
+                for piece in self._iterator:
+                    chunk.append(piece)
+                    length += len(piece)
+                    if length >= STREAMING_CHUNK_SIZE:
+                        break
+                else:
+                    self._finish(chunk)
+                    return
+            except Exception:
+                if not self._started_writing:
+                    # Nothing has been sent yet, so the caller can still send
+                    # an error response.
+                    self._request.unregisterProducer()
+                    self.stopProducing()
+                    raise
+
+                # We're part way through the response, so all we can do is
+                # drop the connection.
+                logger.exception("Failed to encode response to %s", self._request)
+                self._request.loseConnection()
+                self.stopProducing()
+                return
+
+            self._started_writing = True
+            self._request.write(b"".join(chunk))
+
+    def stopProducing(self):
+        # The connection has gone away, so there is no point encoding the rest
+        # of the response.
+        self._request = None
+        self._iterator = iter(())
+
+    def _finish(self, chunk):
+        request = self._request
+        self.stopProducing()
+
+        if chunk:
+            request.write(b"".join(chunk))
+        request.unregisterProducer()
+        finish_request(request)
+
+
 def set_cors_headers(request):
     """Set the CORs headers so that javascript running in a web browsers can
     use this API
@@ -17,9 +17,8 @@
 
 import logging
 
-from canonicaljson import json
-
 from synapse.api.errors import Codes, SynapseError
+from synapse.util.json import json_decoder
 
 logger = logging.getLogger(__name__)
 
@@ -223,7 +222,7 @@ def parse_json_value_from_request(request, allow_empty_body=False):
         raise SynapseError(400, "Content not JSON.", errcode=Codes.NOT_JSON)
 
     try:
-        content = json.loads(content_unicode)
+        content = json_decoder.decode(content_unicode)
     except Exception as e:
         logger.warning("Unable to parse JSON: %s", e)
         raise SynapseError(400, "Content not JSON.", errcode=Codes.NOT_JSON)
@@ -285,8 +284,14 @@ class RestServlet(object):
 
     Automatically handles turning CodeMessageExceptions thrown by these methods
     into the appropriate HTTP response.
+
+    Servlets whose responses can be very large should set `STREAM_RESPONSES`,
+    so that their responses are encoded as they are written rather than all
+    at once.
     """
 
+    STREAM_RESPONSES = False
+
     def register(self, http_server):
         """ Register this servlet with the given HTTP server. """
         if hasattr(self, "PATTERNS"):
@@ -297,7 +302,11 @@ class RestServlet(object):
                     servlet_classname = self.__class__.__name__
                     method_handler = getattr(self, "on_%s" % (method,))
                     http_server.register_paths(
-                        method, patterns, method_handler, servlet_classname
+                        method,
+                        patterns,
+                        method_handler,
+                        servlet_classname,
+                        stream_response=self.STREAM_RESPONSES,
                     )
 
         else:
@@ -14,10 +14,10 @@
 # limitations under the License.
 
 import logging
-from collections import namedtuple
+from collections import OrderedDict, namedtuple
 from typing import Callable, List
 
-from prometheus_client import Counter
+from prometheus_client import Counter, Histogram
 
 from twisted.internet import defer
 
@@ -42,6 +42,17 @@ users_woken_by_stream_counter = Counter(
     "synapse_notifier_users_woken_by_stream", "", ["stream"]
 )
 
+# The number of user streams to be woken by each call to `on_new_event`.
+wakeup_fanout_histogram = Histogram(
+    "synapse_notifier_wakeup_fanout",
+    "Number of user streams to be woken for each new event",
+    buckets=(0, 1, 2, 5, 10, 50, 100, 500, 1000, 5000, 10000, 50000, "+Inf"),
+)
+
+# The number of times a user stream was told about a new event while it was
+# already waiting to be woken, so only needed waking once.
+deduplicated_wakeups_counter = Counter("synapse_notifier_deduplicated_wakeups", "")
+
 
 # TODO(paul): Should be shared somewhere
 def count(func, l):
@@ -91,9 +102,13 @@ class _NotifierUserStream(object):
         with PreserveLoggingContext():
             self.notify_deferred = ObservableDeferred(defer.Deferred())
 
-    def notify(self, stream_key, stream_id, time_now_ms):
-        """Notify any listeners for this user of a new event from an
-        event source.
+    def advance(self, stream_key, stream_id, time_now_ms):
+        """Records a new event from an event source, without waking up the
+        listeners.
+
+        Any new listeners with an older token are woken immediately, so the
+        existing listeners must be woken later with `wake`.
+
         Args:
             stream_key(str): The stream the event came from.
             stream_id(str): The new id for the stream the event came from.
@@ -102,10 +117,13 @@ class _NotifierUserStream(object):
         self.current_token = self.current_token.copy_and_advance(stream_key, stream_id)
         self.last_notified_token = self.current_token
         self.last_notified_ms = time_now_ms
-        noify_deferred = self.notify_deferred
 
         users_woken_by_stream_counter.labels(stream_key).inc()
 
+    def wake(self):
+        """Wakes up the listeners with the current token."""
+        noify_deferred = self.notify_deferred
+
         with PreserveLoggingContext():
             self.notify_deferred = ObservableDeferred(defer.Deferred())
             noify_deferred.callback(self.current_token)
@@ -156,6 +174,12 @@ class Notifier(object):
 
     UNUSED_STREAM_EXPIRY_MS = 10 * 60 * 1000
 
+    # The maximum number of user streams to wake up in one go. Waking a stream
+    # resumes the requests waiting on it, so when a lot of streams need waking
+    # we spread them out over several reactor iterations to give other work a
+    # chance to run in between.
+    MAX_WAKEUPS_PER_ITERATION = 500
+
     def __init__(self, hs: "synapse.server.HomeServer"):
         self.user_to_user_stream = {}
         self.room_to_user_streams = {}
@@ -166,6 +190,13 @@ class Notifier(object):
         self.store = hs.get_datastore()
         self.pending_new_room_events = []
 
+        # The user streams which have been told about new events but whose
+        # listeners haven't been woken yet, in the order they were told. A
+        # stream told about several events before it is woken is only woken
+        # once.
+        self._pending_wakeups = OrderedDict()  # type: OrderedDict
+        self._wakeup_call = None
+
         # Called when there are new things to stream over replication
         self.replication_callbacks = []  # type: List[Callable[[], None]]
 
@@ -211,6 +242,12 @@ class Notifier(object):
         LaterGauge(
             "synapse_notifier_users", "", [], lambda: len(self.user_to_user_stream)
         )
+        LaterGauge(
+            "synapse_notifier_pending_wakeups",
+            "",
+            [],
+            lambda: len(self._pending_wakeups),
+        )
 
     def add_replication_callback(self, cb: Callable[[], None]):
         """Add a callback that will be called when some new data is available.
@@ -245,6 +282,16 @@ class Notifier(object):
 
         self.notify_replication()
 
+    def on_room_stream_advanced(self, max_room_stream_id):
+        """Used to inform the notifier that the room stream has moved on
+        without any new events being passed to it, e.g. because another event
+        writer has caught up, so that the events waiting for that can be
+        notified.
+        """
+        self._notify_pending_new_room_events(max_room_stream_id)
+
+        self.notify_replication()
+
     def _notify_pending_new_room_events(self, max_room_stream_id):
         """Notify for the room events that were queued waiting for a previous
         event to be persisted.
@@ -254,6 +301,7 @@ class Notifier(object):
         """
         pending = self.pending_new_room_events
         self.pending_new_room_events = []
+
         for room_stream_id, event, extra_users in pending:
             if room_stream_id > max_room_stream_id:
                 self.pending_new_room_events.append(
@@ -293,25 +341,70 @@ class Notifier(object):
         """
         with PreserveLoggingContext():
             with Measure(self.clock, "on_new_event"):
-                user_streams = set()
+                time_now_ms = self.clock.time_msec()
+                num_streams = 0
 
                 for user in users:
                     user_stream = self.user_to_user_stream.get(str(user))
                     if user_stream is not None:
-                        user_streams.add(user_stream)
+                        self._advance_user_stream(
+                            user_stream, stream_key, new_token, time_now_ms
+                        )
+                        num_streams += 1
 
                 for room in rooms:
-                    user_streams |= self.room_to_user_streams.get(room, set())
+                    for user_stream in self.room_to_user_streams.get(room, ()):
+                        self._advance_user_stream(
+                            user_stream, stream_key, new_token, time_now_ms
+                        )
+                        num_streams += 1
 
-                time_now_ms = self.clock.time_msec()
-                for user_stream in user_streams:
-                    try:
-                        user_stream.notify(stream_key, new_token, time_now_ms)
-                    except Exception:
-                        logger.exception("Failed to notify listener")
+                wakeup_fanout_histogram.observe(num_streams)
+
+                if self._pending_wakeups and self._wakeup_call is None:
+                    self._wakeup_call = self.clock.call_later(
+                        0, self._wake_pending_user_streams
+                    )
 
                 self.notify_replication()
 
+    def _advance_user_stream(self, user_stream, stream_key, new_token, time_now_ms):
+        """Tells the user stream about a new event, and queues it up to have
+        its listeners woken.
+        """
+        try:
+            user_stream.advance(stream_key, new_token, time_now_ms)
+        except Exception:
+            logger.exception("Failed to notify listener")
+            return
+
+        if user_stream in self._pending_wakeups:
+            deduplicated_wakeups_counter.inc()
+        else:
+            self._pending_wakeups[user_stream] = None
+
+    def _wake_pending_user_streams(self):
+        """Wakes the listeners of the user streams which have been told about
+        new events, up to MAX_WAKEUPS_PER_ITERATION of them. If there are more,
+        the rest are woken in the next reactor iteration.
+        """
+        self._wakeup_call = None
+
+        with Measure(self.clock, "wake_pending_user_streams"):
+            for _ in range(
+                min(len(self._pending_wakeups), self.MAX_WAKEUPS_PER_ITERATION)
+            ):
+                user_stream = self._pending_wakeups.popitem(last=False)[0]
+                try:
+                    user_stream.wake()
+                except Exception:
+                    logger.exception("Failed to notify listener")
+
+        if self._pending_wakeups:
+            self._wakeup_call = self.clock.call_later(
+                0, self._wake_pending_user_streams
+            )
+
     def on_new_replication_data(self):
         """Used to inform replication listeners that something has happend
         without waking up any of the normal user event streams"""
@@ -99,6 +99,9 @@ CONDITIONAL_REQUIREMENTS = {
     "opentracing": ["jaeger-client>=4.0.0", "opentracing>=2.2.0"],
     "jwt": ["pyjwt>=1.6.4"],
     "websocket": ["autobahn"],
+    # a faster JSON library, used by synapse.util.json if it is installed.
+    "orjson": ['orjson>=3.0;python_version>="3.6"'],
+    "redis": ["txredisapi>=1.4.7"],
 }
 
 ALL_OPTIONAL_REQUIREMENTS = set()  # type: Set[str]
@@ -231,7 +231,7 @@ class ReplicationCleanRoomRestServlet(ReplicationEndpoint):
         self.store = hs.get_datastore()
 
     @staticmethod
-    def _serialize_payload(room_id, args):
+    def _serialize_payload(room_id):
         """
         Args:
             room_id (str)
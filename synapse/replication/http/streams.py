@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+
+from synapse.api.errors import SynapseError
+from synapse.http.servlet import parse_string
+from synapse.replication.http._base import ReplicationEndpoint
+
+logger = logging.getLogger(__name__)
+
+
+class ReplicationGetStreamUpdates(ReplicationEndpoint):
+    """Fetches the updates to a replication stream since a given token.
+
+    Workers which get their replication data over a pub/sub bus use this to
+    catch up with the updates they missed while they weren't subscribed.
+
+    Request format:
+
+        GET /_synapse/replication/get_repl_stream_updates/:stream_name?from_token=X
+
+    Response:
+
+        {
+            "updates": [ [<token>, <row>], ... ],
+            "upto_token": <token>
+        }
+
+    where `upto_token` is the position of the stream the updates go up to.
+    """
+
+    NAME = "get_repl_stream_updates"
+    PATH_ARGS = ("stream_name",)
+    METHOD = "GET"
+    CACHE = False
+
+    def __init__(self, hs):
+        super(ReplicationGetStreamUpdates, self).__init__(hs)
+
+        self.hs = hs
+
+    @staticmethod
+    def _serialize_payload(stream_name, from_token):
+        return {"from_token": str(from_token)}
+
+    async def _handle_request(self, request, stream_name):
+        from_token = parse_string(request, "from_token", required=True)
+
+        streamer = self.hs.get_replication_streamer()
+        if stream_name not in streamer.streams_by_name:
+            raise SynapseError(400, "Unknown stream %s" % (stream_name,))
+
+        updates, upto_token = await streamer.get_stream_updates(stream_name, from_token)
+
+        return 200, {"updates": updates, "upto_token": upto_token}
+
+
+def register_servlets(hs, http_server):
+    ReplicationGetStreamUpdates(hs).register(http_server)
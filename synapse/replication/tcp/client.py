@@ -26,6 +26,7 @@ from synapse.replication.tcp.protocol import (
     AbstractReplicationClientHandler,
     ClientReplicationStreamProtocol,
 )
+from synapse.replication.tcp.pubsub import PubSubReplicationClient
 
 from .commands import (
     Command,
@@ -103,8 +104,13 @@ class ReplicationClientHandler(AbstractReplicationClientHandler):
 
     def start_replication(self, hs):
         """Helper method to start a replication connection to the remote server
-        using TCP.
+        using TCP, or to subscribe to replication over a pub/sub bus if one is
+        configured.
         """
+        if hs.get_replication_pubsub_bus():
+            PubSubReplicationClient(hs, self).start()
+            return
+
         client_name = hs.config.worker_name
         self.factory = ReplicationClientFactory(hs, client_name, self)
         host = hs.config.worker_replication_host
@@ -199,10 +205,14 @@ class ReplicationClientHandler(AbstractReplicationClientHandler):
         cmd = RemovePusherCommand(app_id, push_key, user_id)
         self.send_command(cmd)
 
-    def send_invalidate_cache(self, cache_func, keys):
+    def send_invalidate_cache(self, cache_name, keys):
         """Poke the master to invalidate a cache.
+
+        Args:
+            cache_name (str): the name of the cache
+            keys (list|None): the entry to invalidate
         """
-        cmd = InvalidateCacheCommand(cache_func.__name__, keys)
+        cmd = InvalidateCacheCommand(cache_name, keys)
         self.send_command(cmd)
 
     def send_user_ip(self, user_id, access_token, ip, user_agent, device_id, last_seen):
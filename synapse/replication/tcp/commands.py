@@ -19,17 +19,9 @@ allowed to be sent by which side.
 """
 
 import logging
-import platform
 from typing import Tuple, Type
 
-if platform.python_implementation() == "PyPy":
-    import json
-
-    _json_encoder = json.JSONEncoder()
-else:
-    import simplejson as json  # type: ignore[no-redef]  # noqa: F821
-
-    _json_encoder = json.JSONEncoder(namedtuple_as_object=False)  # type: ignore[call-arg]  # noqa: F821
+from synapse.util.json import json_decoder, json_encoder
 
 logger = logging.getLogger(__name__)
 
@@ -116,7 +108,9 @@ class RdataCommand(Command):
     def from_line(cls, line):
         stream_name, token, row_json = line.split(" ", 2)
         return cls(
-            stream_name, None if token == "batch" else int(token), json.loads(row_json)
+            stream_name,
+            None if token == "batch" else int(token),
+            json_decoder.decode(row_json),
         )
 
     def to_line(self):
@@ -124,7 +118,7 @@ class RdataCommand(Command):
             (
                 self.stream_name,
                 str(self.token) if self.token is not None else "batch",
-                _json_encoder.encode(self.row),
+                json_encoder.encode(self.row),
             )
         )
 
@@ -170,6 +164,20 @@ class PingCommand(Command):
     NAME = "PING"
 
 
+class BinaryFramesCommand(Command):
+    """Sent by the server in reply to a client which said in its PING that it
+    supports binary framing. Everything the server sends after this line is
+    sent as binary frames rather than lines. The data is the version of the
+    framing in use.
+
+    Format::
+
+        BINARY_FRAMES <version>
+    """
+
+    NAME = "BINARY_FRAMES"
+
+
 class NameCommand(Command):
     """Sent by client to inform the server of the client's identity. The data
     is the name
@@ -339,10 +347,10 @@ class InvalidateCacheCommand(Command):
     def from_line(cls, line):
         cache_func, keys_json = line.split(" ", 1)
 
-        return cls(cache_func, json.loads(keys_json))
+        return cls(cache_func, json_decoder.decode(keys_json))
 
     def to_line(self):
-        return " ".join((self.cache_func, _json_encoder.encode(self.keys)))
+        return " ".join((self.cache_func, json_encoder.encode(self.keys)))
 
 
 class UserIpCommand(Command):
@@ -367,7 +375,7 @@ class UserIpCommand(Command):
     def from_line(cls, line):
         user_id, jsn = line.split(" ", 1)
 
-        access_token, ip, user_agent, device_id, last_seen = json.loads(jsn)
+        access_token, ip, user_agent, device_id, last_seen = json_decoder.decode(jsn)
 
         return cls(user_id, access_token, ip, user_agent, device_id, last_seen)
 
@@ -375,7 +383,7 @@ class UserIpCommand(Command):
         return (
             self.user_id
             + " "
-            + _json_encoder.encode(
+            + json_encoder.encode(
                 (
                     self.access_token,
                     self.ip,
@@ -401,12 +409,41 @@ class RemoteServerUpCommand(Command):
     NAME = "REMOTE_SERVER_UP"
 
 
+class WriterPositionCommand(Command):
+    """Sent by a process which writes to a stream that has more than one
+    writer (e.g. an event persister) when its position in the stream changes.
+
+    The server relays the command to all the other connections, so that every
+    process knows how far each writer has got.
+
+    Format::
+
+        WRITER_POSITION <stream_name> <instance_name> <token>
+    """
+
+    NAME = "WRITER_POSITION"
+
+    def __init__(self, stream_name, instance_name, token):
+        self.stream_name = stream_name
+        self.instance_name = instance_name
+        self.token = token
+
+    @classmethod
+    def from_line(cls, line):
+        stream_name, instance_name, token = line.split(" ", 2)
+        return cls(stream_name, instance_name, int(token))
+
+    def to_line(self):
+        return " ".join((self.stream_name, self.instance_name, str(self.token)))
+
+
 _COMMANDS = (
     ServerCommand,
     RdataCommand,
     PositionCommand,
     ErrorCommand,
     PingCommand,
+    BinaryFramesCommand,
     NameCommand,
     ReplicateCommand,
     UserSyncCommand,
@@ -416,6 +453,7 @@ _COMMANDS = (
     InvalidateCacheCommand,
     UserIpCommand,
     RemoteServerUpCommand,
+    WriterPositionCommand,
 )  # type: Tuple[Type[Command], ...]
 
 # Map of command name to command type.
@@ -428,8 +466,10 @@ VALID_SERVER_COMMANDS = (
     PositionCommand.NAME,
     ErrorCommand.NAME,
     PingCommand.NAME,
+    BinaryFramesCommand.NAME,
     SyncCommand.NAME,
     RemoteServerUpCommand.NAME,
+    WriterPositionCommand.NAME,
 )
 
 # The commands the client is allowed to send
@@ -444,4 +484,5 @@ VALID_CLIENT_COMMANDS = (
     UserIpCommand.NAME,
     ErrorCommand.NAME,
     RemoteServerUpCommand.NAME,
+    WriterPositionCommand.NAME,
 )
@@ -47,6 +47,21 @@ indicate which side is sending, these are *not* included on the wire::
     < PING 1490197675618
     > ERROR server stopping
     * connection closed by server *
+
+# Binary frames
+
+A client which supports binary framing adds `BINARY_FRAMES` to the data of
+its first `PING`, e.g. `PING 1490197665618 BINARY_FRAMES`. Servers which don't
+support it ignore the data of `PING`s, so carry on with lines as usual. A
+server which does support it replies with `BINARY_FRAMES 1`, and everything it
+sends after that line is sent as frames: a 4 byte big-endian length followed
+by a msgpack-encoded payload, which is either:
+
+    [<command_name>, <rest_of_line>]
+    ["RDATA", <stream_name>, <token>, [<row>, ...]]
+
+The second form carries a whole batch of rows which share a token. The client
+carries on sending lines.
 """
 import abc
 import fcntl
@@ -57,10 +72,12 @@ from typing import Any, DefaultDict, Dict, List, Set, Tuple
 
 from six import iteritems, iterkeys
 
+import msgpack
+from frozendict import frozendict
 from prometheus_client import Counter
 
 from twisted.internet import defer
-from twisted.protocols.basic import LineOnlyReceiver
+from twisted.protocols.basic import LineReceiver
 from twisted.python.failure import Failure
 
 from synapse.logging.context import make_deferred_yieldable, run_in_background
@@ -70,6 +87,7 @@ from synapse.replication.tcp.commands import (
     COMMAND_MAP,
     VALID_CLIENT_COMMANDS,
     VALID_SERVER_COMMANDS,
+    BinaryFramesCommand,
     Command,
     ErrorCommand,
     NameCommand,
@@ -81,6 +99,7 @@ from synapse.replication.tcp.commands import (
     ServerCommand,
     SyncCommand,
     UserSyncCommand,
+    WriterPositionCommand,
 )
 from synapse.replication.tcp.streams import STREAMS_MAP
 from synapse.types import Collection
@@ -103,6 +122,15 @@ PING_TIME = 5000
 PING_TIMEOUT_MULTIPLIER = 5
 PING_TIMEOUT_MS = PING_TIME * PING_TIMEOUT_MULTIPLIER
 
+# Added to the data of a client's first PING to say that it supports binary
+# frames.
+BINARY_FRAMES_CAPABILITY = "BINARY_FRAMES"
+BINARY_FRAMES_VERSION = "1"
+
+# Each frame starts with the length of its payload.
+_FRAME_HEADER = struct.Struct("!I")
+MAX_FRAME_LENGTH = 16 * 1024 * 1024
+
 
 class ConnectionStates(object):
     CONNECTING = "connecting"
@@ -111,12 +139,31 @@ class ConnectionStates(object):
     CLOSED = "closed"
 
 
-class BaseReplicationStreamProtocol(LineOnlyReceiver):
+def _msgpack_default(obj):
+    """Converts the objects which msgpack can't encode itself"""
+    if isinstance(obj, frozendict):
+        return dict(obj)
+    raise TypeError(
+        "Object of type %s is not msgpack serializable" % obj.__class__.__name__
+    )
+
+
+def _encode_frame(payload):
+    """Encodes the payload of a binary frame.
+
+    Raises:
+        TypeError, ValueError or OverflowError if the payload can't be encoded
+    """
+    return msgpack.packb(payload, use_bin_type=True, default=_msgpack_default)
+
+
+class BaseReplicationStreamProtocol(LineReceiver):
     """Base replication protocol shared between client and server.
 
     Reads lines (ignoring blank ones) and parses them into command classes,
     asserting that they are valid for the given direction, i.e. server commands
-    are only sent by the server.
+    are only sent by the server. Once binary frames have been negotiated (see
+    the module docstring), the server sends frames instead of lines.
 
     On receiving a new command it calls `on_<COMMAND_NAME>` with the parsed
     command.
@@ -135,6 +182,9 @@ class BaseReplicationStreamProtocol(LineOnlyReceiver):
 
     max_line_buffer = 10000
 
+    # Whether we offer or accept binary frames
+    SUPPORTS_BINARY_FRAMES = True
+
     def __init__(self, clock):
         self.clock = clock
 
@@ -158,6 +208,16 @@ class BaseReplicationStreamProtocol(LineOnlyReceiver):
         self.inbound_commands_counter = defaultdict(int)  # type: DefaultDict[str, int]
         self.outbound_commands_counter = defaultdict(int)  # type: DefaultDict[str, int]
 
+        # Whether we are sending binary frames rather than lines
+        self.sending_frames = False
+
+        # Map from stream name to the rows of an RDATA batch which we are
+        # waiting for the end of, so that we can send them in one frame.
+        self._pending_frame_rows = {}  # type: Dict[str, List[Any]]
+
+        # The data received since the end of the last complete frame
+        self._frame_buffer = bytearray()
+
     def connectionMade(self):
         logger.info("[%s] Connection established", self.id())
 
@@ -174,7 +234,11 @@ class BaseReplicationStreamProtocol(LineOnlyReceiver):
 
         # Always send the initial PING so that the other side knows that they
         # can time us out.
-        self.send_command(PingCommand(self.clock.time_msec()))
+        self.send_command(PingCommand(self.get_initial_ping_data()))
+
+    def get_initial_ping_data(self):
+        """Returns the data for the PING we send when the connection is made"""
+        return self.clock.time_msec()
 
     def send_ping(self):
         """Periodically sends a ping and checks if we should close the connection
@@ -213,20 +277,125 @@ class BaseReplicationStreamProtocol(LineOnlyReceiver):
         line = line.decode("utf-8")
         cmd_name, rest_of_line = line.split(" ", 1)
 
+        cmd = self._parse_command(cmd_name, rest_of_line)
+        if cmd is None:
+            return
+
+        if cmd.NAME == BinaryFramesCommand.NAME:
+            # Everything after this line is framed, so we have to switch now
+            # rather than when the command is handled.
+            logger.info("[%s] Switching to binary frames", self.id())
+            self.setRawMode()
+
+        # Now lets try and call on_<CMD_NAME> function
+        run_as_background_process(
+            "replication-" + cmd.get_logcontext_id(), self.handle_command, cmd
+        )
+
+    def rawDataReceived(self, data):
+        """Called when we've received data after switching to binary frames
+        """
+        buf = self._frame_buffer
+        buf += data
+
+        offset = 0
+        while len(buf) - offset >= _FRAME_HEADER.size:
+            (length,) = _FRAME_HEADER.unpack_from(buf, offset)
+            if length > MAX_FRAME_LENGTH:
+                self._frame_buffer = bytearray()
+                self.send_error("Frame length exceeded")
+                return
+
+            start = offset + _FRAME_HEADER.size
+            end = start + length
+            if len(buf) < end:
+                break
+
+            self._frame_received(bytes(buf[start:end]))
+            offset = end
+
+            if self.state == ConnectionStates.CLOSED:
+                return
+
+        del buf[:offset]
+
+    def _frame_received(self, payload):
+        """Called when we've received a binary frame
+        """
+        try:
+            frame = msgpack.unpackb(payload, raw=False)
+            cmd_name = frame[0]
+        except Exception as e:
+            logger.exception("[%s] failed to parse frame %r", self.id(), payload)
+            self.send_error("failed to parse frame: %r" % (e,))
+            return
+
+        if len(frame) == 2:
+            cmd = self._parse_command(cmd_name, frame[1])
+            if cmd is not None:
+                run_as_background_process(
+                    "replication-" + cmd.get_logcontext_id(), self.handle_command, cmd
+                )
+            return
+
+        # Otherwise this is a whole batch of RDATA
+        if cmd_name != RdataCommand.NAME or len(frame) != 4:
+            logger.error("[%s] invalid frame for %r", self.id(), cmd_name)
+            self.send_error("invalid frame for %r" % (cmd_name,))
+            return
+
+        _, stream_name, token, rows = frame
+        if not self._check_inbound_command(cmd_name, len(rows)):
+            return
+
+        run_as_background_process(
+            "replication-%s-%s" % (cmd_name, stream_name),
+            self.on_rdata_batch,
+            stream_name,
+            token,
+            rows,
+        )
+
+    def _check_inbound_command(self, cmd_name, count=1):
+        """Checks that we're allowed to receive the given command, and updates
+        the metrics. If we're not, sends an error and closes the connection.
+
+        Args:
+            cmd_name (str)
+            count (int): the number of commands of this type received
+
+        Returns:
+            bool: whether the command is allowed
+        """
         if cmd_name not in self.VALID_INBOUND_COMMANDS:
             logger.error("[%s] invalid command %s", self.id(), cmd_name)
             self.send_error("invalid command: %s", cmd_name)
-            return
+            return False
 
         self.last_received_command = self.clock.time_msec()
 
         self.inbound_commands_counter[cmd_name] = (
-            self.inbound_commands_counter[cmd_name] + 1
+            self.inbound_commands_counter[cmd_name] + count
         )
+        return True
+
+    def _parse_command(self, cmd_name, rest_of_line):
+        """Parses a command we have received.
+
+        Args:
+            cmd_name (str)
+            rest_of_line (str)
+
+        Returns:
+            Command|None: the command, or None if it isn't valid, in which case
+                we've sent an error and closed the connection.
+        """
+        if not self._check_inbound_command(cmd_name):
+            return None
 
         cmd_cls = COMMAND_MAP[cmd_name]
         try:
-            cmd = cmd_cls.from_line(rest_of_line)
+            return cmd_cls.from_line(rest_of_line)
         except Exception as e:
             logger.exception(
                 "[%s] failed to parse line %r: %r", self.id(), cmd_name, rest_of_line
@@ -234,12 +403,7 @@ class BaseReplicationStreamProtocol(LineOnlyReceiver):
             self.send_error(
                 "failed to parse line for  %r: %r (%r):" % (cmd_name, e, rest_of_line)
             )
-            return
-
-        # Now lets try and call on_<CMD_NAME> function
-        run_as_background_process(
-            "replication-" + cmd.get_logcontext_id(), self.handle_command, cmd
-        )
+            return None
 
     async def handle_command(self, cmd: Command):
         """Handle a command we have received over the replication stream.
@@ -285,6 +449,20 @@ class BaseReplicationStreamProtocol(LineOnlyReceiver):
         self.outbound_commands_counter[cmd.NAME] = (
             self.outbound_commands_counter[cmd.NAME] + 1
         )
+
+        if self.sending_frames:
+            self._send_frame(cmd)
+        else:
+            self._send_line(cmd)
+
+        self.last_sent_command = self.clock.time_msec()
+
+        if cmd.NAME == BinaryFramesCommand.NAME:
+            self.sending_frames = True
+
+    def _send_line(self, cmd):
+        """Sends a command as a line
+        """
         string = "%s %s" % (cmd.NAME, cmd.to_line())
         if "\n" in string:
             raise Exception("Unexpected newline in command: %r", string)
@@ -299,7 +477,47 @@ class BaseReplicationStreamProtocol(LineOnlyReceiver):
 
         self.sendLine(encoded_string)
 
-        self.last_sent_command = self.clock.time_msec()
+    def _send_frame(self, cmd):
+        """Sends a command as a binary frame.
+
+        The rows of a batch of RDATA are held back until the end of the batch,
+        and then sent together in one frame.
+        """
+        if not isinstance(cmd, RdataCommand):
+            self._write_frame(_encode_frame([cmd.NAME, "%s" % (cmd.to_line(),)]))
+            return
+
+        rows = self._pending_frame_rows.setdefault(cmd.stream_name, [])
+        rows.append(cmd.row)
+        if cmd.token is None:
+            return
+
+        del self._pending_frame_rows[cmd.stream_name]
+
+        try:
+            payload = _encode_frame([cmd.NAME, cmd.stream_name, cmd.token, rows])
+        except (TypeError, ValueError, OverflowError):
+            # Fall back to sending each row in its text form, which can
+            # encode more things (e.g. integers which don't fit in 64 bits).
+            payload = None
+
+        if payload is not None and len(payload) <= MAX_FRAME_LENGTH:
+            self._write_frame(payload)
+            return
+
+        for i, row in enumerate(rows):
+            token = cmd.token if i == len(rows) - 1 else None
+            row_cmd = RdataCommand(cmd.stream_name, token, row)
+            self._write_frame(_encode_frame([cmd.NAME, row_cmd.to_line()]))
+
+    def _write_frame(self, payload):
+        if len(payload) > MAX_FRAME_LENGTH:
+            raise Exception(
+                "Failed to send frame as too long (%d > %d)"
+                % (len(payload), MAX_FRAME_LENGTH)
+            )
+
+        self.transport.write(_FRAME_HEADER.pack(len(payload)) + payload)
 
     def _queue_command(self, cmd):
         """Queue the command until the connection is ready to write to again.
@@ -378,6 +596,7 @@ class BaseReplicationStreamProtocol(LineOnlyReceiver):
 
         self.state = ConnectionStates.CLOSED
         self.pending_commands = []
+        self._pending_frame_rows = {}
 
         if self.transport:
             self.transport.unregisterProducer()
@@ -430,6 +649,19 @@ class ServerReplicationStreamProtocol(BaseReplicationStreamProtocol):
         logger.info("[%s] Renamed to %r", self.id(), cmd.data)
         self.name = cmd.data
 
+    async def on_PING(self, cmd):
+        # Clients which support binary frames say so in their first PING.
+        capabilities = ("%s" % (cmd.data,)).split(" ")[1:]
+        if (
+            self.SUPPORTS_BINARY_FRAMES
+            and BINARY_FRAMES_CAPABILITY in capabilities
+            and not self.sending_frames
+        ):
+            logger.info("[%s] Switching to binary frames", self.id())
+            self.send_command(BinaryFramesCommand(BINARY_FRAMES_VERSION))
+
+        await BaseReplicationStreamProtocol.on_PING(self, cmd)
+
     async def on_USER_SYNC(self, cmd):
         await self.streamer.on_user_sync(
             self.conn_id, cmd.user_id, cmd.is_syncing, cmd.last_sync_ms
@@ -464,6 +696,9 @@ class ServerReplicationStreamProtocol(BaseReplicationStreamProtocol):
     async def on_REMOTE_SERVER_UP(self, cmd: RemoteServerUpCommand):
         self.streamer.on_remote_server_up(cmd.data)
 
+    async def on_WRITER_POSITION(self, cmd: WriterPositionCommand):
+        self.streamer.on_writer_position(cmd.stream_name, cmd.instance_name, cmd.token)
+
     async def on_USER_IP(self, cmd):
         self.streamer.on_user_ip(
             cmd.user_id,
@@ -562,6 +797,9 @@ class ServerReplicationStreamProtocol(BaseReplicationStreamProtocol):
     def send_remote_server_up(self, server: str):
         self.send_command(RemoteServerUpCommand(server))
 
+    def send_writer_position(self, stream_name: str, instance_name: str, token: int):
+        self.send_command(WriterPositionCommand(stream_name, instance_name, token))
+
     def on_connection_closed(self):
         BaseReplicationStreamProtocol.on_connection_closed(self)
         self.streamer.lost_connection(self)
@@ -600,6 +838,13 @@ class AbstractReplicationClientHandler(metaclass=abc.ABCMeta):
         """Called when get a new REMOTE_SERVER_UP command."""
         raise NotImplementedError()
 
+    def on_writer_position(self, stream_name: str, instance_name: str, token: int):
+        """Called when we learn the position of one of the writers of a stream
+        which has more than one writer.
+
+        By default this does nothing.
+        """
+
     @abc.abstractmethod
     def get_streams_to_replicate(self):
         """Called when a new connection has been established and we need to
@@ -680,32 +925,52 @@ class ClientReplicationStreamProtocol(BaseReplicationStreamProtocol):
         if not self.streams_connecting:
             self.handler.finished_connecting()
 
+    def get_initial_ping_data(self):
+        now = self.clock.time_msec()
+        if self.SUPPORTS_BINARY_FRAMES:
+            return "%d %s" % (now, BINARY_FRAMES_CAPABILITY)
+        return now
+
     async def on_SERVER(self, cmd):
         if cmd.data != self.server_name:
             logger.error("[%s] Connected to wrong remote: %r", self.id(), cmd.data)
             self.send_error("Wrong remote")
 
+    async def on_BINARY_FRAMES(self, cmd):
+        # We've already switched to reading frames in `lineReceived`.
+        pass
+
     async def on_RDATA(self, cmd):
-        stream_name = cmd.stream_name
-        inbound_rdata_count.labels(stream_name).inc()
+        await self.on_rdata_batch(cmd.stream_name, cmd.token, [cmd.row])
+
+    async def on_rdata_batch(self, stream_name, token, raw_rows):
+        """Handles rows received for a stream, either from an RDATA command or
+        from a frame holding a whole batch.
+
+        Args:
+            stream_name (str)
+            token (int|None): the token of the rows, or None if they are part
+                of a batch which hasn't finished yet.
+            raw_rows (list): the rows, as sent on the wire
+        """
+        inbound_rdata_count.labels(stream_name).inc(len(raw_rows))
 
         try:
-            row = STREAMS_MAP[stream_name].parse_row(cmd.row)
+            rows = [STREAMS_MAP[stream_name].parse_row(row) for row in raw_rows]
         except Exception:
             logger.exception(
-                "[%s] Failed to parse RDATA: %r %r", self.id(), stream_name, cmd.row
+                "[%s] Failed to parse RDATA: %r %r", self.id(), stream_name, raw_rows
             )
             raise
 
-        if cmd.token is None:
+        if token is None:
             # I.e. this is part of a batch of updates for this stream. Batch
             # until we get an update for the stream with a non None token
-            self.pending_batches.setdefault(stream_name, []).append(row)
+            self.pending_batches.setdefault(stream_name, []).extend(rows)
         else:
             # Check if this is the last of a batch of updates
-            rows = self.pending_batches.pop(stream_name, [])
-            rows.append(row)
-            await self.handler.on_rdata(stream_name, cmd.token, rows)
+            rows = self.pending_batches.pop(stream_name, []) + rows
+            await self.handler.on_rdata(stream_name, token, rows)
 
     async def on_POSITION(self, cmd):
         # When we get a `POSITION` command it means we've finished getting
@@ -722,6 +987,9 @@ class ClientReplicationStreamProtocol(BaseReplicationStreamProtocol):
     async def on_REMOTE_SERVER_UP(self, cmd: RemoteServerUpCommand):
         self.handler.on_remote_server_up(cmd.data)
 
+    async def on_WRITER_POSITION(self, cmd: WriterPositionCommand):
+        self.handler.on_writer_position(cmd.stream_name, cmd.instance_name, cmd.token)
+
     def replicate(self, stream_name, token):
         """Send the subscription request to the server
         """
@@ -0,0 +1,450 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Replication over a pub/sub bus (such as Redis), rather than over a TCP
+connection from each worker to the master.
+
+The master publishes each command for the workers once, on the server
+channel, and every worker subscribes to it. The messages are command lines, in
+the same format as on a TCP connection (see `synapse.replication.tcp.protocol`).
+
+Workers publish their commands for the master on the client channel. Each
+message is the name of the worker instance which sent it followed by the
+command line, e.g.::
+
+    generic_worker1-aBcDe USER_SYNC @user:example.com start 1490197670513
+
+A bus can't replay the updates a worker missed while it wasn't subscribed, so
+when it subscribes a worker fetches them from the master over HTTP (see
+`synapse.replication.http.streams`), holding back any updates it is sent in the
+meantime.
+"""
+
+import abc
+import logging
+from typing import Any, Dict, List, Set, Tuple
+
+from twisted.internet import defer
+
+from synapse.logging.context import make_deferred_yieldable, run_in_background
+from synapse.metrics.background_process_metrics import run_as_background_process
+from synapse.replication.http.streams import ReplicationGetStreamUpdates
+from synapse.replication.tcp.commands import (
+    COMMAND_MAP,
+    VALID_CLIENT_COMMANDS,
+    VALID_SERVER_COMMANDS,
+    Command,
+    ErrorCommand,
+    RdataCommand,
+    RemoteServerUpCommand,
+    SyncCommand,
+    UserSyncCommand,
+    WriterPositionCommand,
+)
+from synapse.replication.tcp.streams import STREAMS_MAP
+from synapse.util.stringutils import random_string
+
+logger = logging.getLogger(__name__)
+
+# How long to wait before retrying a failed attempt to catch up with a stream
+CATCH_UP_RETRY_INTERVAL_SEC = 5
+
+
+def get_server_channel(server_name):
+    """The channel which the master publishes on"""
+    return "synapse.replication.%s.server" % (server_name,)
+
+
+def get_client_channel(server_name):
+    """The channel which workers publish on"""
+    return "synapse.replication.%s.client" % (server_name,)
+
+
+class PubSubListener(metaclass=abc.ABCMeta):
+    """The interface for objects which subscribe to a channel of a
+    `PubSubBus`.
+    """
+
+    @abc.abstractmethod
+    def on_subscribed(self):
+        """Called when we've subscribed to the channel, including after the
+        connection to the bus has been lost and re-established.
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def on_unsubscribed(self):
+        """Called when the connection to the bus has been lost, so we may miss
+        messages until `on_subscribed` is called again.
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def on_message(self, message):
+        """Called with each message published on the channel.
+
+        Args:
+            message (str)
+        """
+        raise NotImplementedError()
+
+
+class PubSubBus(metaclass=abc.ABCMeta):
+    """The interface for pub/sub backends. Messages published on a channel
+    must be delivered to its subscribers in the order they were published.
+    """
+
+    @abc.abstractmethod
+    def publish(self, channel, message):
+        """Publishes a message on a channel. Messages are dropped if we aren't
+        connected to the bus.
+
+        Args:
+            channel (str)
+            message (str)
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def subscribe(self, channel, listener):
+        """Subscribes to a channel, keeping the subscription if the connection
+        to the bus is lost and re-established.
+
+        Args:
+            channel (str)
+            listener (PubSubListener)
+        """
+        raise NotImplementedError()
+
+
+def _parse_command(line, valid_commands):
+    """Parses a command line received from the bus.
+
+    Args:
+        line (str)
+        valid_commands (Collection[str]): the commands we expect to receive
+
+    Returns:
+        Command|None: the command, or None if it isn't one we expect
+    """
+    cmd_name, rest_of_line = line.split(" ", 1)
+    if cmd_name not in valid_commands:
+        logger.warning("Ignoring unexpected replication command %s", cmd_name)
+        return None
+
+    return COMMAND_MAP[cmd_name].from_line(rest_of_line)
+
+
+class PubSubReplicationPublisher(PubSubListener):
+    """The master's end of replication over a pub/sub bus.
+
+    This is added to the `ReplicationStreamer`'s connections, and publishes
+    the updates it is given once for all of the workers. It also handles the
+    commands the workers publish.
+    """
+
+    def __init__(self, hs, streamer):
+        self.streamer = streamer
+        self.bus = hs.get_replication_pubsub_bus()
+
+        self.name = "pubsub"
+        self.conn_id = "pubsub"
+
+        # Every worker gets every stream.
+        self.replication_streams = set(streamer.streams_by_name)
+
+        self._server_channel = get_server_channel(hs.hostname)
+        self.bus.subscribe(get_client_channel(hs.hostname), self)
+
+    def send_command(self, cmd):
+        self.bus.publish(self._server_channel, "%s %s" % (cmd.NAME, cmd.to_line()))
+
+    def stream_update(self, stream_name, token, data):
+        self.send_command(RdataCommand(stream_name, token, data))
+
+    def send_sync(self, data):
+        self.send_command(SyncCommand(data))
+
+    def send_remote_server_up(self, server):
+        self.send_command(RemoteServerUpCommand(server))
+
+    def send_writer_position(self, stream_name, instance_name, token):
+        self.send_command(WriterPositionCommand(stream_name, instance_name, token))
+
+    def send_error(self, error_string, *args):
+        self.send_command(ErrorCommand(error_string % args))
+
+    def on_subscribed(self):
+        logger.info("Subscribed to replication commands from workers")
+
+    def on_unsubscribed(self):
+        logger.warning("Lost subscription to replication commands from workers")
+
+    def on_message(self, message):
+        try:
+            sender, line = message.split(" ", 1)
+            cmd = _parse_command(line, VALID_CLIENT_COMMANDS)
+        except Exception:
+            logger.exception("Failed to parse replication message %r", message)
+            return
+
+        handler = getattr(self, "on_%s" % (cmd.NAME,), None) if cmd else None
+        if handler is None:
+            return
+
+        run_as_background_process(
+            "replication-" + cmd.get_logcontext_id(), handler, sender, cmd
+        )
+
+    async def on_USER_SYNC(self, sender, cmd):
+        # Syncs are tracked per worker instance. If the worker goes away the
+        # presence handler times them out, as we can't see it disconnect.
+        await self.streamer.on_user_sync(
+            sender, cmd.user_id, cmd.is_syncing, cmd.last_sync_ms
+        )
+
+    async def on_FEDERATION_ACK(self, sender, cmd):
+        self.streamer.federation_ack(cmd.token)
+
+    async def on_REMOVE_PUSHER(self, sender, cmd):
+        await self.streamer.on_remove_pusher(cmd.app_id, cmd.push_key, cmd.user_id)
+
+    async def on_INVALIDATE_CACHE(self, sender, cmd):
+        await self.streamer.on_invalidate_cache(cmd.cache_func, cmd.keys)
+
+    async def on_REMOTE_SERVER_UP(self, sender, cmd):
+        self.streamer.on_remote_server_up(cmd.data)
+
+    async def on_WRITER_POSITION(self, sender, cmd):
+        self.streamer.on_writer_position(cmd.stream_name, cmd.instance_name, cmd.token)
+
+    async def on_USER_IP(self, sender, cmd):
+        await self.streamer.on_user_ip(
+            cmd.user_id,
+            cmd.access_token,
+            cmd.ip,
+            cmd.user_agent,
+            cmd.device_id,
+            cmd.last_seen,
+        )
+
+    async def on_ERROR(self, sender, cmd):
+        logger.error("Worker %s reported error: %r", sender, cmd.data)
+
+
+class PubSubReplicationClient(PubSubListener):
+    """A worker's end of replication over a pub/sub bus.
+
+    This stands in for a `ClientReplicationStreamProtocol`: it passes the
+    updates published by the master to the `ReplicationClientHandler`, and
+    publishes the commands which the handler sends.
+    """
+
+    def __init__(self, hs, handler):
+        """
+        Args:
+            hs (synapse.server.HomeServer)
+            handler (AbstractReplicationClientHandler)
+        """
+        self.clock = hs.get_clock()
+        self.handler = handler
+        self.bus = hs.get_replication_pubsub_bus()
+
+        self.name = hs.config.worker_name or "worker"
+        self.conn_id = random_string(5)
+
+        self._server_channel = get_server_channel(hs.hostname)
+        self._client_channel = get_client_channel(hs.hostname)
+
+        self._get_stream_updates = ReplicationGetStreamUpdates.make_client(hs)
+
+        # Map from the name of each stream we replicate to the token we have
+        # processed the stream up to.
+        self.stream_positions = {}  # type: Dict[str, int]
+
+        # The streams we are catching up with, and the updates to them which
+        # we have been sent meanwhile.
+        self.streams_connecting = set()  # type: Set[str]
+        self.pending_rdata = {}  # type: Dict[str, List[Tuple[Any, Any]]]
+
+        # Map of stream to batched updates. See RdataCommand for info on how
+        # batching works.
+        self.pending_batches = {}  # type: Dict[str, List[Any]]
+
+    def id(self):
+        return "%s-%s" % (self.name, self.conn_id)
+
+    def start(self):
+        self.bus.subscribe(self._server_channel, self)
+
+    def send_command(self, cmd: Command):
+        """Publishes a command for the master"""
+        self.bus.publish(
+            self._client_channel, "%s %s %s" % (self.id(), cmd.NAME, cmd.to_line())
+        )
+
+    def on_subscribed(self):
+        logger.info("[%s] Subscribed to replication", self.id())
+        run_as_background_process("replication-catch-up", self._catch_up)
+
+    def on_unsubscribed(self):
+        logger.warning("[%s] Lost subscription to replication", self.id())
+        self.handler.update_connection(None)
+
+    async def _catch_up(self):
+        """Fetches the updates we missed while we weren't subscribed."""
+        streams = self.handler.get_streams_to_replicate()
+
+        self.stream_positions = dict(streams)
+        self.streams_connecting = set(streams)
+        self.pending_rdata = {}
+        self.pending_batches = {}
+
+        # We can send commands now. Tell the master if we have any users
+        # currently syncing (should only happen on synchrotrons)
+        self.handler.update_connection(self)
+
+        now = self.clock.time_msec()
+        for user_id in self.handler.get_currently_syncing_users():
+            self.send_command(UserSyncCommand(user_id, True, now))
+
+        await make_deferred_yieldable(
+            defer.gatherResults(
+                [
+                    run_in_background(self._catch_up_stream, stream_name, token)
+                    for stream_name, token in streams.items()
+                ],
+                consumeErrors=True,
+            )
+        )
+
+        self.handler.finished_connecting()
+
+    async def _catch_up_stream(self, stream_name, token):
+        while True:
+            try:
+                result = await self._get_stream_updates(
+                    stream_name=stream_name, from_token=token
+                )
+                break
+            except Exception:
+                logger.exception(
+                    "[%s] Failed to fetch updates for stream %s, retrying",
+                    self.id(),
+                    stream_name,
+                )
+                await self.clock.sleep(CATCH_UP_RETRY_INTERVAL_SEC)
+
+        # Send on the updates in batches of rows which share a token.
+        rows = []  # type: List[Any]
+        updates = result["updates"]
+        for i, (update_token, row) in enumerate(updates):
+            rows.append(STREAMS_MAP[stream_name].parse_row(row))
+            if i == len(updates) - 1 or updates[i + 1][0] != update_token:
+                await self.handler.on_rdata(stream_name, update_token, rows)
+                rows = []
+
+        upto_token = result["upto_token"]
+        self.stream_positions[stream_name] = upto_token
+        await self.handler.on_position(stream_name, upto_token)
+
+        # Now pass on the updates we were sent while we were catching up,
+        # dropping any which we've already seen.
+        while True:
+            pending = self.pending_rdata.pop(stream_name, [])
+            if not pending:
+                break
+            for update_token, row in pending:
+                await self._handle_rdata(stream_name, update_token, row)
+
+        self.streams_connecting.discard(stream_name)
+        logger.info("[%s] Caught up with stream %s", self.id(), stream_name)
+
+    def on_message(self, message):
+        try:
+            cmd = _parse_command(message, VALID_SERVER_COMMANDS)
+        except Exception:
+            logger.exception(
+                "[%s] Failed to parse replication message %r", self.id(), message
+            )
+            return
+
+        if cmd is None:
+            return
+
+        if cmd.NAME == RdataCommand.NAME:
+            if cmd.stream_name not in self.stream_positions:
+                # We don't replicate this stream
+                return
+
+            if cmd.stream_name in self.streams_connecting:
+                # This has to be decided as the message arrives, so that the
+                # updates are passed on in order once we've caught up.
+                self.pending_rdata.setdefault(cmd.stream_name, []).append(
+                    (cmd.token, cmd.row)
+                )
+                return
+
+        handler = getattr(self, "on_%s" % (cmd.NAME,), None)
+        if handler is None:
+            return
+
+        run_as_background_process(
+            "replication-" + cmd.get_logcontext_id(), handler, cmd
+        )
+
+    async def on_RDATA(self, cmd):
+        await self._handle_rdata(cmd.stream_name, cmd.token, cmd.row)
+
+    async def _handle_rdata(self, stream_name, token, raw_row):
+        row = STREAMS_MAP[stream_name].parse_row(raw_row)
+
+        if token is None:
+            # I.e. this is part of a batch of updates for this stream. Batch
+            # until we get an update for the stream with a non None token
+            self.pending_batches.setdefault(stream_name, []).append(row)
+            return
+
+        rows = self.pending_batches.pop(stream_name, [])
+        rows.append(row)
+
+        if token <= self.stream_positions[stream_name]:
+            # We've already had these, while catching up.
+            return
+
+        self.stream_positions[stream_name] = token
+        await self.handler.on_rdata(stream_name, token, rows)
+
+    async def on_POSITION(self, cmd):
+        if cmd.stream_name not in self.stream_positions:
+            return
+
+        if cmd.stream_name in self.streams_connecting:
+            return
+
+        if cmd.token > self.stream_positions[cmd.stream_name]:
+            self.stream_positions[cmd.stream_name] = cmd.token
+            await self.handler.on_position(cmd.stream_name, cmd.token)
+
+    async def on_SYNC(self, cmd):
+        self.handler.on_sync(cmd.data)
+
+    async def on_REMOTE_SERVER_UP(self, cmd):
+        self.handler.on_remote_server_up(cmd.data)
+
+    async def on_WRITER_POSITION(self, cmd):
+        self.handler.on_writer_position(cmd.stream_name, cmd.instance_name, cmd.token)
+
+    async def on_ERROR(self, cmd):
+        logger.error("[%s] Master reported error: %r", self.id(), cmd.data)
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""A `PubSubBus` which uses Redis.
+
+This needs txredisapi, so must only be imported if Redis has been enabled in
+the config.
+"""
+
+import logging
+from typing import Optional
+
+import txredisapi
+
+from twisted.internet import defer
+
+from synapse.logging.context import make_deferred_yieldable
+from synapse.metrics.background_process_metrics import run_as_background_process
+from synapse.replication.tcp.pubsub import PubSubBus, PubSubListener
+
+logger = logging.getLogger(__name__)
+
+
+class _RedisSubscriberProtocol(txredisapi.SubscriberProtocol):
+    """A connection to Redis which subscribes to a channel, and passes what it
+    receives to a `PubSubListener`.
+    """
+
+    channel = None  # type: str
+    listener = None  # type: Optional[PubSubListener]
+
+    def connectionMade(self):
+        logger.info("Connected to redis, subscribing to %s", self.channel)
+        run_as_background_process("redis-subscribe", self._subscribe)
+
+    async def _subscribe(self):
+        # This authenticates, if a password is configured.
+        await make_deferred_yieldable(defer.maybeDeferred(super().connectionMade))
+        await make_deferred_yieldable(self.subscribe(self.channel))
+        assert self.listener is not None
+        self.listener.on_subscribed()
+
+    def messageReceived(self, pattern, channel, message):
+        assert self.listener is not None
+        self.listener.on_message(message)
+
+    def connectionLost(self, reason):
+        logger.warning("Lost connection to redis: %r", reason)
+        super().connectionLost(reason)
+        assert self.listener is not None
+        self.listener.on_unsubscribed()
+
+
+class _RedisSubscriberFactory(txredisapi.SubscriberFactory):
+    """Connects to Redis for a subscription, reconnecting if the connection is
+    lost.
+    """
+
+    maxDelay = 5
+    continueTrying = True
+    protocol = _RedisSubscriberProtocol
+
+    def __init__(self, password, channel, listener):
+        super().__init__()
+
+        # The SubscriberFactory constructor doesn't take the password, so we
+        # set it on the RedisFactory base class ourselves.
+        self.password = password
+
+        self.channel = channel
+        self.listener = listener
+
+    def buildProtocol(self, addr):
+        p = super().buildProtocol(addr)
+        p.channel = self.channel
+        p.listener = self.listener
+        return p
+
+
+class RedisPubSubBus(PubSubBus):
+    """Publishes and subscribes to channels on the Redis server given in the
+    config.
+
+    Redis connections which are subscribed to a channel can't be used for
+    anything else, so each subscription has its own connection, and there is
+    another connection for publishing.
+    """
+
+    def __init__(self, hs):
+        self._reactor = hs.get_reactor()
+        self._host = hs.config.redis_host
+        self._port = hs.config.redis_port
+        self._password = hs.config.redis_password
+
+        self._publisher = txredisapi.lazyConnection(
+            host=self._host, port=self._port, password=self._password, reconnect=True,
+        )
+
+    def publish(self, channel, message):
+        run_as_background_process(
+            "redis-publish", self._publish, channel, message,
+        )
+
+    async def _publish(self, channel, message):
+        try:
+            await make_deferred_yieldable(self._publisher.publish(channel, message))
+        except txredisapi.ConnectionError:
+            logger.warning("Dropping replication message as redis is unavailable")
+
+    def subscribe(self, channel, listener):
+        factory = _RedisSubscriberFactory(self._password, channel, listener)
+        self._reactor.connectTCP(self._host, self._port, factory)
@@ -17,7 +17,7 @@
 
 import logging
 import random
-from typing import Any, List
+from typing import Any, Dict, List
 
 from six import itervalues
 
@@ -25,11 +25,14 @@ from prometheus_client import Counter
 
 from twisted.internet.protocol import Factory
 
+from synapse.api.constants import EventTypes, Membership
 from synapse.metrics import LaterGauge
 from synapse.metrics.background_process_metrics import run_as_background_process
+from synapse.util.async_helpers import Linearizer
 from synapse.util.metrics import Measure, measure_func
 
 from .protocol import ServerReplicationStreamProtocol
+from .pubsub import PubSubReplicationPublisher
 from .streams import STREAMS_MAP
 from .streams.federation import FederationStream
 
@@ -43,6 +46,9 @@ invalidate_cache_counter = Counter(
     "synapse_replication_tcp_resource_invalidate_cache", ""
 )
 user_ip_cache_counter = Counter("synapse_replication_tcp_resource_user_ip_cache", "")
+writer_position_counter = Counter(
+    "synapse_replication_tcp_resource_writer_position", ""
+)
 
 logger = logging.getLogger(__name__)
 
@@ -52,7 +58,7 @@ class ReplicationStreamProtocolFactory(Factory):
     """
 
     def __init__(self, hs):
-        self.streamer = ReplicationStreamer(hs)
+        self.streamer = hs.get_replication_streamer()
         self.clock = hs.get_clock()
         self.server_name = hs.config.server_name
 
@@ -75,6 +81,23 @@ class ReplicationStreamer(object):
         self.clock = hs.get_clock()
         self.notifier = hs.get_notifier()
         self._server_notices_sender = hs.get_server_notices_sender()
+        self._pusher_pool = hs.get_pusherpool()
+        self._is_mine_id = hs.is_mine_id
+
+        # If events are persisted by more than one process, the streams they
+        # write to have several writers. We tell the other processes about our
+        # own positions in those streams, and pass on the positions of the
+        # others.
+        self._instance_name = hs.config.worker.instance_name
+        self._main_store_writers = hs.config.worker.main_store_writers
+        self._has_multiple_writers = len(self._main_store_writers) > 1
+        self._last_sent_writer_positions = {}  # type: Dict[str, int]
+
+        # We process the positions of the other event writers one at a time, so
+        # that we notify for their events in order.
+        self._writer_position_linearizer = Linearizer(
+            name="replication_writer_position"
+        )
 
         self._replication_torture_level = hs.config.replication_torture_level
 
@@ -122,6 +145,11 @@ class ReplicationStreamer(object):
         self.notifier.add_replication_callback(self.on_notifier_poke)
         self.notifier.add_remote_server_up_callback(self.send_remote_server_up)
 
+        # If there is a pub/sub bus, we publish every update on it once for
+        # all of the workers subscribed to it, as if it were a connection.
+        if hs.get_replication_pubsub_bus():
+            self.new_connection(PubSubReplicationPublisher(hs, self))
+
         # Keeps track of whether we are currently checking for updates
         self.is_looping = False
         self.pending_updates = False
@@ -147,6 +175,8 @@ class ReplicationStreamer(object):
                 stream.discard_updates_and_advance()
             return
 
+        self._send_own_writer_positions()
+
         self.pending_updates = True
 
         if self.is_looping:
@@ -280,6 +310,126 @@ class ReplicationStreamer(object):
         # workers.
         await self.store.invalidate_cache_and_stream(cache_func, tuple(keys))
 
+    @measure_func("repl.on_writer_position")
+    def on_writer_position(self, stream_name: str, instance_name: str, token: int):
+        """One of the other writers has told us its position in a stream with
+        multiple writers.
+        """
+        writer_position_counter.inc()
+
+        # Pass it on to the other workers.
+        for conn in self.connections:
+            conn.send_writer_position(stream_name, instance_name, token)
+
+        if stream_name == "caches":
+            prev_token = self.store.get_cache_stream_token_for_writer(instance_name)
+            self.store.advance_writer_position(stream_name, instance_name, token)
+            new_token = self.store.get_cache_stream_token_for_writer(instance_name)
+
+            if new_token > prev_token:
+                run_as_background_process(
+                    "invalidate_caches_from_other_writer",
+                    self._invalidate_caches_from_other_writer,
+                    instance_name,
+                    prev_token,
+                    new_token,
+                )
+            return
+
+        if stream_name != "events":
+            self.store.advance_writer_position(stream_name, instance_name, token)
+            return
+
+        # The current token of the events stream is the minimum of the writers'
+        # positions, so may now have moved on.
+        prev_token = self.store.get_room_max_stream_ordering()
+        self.store.advance_writer_position(stream_name, instance_name, token)
+        new_token = self.store.get_room_max_stream_ordering()
+
+        if new_token > prev_token:
+            run_as_background_process(
+                "notify_events_from_other_writers",
+                self._notify_events_from_other_writers,
+                prev_token,
+                new_token,
+            )
+
+    async def _notify_events_from_other_writers(self, prev_token: int, new_token: int):
+        """Invalidates our caches for, and notifies about, the events in the
+        given range of the events stream which were persisted by other event
+        writers.
+        """
+        with (await self._writer_position_linearizer.queue(())):
+            rows = await self.store.get_new_events_from_other_writers(
+                prev_token, new_token
+            )
+            self.store.invalidate_caches_for_events_from_other_writers(rows)
+
+            events = await self.store.get_events_as_list(
+                [row[1] for row in rows], allow_rejected=True
+            )
+            for event in events:
+                if event.rejected_reason:
+                    continue
+
+                extra_users = []
+                if event.type == EventTypes.Member:
+                    # We notify for outlier memberships if they are invites
+                    # for our users, as the federation handler does.
+                    if event.internal_metadata.is_outlier() and (
+                        event.membership != Membership.INVITE
+                        or not self._is_mine_id(event.state_key)
+                    ):
+                        continue
+                    extra_users.append(event.state_key)
+                elif event.internal_metadata.is_outlier():
+                    continue
+
+                self.notifier.on_new_room_event(
+                    event,
+                    event.internal_metadata.stream_ordering,
+                    new_token,
+                    extra_users=extra_users,
+                )
+
+            # This also notifies for any of our own events which were waiting
+            # for the other writers to catch up.
+            self.notifier.on_room_stream_advanced(new_token)
+
+            await self._pusher_pool.on_new_notifications(prev_token, new_token)
+
+    async def _invalidate_caches_from_other_writer(
+        self, instance_name: str, prev_token: int, new_token: int
+    ):
+        """Invalidates our caches for the invalidations in the given range of
+        the cache stream which were written by another process.
+        """
+        rows = await self.store.get_cache_invalidations_for_writer(
+            instance_name, prev_token, new_token
+        )
+        for cache_func, keys in rows:
+            self.store._invalidate_cache_from_replication(cache_func, keys)
+
+        # The cache stream may have moved on, so we need to pass the rows on
+        # to the workers.
+        self.notifier.on_new_replication_data()
+
+    def _send_own_writer_positions(self):
+        """Tells the workers our positions in the streams with multiple
+        writers, if they have changed.
+        """
+        if not self._has_multiple_writers:
+            return
+
+        positions = self.store.get_writer_positions(self._instance_name)
+        for stream_name, token in positions.items():
+            if self._last_sent_writer_positions.get(stream_name) == token:
+                continue
+            self._last_sent_writer_positions[stream_name] = token
+
+            for conn in self.connections:
+                conn.send_writer_position(stream_name, self._instance_name, token)
+
     @measure_func("repl.on_user_ip")
     async def on_user_ip(
         self, user_id, access_token, ip, user_agent, device_id, last_seen
@@ -313,6 +463,13 @@ class ReplicationStreamer(object):
         """
         self.connections.append(connection)
 
+        # Tell it where each of the writers has got to.
+        if self._has_multiple_writers:
+            for instance_name in self._main_store_writers:
+                positions = self.store.get_writer_positions(instance_name)
+                for stream_name, token in positions.items():
+                    connection.send_writer_position(stream_name, instance_name, token)
+
     def lost_connection(self, connection):
         """A client connection has been lost
         """
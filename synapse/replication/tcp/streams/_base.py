@@ -17,7 +17,7 @@
 import itertools
 import logging
 from collections import namedtuple
-from typing import Any, List, Optional
+from typing import Any, Dict, List, Optional
 
 import attr
 
@@ -26,6 +26,11 @@ logger = logging.getLogger(__name__)
 
 MAX_EVENTS_BEHIND = 500000
 
+# The approximate maximum size of the keys in a single coalesced CachesStream
+# row. The max line length is 16K, so this leaves plenty of room for the rest of
+# the RDATA command.
+MAX_COALESCED_CACHE_KEYS_SIZE = 8192
+
 BackfillStreamRow = namedtuple(
     "BackfillStreamRow",
     (
@@ -76,13 +81,17 @@ class CachesStreamRow:
     Attributes:
         cache_func: Name of the cached function.
         keys: The entry in the cache to invalidate. If None then will
-            invalidate all.
+            invalidate all. If `is_bulk` is set, a list of entries to
+            invalidate.
         invalidation_ts: Timestamp of when the invalidation took place.
+        is_bulk: Whether this row is several invalidations of the same cache
+            which have been coalesced together.
     """
 
     cache_func = attr.ib(type=str)
     keys = attr.ib(type=Optional[List[Any]])
     invalidation_ts = attr.ib(type=int)
+    is_bulk = attr.ib(type=bool, default=False)
 
 
 PublicRoomsStreamRow = namedtuple(
@@ -332,19 +341,109 @@ class PushersStream(Stream):
 class CachesStream(Stream):
     """A cache was invalidated on the master and no other stream would invalidate
     the cache on the workers
+
+    Invalidations of the same cache which are sent in the same batch are
+    coalesced into a single "bulk" row, to cut down on the number of RDATA
+    commands sent when many invalidations happen at once (e.g. during a large
+    room join).
     """
 
     NAME = "caches"
     ROW_TYPE = CachesStreamRow
 
     def __init__(self, hs):
-        store = hs.get_datastore()
+        self.store = hs.get_datastore()
 
-        self.current_token = store.get_cache_stream_token  # type: ignore
-        self.update_function = store.get_all_updated_caches  # type: ignore
+        self.current_token = self.store.get_cache_stream_token  # type: ignore
 
         super(CachesStream, self).__init__(hs)
 
+    async def update_function(self, from_token, to_token, limit):
+        rows = await self.store.get_all_updated_caches(from_token, to_token, limit)
+
+        # coalescing can bring the number of rows back under the limit, so check
+        # whether we have fallen behind first. Otherwise the rows past the limit
+        # would be skipped.
+        if len(rows) >= MAX_EVENTS_BEHIND:
+            raise Exception("stream %s has fallen behind" % (self.NAME))
+
+        return coalesce_cache_invalidations(rows)
+
+
+def coalesce_cache_invalidations(rows):
+    """Merges cache invalidation rows for the same cache into bulk rows.
+
+    All of the returned rows are given the stream ID of the last of the input
+    rows, so that they get sent as a single batch over replication and a worker
+    never persists a position part way through a set of merged rows. Since
+    invalidations are idempotent, the order in which they are applied within
+    the batch does not matter.
+
+    Args:
+        rows (list[tuple]): rows of `(stream_id, cache_func, keys,
+            invalidation_ts)`, in stream order.
+
+    Returns:
+        list[tuple]: rows of `(stream_id, cache_func, keys, invalidation_ts,
+            is_bulk)`
+    """
+    if len(rows) <= 1:
+        return [tuple(row) + (False,) for row in rows]
+
+    last_stream_id = rows[-1][0]
+
+    # Ordered map from cache_func to the list of pending bulk rows for that
+    # cache, each of the form [keys, invalidation_ts, seen_keys, size].
+    bulk_rows = {}  # type: Dict[str, List[list]]
+    # Invalidations of an entire cache, which are sent as they are.
+    invalidate_all_rows = []
+
+    for _stream_id, cache_func, keys, invalidation_ts in rows:
+        if keys is None:
+            invalidate_all_rows.append((cache_func, invalidation_ts))
+            continue
+
+        try:
+            key_id = tuple(keys)  # type: Optional[tuple]
+            hash(key_id)
+        except TypeError:
+            key_id = None
+
+        pending = bulk_rows.setdefault(cache_func, [])
+        current = pending[-1] if pending else None
+        if current is not None and key_id is not None and key_id in current[2]:
+            # We're already invalidating this key.
+            current[1] = max(current[1], invalidation_ts)
+            continue
+
+        size = sum(len(str(k)) + 4 for k in keys)
+        if current is None or current[3] + size > MAX_COALESCED_CACHE_KEYS_SIZE:
+            current = [[], invalidation_ts, set(), 0]
+            pending.append(current)
+
+        current[0].append(keys)
+        current[1] = max(current[1], invalidation_ts)
+        if key_id is not None:
+            current[2].add(key_id)
+        current[3] += size
+
+    result = [
+        (last_stream_id, cache_func, None, invalidation_ts, False)
+        for cache_func, invalidation_ts in invalidate_all_rows
+    ]
+    for cache_func, pending in bulk_rows.items():
+        for keys_list, invalidation_ts, _, _ in pending:
+            if len(keys_list) == 1:
+                result.append(
+                    (last_stream_id, cache_func, keys_list[0], invalidation_ts, False)
+                )
+            else:
+                result.append(
+                    (last_stream_id, cache_func, keys_list, invalidation_ts, True)
+                )
+
+    return result
+
 
 class PublicRoomsStream(Stream):
     """The public rooms list changed
@@ -497,6 +497,7 @@ class JoinedRoomMemberListRestServlet(RestServlet):
 # TODO: Needs better unit testing
 class RoomMessageListRestServlet(RestServlet):
     PATTERNS = client_patterns("/rooms/(?P<room_id>[^/]*)/messages$", v1=True)
+    STREAM_RESPONSES = True
 
     def __init__(self, hs):
         super(RoomMessageListRestServlet, self).__init__()
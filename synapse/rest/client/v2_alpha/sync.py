@@ -73,6 +73,7 @@ class SyncRestServlet(RestServlet):
 
     PATTERNS = client_patterns("/sync$")
     ALLOWED_PRESENCE = {"online", "offline", "unavailable"}
+    STREAM_RESPONSES = True
 
     def __init__(self, hs):
         super(SyncRestServlet, self).__init__()
@@ -85,6 +85,7 @@ from synapse.http.matrixfederationclient import MatrixFederationHttpClient
 from synapse.notifier import Notifier
 from synapse.push.action_generator import ActionGenerator
 from synapse.push.pusherpool import PusherPool
+from synapse.replication.tcp.resource import ReplicationStreamer
 from synapse.rest.media.v1.media_repository import (
     MediaRepository,
     MediaRepositoryResource,
@@ -176,6 +177,8 @@ class HomeServer(object):
         "receipts_handler",
         "macaroon_generator",
         "tcp_replication",
+        "replication_streamer",
+        "replication_pubsub_bus",
         "read_marker_handler",
         "action_generator",
         "user_directory_handler",
@@ -251,6 +254,11 @@ class HomeServer(object):
         for i in self.REQUIRED_ON_MASTER_STARTUP:
             getattr(self, "get_" + i)()
 
+        if self.config.redis_enabled:
+            # We publish replication data over redis whether or not there is a
+            # replication listener, so the streamer has to be created now.
+            self.get_replication_streamer()
+
     def get_reactor(self):
         """
         Fetch the Twisted reactor in use by this HomeServer.
@@ -453,6 +461,19 @@ class HomeServer(object):
     def build_tcp_replication(self):
         raise NotImplementedError()
 
+    def build_replication_streamer(self):
+        return ReplicationStreamer(self)
+
+    def build_replication_pubsub_bus(self):
+        if not self.config.redis_enabled:
+            return None
+
+        # txredisapi is an optional dependency, so we only import this if redis
+        # has been enabled.
+        from synapse.replication.tcp.redis import RedisPubSubBus
+
+        return RedisPubSubBus(self)
+
     def build_action_generator(self):
         return ActionGenerator(self)
 
@@ -1,3 +1,5 @@
+from typing import Optional
+
 import twisted.internet
 
 import synapse.api.auth
@@ -19,6 +21,8 @@ import synapse.handlers.set_password
 import synapse.http.client
 import synapse.notifier
 import synapse.replication.tcp.client
+import synapse.replication.tcp.pubsub
+import synapse.replication.tcp.resource
 import synapse.rest.media.v1.media_repository
 import synapse.server_notices.server_notices_manager
 import synapse.server_notices.server_notices_sender
@@ -108,6 +112,14 @@ class HomeServer(object):
         self,
     ) -> synapse.replication.tcp.client.ReplicationClientHandler:
         pass
+    def get_replication_streamer(
+        self,
+    ) -> synapse.replication.tcp.resource.ReplicationStreamer:
+        pass
+    def get_replication_pubsub_bus(
+        self,
+    ) -> Optional[synapse.replication.tcp.pubsub.PubSubBus]:
+        pass
     def get_federation_registry(
         self,
     ) -> synapse.federation.federation_server.FederationHandlerRegistry:
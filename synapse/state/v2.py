@@ -135,8 +135,9 @@ def resolve_events_with_store(
     # OK, so we've now resolved the power events. Now sort the remaining
     # events using the mainline of the resolved power level.
 
+    sorted_power_event_ids = set(sorted_power_events)
     leftover_events = [
-        ev_id for ev_id in full_conflicted_set if ev_id not in sorted_power_events
+        ev_id for ev_id in full_conflicted_set if ev_id not in sorted_power_event_ids
     ]
 
     logger.debug("sorting %d remaining events", len(leftover_events))
@@ -353,11 +354,14 @@ def _reverse_topological_power_sort(
 
         return -pl, ev.origin_server_ts, event_id
 
-    # Note: graph is modified during the sort
-    it = lexicographical_topological_sort(graph, key=_get_power_order)
-    sorted_events = list(it)
+    # Map the events to dense indices, so that the sort itself only deals with
+    # lists of ints. The keys all end with the event ID, so are distinct.
+    nodes = list(graph)
+    node_to_index = {event_id: i for i, event_id in enumerate(nodes)}
+    edges = [[node_to_index[aid] for aid in graph[event_id]] for event_id in nodes]
+    keys = [_get_power_order(event_id) for event_id in nodes]
 
-    return sorted_events
+    return [nodes[i] for i in _indexed_lexicographical_topological_sort(edges, keys)]
 
 
 @defer.inlineCallbacks
@@ -458,10 +462,14 @@ def _mainline_sort(
 
     event_ids = list(event_ids)
 
+    # _get_mainline_depth_for_event adds the depths of the events it walks
+    # through to the map, so later walks can stop as soon as they reach one.
+    depth_map = dict(mainline_map)
+
     order_map = {}
     for ev_id in event_ids:
         depth = yield _get_mainline_depth_for_event(
-            event_map[ev_id], mainline_map, event_map, state_res_store
+            event_map[ev_id], depth_map, event_map, state_res_store
         )
         order_map[ev_id] = (depth, event_map[ev_id].origin_server_ts, ev_id)
 
@@ -477,7 +485,9 @@ def _get_mainline_depth_for_event(event, mainline_map, event_map, state_res_stor
     Args:
         event (FrozenEvent)
         mainline_map (dict[str, int]): Map from event_id to mainline depth for
-            events in the mainline.
+            events in the mainline, and any other events whose mainline depth
+            is known. The depths of the events walked through to find the
+            depth of `event` are added to it.
         event_map (dict[str,FrozenEvent])
         state_res_store (StateResolutionStore)
 
@@ -487,13 +497,20 @@ def _get_mainline_depth_for_event(event, mainline_map, event_map, state_res_stor
 
     room_id = event.room_id
 
+    # The events we walk through all have the same mainline depth as `event`.
+    walked_event_ids = []
+
     # We do an iterative search, replacing `event with the power level in its
     # auth events (if any)
     while event:
         depth = mainline_map.get(event.event_id)
         if depth is not None:
+            for event_id in walked_event_ids:
+                mainline_map[event_id] = depth
             return depth
 
+        walked_event_ids.append(event.event_id)
+
         auth_events = event.auth_event_ids()
         event = None
 
@@ -506,6 +523,8 @@ def _get_mainline_depth_for_event(event, mainline_map, event_map, state_res_stor
                 break
 
     # Didn't find a power level auth event, so we just return 0
+    for event_id in walked_event_ids:
+        mainline_map[event_id] = 0
     return 0
 
 
@@ -593,3 +612,46 @@ def lexicographical_topological_sort(graph, key):
                 heapq.heappush(zero_outdegree, (key(parent), parent))
 
         yield node
+
+
+def _indexed_lexicographical_topological_sort(edges, keys):
+    """Performs the same sort as `lexicographical_topological_sort`, on a graph
+    whose nodes are numbered from 0.
+
+    Args:
+        edges (list[list[int]]): The edges of each node. Each list must not
+            contain duplicates.
+        keys (list): The sort key for each node. The keys must be distinct.
+
+    Returns:
+        list[int]: The nodes in sorted order
+    """
+    node_count = len(edges)
+
+    # Rank the nodes by their key up front, so that the heap only needs to
+    # compare ints. As the keys are distinct this gives the same order.
+    nodes_by_rank = sorted(range(node_count), key=keys.__getitem__)
+    rank = [0] * node_count
+    for r, node in enumerate(nodes_by_rank):
+        rank[node] = r
+
+    outdegree = [len(node_edges) for node_edges in edges]
+    reverse_edges = [[] for _ in range(node_count)]
+    for node, node_edges in enumerate(edges):
+        for edge in node_edges:
+            reverse_edges[edge].append(node)
+
+    zero_outdegree = [rank[node] for node in range(node_count) if not outdegree[node]]
+    heapq.heapify(zero_outdegree)
+
+    result = []
+    while zero_outdegree:
+        node = nodes_by_rank[heapq.heappop(zero_outdegree)]
+        result.append(node)
+
+        for parent in reverse_edges[node]:
+            outdegree[parent] -= 1
+            if not outdegree[parent]:
+                heapq.heappush(zero_outdegree, rank[parent])
+
+    return result
@@ -18,6 +18,7 @@
 import calendar
 import logging
 import time
+from typing import Optional
 
 from synapse.api.constants import PresenceState
 from synapse.config.homeserver import HomeServerConfig
@@ -26,6 +27,7 @@ from synapse.storage.engines import PostgresEngine
 from synapse.storage.util.id_generators import (
     ChainedIdGenerator,
     IdGenerator,
+    MultiWriterIdGenerator,
     StreamIdGenerator,
 )
 from synapse.util.caches.stream_change_cache import StreamChangeCache
@@ -118,18 +120,30 @@ class DataStore(
         self._clock = hs.get_clock()
         self.database_engine = database.engine
 
-        self._stream_id_gen = StreamIdGenerator(
+        self._instance_name = hs.config.worker.instance_name
+
+        self._stream_id_gen = MultiWriterIdGenerator(
             db_conn,
-            "events",
-            "stream_ordering",
+            database,
+            stream_name="events",
+            instance_name=self._instance_name,
+            table="events",
+            id_column="stream_ordering",
+            sequence_name="events_stream_seq",
+            writers=hs.config.worker.writers.events,
             extra_tables=[("local_invites", "stream_id")],
         )
-        self._backfill_id_gen = StreamIdGenerator(
+        self._backfill_id_gen = MultiWriterIdGenerator(
             db_conn,
-            "events",
-            "stream_ordering",
-            step=-1,
+            database,
+            stream_name="backfill",
+            instance_name=self._instance_name,
+            table="events",
+            id_column="stream_ordering",
+            sequence_name="events_backfill_stream_seq",
+            writers=hs.config.worker.writers.events,
             extra_tables=[("ex_outlier_stream", "event_stream_ordering")],
+            positive=False,
         )
         self._presence_id_gen = StreamIdGenerator(
             db_conn, "presence_stream", "stream_id"
@@ -165,9 +179,16 @@ class DataStore(
         )
 
         if isinstance(self.database_engine, PostgresEngine):
-            self._cache_id_gen = StreamIdGenerator(
-                db_conn, "cache_invalidation_stream", "stream_id"
-            )
+            self._cache_id_gen = MultiWriterIdGenerator(
+                db_conn,
+                database,
+                stream_name="caches",
+                instance_name=self._instance_name,
+                table="cache_invalidation_stream",
+                id_column="stream_id",
+                sequence_name="cache_invalidation_stream_seq",
+                writers=hs.config.worker.main_store_writers,
+            )  # type: Optional[MultiWriterIdGenerator]
         else:
             self._cache_id_gen = None
 
@@ -264,6 +285,46 @@ class DataStore(
         # Used in _generate_user_daily_visits to keep track of progress
         self._last_user_visit_update = self._get_start_of_day()
 
+    def advance_writer_position(self, stream_name, instance_name, token):
+        """Called when we learn the position of another writer to one of the
+        streams with multiple writers.
+
+        Args:
+            stream_name (str): "events", "backfill" or "caches"
+            instance_name (str): the name of the writer
+            token (int): the writer's position, as it appears in the
+                replication stream (i.e. positive for backfill).
+        """
+        if stream_name == "events":
+            self._stream_id_gen.advance(instance_name, token)
+        elif stream_name == "backfill":
+            self._backfill_id_gen.advance(instance_name, -token)
+        elif stream_name == "caches" and self._cache_id_gen:
+            self._cache_id_gen.advance(instance_name, token)
+        else:
+            raise Exception("Unknown stream with multiple writers %s" % (stream_name,))
+
+    def get_writer_positions(self, instance_name):
+        """Gets the positions of the given writer in each of the streams it
+        writes to, as they appear in replication.
+
+        Returns:
+            dict[str, int]: map from stream name to position
+        """
+        positions = {}
+        if instance_name in self._stream_id_gen.get_writers():
+            positions["events"] = self._stream_id_gen.get_current_token_for_writer(
+                instance_name
+            )
+            positions["backfill"] = -self._backfill_id_gen.get_current_token_for_writer(
+                instance_name
+            )
+        if self._cache_id_gen and instance_name in self._cache_id_gen.get_writers():
+            positions["caches"] = self._cache_id_gen.get_current_token_for_writer(
+                instance_name
+            )
+        return positions
+
     def take_presence_startup_info(self):
         active_on_startup = self._presence_on_startup
         self._presence_on_startup = None
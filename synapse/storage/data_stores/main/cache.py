@@ -46,7 +46,7 @@ class CacheInvalidationStore(SQLBaseStore):
             return
 
         cache_func.invalidate(keys)
-        await self.runInteraction(
+        await self.db.runInteraction(
             "invalidate_cache_and_stream",
             self._send_invalidation_to_replication,
             cache_func.__name__,
@@ -121,14 +121,9 @@ class CacheInvalidationStore(SQLBaseStore):
             )
 
         if isinstance(self.database_engine, PostgresEngine):
-            # get_next() returns a context manager which is designed to wrap
-            # the transaction. However, we want to only get an ID when we want
-            # to use it, here, so we need to call __enter__ manually, and have
-            # __exit__ called after the transaction finishes.
-            ctx = self._cache_id_gen.get_next()
-            stream_id = ctx.__enter__()
-            txn.call_on_exception(ctx.__exit__, None, None, None)
-            txn.call_after(ctx.__exit__, None, None, None)
+            # The stream ID is marked as finished once the transaction
+            # completes.
+            stream_id = self._cache_id_gen.get_next_txn(txn)
             txn.call_after(self.hs.get_notifier().on_new_replication_data)
 
             if keys is not None:
@@ -142,6 +137,7 @@ class CacheInvalidationStore(SQLBaseStore):
                     "cache_func": cache_name,
                     "keys": keys,
                     "invalidation_ts": self.clock.time_msec(),
+                    "instance_name": self._instance_name,
                 },
             )
 
@@ -165,8 +161,68 @@ class CacheInvalidationStore(SQLBaseStore):
             "get_all_updated_caches", get_all_updated_caches_txn
         )
 
+    def get_cache_invalidations_for_writer(self, instance_name, last_id, current_id):
+        """Get the invalidations in the given range of the cache stream which
+        were written by the given process.
+
+        Args:
+            instance_name (str)
+            last_id (int)
+            current_id (int)
+
+        Returns:
+            Deferred[list[tuple[str, list|None]]]: the cache names and keys, in
+                stream order.
+        """
+        if last_id == current_id:
+            return defer.succeed([])
+
+        def get_cache_invalidations_for_writer_txn(txn):
+            sql = (
+                "SELECT cache_func, keys FROM cache_invalidation_stream"
+                " WHERE ? < stream_id AND stream_id <= ? AND instance_name = ?"
+                " ORDER BY stream_id ASC"
+            )
+            txn.execute(sql, (last_id, current_id, instance_name))
+            return txn.fetchall()
+
+        return self.db.runInteraction(
+            "get_cache_invalidations_for_writer",
+            get_cache_invalidations_for_writer_txn,
+        )
+
+    def _invalidate_cache_from_replication(self, cache_func, keys):
+        """Handles a single invalidation written to the cache stream by
+        another process.
+
+        Args:
+            cache_func (str): name of the cache
+            keys (list|None): the entry to invalidate, or None to invalidate
+                the entire cache
+        """
+        if cache_func == CURRENT_STATE_CACHE_NAME:
+            if keys is None:
+                raise Exception(
+                    "Can't send an 'invalidate all' for current state cache"
+                )
+
+            room_id = keys[0]
+            members_changed = set(keys[1:])
+            self._invalidate_state_caches(room_id, members_changed)
+        elif cache_func == "_get_event_cache" and keys is not None:
+            # this also drops the event from the shared event cache, if any.
+            self._invalidate_get_event_cache(keys[0])
+        else:
+            self._attempt_to_invalidate_cache(cache_func, keys)
+
     def get_cache_stream_token(self):
         if self._cache_id_gen:
             return self._cache_id_gen.get_current_token()
         else:
             return 0
+
+    def get_cache_stream_token_for_writer(self, instance_name):
+        if self._cache_id_gen:
+            return self._cache_id_gen.get_current_token_for_writer(instance_name)
+        else:
+            return 0
@@ -14,18 +14,21 @@
 # limitations under the License.
 import itertools
 import logging
-from typing import Dict, List, Optional, Set, Tuple
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 
 from six.moves.queue import Empty, PriorityQueue
 
 from twisted.internet import defer
 
+from synapse.api.constants import EventTypes
 from synapse.api.errors import StoreError
+from synapse.events import EventBase
 from synapse.metrics.background_process_metrics import run_as_background_process
 from synapse.storage._base import SQLBaseStore, make_in_list_sql_clause
 from synapse.storage.data_stores.main.events_worker import EventsWorkerStore
 from synapse.storage.data_stores.main.signatures import SignatureWorkerStore
 from synapse.storage.database import Database
+from synapse.storage.util.id_generators import build_sequence_generator
 from synapse.util.caches.descriptors import cached
 from synapse.util.iterutils import batch_iter
 
@@ -75,7 +78,13 @@ class EventFederationWorkerStore(EventsWorkerStore, SignatureWorkerStore, SQLBas
         )
 
     def _get_auth_chain_ids_txn(self, txn, event_ids, include_given, ignore_events):
-        if ignore_events is None:
+        if not ignore_events:
+            results = self._get_auth_chain_ids_using_index_txn(
+                txn, event_ids, include_given
+            )
+            if results is not None:
+                return list(results)
+
             ignore_events = set()
 
         if include_given:
@@ -124,7 +133,13 @@ class EventFederationWorkerStore(EventsWorkerStore, SignatureWorkerStore, SQLBas
     def _get_auth_chain_difference_txn(
         self, txn, state_sets: List[Set[str]]
     ) -> Set[str]:
+        difference = self._get_auth_chain_difference_using_index_txn(txn, state_sets)
+        if difference is not None:
+            return difference
 
+        # We don't have all the events in the auth chain index, so fall back to
+        # walking the auth graph.
+        #
         # Algorithm Description
         # ~~~~~~~~~~~~~~~~~~~~~
         #
@@ -251,6 +266,205 @@ class EventFederationWorkerStore(EventsWorkerStore, SignatureWorkerStore, SQLBas
         # Return all events where not all sets can reach them.
         return {eid for eid, n in event_to_missing_sets.items() if n}
 
+    def _get_auth_chain_ids_using_index_txn(
+        self, txn, event_ids: Iterable[str], include_given: bool
+    ) -> Optional[Set[str]]:
+        """Calculates the auth chain of the given events using the auth chain
+        index.
+
+        Returns:
+            The event IDs in the auth chain, or None if some of the auth events
+            of the given events are not in the index.
+        """
+        event_ids = list(event_ids)
+
+        # The auth chain is everything that the auth events of the given events
+        # can reach, so we start from their positions.
+        reach = {}  # type: Dict[int, int]
+        sql = """
+            SELECT c.chain_id, c.sequence_number FROM event_auth AS a
+            LEFT JOIN event_auth_chains AS c ON (c.event_id = a.auth_id)
+            WHERE
+        """
+        for batch in batch_iter(event_ids, 100):
+            clause, args = make_in_list_sql_clause(
+                txn.database_engine, "a.event_id", batch
+            )
+            txn.execute(sql + clause, args)
+            for chain_id, sequence_number in txn:
+                if chain_id is None:
+                    return None
+                if reach.get(chain_id, 0) < sequence_number:
+                    reach[chain_id] = sequence_number
+
+        self._expand_auth_chain_reach_txn(txn, {}, reach)
+
+        results = self._get_event_ids_in_chain_ranges_txn(
+            txn, {chain_id: (0, seq) for chain_id, seq in reach.items()}
+        )
+        if include_given:
+            results.update(event_ids)
+
+        return results
+
+    def _get_auth_chain_difference_using_index_txn(
+        self, txn, state_sets: List[Set[str]]
+    ) -> Optional[Set[str]]:
+        """Calculates the auth chain difference of the given state sets using
+        the auth chain index.
+
+        For each state set we work out how far along each chain its auth chain
+        reaches. The difference is then, for each chain, the events between the
+        least and the greatest of those positions.
+
+        Returns:
+            The auth chain difference, or None if some of the events in the
+            state sets are not in the index.
+        """
+        initial_events = set(state_sets[0]).union(*state_sets[1:])
+
+        chain_map = self._get_event_auth_chain_positions_txn(txn, initial_events)
+        if len(chain_map) != len(initial_events):
+            return None
+
+        # The links we have fetched so far, shared between the state sets.
+        chain_links = {}  # type: Dict[int, List[Tuple[int, int, int]]]
+
+        set_reaches = []
+        for state_set in state_sets:
+            reach = {}  # type: Dict[int, int]
+            for event_id in state_set:
+                chain_id, sequence_number = chain_map[event_id]
+                if reach.get(chain_id, 0) < sequence_number:
+                    reach[chain_id] = sequence_number
+
+            self._expand_auth_chain_reach_txn(txn, chain_links, reach)
+            set_reaches.append(reach)
+
+        ranges = {}  # type: Dict[int, Tuple[int, int]]
+        for chain_id in set().union(*set_reaches):
+            positions = [reach.get(chain_id, 0) for reach in set_reaches]
+            if min(positions) < max(positions):
+                ranges[chain_id] = (min(positions), max(positions))
+
+        return self._get_event_ids_in_chain_ranges_txn(txn, ranges)
+
+    def _get_event_auth_chain_positions_txn(
+        self, txn, event_ids: Iterable[str]
+    ) -> Dict[str, Tuple[int, int]]:
+        """Fetches the chain IDs and sequence numbers of the given events, for
+        those which are in the auth chain index.
+        """
+        results = {}
+        for batch in batch_iter(event_ids, 100):
+            rows = self.db.simple_select_many_txn(
+                txn,
+                table="event_auth_chains",
+                column="event_id",
+                iterable=batch,
+                keyvalues={},
+                retcols=("event_id", "chain_id", "sequence_number"),
+            )
+            for row in rows:
+                results[row["event_id"]] = (row["chain_id"], row["sequence_number"])
+
+        return results
+
+    def _get_auth_ids_txn(self, txn, event_ids: Iterable[str]) -> Dict[str, Set[str]]:
+        """Fetches the auth event IDs of each of the given events."""
+        results = {event_id: set() for event_id in event_ids}
+        for batch in batch_iter(results, 100):
+            rows = self.db.simple_select_many_txn(
+                txn,
+                table="event_auth",
+                column="event_id",
+                iterable=batch,
+                keyvalues={},
+                retcols=("event_id", "auth_id"),
+            )
+            for row in rows:
+                results[row["event_id"]].add(row["auth_id"])
+
+        return results
+
+    def _expand_auth_chain_reach_txn(
+        self,
+        txn,
+        chain_links: Dict[int, List[Tuple[int, int, int]]],
+        reach: Dict[int, int],
+    ):
+        """Follows the links between chains to work out how far along each
+        chain a set of events can reach.
+
+        Args:
+            chain_links: map from chain ID to the (origin sequence number,
+                target chain ID, target sequence number) of the links from that
+                chain. Links are fetched into this as needed.
+            reach: map from chain ID to the greatest sequence number reachable
+                on that chain. Updated in place.
+        """
+        pending = set(reach)
+        while pending:
+            to_fetch = [c_id for c_id in pending if c_id not in chain_links]
+            for batch in batch_iter(to_fetch, 100):
+                for chain_id in batch:
+                    chain_links[chain_id] = []
+
+                clause, args = make_in_list_sql_clause(
+                    txn.database_engine, "origin_chain_id", batch
+                )
+                txn.execute(
+                    """
+                    SELECT
+                        origin_chain_id, origin_sequence_number,
+                        target_chain_id, target_sequence_number
+                    FROM event_auth_chain_links
+                    WHERE %s
+                    """
+                    % (clause,),
+                    args,
+                )
+                for origin_chain_id, origin_seq, target_chain_id, target_seq in txn:
+                    chain_links[origin_chain_id].append(
+                        (origin_seq, target_chain_id, target_seq)
+                    )
+
+            new_pending = set()
+            for chain_id in pending:
+                sequence_number = reach[chain_id]
+                for origin_seq, target_chain_id, target_seq in chain_links[chain_id]:
+                    if (
+                        origin_seq <= sequence_number
+                        and reach.get(target_chain_id, 0) < target_seq
+                    ):
+                        reach[target_chain_id] = target_seq
+                        new_pending.add(target_chain_id)
+
+            pending = new_pending
+
+    def _get_event_ids_in_chain_ranges_txn(
+        self, txn, ranges: Dict[int, Tuple[int, int]]
+    ) -> Set[str]:
+        """Fetches the events in the given ranges of the auth chain index.
+
+        Args:
+            ranges: map from chain ID to the (exclusive) lower and (inclusive)
+                upper bounds of the sequence numbers to fetch.
+        """
+        results = set()
+        for batch in batch_iter(ranges.items(), 100):
+            clause = " OR ".join(
+                "(chain_id = ? AND ? < sequence_number AND sequence_number <= ?)"
+                for _ in batch
+            )
+            args = []  # type: List[int]
+            for chain_id, (lower, upper) in batch:
+                args.extend((chain_id, lower, upper))
+            txn.execute("SELECT event_id FROM event_auth_chains WHERE " + clause, args)
+            results.update(event_id for event_id, in txn)
+
+        return results
+
     def get_oldest_events_in_room(self, room_id):
         return self.db.runInteraction(
             "get_oldest_events_in_room", self._get_oldest_events_in_room_txn, room_id
@@ -619,6 +833,7 @@ class EventFederationStore(EventFederationWorkerStore):
     """
 
     EVENT_AUTH_STATE_ONLY = "event_auth_state_only"
+    EVENT_AUTH_CHAINS = "event_auth_chains"
 
     def __init__(self, database: Database, db_conn, hs):
         super(EventFederationStore, self).__init__(database, db_conn, hs)
@@ -627,6 +842,18 @@ class EventFederationStore(EventFederationWorkerStore):
             self.EVENT_AUTH_STATE_ONLY, self._background_delete_non_state_event_auth
         )
 
+        self.db.updates.register_background_update_handler(
+            self.EVENT_AUTH_CHAINS, self._background_index_event_auth_chains
+        )
+
+        self._event_chain_id_gen = build_sequence_generator(
+            db_conn,
+            database.engine,
+            "event_auth_chains",
+            "chain_id",
+            "event_auth_chain_id",
+        )
+
         hs.get_clock().looping_call(
             self._delete_old_forward_extrem_cache, 60 * 60 * 1000
         )
@@ -714,6 +941,283 @@ class EventFederationStore(EventFederationWorkerStore):
             ],
         )
 
+    def _persist_event_auth_chains_txn(self, txn, events: List[EventBase]):
+        """Adds newly persisted state events to the auth chain index, for the
+        rooms which are indexed.
+        """
+        events_by_room = {}  # type: Dict[str, Dict[str, Tuple[str, str, List[str]]]]
+        for event in events:
+            if event.is_state():
+                events_by_room.setdefault(event.room_id, {})[event.event_id] = (
+                    event.type,
+                    event.state_key,
+                    event.auth_event_ids(),
+                )
+
+        if not events_by_room:
+            return
+
+        rows = self.db.simple_select_many_txn(
+            txn,
+            table="event_auth_chain_rooms",
+            column="room_id",
+            iterable=events_by_room,
+            keyvalues={},
+            retcols=("room_id",),
+        )
+        indexed_rooms = {row["room_id"] for row in rows}
+
+        for room_id, room_events in events_by_room.items():
+            if room_id not in indexed_rooms:
+                # If this is the start of the room's auth graph we can index
+                # the room from here on. Otherwise we leave it to the
+                # background update.
+                if not any(
+                    (typ, state_key) == (EventTypes.Create, "")
+                    for typ, state_key, _ in room_events.values()
+                ):
+                    continue
+
+                self.db.simple_upsert_txn(
+                    txn,
+                    table="event_auth_chain_rooms",
+                    keyvalues={"room_id": room_id},
+                    values={},
+                )
+
+            self._add_chain_cover_index_txn(txn, room_id, room_events)
+
+    def _add_chain_cover_index_txn(
+        self, txn, room_id: str, events: Dict[str, Tuple[str, str, Iterable[str]]]
+    ):
+        """Adds state events to the auth chain index.
+
+        Each event is put at the end of an existing chain if one of its auth
+        events has the same type and state key and is the last event on its
+        chain, and otherwise starts a new chain. We then record a link for
+        each auth event on a different chain, unless the chain already has a
+        link which reaches at least as far.
+
+        An event can only be added once all of its auth events are in the
+        index. Any auth events which we have but which aren't in the index
+        are added along with the given events, and events whose auth events we
+        don't have are stored so that we can try again later.
+
+        Args:
+            room_id: the room the events are in
+            events: map from event ID to the type, state key and auth event IDs
+                of the events to add
+        """
+        # Map from event ID to chain ID and sequence number. We skip any events
+        # which are already in the index, as events can be persisted again if
+        # persisting them failed part way through.
+        chain_map = self._get_event_auth_chain_positions_txn(txn, events)
+
+        # Map from event ID to type and state key, and to auth event IDs, of
+        # the events to add.
+        event_types = {
+            event_id: (typ, state_key)
+            for event_id, (typ, state_key, _) in events.items()
+            if event_id not in chain_map
+        }  # type: Dict[str, Tuple[str, str]]
+        event_to_auth_ids = {
+            event_id: set(auth_ids)
+            for event_id, (_, _, auth_ids) in events.items()
+            if event_id not in chain_map
+        }  # type: Dict[str, Set[str]]
+
+        # Retry the events we previously couldn't add.
+        txn.execute(
+            """
+            SELECT t.event_id, t.type, t.state_key, a.auth_id
+            FROM event_auth_chain_to_calculate AS t
+            LEFT JOIN event_auth AS a USING (event_id)
+            WHERE t.room_id = ?
+            """,
+            (room_id,),
+        )
+        retried = set()
+        for event_id, typ, state_key, auth_id in txn.fetchall():
+            retried.add(event_id)
+            event_types[event_id] = (typ, state_key)
+            auth_ids = event_to_auth_ids.setdefault(event_id, set())
+            if auth_id is not None:
+                auth_ids.add(auth_id)
+
+        for batch in batch_iter(retried, 100):
+            self.db.simple_delete_many_txn(
+                txn,
+                table="event_auth_chain_to_calculate",
+                column="event_id",
+                iterable=batch,
+                keyvalues={},
+            )
+
+        # Look up the auth events, pulling in any that aren't in the index yet.
+        to_fetch = set().union(*event_to_auth_ids.values())
+        to_fetch -= set(event_types)
+        to_fetch -= set(chain_map)
+        while to_fetch:
+            chain_map.update(self._get_event_auth_chain_positions_txn(txn, to_fetch))
+
+            unindexed = set()
+            for batch in batch_iter(to_fetch, 100):
+                rows = self.db.simple_select_many_txn(
+                    txn,
+                    table="state_events",
+                    column="event_id",
+                    iterable=batch,
+                    keyvalues={},
+                    retcols=("event_id", "type", "state_key"),
+                )
+                for row in rows:
+                    event_types[row["event_id"]] = (row["type"], row["state_key"])
+                    if row["event_id"] not in chain_map:
+                        unindexed.add(row["event_id"])
+
+            for event_id, auth_ids in self._get_auth_ids_txn(txn, unindexed).items():
+                event_to_auth_ids[event_id] = auth_ids
+
+            to_fetch = set()
+            for event_id in unindexed:
+                to_fetch.update(event_to_auth_ids[event_id])
+            to_fetch -= set(event_types)
+            to_fetch -= set(chain_map)
+
+        # Fetch the last sequence number of each chain we might add to.
+        chain_tips = {}  # type: Dict[int, int]
+        existing_chains = {chain_id for chain_id, _ in chain_map.values()}
+        for batch in batch_iter(existing_chains, 100):
+            clause, args = make_in_list_sql_clause(
+                txn.database_engine, "chain_id", batch
+            )
+            txn.execute(
+                """
+                SELECT chain_id, MAX(sequence_number) FROM event_auth_chains
+                WHERE %s
+                GROUP BY chain_id
+                """
+                % (clause,),
+                args,
+            )
+            chain_tips.update(txn)
+
+        # Add the events in topological order, so that their auth events are
+        # added first.
+        new_events = []  # type: List[str]
+        to_calculate = []  # type: List[str]
+        for event_id in _sorted_by_auth_events(event_to_auth_ids):
+            auth_ids = event_to_auth_ids[event_id]
+            if not all(auth_id in chain_map for auth_id in auth_ids):
+                to_calculate.append(event_id)
+                continue
+
+            chain_id = None
+            for auth_id in auth_ids:
+                auth_chain_id, auth_seq = chain_map[auth_id]
+                if (
+                    event_types.get(auth_id) == event_types[event_id]
+                    and chain_tips[auth_chain_id] == auth_seq
+                ):
+                    chain_id, sequence_number = auth_chain_id, auth_seq + 1
+                    break
+
+            if chain_id is None:
+                chain_id = self._event_chain_id_gen.get_next_id_txn(txn)
+                sequence_number = 1
+
+            chain_tips[chain_id] = sequence_number
+            chain_map[event_id] = (chain_id, sequence_number)
+            new_events.append(event_id)
+
+        # Events which are part of an auth cycle never get sorted, and can't be
+        # added either.
+        to_calculate.extend(set(event_to_auth_ids) - set(chain_map) - set(to_calculate))
+
+        # Fetch how far the existing links from the chains we've added to reach,
+        # so that we don't add links which are implied by existing ones.
+        chain_to_link_reach = {}  # type: Dict[int, Dict[int, int]]
+        added_to_chains = {chain_map[event_id][0] for event_id in new_events}
+        for batch in batch_iter(added_to_chains & existing_chains, 100):
+            clause, args = make_in_list_sql_clause(
+                txn.database_engine, "origin_chain_id", batch
+            )
+            txn.execute(
+                """
+                SELECT origin_chain_id, target_chain_id, MAX(target_sequence_number)
+                FROM event_auth_chain_links
+                WHERE %s
+                GROUP BY origin_chain_id, target_chain_id
+                """
+                % (clause,),
+                args,
+            )
+            for origin_chain_id, target_chain_id, target_seq in txn:
+                chain_to_link_reach.setdefault(origin_chain_id, {})[
+                    target_chain_id
+                ] = target_seq
+
+        links = []  # type: List[Tuple[int, int, int, int]]
+        for event_id in new_events:
+            chain_id, sequence_number = chain_map[event_id]
+
+            targets = {}  # type: Dict[int, int]
+            for auth_id in event_to_auth_ids[event_id]:
+                auth_chain_id, auth_seq = chain_map[auth_id]
+                if auth_chain_id == chain_id:
+                    continue
+                if targets.get(auth_chain_id, 0) < auth_seq:
+                    targets[auth_chain_id] = auth_seq
+
+            link_reach = chain_to_link_reach.setdefault(chain_id, {})
+            for target_chain_id, target_seq in targets.items():
+                if link_reach.get(target_chain_id, 0) >= target_seq:
+                    continue
+
+                link_reach[target_chain_id] = target_seq
+                links.append((chain_id, sequence_number, target_chain_id, target_seq))
+
+        self.db.simple_insert_many_txn(
+            txn,
+            table="event_auth_chains",
+            values=[
+                {
+                    "event_id": event_id,
+                    "chain_id": chain_map[event_id][0],
+                    "sequence_number": chain_map[event_id][1],
+                }
+                for event_id in new_events
+            ],
+        )
+
+        self.db.simple_insert_many_txn(
+            txn,
+            table="event_auth_chain_links",
+            values=[
+                {
+                    "origin_chain_id": origin_chain_id,
+                    "origin_sequence_number": origin_seq,
+                    "target_chain_id": target_chain_id,
+                    "target_sequence_number": target_seq,
+                }
+                for origin_chain_id, origin_seq, target_chain_id, target_seq in links
+            ],
+        )
+
+        self.db.simple_insert_many_txn(
+            txn,
+            table="event_auth_chain_to_calculate",
+            values=[
+                {
+                    "event_id": event_id,
+                    "room_id": room_id,
+                    "type": event_types[event_id][0],
+                    "state_key": event_types[event_id][1],
+                }
+                for event_id in to_calculate
+            ],
+        )
+
     def _delete_old_forward_extrem_cache(self):
         def _delete_old_forward_extrem_cache_txn(txn):
             # Delete entries older than a month, while making sure we don't delete
@@ -797,3 +1301,105 @@ class EventFederationStore(EventFederationWorkerStore):
             yield self.db.updates._end_background_update(self.EVENT_AUTH_STATE_ONLY)
 
         return batch_size
+
+    async def _background_index_event_auth_chains(self, progress, batch_size):
+        """Adds the state events of existing rooms to the auth chain index, one
+        room at a time.
+        """
+        last_room_id = progress.get("room_id", "")
+
+        def _index_event_auth_chains_txn(txn):
+            txn.execute(
+                """
+                SELECT r.room_id FROM rooms AS r
+                LEFT JOIN event_auth_chain_rooms AS c USING (room_id)
+                WHERE r.room_id >= ? AND c.room_id IS NULL
+                ORDER BY r.room_id ASC
+                LIMIT 1
+                """,
+                (last_room_id,),
+            )
+            row = txn.fetchone()
+            if not row:
+                return None, 0
+            (room_id,) = row
+
+            txn.execute(
+                """
+                SELECT s.event_id, s.type, s.state_key FROM state_events AS s
+                INNER JOIN events AS e USING (event_id)
+                LEFT JOIN event_auth_chains AS c USING (event_id)
+                LEFT JOIN event_auth_chain_to_calculate AS t USING (event_id)
+                WHERE s.room_id = ? AND c.event_id IS NULL AND t.event_id IS NULL
+                ORDER BY e.stream_ordering ASC
+                LIMIT ?
+                """,
+                (room_id, batch_size),
+            )
+            rows = txn.fetchall()
+
+            event_to_auth_ids = self._get_auth_ids_txn(txn, [row[0] for row in rows])
+            events = {
+                event_id: (typ, state_key, event_to_auth_ids[event_id])
+                for event_id, typ, state_key in rows
+            }
+
+            self._add_chain_cover_index_txn(txn, room_id, events)
+
+            if len(events) < batch_size:
+                # That's all of the room's events, so from now on we add its
+                # new events as they are persisted. Any events persisted while
+                # this transaction was running won't be in the index, but they
+                # will be added when their children are.
+                self.db.simple_insert_txn(
+                    txn, table="event_auth_chain_rooms", values={"room_id": room_id}
+                )
+
+            self.db.updates._background_update_progress_txn(
+                txn, self.EVENT_AUTH_CHAINS, {"room_id": room_id}
+            )
+
+            return room_id, len(events)
+
+        room_id, count = await self.db.runInteraction(
+            self.EVENT_AUTH_CHAINS, _index_event_auth_chains_txn
+        )
+
+        if room_id is None:
+            await self.db.updates._end_background_update(self.EVENT_AUTH_CHAINS)
+
+        return count
+
+
+def _sorted_by_auth_events(event_to_auth_ids: Dict[str, Set[str]]) -> List[str]:
+    """Sorts the given events so that each comes after its auth events.
+
+    Args:
+        event_to_auth_ids: map from event ID to its auth event IDs. Auth
+            events not in the map are ignored.
+
+    Returns:
+        The sorted event IDs. Events in a cycle of auth events are left out.
+    """
+    # Map from event to the events that it is an auth event of, and the number
+    # of each event's auth events that are still to be sorted.
+    children = {}  # type: Dict[str, List[str]]
+    pending_counts = {}  # type: Dict[str, int]
+    for event_id, auth_ids in event_to_auth_ids.items():
+        pending_counts[event_id] = 0
+        for auth_id in auth_ids:
+            if auth_id in event_to_auth_ids:
+                children.setdefault(auth_id, []).append(event_id)
+                pending_counts[event_id] += 1
+
+    result = []
+    ready = [event_id for event_id, count in pending_counts.items() if not count]
+    while ready:
+        event_id = ready.pop()
+        result.append(event_id)
+        for child in children.get(event_id, ()):
+            pending_counts[child] -= 1
+            if not pending_counts[child]:
+                ready.append(child)
+
+    return result
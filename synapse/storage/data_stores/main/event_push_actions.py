@@ -648,9 +648,13 @@ class EventPushActionsStore(EventPushActionsWorkerStore):
         )
 
         self._doing_notif_rotation = False
-        self._rotate_notif_loop = self._clock.looping_call(
-            self._start_rotate_notifs, 30 * 60 * 1000
-        )
+
+        # Event persisters share this store with the main process, but only the
+        # main process rotates the notifications.
+        if hs.config.worker_app is None:
+            self._rotate_notif_loop = self._clock.looping_call(
+                self._start_rotate_notifs, 30 * 60 * 1000
+            )
 
     def _set_push_actions_for_event_and_users_txn(
         self, txn, events_and_contexts, all_events_and_contexts
@@ -24,7 +24,6 @@ from typing import Dict, List, Tuple
 from six import iteritems, text_type
 from six.moves import range
 
-from canonicaljson import json
 from prometheus_client import Counter
 
 from twisted.internet import defer
@@ -47,8 +46,8 @@ from synapse.storage.database import Database, LoggingTransaction
 from synapse.storage.persist_events import DeltaState
 from synapse.types import RoomStreamToken, StateMap, get_domain_from_id
 from synapse.util.caches.descriptors import cached, cachedInlineCallbacks
-from synapse.util.frozenutils import frozendict_json_encoder
 from synapse.util.iterutils import batch_iter
+from synapse.util.json import json_decoder, json_encoder
 
 logger = logging.getLogger(__name__)
 
@@ -64,10 +63,7 @@ def encode_json(json_object):
     """
     Encode a Python object as JSON and return it in a Unicode string.
     """
-    out = frozendict_json_encoder.encode(json_object)
-    if isinstance(out, bytes):
-        out = out.decode("utf8")
-    return out
+    return json_encoder.encode(json_object)
 
 
 _EventCacheEntry = namedtuple("_EventCacheEntry", ("event", "redacted_event"))
@@ -78,17 +74,16 @@ def _retry_on_integrity_error(func):
     with `delete_existing=True` passed in.
 
     Args:
-        func: function that returns a Deferred and accepts a `delete_existing` arg
+        func: async function that accepts a `delete_existing` arg
     """
 
     @wraps(func)
-    @defer.inlineCallbacks
-    def f(self, *args, **kwargs):
+    async def f(self, *args, **kwargs):
         try:
-            res = yield func(self, *args, delete_existing=False, **kwargs)
+            res = await func(self, *args, delete_existing=False, **kwargs)
         except self.database_engine.module.IntegrityError:
             logger.exception("IntegrityError, retrying.")
-            res = yield func(self, *args, delete_existing=True, **kwargs)
+            res = await func(self, *args, delete_existing=True, **kwargs)
         return res
 
     return f
@@ -127,7 +122,12 @@ class EventsStore(
                 "_censor_redactions", self._censor_redactions
             )
 
-        if self.hs.config.redaction_retention_period is not None:
+        if (
+            self.hs.config.redaction_retention_period is not None
+            and hs.config.worker_app is None
+        ):
+            # Only the main process censors redactions, even if there are other
+            # event persisters.
             hs.get_clock().looping_call(_censor_redactions, 5 * 60 * 1000)
 
         self._ephemeral_messages_enabled = hs.config.enable_ephemeral_messages
@@ -148,8 +148,7 @@ class EventsStore(
         self._current_forward_extremities_amount = c_counter([x[0] for x in res])
 
     @_retry_on_integrity_error
-    @defer.inlineCallbacks
-    def _persist_events_and_state_updates(
+    async def _persist_events_and_state_updates(
         self,
         events_and_contexts: List[Tuple[EventBase, EventContext]],
         current_state_for_room: Dict[str, StateMap[str]],
@@ -173,7 +172,7 @@ class EventsStore(
             delete_existing
 
         Returns:
-            Deferred: resolves when the events have been persisted
+            Resolves when the events have been persisted
         """
 
         # We want to calculate the stream orderings as late as possible, as
@@ -201,11 +200,11 @@ class EventsStore(
                 len(events_and_contexts)
             )
 
-        with stream_ordering_manager as stream_orderings:
+        async with stream_ordering_manager as stream_orderings:
             for (event, context), stream in zip(events_and_contexts, stream_orderings):
                 event.internal_metadata.stream_ordering = stream
 
-            yield self.db.runInteraction(
+            await self.db.runInteraction(
                 "persist_events",
                 self._persist_events_txn,
                 events_and_contexts=events_and_contexts,
@@ -244,6 +243,12 @@ class EventsStore(
                     (room_id,), list(latest_event_ids)
                 )
 
+        if len(self.hs.config.worker.main_store_writers) > 1:
+            # Our position in the event streams has moved on, which the other
+            # event writers need to hear about even if nothing is notified
+            # (e.g. for backfilled events).
+            self.hs.get_notifier().on_new_replication_data()
+
     @defer.inlineCallbacks
     def _get_events_which_are_prevs(self, event_ids):
         """Filter the supplied list of event_ids to get those which are prev_events of
@@ -275,7 +280,9 @@ class EventsStore(
             )
 
             txn.execute(sql + clause, args)
-            results.extend(r[0] for r in txn if not json.loads(r[1]).get("soft_failed"))
+            results.extend(
+                r[0] for r in txn if not json_decoder.decode(r[1]).get("soft_failed")
+            )
 
         for chunk in batch_iter(event_ids, 100):
             yield self.db.runInteraction(
@@ -336,7 +343,7 @@ class EventsStore(
                     if prev_event_id in existing_prevs:
                         continue
 
-                    soft_failed = json.loads(metadata).get("soft_failed")
+                    soft_failed = json_decoder.decode(metadata).get("soft_failed")
                     if soft_failed or rejected:
                         to_recursively_check.append(prev_event_id)
                         existing_prevs.add(prev_event_id)
@@ -382,6 +389,12 @@ class EventsStore(
         min_stream_order = events_and_contexts[0][0].internal_metadata.stream_ordering
         max_stream_order = events_and_contexts[-1][0].internal_metadata.stream_ordering
 
+        # Let the other processes know how far we've got, in case they restart.
+        if backfilled:
+            self._backfill_id_gen.update_stream_positions_txn(txn)
+        else:
+            self._stream_id_gen.update_stream_positions_txn(txn)
+
         self._update_forward_extremities_txn(
             txn,
             new_forward_extremities=new_forward_extremeties,
@@ -439,6 +452,10 @@ class EventsStore(
             ],
         )
 
+        self._persist_event_auth_chains_txn(
+            txn, [event for event, _ in events_and_contexts]
+        )
+
         # _store_rejected_events_txn filters out any events which were
         # rejected, and returns the filtered list.
         events_and_contexts = self._store_rejected_events_txn(
@@ -627,7 +644,7 @@ class EventsStore(
         txn.execute(sql, (room_id, EventTypes.Create, ""))
         row = txn.fetchone()
         if row:
-            event_json = json.loads(row[0])
+            event_json = json_decoder.decode(row[0])
             content = event_json.get("content", {})
             creator = content.get("creator")
             room_version_id = content.get("room_version", RoomVersions.V1.identifier)
@@ -895,6 +912,7 @@ class EventsStore(
                         "url" in event.content
                         and isinstance(event.content["url"], text_type)
                     ),
+                    "instance_name": self._instance_name,
                 }
                 for event, _ in events_and_contexts
             ],
@@ -1365,6 +1383,77 @@ class EventsStore(
             "get_all_new_backfill_event_rows", get_all_new_backfill_event_rows
         )
 
+    def get_new_events_from_other_writers(self, last_id, current_id):
+        """Get the events in the given range of the events stream which were
+        persisted by another event writer, so that we can invalidate our caches
+        and notify for them.
+
+        Args:
+            last_id (int)
+            current_id (int)
+
+        Returns:
+            Deferred[list[tuple]]: rows of (stream_ordering, event_id, room_id,
+                type, state_key, redacts, relates_to_id, outlier), in stream
+                order.
+        """
+        if last_id == current_id:
+            return defer.succeed([])
+
+        def get_new_events_from_other_writers_txn(txn):
+            sql = (
+                "SELECT e.stream_ordering, e.event_id, e.room_id, e.type,"
+                " state_key, redacts, relates_to_id, e.outlier"
+                " FROM events AS e"
+                " LEFT JOIN redactions USING (event_id)"
+                " LEFT JOIN state_events USING (event_id)"
+                " LEFT JOIN event_relations USING (event_id)"
+                " WHERE ? < stream_ordering AND stream_ordering <= ?"
+                " AND instance_name != ?"
+                " ORDER BY stream_ordering ASC"
+            )
+            txn.execute(sql, (last_id, current_id, self._instance_name))
+            return txn.fetchall()
+
+        return self.db.runInteraction(
+            "get_new_events_from_other_writers", get_new_events_from_other_writers_txn
+        )
+
+    def invalidate_caches_for_events_from_other_writers(self, rows):
+        """Invalidates our caches for events persisted by other event writers.
+
+        Args:
+            rows (list[tuple]): as returned by `get_new_events_from_other_writers`
+        """
+        for row in rows:
+            (
+                stream_ordering,
+                event_id,
+                room_id,
+                etype,
+                state_key,
+                redacts,
+                relates_to,
+                _outlier,
+            ) = row
+
+            self.invalidate_caches_for_event(
+                stream_ordering,
+                event_id,
+                room_id,
+                etype,
+                state_key,
+                redacts,
+                relates_to,
+                backfilled=False,
+            )
+
+            if state_key is not None:
+                # The current state of the room may have changed.
+                self._curr_state_delta_stream_cache.entity_has_changed(
+                    room_id, stream_ordering
+                )
+
     @cached(num_args=5, max_entries=10)
     def get_all_new_events(
         self,
@@ -1738,9 +1827,23 @@ class EventsStore(
 
         state_groups = [row[0] for row in txn]
 
+        # The chains in the auth chain index only ever hold events from one
+        # room, so we can delete the links from all of the room's chains.
+        txn.execute(
+            """
+                DELETE FROM event_auth_chain_links WHERE origin_chain_id IN (
+                  SELECT chain_id FROM event_auth_chains
+                  INNER JOIN events USING (event_id)
+                  WHERE events.room_id = ?
+                )
+            """,
+            (room_id,),
+        )
+
         # Now we delete tables which lack an index on room_id but have one on event_id
         for table in (
             "event_auth",
+            "event_auth_chains",
             "event_edges",
             "event_push_actions_staging",
             "event_reference_hashes",
@@ -1765,6 +1868,9 @@ class EventsStore(
         # and finally, the tables with an index on room_id (or no useful index)
         for table in (
             "current_state_events",
+            "destination_rooms",
+            "event_auth_chain_rooms",
+            "event_auth_chain_to_calculate",
             "event_backward_extremities",
             "event_forward_extremities",
             "event_json",
@@ -1945,7 +2051,7 @@ class EventsStore(
             # changed its content in the database. We can't call
             # self._invalidate_cache_and_stream because self.get_event_cache isn't of the
             # right type.
-            txn.call_after(self._get_event_cache.invalidate, (event.event_id,))
+            txn.call_after(self._invalidate_get_event_cache, event.event_id)
             # Send that invalidation to replication so that other workers also invalidate
             # the event cache.
             self._send_invalidation_to_replication(
@@ -19,10 +19,11 @@ import itertools
 import logging
 import threading
 from collections import namedtuple
+from time import monotonic as monotonic_time
 from typing import List, Optional
 
-from canonicaljson import json
 from constantly import NamedConstant, Names
+from prometheus_client import Histogram
 
 from twisted.internet import defer
 
@@ -33,15 +34,18 @@ from synapse.api.room_versions import (
     EventFormatVersions,
     RoomVersions,
 )
-from synapse.events import make_event_from_dict
+from synapse.events import make_event_from_dict, make_event_from_json
 from synapse.events.utils import prune_event
 from synapse.logging.context import LoggingContext, PreserveLoggingContext
+from synapse.metrics import LaterGauge
 from synapse.metrics.background_process_metrics import run_as_background_process
 from synapse.storage._base import SQLBaseStore, make_in_list_sql_clause
 from synapse.storage.database import Database
 from synapse.types import get_domain_from_id
 from synapse.util.caches.descriptors import Cache
+from synapse.util.caches.mmapcache import SharedMmapCache
 from synapse.util.iterutils import batch_iter
+from synapse.util.json import json_decoder, json_encoder
 from synapse.util.metrics import Measure
 
 logger = logging.getLogger(__name__)
@@ -52,10 +56,19 @@ logger = logging.getLogger(__name__)
 # The values are plucked out of thing air to make initial sync run faster
 # on jki.re
 # TODO: Make these configurable.
-EVENT_QUEUE_THREADS = 3  # Max number of threads that will fetch events
 EVENT_QUEUE_ITERATIONS = 3  # No. times we block waiting for requests for events
 EVENT_QUEUE_TIMEOUT_S = 0.1  # Timeout when waiting for requests for events
 
+# How long each stage of fetching a batch of events takes. The stages are:
+#
+#  * queue: waiting in `_event_fetch_list` for a fetcher thread
+#  * db: fetching the rows from the database
+#  * build: decoding the rows and building the event objects
+#  * deliver: waiting for the reactor thread to pick up the results
+event_fetch_stage_timer = Histogram(
+    "synapse_storage_event_fetch_stage_time", "sec", ["stage"]
+)
+
 
 _EventCacheEntry = namedtuple("_EventCacheEntry", ("event", "redacted_event"))
 
@@ -82,6 +95,34 @@ class EventsWorkerStore(SQLBaseStore):
         self._event_fetch_list = []
         self._event_fetch_ongoing = 0
 
+        # Max number of threads that will fetch events
+        self._event_fetch_threads = hs.config.event_fetch_threads
+
+        LaterGauge(
+            "synapse_storage_event_fetch_queue_depth",
+            "Number of requests waiting for an event fetcher thread",
+            [],
+            lambda: len(self._event_fetch_list),
+        )
+        LaterGauge(
+            "synapse_storage_event_fetch_threads",
+            "Number of event fetcher threads running",
+            [],
+            lambda: self._event_fetch_ongoing,
+        )
+
+        self._lazy_event_decoding = hs.config.lazy_event_decoding
+
+        # A cache of event rows shared with the other processes on this host,
+        # which is checked before going to the database.
+        self._shared_event_cache = None  # type: Optional[SharedMmapCache]
+        if hs.config.shared_event_cache_path:
+            self._shared_event_cache = SharedMmapCache(
+                "*getEvent*shared*",
+                hs.config.shared_event_cache_path,
+                hs.config.shared_event_cache_size,
+            )
+
     def get_received_ts(self, event_id):
         """Get received_ts (when it was persisted) for the event.
 
@@ -427,6 +468,43 @@ class EventsWorkerStore(SQLBaseStore):
 
     def _invalidate_get_event_cache(self, event_id):
         self._get_event_cache.invalidate((event_id,))
+        if self._shared_event_cache is not None:
+            self._shared_event_cache.invalidate(event_id)
+
+    def invalidate_caches_for_event(
+        self,
+        stream_ordering,
+        event_id,
+        room_id,
+        etype,
+        state_key,
+        redacts,
+        relates_to,
+        backfilled,
+    ):
+        """Invalidates the caches which depend on an event which has been
+        persisted by another process.
+        """
+        self._invalidate_get_event_cache(event_id)
+
+        self.get_latest_event_ids_in_room.invalidate((room_id,))
+
+        self.get_unread_event_push_actions_by_room_for_user.invalidate_many((room_id,))
+
+        if not backfilled:
+            self._events_stream_cache.entity_has_changed(room_id, stream_ordering)
+
+        if redacts:
+            self._invalidate_get_event_cache(redacts)
+
+        if etype == EventTypes.Member:
+            self._membership_stream_cache.entity_has_changed(state_key, stream_ordering)
+            self.get_invited_rooms_for_local_user.invalidate((state_key,))
+
+        if relates_to:
+            self.get_relations_for_event.invalidate_many((relates_to,))
+            self.get_aggregation_groups_for_event.invalidate_many((relates_to,))
+            self.get_applicable_edit.invalidate((relates_to,))
 
     def _get_events_from_cache(self, events, allow_rejected, update_metrics=True):
         """Fetch events from the caches
@@ -486,28 +564,59 @@ class EventsWorkerStore(SQLBaseStore):
         Args:
             conn (twisted.enterprise.adbapi.Connection): database connection
 
-            event_list (list[Tuple[list[str], Deferred]]):
+            event_list (list[Tuple[list[str], Deferred, float]]):
                 The fetch requests. Each entry consists of a list of event
-                ids to be fetched, and a deferred to be completed once the
-                events have been fetched.
+                ids to be fetched, a deferred to be completed once the
+                events have been fetched, and the time the request was queued.
 
                 The deferreds are callbacked with a dictionary mapping from event id
-                to event row. Note that it may well contain additional events that
-                were not part of this request.
+                to event row, with the built event under the "event" key (see
+                `_build_event_from_row`). Note that it may well contain
+                additional events that were not part of this request.
         """
         with Measure(self._clock, "_fetch_event_list"):
             try:
+                start = monotonic_time()
+                for _, _, queued_at in event_list:
+                    event_fetch_stage_timer.labels("queue").observe(start - queued_at)
+
                 events_to_fetch = {
-                    event_id for events, _ in event_list for event_id in events
+                    event_id for events, _, _ in event_list for event_id in events
                 }
 
+                # Note the shared cache's generation before reading the rows: if
+                # an event gets invalidated by any process while we're fetching
+                # it, what we read may be out of date and mustn't be cached.
+                cache_generation = None
+                if self._shared_event_cache is not None:
+                    cache_generation = self._shared_event_cache.generation()
+
                 row_dict = self.db.new_transaction(
                     conn, "do_fetch", [], [], self._fetch_event_rows, events_to_fetch
                 )
+                fetched = monotonic_time()
+                event_fetch_stage_timer.labels("db").observe(fetched - start)
+
+                # Decode the events here, rather than on the reactor thread,
+                # which is otherwise kept busy doing so for large fetches.
+                for row in row_dict.values():
+                    row["event"] = self._build_event_from_row(row)
+                    if row["event"] is None or self._shared_event_cache is None:
+                        continue
+                    self._shared_event_cache.set(
+                        row["event_id"],
+                        _encode_shared_cache_row(row),
+                        generation=cache_generation,
+                    )
+                built = monotonic_time()
+                event_fetch_stage_timer.labels("build").observe(built - fetched)
 
                 # We only want to resolve deferreds from the main thread
                 def fire():
-                    for _, d in event_list:
+                    event_fetch_stage_timer.labels("deliver").observe(
+                        monotonic_time() - built
+                    )
+                    for _, d, _ in event_list:
                         d.callback(row_dict)
 
                 with PreserveLoggingContext():
@@ -517,7 +626,7 @@ class EventsWorkerStore(SQLBaseStore):
 
                 # We only want to resolve deferreds from the main thread
                 def fire(evs, exc):
-                    for _, d in evs:
+                    for _, d, _ in evs:
                         if not d.called:
                             with PreserveLoggingContext():
                                 d.errback(exc)
@@ -548,7 +657,11 @@ class EventsWorkerStore(SQLBaseStore):
         events_to_fetch = event_ids
 
         while events_to_fetch:
-            row_map = yield self._enqueue_events(events_to_fetch)
+            row_map = self._get_event_rows_from_shared_cache(events_to_fetch)
+            missing_event_ids = [e for e in events_to_fetch if e not in row_map]
+            if missing_event_ids:
+                db_row_map = yield self._enqueue_events(missing_event_ids)
+                row_map.update(db_row_map)
 
             # we need to recursively fetch any redactions of those events
             redaction_ids = set()
@@ -569,66 +682,12 @@ class EventsWorkerStore(SQLBaseStore):
                 continue
             assert row["event_id"] == event_id
 
-            rejected_reason = row["rejected_reason"]
-
-            if not allow_rejected and rejected_reason:
+            original_ev = row["event"]
+            if original_ev is None:
                 continue
 
-            d = json.loads(row["json"])
-            internal_metadata = json.loads(row["internal_metadata"])
-
-            format_version = row["format_version"]
-            if format_version is None:
-                # This means that we stored the event before we had the concept
-                # of a event format version, so it must be a V1 event.
-                format_version = EventFormatVersions.V1
-
-            room_version_id = row["room_version_id"]
-
-            if not room_version_id:
-                # this should only happen for out-of-band membership events
-                if not internal_metadata.get("out_of_band_membership"):
-                    logger.warning(
-                        "Room %s for event %s is unknown", d["room_id"], event_id
-                    )
-                    continue
-
-                # take a wild stab at the room version based on the event format
-                if format_version == EventFormatVersions.V1:
-                    room_version = RoomVersions.V1
-                elif format_version == EventFormatVersions.V2:
-                    room_version = RoomVersions.V3
-                else:
-                    room_version = RoomVersions.V5
-            else:
-                room_version = KNOWN_ROOM_VERSIONS.get(room_version_id)
-                if not room_version:
-                    logger.error(
-                        "Event %s in room %s has unknown room version %s",
-                        event_id,
-                        d["room_id"],
-                        room_version_id,
-                    )
-                    continue
-
-                if room_version.event_format != format_version:
-                    logger.error(
-                        "Event %s in room %s with version %s has wrong format: "
-                        "expected %s, was %s",
-                        event_id,
-                        d["room_id"],
-                        room_version_id,
-                        room_version.event_format,
-                        format_version,
-                    )
-                    continue
-
-            original_ev = make_event_from_dict(
-                event_dict=d,
-                room_version=room_version,
-                internal_metadata_dict=internal_metadata,
-                rejected_reason=rejected_reason,
-            )
+            if not allow_rejected and original_ev.rejected_reason:
+                continue
 
             event_map[event_id] = original_ev
 
@@ -650,6 +709,119 @@ class EventsWorkerStore(SQLBaseStore):
 
         return result_map
 
+    def _get_event_rows_from_shared_cache(self, event_ids):
+        """Fetch event rows from the cache shared with the other processes on
+        this host, if there is one.
+
+        Args:
+            event_ids (Iterable[str]): The event_ids of the events to fetch
+
+        Returns:
+            Dict[str, Dict]: map from event id to row data, as returned by
+                `_enqueue_events`, for the events which were found.
+        """
+        row_map = {}
+        if self._shared_event_cache is None:
+            return row_map
+
+        for event_id in event_ids:
+            value = self._shared_event_cache.get(event_id)
+            if value is None:
+                continue
+
+            row = _decode_shared_cache_row(event_id, value)
+            row["event"] = self._build_event_from_row(row)
+            row_map[event_id] = row
+
+        return row_map
+
+    def _build_event_from_row(self, row):
+        """Builds the event object for a row returned by `_fetch_event_rows`.
+
+        This is called on the event fetcher threads.
+
+        Args:
+            row (dict): the row for the event
+
+        Returns:
+            EventBase|None: the event, or None if it couldn't be built (e.g.
+                because its room version is unknown).
+        """
+        event_id = row["event_id"]
+        rejected_reason = row["rejected_reason"]
+
+        internal_metadata = json_decoder.decode(row["internal_metadata"])
+
+        format_version = row["format_version"]
+        if format_version is None:
+            # This means that we stored the event before we had the concept
+            # of a event format version, so it must be a V1 event.
+            format_version = EventFormatVersions.V1
+
+        room_version_id = row["room_version_id"]
+
+        if not room_version_id:
+            # this should only happen for out-of-band membership events
+            if not internal_metadata.get("out_of_band_membership"):
+                logger.warning(
+                    "Room %s for event %s is unknown", row["room_id"], event_id
+                )
+                return None
+
+            # take a wild stab at the room version based on the event format
+            if format_version == EventFormatVersions.V1:
+                room_version = RoomVersions.V1
+            elif format_version == EventFormatVersions.V2:
+                room_version = RoomVersions.V3
+            else:
+                room_version = RoomVersions.V5
+        else:
+            room_version = KNOWN_ROOM_VERSIONS.get(room_version_id)
+            if not room_version:
+                logger.error(
+                    "Event %s in room %s has unknown room version %s",
+                    event_id,
+                    row["room_id"],
+                    room_version_id,
+                )
+                return None
+
+            if room_version.event_format != format_version:
+                logger.error(
+                    "Event %s in room %s with version %s has wrong format: "
+                    "expected %s, was %s",
+                    event_id,
+                    row["room_id"],
+                    room_version_id,
+                    room_version.event_format,
+                    format_version,
+                )
+                return None
+
+        header = None
+        if self._lazy_event_decoding:
+            header = _event_header_from_row(row)
+
+        if header is not None:
+            # we have everything needed to build the event without parsing
+            # the JSON, which is left until the body is first accessed.
+            original_ev = make_event_from_json(
+                event_json=row["json"],
+                header=header,
+                room_version=room_version,
+                internal_metadata_dict=internal_metadata,
+                rejected_reason=rejected_reason,
+            )
+        else:
+            original_ev = make_event_from_dict(
+                event_dict=json_decoder.decode(row["json"]),
+                room_version=room_version,
+                internal_metadata_dict=internal_metadata,
+                rejected_reason=rejected_reason,
+            )
+
+        return original_ev
+
     @defer.inlineCallbacks
     def _enqueue_events(self, events):
         """Fetches events from the database using the _event_fetch_list. This
@@ -660,17 +832,18 @@ class EventsWorkerStore(SQLBaseStore):
             events (Iterable[str]): events to be fetched.
 
         Returns:
-            Deferred[Dict[str, Dict]]: map from event id to row data from the database.
-                May contain events that weren't requested.
+            Deferred[Dict[str, Dict]]: map from event id to row data from the database,
+                including the built event. May contain events that weren't
+                requested.
         """
 
         events_d = defer.Deferred()
         with self._event_fetch_lock:
-            self._event_fetch_list.append((events, events_d))
+            self._event_fetch_list.append((events, events_d, monotonic_time()))
 
             self._event_fetch_lock.notify()
 
-            if self._event_fetch_ongoing < EVENT_QUEUE_THREADS:
+            if self._event_fetch_ongoing < self._event_fetch_threads:
                 self._event_fetch_ongoing += 1
                 should_start = True
             else:
@@ -717,6 +890,14 @@ class EventsWorkerStore(SQLBaseStore):
          * redactions (List[str]): a list of event-ids which (claim to) redact
            this event.
 
+         * room_id (str): the room containing the event.
+
+         * type (str|None), sender (str|None): the type and sender of the
+           event, or None if they were not found in the events table.
+
+         * state_key (str|None): the state key of the event, if it is a state
+           event.
+
         Args:
             txn (twisted.enterprise.adbapi.Connection):
             event_ids (Iterable[str]): event IDs to fetch
@@ -733,10 +914,16 @@ class EventsWorkerStore(SQLBaseStore):
                   e.json,
                   e.format_version,
                   r.room_version,
-                  rej.reason
+                  rej.reason,
+                  e.room_id,
+                  ev.type,
+                  ev.sender,
+                  se.state_key
                 FROM event_json as e
                   LEFT JOIN rooms r USING (room_id)
                   LEFT JOIN rejections as rej USING (event_id)
+                  LEFT JOIN events as ev ON ev.event_id = e.event_id
+                  LEFT JOIN state_events as se ON se.event_id = e.event_id
                 WHERE """
 
             clause, args = make_in_list_sql_clause(
@@ -755,6 +942,10 @@ class EventsWorkerStore(SQLBaseStore):
                     "room_version_id": row[4],
                     "rejected_reason": row[5],
                     "redactions": [],
+                    "room_id": row[6],
+                    "type": row[7],
+                    "sender": row[8],
+                    "state_key": row[9],
                 }
 
             # check for redactions
@@ -963,3 +1154,87 @@ class EventsWorkerStore(SQLBaseStore):
         complexity_v1 = round(state_events / 500, 2)
 
         return {"v1": complexity_v1}
+
+
+def _event_header_from_row(row):
+    """Builds the header for a lazily-decoded event from the columns returned
+    by `_fetch_event_rows`.
+
+    Args:
+        row (dict): the row for the event
+
+    Returns:
+        dict|None: the header for `make_event_from_json`, or None if the row
+            doesn't have all the required fields, in which case the event
+            should be decoded up front.
+    """
+    if row["type"] is None or row["sender"] is None or row["room_id"] is None:
+        return None
+
+    # rejected events don't get a `state_events` row, so we can't tell from the
+    # row whether they are state events.
+    if row["rejected_reason"]:
+        return None
+
+    header = {
+        "event_id": row["event_id"],
+        "room_id": row["room_id"],
+        "type": row["type"],
+        "sender": row["sender"],
+    }
+    if row["state_key"] is not None:
+        header["state_key"] = row["state_key"]
+    return header
+
+
+# The columns from `_fetch_event_rows`, other than the event id and JSON, which
+# are stored in the shared event cache.
+_SHARED_CACHE_ROW_KEYS = (
+    "internal_metadata",
+    "format_version",
+    "room_version_id",
+    "rejected_reason",
+    "redactions",
+    "room_id",
+    "type",
+    "sender",
+    "state_key",
+)
+
+
+def _encode_shared_cache_row(row):
+    """Encodes a row returned by `_fetch_event_rows` for the shared event cache.
+
+    The columns are encoded as a JSON list, followed by a newline and then the
+    event JSON as it was stored in the database, so that the event JSON can be
+    decoded lazily.
+
+    Args:
+        row (dict): the row for the event
+
+    Returns:
+        bytes
+    """
+    columns = json_encoder.encode_bytes([row[key] for key in _SHARED_CACHE_ROW_KEYS])
+    event_json = row["json"]
+    if isinstance(event_json, str):
+        event_json = event_json.encode("utf-8")
+    return columns + b"\n" + event_json
+
+
+def _decode_shared_cache_row(event_id, value):
+    """Decodes an entry from the shared event cache into a row, as returned by
+    `_fetch_event_rows`.
+
+    Args:
+        event_id (str): the event id of the entry
+        value (bytes): the entry, as built by `_encode_shared_cache_row`
+
+    Returns:
+        dict: the row for the event
+    """
+    columns, _, event_json = value.partition(b"\n")
+    row = dict(zip(_SHARED_CACHE_ROW_KEYS, json_decoder.decode(columns)))
+    row["event_id"] = event_id
+    row["json"] = event_json.decode("utf-8")
+    return row
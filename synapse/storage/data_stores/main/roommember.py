@@ -53,6 +53,11 @@ logger = logging.getLogger(__name__)
 _MEMBERSHIP_PROFILE_UPDATE_NAME = "room_membership_profile_update"
 _CURRENT_STATE_MEMBERSHIP_UPDATE_NAME = "current_state_events_membership"
 
+# How long entries in the per-room and per-user membership caches can go
+# unused before they are dropped, so that the caches shrink back down after a
+# spike in traffic.
+_MEMBERSHIP_CACHE_EXPIRY_MS = 30 * 60 * 1000
+
 
 class RoomMemberWorkerStore(EventsWorkerStore):
     def __init__(self, database: Database, db_conn, hs):
@@ -163,7 +168,7 @@ class RoomMemberWorkerStore(EventsWorkerStore):
         hosts = frozenset(get_domain_from_id(user_id) for user_id in user_ids)
         return hosts
 
-    @cached(max_entries=100000, iterable=True)
+    @cached(max_entries=100000, iterable=True, expiry_ms=_MEMBERSHIP_CACHE_EXPIRY_MS)
     def get_users_in_room(self, room_id):
         return self.db.runInteraction(
             "get_users_in_room", self.get_users_in_room_txn, room_id
@@ -387,7 +392,7 @@ class RoomMemberWorkerStore(EventsWorkerStore):
 
         return results
 
-    @cached(max_entries=500000, iterable=True)
+    @cached(max_entries=500000, iterable=True, expiry_ms=_MEMBERSHIP_CACHE_EXPIRY_MS)
     def get_rooms_for_user_with_stream_ordering(self, user_id):
         """Returns a set of room_ids the user is currently joined to.
 
@@ -501,6 +506,29 @@ class RoomMemberWorkerStore(EventsWorkerStore):
 
         return user_who_share_room
 
+    @cachedInlineCallbacks(max_entries=500000, cache_context=True, iterable=True)
+    def get_hosts_sharing_room_with_user(self, user_id, cache_context):
+        """Returns the set of hosts which share a room with `user_id`, i.e.
+        those which should be sent the user's presence.
+
+        The entry is invalidated when the user's rooms or the membership of
+        any of those rooms change. The hosts of each room are cached by
+        `get_hosts_in_room`, so they are only computed once however many users
+        share the room.
+        """
+        room_ids = yield self.get_rooms_for_user(
+            user_id, on_invalidate=cache_context.invalidate
+        )
+
+        hosts = set()
+        for room_id in room_ids:
+            room_hosts = yield self.get_hosts_in_room(
+                room_id, on_invalidate=cache_context.invalidate
+            )
+            hosts.update(room_hosts)
+
+        return frozenset(hosts)
+
     @defer.inlineCallbacks
     def get_joined_users_from_context(self, event, context):
         state_group = context.state_group
@@ -1150,8 +1178,7 @@ class RoomMemberStore(RoomMemberWorkerStore, RoomMemberBackgroundUpdateStore):
                         },
                     )
 
-    @defer.inlineCallbacks
-    def locally_reject_invite(self, user_id, room_id):
+    async def locally_reject_invite(self, user_id, room_id):
         sql = (
             "UPDATE local_invites SET stream_id = ?, locally_rejected = ? WHERE"
             " room_id = ? AND invitee = ? AND locally_rejected is NULL"
@@ -1170,8 +1197,8 @@ class RoomMemberStore(RoomMemberWorkerStore, RoomMemberBackgroundUpdateStore):
                 keyvalues={"room_id": room_id, "user_id": user_id},
             )
 
-        with self._stream_id_gen.get_next() as stream_ordering:
-            yield self.db.runInteraction("locally_reject_invite", f, stream_ordering)
+        async with self._stream_id_gen.get_next() as stream_ordering:
+            await self.db.runInteraction("locally_reject_invite", f, stream_ordering)
 
     def forget(self, user_id, room_id):
         """Indicate that user_id wishes to discard history for room_id."""
@@ -0,0 +1,31 @@
+/* Copyright 2020 The Matrix.org Foundation C.I.C
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *    http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+-- The stream ordering of the latest event in each room which should be sent
+-- to each destination, so that we can catch a destination up on the rooms it
+-- missed while it was unreachable.
+CREATE TABLE IF NOT EXISTS destination_rooms (
+    destination TEXT NOT NULL,
+    room_id TEXT NOT NULL,
+    stream_ordering BIGINT NOT NULL,
+    PRIMARY KEY (destination, room_id)
+);
+
+CREATE INDEX IF NOT EXISTS destination_rooms_room_id ON destination_rooms (room_id);
+
+-- The stream ordering of the latest event which was successfully sent to each
+-- destination. Everything in `destination_rooms` up to this point has been
+-- sent.
+ALTER TABLE destinations ADD COLUMN last_successful_stream_ordering BIGINT;
@@ -0,0 +1,61 @@
+/* Copyright 2020 The Matrix.org Foundation C.I.C
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *    http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+-- An index of the auth graph, so that we can calculate auth chains without
+-- walking `event_auth` one event at a time.
+--
+-- Each state event is given a position on a chain of events. An event can
+-- reach (through its auth events) every event earlier on its own chain.
+CREATE TABLE event_auth_chains (
+    event_id TEXT NOT NULL,
+    chain_id BIGINT NOT NULL,
+    sequence_number BIGINT NOT NULL
+);
+
+CREATE UNIQUE INDEX event_auth_chains_id ON event_auth_chains (event_id);
+CREATE UNIQUE INDEX event_auth_chains_c_seq_index ON event_auth_chains (chain_id, sequence_number);
+
+-- The links between chains: every event at or after the origin position can
+-- reach every event at or before the target position.
+CREATE TABLE event_auth_chain_links (
+    origin_chain_id BIGINT NOT NULL,
+    origin_sequence_number BIGINT NOT NULL,
+    target_chain_id BIGINT NOT NULL,
+    target_sequence_number BIGINT NOT NULL
+);
+
+CREATE INDEX event_auth_chain_links_idx ON event_auth_chain_links (origin_chain_id, target_chain_id);
+
+-- State events in indexed rooms which we couldn't add to the index yet, as we
+-- don't have all of their auth events.
+CREATE TABLE event_auth_chain_to_calculate (
+    event_id TEXT NOT NULL,
+    room_id TEXT NOT NULL,
+    type TEXT NOT NULL,
+    state_key TEXT NOT NULL
+);
+
+CREATE UNIQUE INDEX event_auth_chain_to_calculate_id ON event_auth_chain_to_calculate (event_id);
+CREATE INDEX event_auth_chain_to_calculate_rm_id ON event_auth_chain_to_calculate (room_id);
+
+-- Rooms whose new state events are added to the index as they are persisted.
+CREATE TABLE event_auth_chain_rooms (
+    room_id TEXT NOT NULL
+);
+
+CREATE UNIQUE INDEX event_auth_chain_rooms_id ON event_auth_chain_rooms (room_id);
+
+INSERT INTO background_updates (update_name, progress_json)
+    VALUES ('event_auth_chains', '{}');
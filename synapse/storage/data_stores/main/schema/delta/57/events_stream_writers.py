@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Adds what we need so that events can be persisted by more than one process:
+#
+#   * `events.instance_name` records which process persisted each event.
+#   * `stream_positions` records how far each writer has got with each stream,
+#     so that the other processes know where it was when they start up.
+#   * on postgres, the stream orderings of new events (and backfilled events)
+#     and the IDs of new auth chains are handed out by sequences, so that they
+#     are unique across the processes.
+
+from synapse.storage.engines import PostgresEngine
+
+
+def _create_sequence(cur, sequence_name, sql):
+    """Creates a sequence which starts after the largest value returned by the
+    given query.
+
+    As with the in-memory ID generators, IDs start from 2 if there are none
+    yet.
+    """
+    cur.execute(sql)
+    row = cur.fetchone()
+
+    start_val = max(row[0] or 0, 1) + 1
+
+    cur.execute("CREATE SEQUENCE %s START WITH %d" % (sequence_name, start_val))
+
+
+def run_create(cur, database_engine, *args, **kwargs):
+    cur.execute("ALTER TABLE events ADD COLUMN instance_name TEXT")
+
+    cur.execute(
+        """
+        CREATE TABLE stream_positions (
+            stream_name TEXT NOT NULL,
+            instance_name TEXT NOT NULL,
+            stream_id BIGINT NOT NULL
+        )
+        """
+    )
+    cur.execute(
+        "CREATE UNIQUE INDEX stream_positions_idx"
+        " ON stream_positions (stream_name, instance_name)"
+    )
+
+    if isinstance(database_engine, PostgresEngine):
+        _create_sequence(
+            cur,
+            "events_stream_seq",
+            """
+            SELECT GREATEST(
+                (SELECT MAX(stream_ordering) FROM events),
+                (SELECT MAX(stream_id) FROM local_invites)
+            )
+            """,
+        )
+        _create_sequence(
+            cur,
+            "events_backfill_stream_seq",
+            "SELECT -MIN(stream_ordering) FROM events",
+        )
+        _create_sequence(
+            cur, "event_auth_chain_id", "SELECT MAX(chain_id) FROM event_auth_chains",
+        )
+
+
+def run_upgrade(*args, **kwargs):
+    pass
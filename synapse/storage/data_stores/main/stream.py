@@ -767,7 +767,8 @@ class StreamWorkerStore(EventsWorkerStore, SQLBaseStore):
              Deferred[Tuple[int, list[FrozenEvent]]]: A tuple of (next_id, events), where
              `next_id` is the next value to pass as `from_id` (it will either be the
              stream_ordering of the last returned event, or, if fewer than `limit` events
-             were found, `current_id`.
+             were found, `current_id`. The events have their stream_ordering set in
+             their internal metadata.
          """
 
         def get_all_new_events_stream_txn(txn):
@@ -787,13 +788,17 @@ class StreamWorkerStore(EventsWorkerStore, SQLBaseStore):
             if len(rows) == limit:
                 upper_bound = rows[-1][0]
 
-            return upper_bound, [row[1] for row in rows]
+            return upper_bound, rows
 
-        upper_bound, event_ids = yield self.db.runInteraction(
+        upper_bound, rows = yield self.db.runInteraction(
             "get_all_new_events_stream", get_all_new_events_stream_txn
         )
 
-        events = yield self.get_events_as_list(event_ids)
+        events = yield self.get_events_as_list([row[1] for row in rows])
+
+        stream_orderings = {event_id: stream for stream, event_id in rows}
+        for event in events:
+            event.internal_metadata.stream_ordering = stream_orderings[event.event_id]
 
         return upper_bound, events
 
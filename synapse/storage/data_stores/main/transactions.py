@@ -169,7 +169,9 @@ class TransactionStore(SQLBaseStore):
             allow_none=True,
         )
 
-        if result and result["retry_last_ts"] > 0:
+        # the row may only exist to hold `last_successful_stream_ordering`, in
+        # which case `retry_last_ts` is NULL.
+        if result and result["retry_last_ts"]:
             return result
         else:
             return None
@@ -216,6 +218,7 @@ class TransactionStore(SQLBaseStore):
                         retry_interval = EXCLUDED.retry_interval
                     WHERE
                         EXCLUDED.retry_interval = 0
+                        OR destinations.retry_interval IS NULL
                         OR destinations.retry_interval < EXCLUDED.retry_interval
             """
 
@@ -247,7 +250,11 @@ class TransactionStore(SQLBaseStore):
                     "retry_interval": retry_interval,
                 },
             )
-        elif retry_interval == 0 or prev_row["retry_interval"] < retry_interval:
+        elif (
+            retry_interval == 0
+            or prev_row["retry_interval"] is None
+            or prev_row["retry_interval"] < retry_interval
+        ):
             self.db.simple_update_one_txn(
                 txn,
                 "destinations",
@@ -259,6 +266,130 @@ class TransactionStore(SQLBaseStore):
                 },
             )
 
+    def store_destination_rooms_entries(self, destinations, room_id, stream_ordering):
+        """Records that the event at `stream_ordering` is the latest in its room
+        to be sent to each of `destinations`.
+
+        Args:
+            destinations (Iterable[str])
+            room_id (str)
+            stream_ordering (int)
+        """
+        destinations = list(destinations)
+
+        return self.db.runInteraction(
+            "store_destination_rooms_entries",
+            self.db.simple_upsert_many_txn,
+            table="destination_rooms",
+            key_names=("destination", "room_id"),
+            key_values=[(destination, room_id) for destination in destinations],
+            value_names=("stream_ordering",),
+            value_values=[(stream_ordering,)] * len(destinations),
+        )
+
+    def get_destination_last_successful_stream_ordering(self, destination):
+        """Gets the stream ordering of the latest event which was successfully
+        sent to the destination.
+
+        Args:
+            destination (str)
+
+        Returns:
+            Deferred[int|None]: None if we have never successfully sent an event
+                to the destination.
+        """
+        return self.db.simple_select_one_onecol(
+            table="destinations",
+            keyvalues={"destination": destination},
+            retcol="last_successful_stream_ordering",
+            allow_none=True,
+            desc="get_destination_last_successful_stream_ordering",
+        )
+
+    def set_destination_last_successful_stream_ordering(
+        self, destination, last_successful_stream_ordering
+    ):
+        """Sets the stream ordering of the latest event which was successfully
+        sent to the destination.
+
+        Args:
+            destination (str)
+            last_successful_stream_ordering (int)
+        """
+        return self.db.simple_upsert(
+            table="destinations",
+            keyvalues={"destination": destination},
+            values={"last_successful_stream_ordering": last_successful_stream_ordering},
+            desc="set_destination_last_successful_stream_ordering",
+        )
+
+    def get_catch_up_room_events(
+        self, destination, last_successful_stream_ordering, limit=50
+    ):
+        """Gets the latest event of each room which the destination has missed,
+        i.e. the rooms with an event to send to the destination after
+        `last_successful_stream_ordering`.
+
+        Args:
+            destination (str)
+            last_successful_stream_ordering (int)
+            limit (int): the most rooms to return
+
+        Returns:
+            Deferred[list[tuple[str, int]]]: (event_id, stream_ordering) of the
+                events, in stream order.
+        """
+
+        def get_catch_up_room_events_txn(txn):
+            sql = """
+                SELECT e.event_id, dr.stream_ordering FROM destination_rooms AS dr
+                INNER JOIN events AS e USING (stream_ordering)
+                WHERE dr.destination = ? AND dr.stream_ordering > ?
+                ORDER BY dr.stream_ordering
+                LIMIT ?
+            """
+            txn.execute(sql, (destination, last_successful_stream_ordering, limit))
+            return txn.fetchall()
+
+        return self.db.runInteraction(
+            "get_catch_up_room_events", get_catch_up_room_events_txn
+        )
+
+    def get_catch_up_outstanding_destinations(self, after_destination, limit=25):
+        """Gets destinations which have missed events and aren't backing off,
+        so that they can be caught up (e.g. after a restart).
+
+        Args:
+            after_destination (str|None): only return destinations after this
+                one, to page through the results.
+            limit (int)
+
+        Returns:
+            Deferred[list[str]]: the destinations, in order.
+        """
+
+        def get_catch_up_outstanding_destinations_txn(txn):
+            sql = """
+                SELECT DISTINCT d.destination FROM destinations AS d
+                INNER JOIN destination_rooms AS dr USING (destination)
+                WHERE
+                    dr.stream_ordering > d.last_successful_stream_ordering
+                    AND d.destination > ?
+                    AND (
+                        d.retry_last_ts IS NULL
+                        OR d.retry_last_ts + d.retry_interval < ?
+                    )
+                ORDER BY d.destination
+                LIMIT ?
+            """
+            txn.execute(sql, (after_destination or "", self._clock.time_msec(), limit))
+            return [row[0] for row in txn]
+
+        return self.db.runInteraction(
+            "get_catch_up_outstanding_destinations",
+            get_catch_up_outstanding_destinations_txn,
+        )
+
     def _start_cleanup_transactions(self):
         return run_as_background_process(
             "cleanup_transactions", self._cleanup_transactions
@@ -29,6 +29,13 @@ logger = logging.getLogger(__name__)
 
 MAX_STATE_DELTA_HOPS = 100
 
+# The maximum lengths of the delta chains at each level of the layout written by
+# the state group compaction background update. Each state group is a delta
+# against the previous group at the first level with space; once every level
+# is full the group is stored as a snapshot. This gives a snapshot every
+# 30 * 20 * 10 groups, and at most 30 + 20 + 10 hops to reach one.
+STATE_GROUP_COMPACTION_LEVELS = (30, 20, 10)
+
 
 class StateGroupBackgroundUpdateStore(SQLBaseStore):
     """Defines functions related to state groups needed to run the state backgroud
@@ -183,6 +190,7 @@ class StateBackgroundUpdateStore(StateGroupBackgroundUpdateStore):
     STATE_GROUP_DEDUPLICATION_UPDATE_NAME = "state_group_state_deduplication"
     STATE_GROUP_INDEX_UPDATE_NAME = "state_group_state_type_index"
     STATE_GROUPS_ROOM_INDEX_UPDATE_NAME = "state_groups_room_id_idx"
+    STATE_GROUP_COMPACTION_UPDATE_NAME = "state_group_compaction"
 
     def __init__(self, database: Database, db_conn, hs):
         super(StateBackgroundUpdateStore, self).__init__(database, db_conn, hs)
@@ -199,6 +207,10 @@ class StateBackgroundUpdateStore(StateGroupBackgroundUpdateStore):
             table="state_groups",
             columns=["room_id"],
         )
+        self.db.updates.register_background_update_handler(
+            self.STATE_GROUP_COMPACTION_UPDATE_NAME,
+            self._background_compact_state_groups,
+        )
 
     @defer.inlineCallbacks
     def _background_deduplicate_state(self, progress, batch_size):
@@ -372,3 +384,257 @@ class StateBackgroundUpdateStore(StateGroupBackgroundUpdateStore):
         yield self.db.updates._end_background_update(self.STATE_GROUP_INDEX_UPDATE_NAME)
 
         return 1
+
+    @defer.inlineCallbacks
+    def _background_compact_state_groups(self, progress, batch_size):
+        """This background update rewrites the state groups in each room so
+        that they follow the snapshot/delta layout given by
+        STATE_GROUP_COMPACTION_LEVELS, which bounds the number of hops needed
+        to look up a group while keeping the snapshots (and so the number of
+        rows in `state_groups_state`) to a minimum.
+
+        Rooms are processed in order of room ID, and the groups in each room in
+        order of ID. The heads of the delta chains being built are stored in
+        the progress, so the update can resume part way through a room.
+        """
+        room_id = progress.get("room_id", "")
+        last_state_group = progress.get("last_state_group", 0)
+        levels = progress.get("levels")
+        groups_processed = progress.get("groups_processed", 0)
+        groups_rewritten = progress.get("groups_rewritten", 0)
+        rows_removed = progress.get("rows_removed", 0)
+
+        # Each state group may need its full state loading, so we scale the
+        # batch size down as for the deduplication update.
+        BATCH_SIZE_SCALE_FACTOR = 100
+
+        batch_size = max(1, int(batch_size / BATCH_SIZE_SCALE_FACTOR))
+
+        def compact_txn(txn):
+            nonlocal room_id, last_state_group, levels
+            nonlocal groups_processed, groups_rewritten, rows_removed
+
+            # The heads of the chains, as [state_group, length] pairs, and the
+            # full state of each head.
+            if levels is None:
+                levels = [[None, 0] for _ in STATE_GROUP_COMPACTION_LEVELS]
+            head_states = {}
+
+            # A head may have been purged since the last batch, in which case
+            # we start the chains again.
+            for head, _ in levels:
+                if head is None or head in head_states:
+                    continue
+                is_in_db = self.db.simple_select_one_onecol_txn(
+                    txn,
+                    table="state_groups",
+                    keyvalues={"id": head},
+                    retcol="id",
+                    allow_none=True,
+                )
+                if not is_in_db:
+                    levels = [[None, 0] for _ in STATE_GROUP_COMPACTION_LEVELS]
+                    head_states = {}
+                    break
+                head_states.update(self._get_state_groups_from_groups_txn(txn, [head]))
+
+            count = 0
+            while count < batch_size:
+                txn.execute(
+                    "SELECT id FROM state_groups"
+                    " WHERE room_id = ? AND id > ?"
+                    " ORDER BY id ASC"
+                    " LIMIT ?",
+                    (room_id, last_state_group, batch_size - count),
+                )
+                state_groups = [row[0] for row in txn]
+
+                if not state_groups:
+                    txn.execute(
+                        "SELECT room_id FROM state_groups"
+                        " WHERE room_id > ?"
+                        " ORDER BY room_id ASC"
+                        " LIMIT 1",
+                        (room_id,),
+                    )
+                    row = txn.fetchone()
+                    if not row:
+                        return True, count
+
+                    (room_id,) = row
+                    last_state_group = 0
+                    levels = [[None, 0] for _ in STATE_GROUP_COMPACTION_LEVELS]
+                    head_states = {}
+                    continue
+
+                for state_group in state_groups:
+                    curr_state = self._get_state_groups_from_groups_txn(
+                        txn, [state_group]
+                    )[state_group]
+
+                    prev_group = _next_compacted_prev_group(levels, state_group)
+
+                    if prev_group is None:
+                        new_state = curr_state
+                    else:
+                        prev_state = head_states[prev_group]
+                        if set(prev_state) - set(curr_state):
+                            # We can only do a delta if the current state has a
+                            # superset of the keys of the previous state, so
+                            # this has to be a snapshot.
+                            prev_group = None
+                            new_state = curr_state
+                            for level in levels:
+                                level[:] = [state_group, 1]
+                        else:
+                            new_state = {
+                                key: value
+                                for key, value in iteritems(curr_state)
+                                if prev_state.get(key) != value
+                            }
+
+                    removed = self._rewrite_state_group_txn(
+                        txn, room_id, state_group, prev_group, new_state
+                    )
+                    if removed is not None:
+                        groups_rewritten += 1
+                        rows_removed += removed
+
+                    head_states[state_group] = curr_state
+                    heads = {head for head, _ in levels}
+                    for group in list(head_states):
+                        if group not in heads:
+                            del head_states[group]
+
+                    last_state_group = state_group
+                    groups_processed += 1
+                    count += 1
+
+            progress = {
+                "room_id": room_id,
+                "last_state_group": last_state_group,
+                "levels": levels,
+                "groups_processed": groups_processed,
+                "groups_rewritten": groups_rewritten,
+                "rows_removed": rows_removed,
+            }
+
+            self.db.updates._background_update_progress_txn(
+                txn, self.STATE_GROUP_COMPACTION_UPDATE_NAME, progress
+            )
+
+            return False, count
+
+        finished, result = yield self.db.runInteraction(
+            self.STATE_GROUP_COMPACTION_UPDATE_NAME, compact_txn
+        )
+
+        logger.info(
+            "Compacted state groups up to %s in %s: %i groups processed, %i"
+            " rewritten, %i rows removed",
+            last_state_group,
+            room_id,
+            groups_processed,
+            groups_rewritten,
+            rows_removed,
+        )
+
+        if finished:
+            yield self.db.updates._end_background_update(
+                self.STATE_GROUP_COMPACTION_UPDATE_NAME
+            )
+
+        return result * BATCH_SIZE_SCALE_FACTOR
+
+    def _rewrite_state_group_txn(self, txn, room_id, state_group, prev_group, state):
+        """Stores a state group as a delta against `prev_group`, or as a
+        snapshot if `prev_group` is None, unless it is already stored that way.
+
+        The full state of the group is unchanged, so any groups stored as
+        deltas against it remain valid.
+
+        Args:
+            txn
+            room_id (str): the room the state group is in
+            state_group (int): the state group to rewrite
+            prev_group (int|None): the group to store the state as a delta
+                against
+            state (dict): the delta against `prev_group`, or the full state of
+                the group if `prev_group` is None. Map of (type, state_key) to
+                event_id.
+
+        Returns:
+            int|None: the reduction in the number of `state_groups_state` rows
+            for the group, or None if the group was not rewritten.
+        """
+        current_prev_group = self.db.simple_select_one_onecol_txn(
+            txn,
+            table="state_group_edges",
+            keyvalues={"state_group": state_group},
+            retcol="prev_state_group",
+            allow_none=True,
+        )
+        if current_prev_group == prev_group:
+            return None
+
+        txn.execute(
+            "SELECT count(*) FROM state_groups_state WHERE state_group = ?",
+            (state_group,),
+        )
+        (old_rows,) = txn.fetchone()
+
+        self.db.simple_delete_txn(
+            txn, table="state_group_edges", keyvalues={"state_group": state_group}
+        )
+        if prev_group is not None:
+            self.db.simple_insert_txn(
+                txn,
+                table="state_group_edges",
+                values={"state_group": state_group, "prev_state_group": prev_group},
+            )
+
+        self.db.simple_delete_txn(
+            txn, table="state_groups_state", keyvalues={"state_group": state_group}
+        )
+        self.db.simple_insert_many_txn(
+            txn,
+            table="state_groups_state",
+            values=[
+                {
+                    "state_group": state_group,
+                    "room_id": room_id,
+                    "type": key[0],
+                    "state_key": key[1],
+                    "event_id": state_id,
+                }
+                for key, state_id in iteritems(state)
+            ],
+        )
+
+        return old_rows - len(state)
+
+
+def _next_compacted_prev_group(levels, state_group):
+    """Picks the group that a state group should be stored as a delta against
+    in the layout given by STATE_GROUP_COMPACTION_LEVELS, and adds the state
+    group to the chains.
+
+    Args:
+        levels (list[list]): the head and length of the chain at each level,
+            which are updated in place.
+        state_group (int): the state group being added
+
+    Returns:
+        int|None: the group to store `state_group` as a delta against, or None
+        if it should be stored as a snapshot.
+    """
+    for level, max_length in zip(levels, STATE_GROUP_COMPACTION_LEVELS):
+        head, length = level
+        if head is not None and length < max_length:
+            level[:] = [state_group, length + 1]
+            return head
+
+        # This level is full, so start a new chain at it and move up a level.
+        level[:] = [state_group, 1]
+
+    return None
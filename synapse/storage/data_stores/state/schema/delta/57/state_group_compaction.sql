@@ -0,0 +1,20 @@
+/* Copyright 2020 The Matrix.org Foundation C.I.C.
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *    http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+-- Rewrite the state group delta chains of each room into a layout with fewer
+-- snapshots and shorter chains. This walks the state groups of each room in
+-- turn, so needs the index on state_groups(room_id).
+INSERT INTO background_updates (update_name, progress_json, depends_on) VALUES
+    ('state_group_compaction', '{}', 'state_groups_room_id_idx');
@@ -31,6 +31,7 @@ from synapse.types import StateMap
 from synapse.util.caches import get_cache_factor_for
 from synapse.util.caches.descriptors import cached
 from synapse.util.caches.dictionary_cache import DictionaryCache
+from synapse.util.caches.state_map import CompactStateMap
 
 logger = logging.getLogger(__name__)
 
@@ -86,15 +87,20 @@ class StateGroupDataStore(StateBackgroundUpdateStore, SQLBaseStore):
         #
         # We size the non-members cache to be smaller than the members cache as the
         # vast majority of state in Matrix (today) is member events.
+        #
+        # The state is held as CompactStateMaps, which let the state of a new
+        # group share most of its entries with the state of its previous group.
 
         self._state_group_cache = DictionaryCache(
             "*stateGroupCache*",
             # TODO: this hasn't been tuned yet
             50000 * get_cache_factor_for("stateGroupCache"),
+            value_type=CompactStateMap,
         )
         self._state_group_members_cache = DictionaryCache(
             "*stateGroupMembersCache*",
             500000 * get_cache_factor_for("stateGroupMembersCache"),
+            value_type=CompactStateMap,
         )
 
     @cached(max_entries=10000, iterable=True)
@@ -458,34 +464,68 @@ class StateGroupDataStore(StateBackgroundUpdateStore, SQLBaseStore):
             # is immutable. (If the map wasn't immutable then this prefill could
             # race with another update)
 
-            current_member_state_ids = {
-                s: ev
-                for (s, ev) in iteritems(current_state_ids)
-                if s[0] == EventTypes.Member
-            }
-            txn.call_after(
-                self._state_group_members_cache.update,
-                self._state_group_members_cache.sequence,
-                key=state_group,
-                value=dict(current_member_state_ids),
-            )
+            for cache, is_members in (
+                (self._state_group_members_cache, True),
+                (self._state_group_cache, False),
+            ):
+                cache_state_ids = {
+                    s: ev
+                    for (s, ev) in iteritems(current_state_ids)
+                    if (s[0] == EventTypes.Member) == is_members
+                }
+
+                cache_delta_ids = None
+                if delta_ids is not None:
+                    cache_delta_ids = {
+                        s: ev
+                        for (s, ev) in iteritems(delta_ids)
+                        if (s[0] == EventTypes.Member) == is_members
+                    }
 
-            current_non_member_state_ids = {
-                s: ev
-                for (s, ev) in iteritems(current_state_ids)
-                if s[0] != EventTypes.Member
-            }
-            txn.call_after(
-                self._state_group_cache.update,
-                self._state_group_cache.sequence,
-                key=state_group,
-                value=dict(current_non_member_state_ids),
-            )
+                txn.call_after(
+                    self._prefill_state_group_cache,
+                    cache,
+                    cache.sequence,
+                    state_group,
+                    cache_state_ids,
+                    prev_group,
+                    cache_delta_ids,
+                )
 
             return state_group
 
         return self.db.runInteraction("store_state_group", _store_state_group_txn)
 
+    def _prefill_state_group_cache(
+        self, cache, sequence, state_group, state_ids, prev_group, delta_ids
+    ):
+        """Adds a newly stored state group to one of the state group caches.
+
+        If the previous group is in the cache, the new entry is built on top
+        of it so that they share their common state.
+
+        Args:
+            cache (DictionaryCache): the cache to update
+            sequence (int): the sequence number of the cache before the state
+                group was stored
+            state_group (int): the new state group
+            state_ids (dict): the state of the new group which belongs in
+                `cache`
+            prev_group (int|None): the previous group, if any
+            delta_ids (dict|None): the part of the delta between `prev_group`
+                and the new group which belongs in `cache`, if known
+        """
+        if (
+            prev_group
+            and delta_ids is not None
+            and cache.update_from(
+                sequence, key=state_group, base_key=prev_group, delta=delta_ids
+            )
+        ):
+            return
+
+        cache.update(sequence, key=state_group, value=state_ids)
+
     def purge_unreferenced_state_groups(
         self, room_id: str, state_groups_to_delete
     ) -> defer.Deferred:
@@ -72,6 +72,30 @@ stale_forward_extremities_counter = Histogram(
     buckets=(0, 1, 2, 3, 5, 7, 10, 15, 20, 50, 100, 200, 500, "+Inf"),
 )
 
+# The number of events in each batch of events persisted together.
+event_persist_batch_size = Histogram(
+    "synapse_storage_events_persist_batch_size",
+    "Number of events in each batch of events persisted together",
+    buckets=(1, 2, 3, 5, 10, 20, 50, 100, "+Inf"),
+)
+
+# The number of rooms in each batch of events persisted together.
+event_persist_batch_rooms = Histogram(
+    "synapse_storage_events_persist_batch_rooms",
+    "Number of rooms in each batch of events persisted together",
+    buckets=(1, 2, 3, 5, 10, 20, 50, 100, "+Inf"),
+)
+
+# How long events wait in the persistence queue before being persisted.
+event_persist_queue_wait_time = Histogram(
+    "synapse_storage_events_persist_queue_wait_seconds",
+    "Time events wait in the persistence queue before being persisted",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, "+Inf"),
+)
+
+# The maximum number of events persisted in one transaction.
+_MAX_EVENTS_PER_BATCH = 100
+
 
 @attr.s(slots=True)
 class DeltaState:
@@ -92,16 +116,41 @@ class DeltaState:
 class _EventPeristenceQueue(object):
     """Queues up events so that they can be persisted in bulk with only one
     concurrent transaction per room.
+
+    The queued events of several rooms are coalesced into batches, each of
+    which is persisted in one go. A room is only ever in one batch at a time,
+    and its events are taken from the front of its queue, so the events of each
+    room are still persisted in the order they were queued.
+
+    Args:
+        clock (Clock)
+        per_batch_callback (callable): called with a list of
+            _EventPersistQueueItem to persist, returning an awaitable.
+        batch_latency_ms (int): how long to wait for more events to arrive
+            before persisting the events in the queue, unless there are
+            already enough of them to fill a batch.
     """
 
     _EventPersistQueueItem = namedtuple(
-        "_EventPersistQueueItem", ("events_and_contexts", "backfilled", "deferred")
+        "_EventPersistQueueItem",
+        ("room_id", "events_and_contexts", "backfilled", "deferred", "queued_ts"),
     )
 
-    def __init__(self):
+    def __init__(self, clock, per_batch_callback, batch_latency_ms=0):
+        self._clock = clock
+        self._per_batch_callback = per_batch_callback
+        self._batch_latency_ms = batch_latency_ms
+
         self._event_persist_queues = {}
         self._currently_persisting_rooms = set()
 
+        # The number of events in the queues which aren't in a batch yet.
+        self._num_pending_events = 0
+
+        # The call to `_persist_pending_batches` that is waiting for the latency
+        # budget to run out, if any.
+        self._flush_timer = None
+
     def add_to_queue(self, room_id, events_and_contexts, backfilled):
         """Add events to the queue, with the given persist_event options.
 
@@ -118,6 +167,8 @@ class _EventPeristenceQueue(object):
             defer.Deferred: a deferred which will resolve once the events are
                 persisted. Runs its callbacks *without* a logcontext.
         """
+        self._num_pending_events += len(events_and_contexts)
+
         queue = self._event_persist_queues.setdefault(room_id, deque())
         if queue:
             # if the last item in the queue has the same `backfilled` setting,
@@ -131,65 +182,131 @@ class _EventPeristenceQueue(object):
 
         queue.append(
             self._EventPersistQueueItem(
+                room_id=room_id,
                 events_and_contexts=events_and_contexts,
                 backfilled=backfilled,
                 deferred=deferred,
+                queued_ts=self._clock.time_msec(),
             )
         )
 
         return deferred.observe()
 
-    def handle_queue(self, room_id, per_item_callback):
-        """Attempts to handle the queue for a room if not already being handled.
+    def handle_queue(self):
+        """Starts persisting the queued events, once the latency budget has
+        run out or there are enough of them to fill a batch.
 
-        The given callback will be invoked with for each item in the queue,
-        of type _EventPersistQueueItem. The per_item_callback will continuously
-        be called with new items, unless the queue becomnes empty. The return
-        value of the function will be given to the deferreds waiting on the item,
-        exceptions will be passed to the deferreds as well.
+        The deferreds of the items in the queue are resolved once they have
+        been persisted. If a batch can't be persisted its rooms are retried one
+        at a time, so that the exception is only passed to the deferreds of the
+        rooms which failed.
 
         This function should therefore be called whenever anything is added
         to the queue.
+        """
+        if (
+            self._batch_latency_ms <= 0
+            or self._num_pending_events >= _MAX_EVENTS_PER_BATCH
+        ):
+            self._persist_pending_batches()
+        elif self._flush_timer is None:
+            self._flush_timer = self._clock.call_later(
+                self._batch_latency_ms / 1000.0, self._persist_pending_batches
+            )
 
-        If another callback is currently handling the queue then it will not be
-        invoked.
+    def _persist_pending_batches(self):
+        """Sets off the persistence of all the events which can be persisted
+        now.
         """
+        if self._flush_timer is not None:
+            if self._flush_timer.active():
+                self._flush_timer.cancel()
+            self._flush_timer = None
+
+        while True:
+            items = self._get_next_batch()
+            if not items:
+                break
 
-        if room_id in self._currently_persisting_rooms:
-            return
+            run_as_background_process("persist_events", self._handle_batch, items)
 
-        self._currently_persisting_rooms.add(room_id)
-
-        async def handle_queue_loop():
-            try:
-                queue = self._get_drainining_queue(room_id)
-                for item in queue:
-                    try:
-                        ret = await per_item_callback(item)
-                    except Exception:
-                        with PreserveLoggingContext():
-                            item.deferred.errback()
-                    else:
-                        with PreserveLoggingContext():
-                            item.deferred.callback(ret)
-            finally:
-                queue = self._event_persist_queues.pop(room_id, None)
-                if queue:
-                    self._event_persist_queues[room_id] = queue
-                self._currently_persisting_rooms.discard(room_id)
+    def _get_next_batch(self):
+        """Takes the next batch of items off the front of the queues of the
+        rooms which aren't already being persisted.
 
-        # set handle_queue_loop off in the background
-        run_as_background_process("persist_events", handle_queue_loop)
+        Returns:
+            list[_EventPersistQueueItem]: the items to persist, with at most one
+                per room, which all have the same `backfilled` setting.
+        """
+        now = self._clock.time_msec()
 
-    def _get_drainining_queue(self, room_id):
-        queue = self._event_persist_queues.setdefault(room_id, deque())
+        items = []
+        num_events = 0
+        for room_id, queue in self._event_persist_queues.items():
+            if not queue or room_id in self._currently_persisting_rooms:
+                continue
+
+            item = queue[0]
+            if items and (
+                item.backfilled != items[0].backfilled
+                or num_events + len(item.events_and_contexts) > _MAX_EVENTS_PER_BATCH
+            ):
+                continue
+
+            queue.popleft()
+            self._currently_persisting_rooms.add(room_id)
+            items.append(item)
+            num_events += len(item.events_and_contexts)
+
+            event_persist_queue_wait_time.observe((now - item.queued_ts) / 1000.0)
+
+            if num_events >= _MAX_EVENTS_PER_BATCH:
+                break
+
+        self._num_pending_events -= num_events
+
+        if items:
+            event_persist_batch_size.observe(num_events)
+            event_persist_batch_rooms.observe(len(items))
+
+        return items
 
+    async def _handle_batch(self, items):
         try:
-            while True:
-                yield queue.popleft()
-        except IndexError:
-            # Queue has been drained.
-            pass
+            await self._persist_batch(items)
+        finally:
+            for item in items:
+                self._currently_persisting_rooms.discard(item.room_id)
+
+                queue = self._event_persist_queues.pop(item.room_id, None)
+                if queue:
+                    self._event_persist_queues[item.room_id] = queue
+
+            # There may be events waiting for these rooms to finish.
+            if self._num_pending_events:
+                self.handle_queue()
+
+    async def _persist_batch(self, items):
+        """Persists the given items, and resolves their deferreds."""
+        try:
+            await self._per_batch_callback(items)
+        except Exception:
+            if len(items) == 1:
+                with PreserveLoggingContext():
+                    items[0].deferred.errback()
+                return
+
+            logger.warning(
+                "Failed to persist a batch of events in %d rooms; retrying the"
+                " rooms one at a time",
+                len(items),
+            )
+            for item in items:
+                await self._persist_batch([item])
+        else:
+            for item in items:
+                with PreserveLoggingContext():
+                    item.deferred.callback(None)
 
 
 class EventsPersistenceStorage(object):
@@ -208,7 +325,11 @@ class EventsPersistenceStorage(object):
 
         self._clock = hs.get_clock()
         self.is_mine_id = hs.is_mine_id
-        self._event_persist_queue = _EventPeristenceQueue()
+        self._event_persist_queue = _EventPeristenceQueue(
+            self._clock,
+            self._persist_event_batch,
+            hs.config.event_persistence_batch_latency_ms,
+        )
         self._state_resolution_handler = hs.get_state_resolution_handler()
 
     @defer.inlineCallbacks
@@ -239,8 +360,7 @@ class EventsPersistenceStorage(object):
             )
             deferreds.append(d)
 
-        for room_id in partitioned:
-            self._maybe_start_persisting(room_id)
+        self._event_persist_queue.handle_queue()
 
         yield make_deferred_yieldable(
             defer.gatherResults(deferreds, consumeErrors=True)
@@ -263,21 +383,25 @@ class EventsPersistenceStorage(object):
             event.room_id, [(event, context)], backfilled=backfilled
         )
 
-        self._maybe_start_persisting(event.room_id)
+        self._event_persist_queue.handle_queue()
 
         yield make_deferred_yieldable(deferred)
 
         max_persisted_id = yield self.main_store.get_current_events_token()
         return (event.internal_metadata.stream_ordering, max_persisted_id)
 
-    def _maybe_start_persisting(self, room_id: str):
-        async def persisting_queue(item):
-            with Measure(self._clock, "persist_events"):
-                await self._persist_events(
-                    item.events_and_contexts, backfilled=item.backfilled
-                )
+    async def _persist_event_batch(self, items):
+        """Persists a batch of items from the queue, which may be for several
+        rooms, all with the same `backfilled` setting.
+        """
+        events_and_contexts = []
+        for item in items:
+            events_and_contexts.extend(item.events_and_contexts)
 
-        self._event_persist_queue.handle_queue(room_id, persisting_queue)
+        with Measure(self._clock, "persist_events"):
+            await self._persist_events(
+                events_and_contexts, backfilled=items[0].backfilled
+            )
 
     async def _persist_events(
         self,
@@ -299,9 +423,6 @@ class EventsPersistenceStorage(object):
             # We can't easily parallelize these since different chunks
             # might contain the same event. :(
 
-            # NB: Assumes that we are only persisting events for one room
-            # at a time.
-
             # map room_id->list[event_ids] giving the new forward
             # extremities in each room
             new_forward_extremeties = {}
@@ -13,9 +13,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import abc
 import contextlib
 import threading
 from collections import deque
+from typing import Dict, List, Set
+
+from sortedcontainers import SortedSet
+
+from synapse.storage.engines import PostgresEngine
 
 
 class IdGenerator(object):
@@ -198,3 +204,388 @@ class ChainedIdGenerator(object):
                 return stream_id - 1, chained_id
 
             return self._current_max, self.chained_generator.get_current_token()
+
+
+class SequenceGenerator(metaclass=abc.ABCMeta):
+    """A class which generates unique integer IDs, such as IDs for new rows.
+    """
+
+    @abc.abstractmethod
+    def get_next_id_txn(self, txn) -> int:
+        """Gets the next ID in the sequence"""
+        ...
+
+    def get_next_mult_txn(self, txn, n: int) -> List[int]:
+        """Gets the next `n` IDs in the sequence, in ascending order"""
+        return [self.get_next_id_txn(txn) for _ in range(n)]
+
+
+class PostgresSequenceGenerator(SequenceGenerator):
+    """An implementation of SequenceGenerator which uses a postgres sequence, so
+    that IDs are unique across all the processes using the database.
+    """
+
+    def __init__(self, sequence_name: str):
+        self._sequence_name = sequence_name
+
+    def get_next_id_txn(self, txn) -> int:
+        txn.execute("SELECT nextval(?)", (self._sequence_name,))
+        return txn.fetchone()[0]
+
+    def get_next_mult_txn(self, txn, n: int) -> List[int]:
+        txn.execute(
+            "SELECT nextval(?) FROM generate_series(1, ?)", (self._sequence_name, n)
+        )
+        return sorted(i for (i,) in txn)
+
+
+class LocalSequenceGenerator(SequenceGenerator):
+    """An implementation of SequenceGenerator which uses local locking
+
+    This only works reliably if there are no other processes generating IDs
+    from the same table, which is the case when using SQLite.
+    """
+
+    def __init__(self, current_max_id: int):
+        self._lock = threading.Lock()
+        self._current_max_id = current_max_id
+
+    def get_next_id_txn(self, txn) -> int:
+        with self._lock:
+            self._current_max_id += 1
+            return self._current_max_id
+
+
+def build_sequence_generator(
+    db_conn, database_engine, table: str, column: str, sequence_name: str
+) -> SequenceGenerator:
+    """Get the best implementation of SequenceGenerator available
+
+    This uses PostgresSequenceGenerator on postgres, and a locally-locked
+    implementation, which starts from the largest ID in the table, on sqlite.
+
+    Args:
+        db_conn: A database connection to use to fetch the largest ID.
+        database_engine: the database engine we are connected to
+        table: the table which holds the IDs
+        column: the column of `table` which holds the IDs
+        sequence_name: the name of a postgres sequence to use.
+    """
+    if isinstance(database_engine, PostgresEngine):
+        return PostgresSequenceGenerator(sequence_name)
+    else:
+        return LocalSequenceGenerator(_load_current_id(db_conn, table, column))
+
+
+class MultiWriterIdGenerator(object):
+    """Generates stream ids for a stream which can be written to by several
+    processes ("writers") at once, while keeping track of how far each writer
+    has got.
+
+    On postgres, IDs are handed out by a sequence, so they are unique across
+    all the writers. Each writer knows which of its own IDs are still being
+    persisted, but only learns the positions of other writers when `advance`
+    is called (by replication).
+
+    The position of a writer is the ID such that the writer has persisted
+    everything it will ever write with an ID less than or equal to it. A writer
+    which has nothing in flight will only ever write IDs larger than any ID
+    which has already been handed out, so its position is bumped up to the
+    largest position it knows of. The current token of the stream, i.e. the
+    position up to which readers can safely read the stream, is the minimum of
+    the writers' positions.
+
+    On SQLite there can only be one writer, and IDs are handed out from memory,
+    as with StreamIdGenerator.
+
+    Args:
+        db_conn: A database connection to use to fetch the initial positions.
+        db (Database)
+        stream_name: The name of the stream, used to record the writers'
+            positions in the `stream_positions` table.
+        instance_name: The name of this process.
+        table: The database table which the stream is persisted to.
+        id_column: The column of `table` holding the stream ids.
+        sequence_name: The name of the postgres sequence used to hand out IDs.
+        writers: The names of the processes which can write to the stream.
+        extra_tables: List of pairs of database tables and columns which also
+            hold stream ids, for the initial position of the stream.
+        positive: Whether the stream ids are positive. If false the IDs go
+            downwards from -1, and positions are reported as negative numbers.
+
+    Usage:
+        async with stream_id_gen.get_next() as stream_id:
+            # ... persist event ...
+    """
+
+    def __init__(
+        self,
+        db_conn,
+        db,
+        stream_name: str,
+        instance_name: str,
+        table: str,
+        id_column: str,
+        sequence_name: str,
+        writers: List[str],
+        extra_tables=[],
+        positive: bool = True,
+    ):
+        self._db = db
+        self._stream_name = stream_name
+        self._instance_name = instance_name
+        self._return_factor = 1 if positive else -1
+        self._is_postgres = isinstance(db.engine, PostgresEngine)
+
+        if not self._is_postgres and set(writers) - {instance_name}:
+            raise Exception(
+                "The %s stream can only have more than one writer on PostgreSQL"
+                % (stream_name,)
+            )
+
+        self._lock = threading.Lock()
+
+        # All the IDs which we've handed out but which haven't been persisted
+        # yet. These are always positive, whatever the direction of the stream.
+        self._unfinished_ids = SortedSet()  # type: SortedSet[int]
+
+        # The number of calls to the sequence which haven't returned yet. While
+        # there are any, we might be about to hand out an ID below the
+        # positions of the other writers, so we can't bump our own position.
+        self._in_flight_fetches = 0
+
+        self._current_positions = self._load_current_positions(
+            db_conn, table, id_column, extra_tables, writers
+        )  # type: Dict[str, int]
+
+        # The largest ID we have handed out.
+        self._max_allocated = self._current_positions[instance_name]
+
+        if self._is_postgres:
+            self._sequence_gen = PostgresSequenceGenerator(sequence_name)
+
+    def _load_current_positions(
+        self, db_conn, table, id_column, extra_tables, writers
+    ) -> Dict[str, int]:
+        step = self._return_factor
+        max_id = max(
+            abs(_load_current_id(db_conn, t, c, step))
+            for t, c in [(table, id_column)] + list(extra_tables)
+        )
+
+        # Writers which have never recorded a position haven't written
+        # anything yet, so can start at the end of the stream.
+        positions = {writer: max_id for writer in writers}
+
+        if self._is_postgres:
+            sql = self._db.engine.convert_param_style(
+                "SELECT instance_name, stream_id FROM stream_positions"
+                " WHERE stream_name = ?"
+            )
+            cur = db_conn.cursor()
+            cur.execute(sql, (self._stream_name,))
+            for instance_name, stream_id in cur:
+                if instance_name in positions:
+                    positions[instance_name] = stream_id
+            cur.close()
+
+        # We don't have anything in flight, so our own position is as far
+        # along as anything is.
+        positions[self._instance_name] = max([max_id] + list(positions.values()))
+
+        return positions
+
+    def get_next(self):
+        """
+        Usage:
+            async with stream_id_gen.get_next() as stream_id:
+                # ... persist event ...
+        """
+        return _MultiWriterCtxManager(self)
+
+    def get_next_mult(self, n: int):
+        """
+        Usage:
+            async with stream_id_gen.get_next_mult(5) as stream_ids:
+                # ... persist events ...
+        """
+        return _MultiWriterCtxManager(self, n)
+
+    def get_next_txn(self, txn) -> int:
+        """Gets a new stream ID from within a transaction, which is marked as
+        finished when the transaction completes (or fails).
+
+        Usage:
+            stream_id = stream_id_gen.get_next_txn(txn)
+            # ... persist update with stream_id ...
+        """
+        with self._lock:
+            if not self._is_postgres:
+                self._max_allocated += 1
+                next_id = self._max_allocated
+                self._unfinished_ids.add(next_id)
+            else:
+                self._in_flight_fetches += 1
+
+        if self._is_postgres:
+            try:
+                next_id = self._sequence_gen.get_next_id_txn(txn)
+            except Exception:
+                with self._lock:
+                    self._in_flight_fetches -= 1
+                raise
+
+            with self._lock:
+                self._in_flight_fetches -= 1
+                self._unfinished_ids.add(next_id)
+                self._max_allocated = max(self._max_allocated, next_id)
+
+        txn.call_after(self._mark_ids_as_finished, [next_id])
+        txn.call_on_exception(self._mark_ids_as_finished, [next_id])
+
+        # Let the other processes know how far we've got, in case they restart.
+        self.update_stream_positions_txn(txn)
+
+        return next_id * self._return_factor
+
+    async def _get_next_ids(self, n: int) -> List[int]:
+        """Hands out `n` new (positive) IDs, and marks them as unfinished."""
+        if not self._is_postgres:
+            with self._lock:
+                next_ids = list(
+                    range(self._max_allocated + 1, self._max_allocated + n + 1)
+                )
+                self._max_allocated += n
+                self._unfinished_ids.update(next_ids)
+            return next_ids
+
+        with self._lock:
+            self._in_flight_fetches += 1
+
+        try:
+            next_ids = await self._db.runInteraction(
+                "get_next_stream_ids", self._sequence_gen.get_next_mult_txn, n
+            )
+        except Exception:
+            with self._lock:
+                self._in_flight_fetches -= 1
+            raise
+
+        with self._lock:
+            self._in_flight_fetches -= 1
+            self._unfinished_ids.update(next_ids)
+            self._max_allocated = max(self._max_allocated, next_ids[-1])
+
+        return next_ids
+
+    def _mark_ids_as_finished(self, next_ids: List[int]):
+        """Called when the given IDs have been persisted (or have failed to be
+        persisted).
+        """
+        with self._lock:
+            self._unfinished_ids.difference_update(next_ids)
+            self._update_own_position()
+
+    def _update_own_position(self):
+        """Moves our own position on as far as it can go. Must be called with
+        the lock held.
+        """
+        if self._in_flight_fetches:
+            return
+
+        if self._unfinished_ids:
+            new_position = self._unfinished_ids[0] - 1
+        else:
+            new_position = max(
+                [self._max_allocated] + list(self._current_positions.values())
+            )
+
+        if new_position > self._current_positions[self._instance_name]:
+            self._current_positions[self._instance_name] = new_position
+
+    def get_current_token(self) -> int:
+        """Returns the position up to which every writer has persisted the
+        stream, i.e. the maximum stream id such that all stream ids less than or
+        equal to it have been successfully persisted.
+        """
+        with self._lock:
+            return min(self._current_positions.values()) * self._return_factor
+
+    def get_current_token_for_writer(self, instance_name: str) -> int:
+        """Returns the position of the given writer, or the current token of
+        the stream if we don't know of the writer.
+        """
+        with self._lock:
+            position = self._current_positions.get(
+                instance_name, min(self._current_positions.values())
+            )
+            return position * self._return_factor
+
+    def get_positions(self) -> Dict[str, int]:
+        """Gets the positions of all the writers we know about"""
+        with self._lock:
+            return {
+                name: position * self._return_factor
+                for name, position in self._current_positions.items()
+            }
+
+    def get_writers(self) -> Set[str]:
+        """Gets the names of all the writers we know about"""
+        with self._lock:
+            return set(self._current_positions)
+
+    def advance(self, instance_name: str, new_id: int):
+        """Called when we learn the position of another writer, e.g. from
+        replication.
+        """
+        new_id *= self._return_factor
+
+        with self._lock:
+            self._current_positions[instance_name] = max(
+                new_id, self._current_positions.get(instance_name, 0)
+            )
+            self._update_own_position()
+
+    def update_stream_positions_txn(self, txn):
+        """Records our own position in the `stream_positions` table, so that
+        other processes know where we had got to when they start up.
+
+        This should be called in each transaction which writes to the stream.
+        The position recorded is our position at the start of the transaction,
+        which is a safe lower bound.
+        """
+        if not self._is_postgres:
+            # there is only ever one writer on sqlite.
+            return
+
+        sql = """
+            INSERT INTO stream_positions (stream_name, instance_name, stream_id)
+            VALUES (?, ?, ?)
+            ON CONFLICT (stream_name, instance_name)
+            DO UPDATE SET
+                stream_id = GREATEST(stream_positions.stream_id, EXCLUDED.stream_id)
+        """
+        with self._lock:
+            position = self._current_positions[self._instance_name]
+        txn.execute(sql, (self._stream_name, self._instance_name, position))
+
+
+class _MultiWriterCtxManager(object):
+    """Async context manager returned by MultiWriterIdGenerator"""
+
+    def __init__(self, id_gen: MultiWriterIdGenerator, multiple_ids=None):
+        self._id_gen = id_gen
+        self._multiple_ids = multiple_ids
+        self._stream_ids = []  # type: List[int]
+
+    async def __aenter__(self):
+        self._stream_ids = await self._id_gen._get_next_ids(self._multiple_ids or 1)
+
+        factor = self._id_gen._return_factor
+        if self._multiple_ids is None:
+            return self._stream_ids[0] * factor
+        return [i * factor for i in self._stream_ids]
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._id_gen._mark_ids_as_finished(self._stream_ids)
+        return False
@@ -23,10 +23,18 @@ from six.moves import intern
 
 from prometheus_client.core import REGISTRY, Gauge, GaugeMetricFamily
 
+from synapse.util.caches.memory import CacheMemoryBudget, parse_memory_size
+
 logger = logging.getLogger(__name__)
 
 CACHE_SIZE_FACTOR = float(os.environ.get("SYNAPSE_CACHE_FACTOR", 0.5))
 
+# The maximum estimated memory, in bytes, to be used by all of the registered
+# caches combined. Zero means no limit.
+CACHE_MEMORY_BUDGET = parse_memory_size(
+    os.environ.get("SYNAPSE_CACHE_MEMORY_BUDGET", "")
+)
+
 
 def get_cache_factor_for(cache_name):
     env_var = "SYNAPSE_CACHE_FACTOR_" + cache_name.upper()
@@ -44,6 +52,11 @@ cache_size = Gauge("synapse_util_caches_cache:size", "", ["name"])
 cache_hits = Gauge("synapse_util_caches_cache:hits", "", ["name"])
 cache_evicted = Gauge("synapse_util_caches_cache:evicted_size", "", ["name"])
 cache_total = Gauge("synapse_util_caches_cache:total", "", ["name"])
+cache_memory_usage = Gauge(
+    "synapse_util_caches_cache:memory_usage",
+    "Estimated memory used by the cache, in bytes",
+    ["name"],
+)
 
 response_cache_size = Gauge("synapse_util_caches_response_cache:size", "", ["name"])
 response_cache_hits = Gauge("synapse_util_caches_response_cache:hits", "", ["name"])
@@ -52,10 +65,31 @@ response_cache_evicted = Gauge(
 )
 response_cache_total = Gauge("synapse_util_caches_response_cache:total", "", ["name"])
 
+memory_budget = None
+if CACHE_MEMORY_BUDGET:
+    memory_budget = CacheMemoryBudget(CACHE_MEMORY_BUDGET)
+
+    Gauge(
+        "synapse_util_caches_memory_budget_max_bytes",
+        "The limit on the estimated memory used by all caches, in bytes",
+    ).set(CACHE_MEMORY_BUDGET)
+    Gauge(
+        "synapse_util_caches_memory_budget_used_bytes",
+        "The estimated memory used by all caches, in bytes",
+    ).set_function(lambda: memory_budget.total_bytes)
+    Gauge(
+        "synapse_util_caches_memory_budget_evicted_bytes",
+        "The estimated memory freed by evictions due to the memory budget, in bytes",
+    ).set_function(lambda: memory_budget.evicted_bytes)
+
 
 def register_cache(cache_type, cache_name, cache, collect_callback=None):
     """Register a cache object for metric collection.
 
+    If a global cache memory budget has been configured (via the
+    SYNAPSE_CACHE_MEMORY_BUDGET environment variable) and the cache supports
+    memory tracking, the cache is also attached to the budget.
+
     Args:
         cache_type (str):
         cache_name (str): name of the cache
@@ -104,6 +138,8 @@ def register_cache(cache_type, cache_name, cache, collect_callback=None):
                     cache_hits.labels(cache_name).set(self.hits)
                     cache_evicted.labels(cache_name).set(self.evicted_size)
                     cache_total.labels(cache_name).set(self.hits + self.misses)
+                    if memory_tracked:
+                        cache_memory_usage.labels(cache_name).set(cache.memory_usage())
                 if collect_callback:
                     collect_callback()
             except Exception as e:
@@ -112,6 +148,10 @@ def register_cache(cache_type, cache_name, cache, collect_callback=None):
 
             yield GaugeMetricFamily("__unused", "")
 
+    memory_tracked = memory_budget is not None and hasattr(cache, "set_memory_budget")
+    if memory_tracked:
+        memory_budget.track(cache_name, cache)
+
     metric = CacheMetric()
     REGISTRY.register(metric)
     caches_by_name[cache_name] = cache
@@ -28,7 +28,8 @@ from typing_extensions import Protocol
 from twisted.internet import defer
 
 from synapse.logging.context import make_deferred_yieldable, preserve_fn
-from synapse.util import unwrapFirstError
+from synapse.metrics.background_process_metrics import run_as_background_process
+from synapse.util import Clock, unwrapFirstError
 from synapse.util.async_helpers import ObservableDeferred
 from synapse.util.caches import get_cache_factor_for
 from synapse.util.caches.lrucache import LruCache
@@ -86,19 +87,48 @@ class Cache(object):
         "keylen",
         "thread",
         "metrics",
+        "expiry_ms",
+        "_clock",
         "_pending_deferred_cache",
     )
 
-    def __init__(self, name, max_entries=1000, keylen=1, tree=False, iterable=False):
+    def __init__(
+        self,
+        name,
+        max_entries=1000,
+        keylen=1,
+        tree=False,
+        iterable=False,
+        expiry_ms=0,
+        clock=None,
+    ):
+        """
+        Args:
+            name (str): The name of the cache, used for metrics
+            max_entries (int): The maximum number of entries (or, if iterable
+                is set, the maximum total size of the entries)
+            keylen (int): The length of the keys
+            tree (bool): Use a TreeCache, allowing `invalidate_many`
+            iterable (bool): The size of each entry is its length
+            expiry_ms (int): If non-zero, entries which have not been accessed
+                for this many milliseconds are periodically removed from the
+                cache.
+            clock (Clock|None): The clock to use for expiry. Required if
+                expiry_ms is set.
+        """
         cache_type = TreeCache if tree else dict
         self._pending_deferred_cache = cache_type()
 
+        self.expiry_ms = expiry_ms
+        self._clock = clock
+
         self.cache = LruCache(
             max_size=max_entries,
             keylen=keylen,
             cache_type=cache_type,
             size_callback=(lambda d: len(d)) if iterable else None,
             evicted_callback=self._on_evicted,
+            clock=clock if expiry_ms else None,
         )
 
         self.name = name
@@ -111,9 +141,33 @@ class Cache(object):
             collect_callback=self._metrics_collection_callback,
         )
 
+        if not expiry_ms:
+            # Don't bother starting the loop if things never expire
+            return
+
+        def f():
+            return run_as_background_process(
+                "prune_cache_%s" % (self.name,), self._prune_idle_entries
+            )
+
+        clock.looping_call(f, expiry_ms / 2)
+
     def _on_evicted(self, evicted_count):
         self.metrics.inc_evictions(evicted_count)
 
+    def _prune_idle_entries(self):
+        """Removes any entries which have not been accessed for `expiry_ms`.
+        """
+        cutoff = self._clock.time_msec() - self.expiry_ms
+        count = self.cache.evict_idle(cutoff)
+
+        logger.debug(
+            "[%s] pruned %d idle entries, %d remaining",
+            self.name,
+            count,
+            len(self.cache),
+        )
+
     def _metrics_collection_callback(self):
         cache_pending_metric.labels(self.name).set(len(self._pending_deferred_cache))
 
@@ -350,6 +404,11 @@ class CacheDescriptor(_CacheDescriptorBase):
         num_args (int): number of positional arguments (excluding ``self`` and
             ``cache_context``) to use as cache keys. Defaults to all named
             args of the function.
+        expiry_ms (int): if non-zero, entries which have not been accessed for
+            this many milliseconds are periodically removed from the cache,
+            so that the cache shrinks again after a spike in traffic. The
+            clock used is the `_clock` attribute of the object the method is
+            bound to (if it has one), or else the real reactor.
     """
 
     def __init__(
@@ -361,6 +420,7 @@ class CacheDescriptor(_CacheDescriptorBase):
         inlineCallbacks=False,
         cache_context=False,
         iterable=False,
+        expiry_ms=0,
     ):
 
         super(CacheDescriptor, self).__init__(
@@ -375,14 +435,25 @@ class CacheDescriptor(_CacheDescriptorBase):
         self.max_entries = max_entries
         self.tree = tree
         self.iterable = iterable
+        self.expiry_ms = expiry_ms
 
     def __get__(self, obj, objtype=None):
+        clock = None
+        if self.expiry_ms:
+            clock = getattr(obj, "_clock", None)
+            if clock is None:
+                from twisted.internet import reactor
+
+                clock = Clock(reactor)
+
         cache = Cache(
             name=self.orig.__name__,
             max_entries=self.max_entries,
             keylen=self.num_args,
             tree=self.tree,
             iterable=self.iterable,
+            expiry_ms=self.expiry_ms,
+            clock=clock,
         )
 
         def get_cache_key_gen(args, kwargs):
@@ -661,7 +732,12 @@ class _CacheContext:
 
 
 def cached(
-    max_entries=1000, num_args=None, tree=False, cache_context=False, iterable=False
+    max_entries=1000,
+    num_args=None,
+    tree=False,
+    cache_context=False,
+    iterable=False,
+    expiry_ms=0,
 ):
     return lambda orig: CacheDescriptor(
         orig,
@@ -670,11 +746,17 @@ def cached(
         tree=tree,
         cache_context=cache_context,
         iterable=iterable,
+        expiry_ms=expiry_ms,
     )
 
 
 def cachedInlineCallbacks(
-    max_entries=1000, num_args=None, tree=False, cache_context=False, iterable=False
+    max_entries=1000,
+    num_args=None,
+    tree=False,
+    cache_context=False,
+    iterable=False,
+    expiry_ms=0,
 ):
     return lambda orig: CacheDescriptor(
         orig,
@@ -684,6 +766,7 @@ def cachedInlineCallbacks(
         inlineCallbacks=True,
         cache_context=cache_context,
         iterable=iterable,
+        expiry_ms=expiry_ms,
     )
 
 
@@ -696,6 +779,9 @@ def cachedList(cached_method_name, list_name, num_args=None, inlineCallbacks=Fal
     get passed to the original function, the result of which is stored in the
     cache.
 
+    As the entries are stored in the original cache, they are subject to its
+    size limit and `expiry_ms`.
+
     Args:
         cached_method_name (str): The name of the single-item lookup method.
             This is only used to find the cache to use.
@@ -43,10 +43,15 @@ class DictionaryEntry(namedtuple("DictionaryEntry", ("full", "known_absent", "va
 class DictionaryCache(object):
     """Caches key -> dictionary lookups, supporting caching partial dicts, i.e.
     fetching a subset of dictionary keys for a particular key.
+
+    The dictionaries are stored as `value_type`, which must be a mutable
+    mapping that can be constructed from a mapping. Values returned by `get`
+    are always plain dicts.
     """
 
-    def __init__(self, name, max_entries=1000):
+    def __init__(self, name, max_entries=1000, value_type=dict):
         self.cache = LruCache(max_size=max_entries, size_callback=len)
+        self._value_type = value_type
 
         self.name = name
         self.sequence = 0
@@ -86,7 +91,7 @@ class DictionaryCache(object):
 
             if dict_keys is None:
                 return DictionaryEntry(
-                    entry.full, entry.known_absent, dict(entry.value)
+                    entry.full, entry.known_absent, dict(entry.value.items())
                 )
             else:
                 return DictionaryEntry(
@@ -134,14 +139,47 @@ class DictionaryCache(object):
             else:
                 self._update_or_insert(key, value, fetched_keys)
 
+    def update_from(self, sequence, key, base_key, delta):
+        """Updates the entry in the cache to be the complete value of another
+        entry plus some changes, if that entry is complete.
+
+        If the value type supports it (e.g. CompactStateMap), the new value
+        shares the unchanged entries with the other value.
+
+        Args:
+            sequence
+            key (K)
+            base_key (K): the key of the entry to base the new value on
+            delta (dict[X,Y]): the entries which are added or replaced in the
+                value for `base_key`.
+
+        Returns:
+            bool: whether the cache was updated. It won't be if there is no
+            complete entry for `base_key`, or the sequence number has changed.
+        """
+        self.check_thread()
+        if self.sequence != sequence:
+            return False
+
+        base_entry = self.cache.get(base_key, self.sentinel)
+        if base_entry is self.sentinel or not base_entry.full:
+            return False
+
+        value = self._value_type(base_entry.value)
+        value.update(delta)
+        self._insert(key, value, set())
+        return True
+
     def _update_or_insert(self, key, value, known_absent):
         # We pop and reinsert as we need to tell the cache the size may have
         # changed
 
-        entry = self.cache.pop(key, DictionaryEntry(False, set(), {}))
+        entry = self.cache.pop(key, DictionaryEntry(False, set(), self._value_type()))
         entry.value.update(value)
         entry.known_absent.update(known_absent)
         self.cache[key] = entry
 
     def _insert(self, key, value, known_absent):
+        if not isinstance(value, self._value_type):
+            value = self._value_type(value)
         self.cache[key] = DictionaryEntry(True, known_absent, value)
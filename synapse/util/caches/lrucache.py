@@ -14,11 +14,18 @@
 # limitations under the License.
 
 
+import itertools
 import threading
 from functools import wraps
 
+from synapse.util.caches.memory import estimate_size
 from synapse.util.caches.treecache import TreeCache
 
+# A global counter used to stamp entries with the order in which they were last
+# accessed, so that a `CacheMemoryBudget` can compare the age of entries in
+# different caches.
+_access_counter = itertools.count()
+
 
 def enumerate_leaves(node, depth):
     if depth == 0:
@@ -30,7 +37,16 @@ def enumerate_leaves(node, depth):
 
 
 class _Node(object):
-    __slots__ = ["prev_node", "next_node", "key", "value", "callbacks"]
+    __slots__ = [
+        "prev_node",
+        "next_node",
+        "key",
+        "value",
+        "callbacks",
+        "memory_size",
+        "last_access",
+        "access_time_ms",
+    ]
 
     def __init__(self, prev_node, next_node, key, value, callbacks=set()):
         self.prev_node = prev_node
@@ -38,6 +54,9 @@ class _Node(object):
         self.key = key
         self.value = value
         self.callbacks = callbacks
+        self.memory_size = 0
+        self.last_access = 0
+        self.access_time_ms = 0
 
 
 class LruCache(object):
@@ -48,6 +67,11 @@ class LruCache(object):
 
     Can also set callbacks on objects when getting/setting which are fired
     when that key gets invalidated/evicted.
+
+    If attached to a `CacheMemoryBudget` (see `set_memory_budget`), the cache
+    also estimates the size in bytes of each entry, and the budget may evict
+    entries from it when the total memory used by all the tracked caches is too
+    high.
     """
 
     def __init__(
@@ -57,6 +81,7 @@ class LruCache(object):
         cache_type=dict,
         size_callback=None,
         evicted_callback=None,
+        clock=None,
     ):
         """
         Args:
@@ -73,6 +98,11 @@ class LruCache(object):
             evicted_callback (func(int)|None):
                 if not None, called on eviction with the size of the evicted
                 entry
+
+            clock (Clock|None):
+                if not None, the time at which each entry was last accessed is
+                recorded, so that idle entries can be removed with
+                `evict_idle`.
         """
         cache = cache_type()
         self.cache = cache  # Used for introspection.
@@ -82,6 +112,10 @@ class LruCache(object):
 
         lock = threading.Lock()
 
+        # the CacheMemoryBudget this cache is attached to, if any
+        memory_budget = [None]
+        cached_memory_size = [0]
+
         def evict():
             while cache_len() > max_size:
                 todelete = list_root.prev_node
@@ -90,6 +124,14 @@ class LruCache(object):
                 if evicted_callback:
                     evicted_callback(evicted_len)
 
+        def adjust_memory_size(node, new_size):
+            delta = new_size - node.memory_size
+            node.memory_size = new_size
+            cached_memory_size[0] += delta
+            budget = memory_budget[0]
+            if budget is not None:
+                budget.adjust(delta)
+
         def synchronized(f):
             @wraps(f)
             def inner(*args, **kwargs):
@@ -122,6 +164,13 @@ class LruCache(object):
             if size_callback:
                 cached_cache_len[0] += size_callback(node.value)
 
+            if memory_budget[0] is not None:
+                node.last_access = next(_access_counter)
+                adjust_memory_size(node, estimate_size(key) + estimate_size(value))
+
+            if clock is not None:
+                node.access_time_ms = clock.time_msec()
+
         def move_node_to_front(node):
             prev_node = node.prev_node
             next_node = node.next_node
@@ -134,6 +183,12 @@ class LruCache(object):
             prev_node.next_node = node
             next_node.prev_node = node
 
+            if memory_budget[0] is not None:
+                node.last_access = next(_access_counter)
+
+            if clock is not None:
+                node.access_time_ms = clock.time_msec()
+
         def delete_node(node):
             prev_node = node.prev_node
             next_node = node.next_node
@@ -145,6 +200,9 @@ class LruCache(object):
                 deleted_len = size_callback(node.value)
                 cached_cache_len[0] -= deleted_len
 
+            if node.memory_size:
+                adjust_memory_size(node, 0)
+
             for cb in node.callbacks:
                 cb()
             node.callbacks.clear()
@@ -184,6 +242,9 @@ class LruCache(object):
 
                 move_node_to_front(node)
                 node.value = value
+
+                if memory_budget[0] is not None:
+                    adjust_memory_size(node, estimate_size(key) + estimate_size(value))
             else:
                 add_node(key, value, set(callbacks))
 
@@ -231,20 +292,114 @@ class LruCache(object):
             if size_callback:
                 cached_cache_len[0] = 0
 
+            budget = memory_budget[0]
+            if budget is not None:
+                budget.adjust(-cached_memory_size[0])
+            cached_memory_size[0] = 0
+
         @synchronized
         def cache_contains(key):
             return key in cache
 
+        @synchronized
+        def cache_oldest_access():
+            if list_root.prev_node is list_root:
+                return None
+            return list_root.prev_node.last_access
+
+        @synchronized
+        def cache_evict_oldest():
+            todelete = list_root.prev_node
+            if todelete is list_root:
+                return 0
+
+            freed = todelete.memory_size
+            evicted_len = delete_node(todelete)
+            cache.pop(todelete.key, None)
+            if evicted_callback:
+                evicted_callback(evicted_len)
+            return freed
+
+        @synchronized
+        def cache_evict_idle(cutoff_ms):
+            """Evicts all entries which were last accessed before `cutoff_ms`.
+
+            Only works if constructed with a clock.
+
+            Returns:
+                int: the number of entries evicted
+            """
+            count = 0
+            todelete = list_root.prev_node
+            while todelete is not list_root and todelete.access_time_ms < cutoff_ms:
+                prev_node = todelete.prev_node
+                evicted_len = delete_node(todelete)
+                cache.pop(todelete.key, None)
+                if evicted_callback:
+                    evicted_callback(evicted_len)
+                count += 1
+                todelete = prev_node
+            return count
+
+        @synchronized
+        def cache_memory_usage():
+            return cached_memory_size[0]
+
+        @synchronized
+        def cache_set_memory_budget(budget):
+            """Attach this cache to a CacheMemoryBudget, or detach it if
+            `budget` is None.
+            """
+            old_budget = memory_budget[0]
+            if old_budget is not None:
+                old_budget.adjust(-cached_memory_size[0])
+
+            memory_budget[0] = budget
+
+            # (re)calculate the size of any existing entries
+            cached_memory_size[0] = 0
+            node = list_root.next_node
+            while node is not list_root:
+                node.memory_size = 0
+                if budget is not None:
+                    node.last_access = next(_access_counter)
+                    adjust_memory_size(
+                        node, estimate_size(node.key) + estimate_size(node.value)
+                    )
+                node = node.next_node
+
+        def enforce_memory_budget(f):
+            """Wraps a function which may add entries to the cache, so that
+            the memory budget is checked once the cache lock is released.
+            """
+
+            @wraps(f)
+            def inner(*args, **kwargs):
+                try:
+                    return f(*args, **kwargs)
+                finally:
+                    budget = memory_budget[0]
+                    if budget is not None:
+                        budget.maybe_evict()
+
+            return inner
+
         self.sentinel = object()
         self.get = cache_get
-        self.set = cache_set
-        self.setdefault = cache_set_default
+        self.set = enforce_memory_budget(cache_set)
+        self.setdefault = enforce_memory_budget(cache_set_default)
         self.pop = cache_pop
         if cache_type is TreeCache:
             self.del_multi = cache_del_multi
         self.len = synchronized(cache_len)
         self.contains = cache_contains
         self.clear = cache_clear
+        self.oldest_access = cache_oldest_access
+        self.evict_oldest = cache_evict_oldest
+        if clock is not None:
+            self.evict_idle = cache_evict_idle
+        self.memory_usage = cache_memory_usage
+        self.set_memory_budget = cache_set_memory_budget
 
     def __getitem__(self, key):
         result = self.get(key, self.sentinel)
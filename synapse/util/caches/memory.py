@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Approximate memory accounting for the in-memory caches.
+
+Caches which opt into memory tracking estimate the size in bytes of each entry
+as it is inserted, and report the running total to a shared `CacheMemoryBudget`.
+When the combined usage of all tracked caches exceeds the budget, the budget
+evicts the least recently used entries across *all* tracked caches until usage
+drops back below the limit.
+"""
+
+import logging
+import sys
+import threading
+from collections.abc import Mapping
+
+logger = logging.getLogger(__name__)
+
+# Types whose size is fully accounted for by `sys.getsizeof`.
+_ATOMIC_TYPES = (str, bytes, bytearray, int, float, bool, type(None))
+
+
+def estimate_size(obj, max_objects=10000):
+    """Estimates the number of bytes of memory used by an object.
+
+    This walks the object graph reachable from `obj` (following container
+    members, `__dict__` and `__slots__`) and sums `sys.getsizeof` for every
+    distinct object found. Classes whose `__sizeof__` covers their contents
+    can set `SIZEOF_INCLUDES_CONTENTS = True` to stop the walk there. Objects
+    shared with other cache entries (such as interned strings) will be counted
+    once per entry, so the result is an over-estimate rather than an exact
+    figure.
+
+    Args:
+        obj: the object to measure
+        max_objects (int): stop walking the object graph after visiting this
+            many objects, so that estimating a pathologically large entry does
+            not block the reactor.
+
+    Returns:
+        int: the approximate size in bytes
+    """
+    seen = set()
+    to_visit = [obj]
+    size = 0
+
+    while to_visit and len(seen) < max_objects:
+        o = to_visit.pop()
+        if id(o) in seen:
+            continue
+        seen.add(id(o))
+
+        try:
+            size += sys.getsizeof(o)
+        except TypeError:
+            continue
+
+        if isinstance(o, _ATOMIC_TYPES):
+            continue
+
+        if getattr(type(o), "SIZEOF_INCLUDES_CONTENTS", False):
+            # the object's `__sizeof__` already accounts for its contents
+            continue
+
+        if isinstance(o, Mapping):
+            for k, v in o.items():
+                to_visit.append(k)
+                to_visit.append(v)
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            to_visit.extend(o)
+        elif isinstance(o, type):
+            # don't walk into classes (and thence modules)
+            continue
+        else:
+            d = getattr(o, "__dict__", None)
+            if d is not None:
+                to_visit.append(d)
+            for slot in getattr(type(o), "__slots__", ()):
+                v = getattr(o, slot, None)
+                if v is not None:
+                    to_visit.append(v)
+
+    return size
+
+
+def parse_memory_size(value):
+    """Parses a memory size such as "512M" or "2G" into a number of bytes.
+
+    Args:
+        value (str|int|None): the size. Strings may have a suffix of K, M or G.
+
+    Returns:
+        int: the size in bytes, or 0 if `value` is empty.
+    """
+    if not value:
+        return 0
+    if isinstance(value, int):
+        return value
+
+    value = value.strip()
+    sizes = {"K": 1024, "M": 1024 * 1024, "G": 1024 * 1024 * 1024}
+    multiplier = sizes.get(value[-1].upper())
+    if multiplier:
+        return int(float(value[:-1]) * multiplier)
+    return int(value)
+
+
+class CacheMemoryBudget(object):
+    """Tracks the estimated memory used by a set of caches, and evicts entries
+    across all of them when the total exceeds a fixed limit.
+
+    Caches are attached with `track`, and must provide:
+
+        * `memory_usage()`: returns the estimated bytes used by the cache.
+        * `oldest_access()`: returns a monotonically increasing access stamp
+          for the least recently used entry, or None if the cache is empty.
+        * `evict_oldest()`: evicts the least recently used entry, returning
+          the number of bytes freed.
+    """
+
+    def __init__(self, max_bytes):
+        """
+        Args:
+            max_bytes (int): the limit on the total estimated size of all the
+                tracked caches
+        """
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.evicted_bytes = 0
+        self._caches = {}
+        self._evict_lock = threading.Lock()
+
+    def track(self, name, cache):
+        """Starts tracking the memory used by a cache.
+
+        If a cache is already tracked under the given name, it is replaced.
+        (This usually happens during tests, as at runtime caches are
+        effectively singletons.)
+
+        Args:
+            name (str): the name of the cache
+            cache (LruCache): the cache to track
+        """
+        existing = self._caches.get(name)
+        if existing is not None and existing is not cache:
+            # detaching the old cache removes its entries from our total
+            existing.set_memory_budget(None)
+
+        self._caches[name] = cache
+        cache.set_memory_budget(self)
+
+    def adjust(self, delta):
+        """Called by a tracked cache when its memory usage changes.
+
+        Args:
+            delta (int): the change in bytes
+        """
+        # This is deliberately not locked: the total is only approximate
+        # anyway, and the caches are almost exclusively mutated from the
+        # reactor thread.
+        self.total_bytes += delta
+
+    def maybe_evict(self):
+        """Evicts entries from the tracked caches, least recently used first,
+        until the total usage is within the budget.
+        """
+        if self.total_bytes <= self.max_bytes:
+            return
+
+        # If another thread is already evicting, leave it to get on with it
+        # rather than blocking.
+        if not self._evict_lock.acquire(False):
+            return
+
+        try:
+            while self.total_bytes > self.max_bytes:
+                oldest_cache = None
+                oldest_stamp = None
+                for cache in self._caches.values():
+                    stamp = cache.oldest_access()
+                    if stamp is None:
+                        continue
+                    if oldest_stamp is None or stamp < oldest_stamp:
+                        oldest_cache = cache
+                        oldest_stamp = stamp
+
+                if oldest_cache is None:
+                    # Nothing left to evict; the total must have drifted.
+                    logger.warning(
+                        "Cache memory usage of %d bytes exceeds budget of %d "
+                        "bytes, but no entries are left to evict",
+                        self.total_bytes,
+                        self.max_bytes,
+                    )
+                    self.total_bytes = 0
+                    break
+
+                self.evicted_bytes += oldest_cache.evict_oldest()
+        finally:
+            self._evict_lock.release()
@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import fcntl
+import logging
+import mmap
+import os
+import struct
+import threading
+import zlib
+from contextlib import contextmanager
+from typing import Optional
+
+from synapse.util.caches import register_cache
+
+logger = logging.getLogger(__name__)
+
+# The file starts with a header giving the layout of the slots, so that
+# processes configured differently don't misread each other's entries.
+_FILE_MAGIC = b"SYNMMC02"
+_FILE_HEADER = struct.Struct("!8sQI")
+_FILE_HEADER_SIZE = 64
+
+# The file header is followed by the generation counter, which is incremented
+# by every invalidation.
+_GENERATION = struct.Struct("!Q")
+_GENERATION_OFFSET = 24
+
+# Each slot starts with the generation at which anything in it was last
+# invalidated, then the length of its payload (zero for an empty slot) and a
+# checksum of the payload. The payload is the length of the key, the key and
+# then the value.
+_SLOT_GENERATION = struct.Struct("!Q")
+_SLOT_HEADER = struct.Struct("!II")
+_SLOT_HEADER_OFFSET = _SLOT_GENERATION.size
+_SLOT_OVERHEAD = _SLOT_HEADER_OFFSET + _SLOT_HEADER.size
+_KEY_LENGTH = struct.Struct("!H")
+
+
+class SharedMmapCache(object):
+    """A cache of byte strings keyed by string, held in a memory-mapped file so
+    that it can be shared between the processes on a host.
+
+    The file is split into fixed-size slots, and each key can only live in the
+    slot given by its hash: storing a key overwrites whatever was in its slot,
+    and values which don't fit in a slot are not cached.
+
+    Readers don't take any locks. Instead each entry has a checksum, and
+    entries which are found to be torn by concurrent writes are treated as
+    missing. Writers lock the slot they are changing.
+
+    As with any cache, callers must invalidate entries when the underlying
+    data changes, in every process that uses the file. To stop a process
+    which read the data before it changed from filling the cache after another
+    process has invalidated it, writers can pass the `generation` they saw
+    before reading the data to `set`, which refuses to fill slots that have
+    been invalidated since.
+
+    The file is emptied when it is opened by a process and no other process is
+    using it, so entries never outlive the processes that could have
+    invalidated them. It is best placed on a tmpfs such as /dev/shm.
+    """
+
+    def __init__(self, cache_name: str, path: str, size: int, slot_size: int = 4096):
+        """
+        Args:
+            cache_name: name of the cache, for metrics
+            path: path of the file to share the cache through
+            size: the size of the file, in bytes
+            slot_size: the size of each entry, in bytes. Values must fit in a
+                slot, along with their key and a small header.
+        """
+        if slot_size <= _SLOT_OVERHEAD + _KEY_LENGTH.size:
+            raise ValueError("slot_size of %d is too small" % (slot_size,))
+
+        self._slot_size = slot_size
+        self._slot_count = (size - _FILE_HEADER_SIZE) // slot_size
+        if self._slot_count < 1:
+            raise ValueError("size of %d is too small for any entries" % (size,))
+
+        self._file_size = _FILE_HEADER_SIZE + self._slot_count * slot_size
+
+        # The locks we take on the file don't exclude other threads in this
+        # process, so we need our own lock too.
+        self._lock = threading.Lock()
+
+        # We hold a shared lock on the file for as long as it is open, so that
+        # a process opening it can tell whether anyone else is using it.
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            self._mmap = self._open_file()
+        except Exception:
+            os.close(self._fd)
+            raise
+
+        self._metrics = register_cache("mmap", cache_name, self)
+
+    def _open_file(self) -> mmap.mmap:
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            # Someone else is using the file, so it must already be set up.
+            fcntl.flock(self._fd, fcntl.LOCK_SH)
+        else:
+            # Nobody else has the file mapped, so we can safely resize it and
+            # throw away anything left over from earlier processes.
+            os.ftruncate(self._fd, 0)
+            os.ftruncate(self._fd, self._file_size)
+            header = _FILE_HEADER.pack(_FILE_MAGIC, self._slot_count, self._slot_size)
+            os.pwrite(self._fd, header, 0)
+            fcntl.flock(self._fd, fcntl.LOCK_SH)
+
+        header = os.pread(self._fd, _FILE_HEADER.size, 0)
+        if len(header) != _FILE_HEADER.size or _FILE_HEADER.unpack(header) != (
+            _FILE_MAGIC,
+            self._slot_count,
+            self._slot_size,
+        ):
+            raise ValueError(
+                "Shared cache file is in use with a different size or slot size"
+            )
+
+        return mmap.mmap(self._fd, self._file_size)
+
+    def _slot_offset(self, key_bytes: bytes) -> int:
+        # this needs to be the same in every process, so we can't use `hash`.
+        slot = zlib.crc32(key_bytes) % self._slot_count
+        return _FILE_HEADER_SIZE + slot * self._slot_size
+
+    @contextmanager
+    def _locked(self, offset: int, length: int):
+        """Locks a range of the file against writes by other threads and
+        processes.
+        """
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, length, offset)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, length, offset)
+
+    def _read_slot(self, offset: int) -> Optional[bytes]:
+        """Returns the payload in the slot at the given offset, or None if it
+        is empty or torn.
+        """
+        length, checksum = _SLOT_HEADER.unpack_from(
+            self._mmap, offset + _SLOT_HEADER_OFFSET
+        )
+        if not length or length > self._slot_size - _SLOT_OVERHEAD:
+            return None
+
+        start = offset + _SLOT_OVERHEAD
+        payload = self._mmap[start : start + length]
+        if zlib.crc32(payload) != checksum:
+            return None
+
+        return payload
+
+    def generation(self) -> int:
+        """Get the current generation of the cache, which increases with every
+        invalidation in any process.
+
+        Callers should get this before reading the data they are going to
+        cache, and pass it to `set`.
+        """
+        with self._locked(_GENERATION_OFFSET, _GENERATION.size):
+            (generation,) = _GENERATION.unpack_from(self._mmap, _GENERATION_OFFSET)
+        return generation
+
+    def _next_generation(self) -> int:
+        with self._locked(_GENERATION_OFFSET, _GENERATION.size):
+            (generation,) = _GENERATION.unpack_from(self._mmap, _GENERATION_OFFSET)
+            generation += 1
+            _GENERATION.pack_into(self._mmap, _GENERATION_OFFSET, generation)
+        return generation
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Look up a value in the cache
+
+        Args:
+            key: key to look up
+
+        Returns:
+            the value, or None if it isn't in the cache
+        """
+        key_bytes = key.encode("utf-8")
+        payload = self._read_slot(self._slot_offset(key_bytes))
+
+        if payload is not None:
+            (key_length,) = _KEY_LENGTH.unpack_from(payload)
+            key_end = _KEY_LENGTH.size + key_length
+            if payload[_KEY_LENGTH.size : key_end] == key_bytes:
+                self._metrics.inc_hits()
+                return payload[key_end:]
+
+        self._metrics.inc_misses()
+        return None
+
+    def set(self, key: str, value: bytes, generation: Optional[int] = None) -> bool:
+        """Add or replace an entry in the cache
+
+        Args:
+            key: key for this entry
+            value: value for this entry
+            generation: the result of `generation` from before the value was
+                read. If given, the entry is not stored if its slot has been
+                invalidated since, as the value may be out of date.
+
+        Returns:
+            whether the entry was stored. Entries too large for a slot are not.
+        """
+        key_bytes = key.encode("utf-8")
+        payload = _KEY_LENGTH.pack(len(key_bytes)) + key_bytes + value
+        if len(payload) > self._slot_size - _SLOT_OVERHEAD:
+            return False
+
+        offset = self._slot_offset(key_bytes)
+        header = offset + _SLOT_HEADER_OFFSET
+        start = offset + _SLOT_OVERHEAD
+
+        with self._locked(offset, self._slot_size):
+            if generation is not None:
+                (invalidated_at,) = _SLOT_GENERATION.unpack_from(self._mmap, offset)
+                if invalidated_at > generation:
+                    return False
+
+            # Mark the slot empty while we fill it in, so that readers don't see
+            # a valid header over a partially written payload.
+            self._mmap[header:start] = _SLOT_HEADER.pack(0, 0)
+            self._mmap[start : start + len(payload)] = payload
+            self._mmap[header:start] = _SLOT_HEADER.pack(
+                len(payload), zlib.crc32(payload)
+            )
+        return True
+
+    def invalidate(self, key: str):
+        """Remove an entry from the cache, if it is there
+
+        Args:
+            key: key of the entry to remove
+        """
+        key_bytes = key.encode("utf-8")
+        offset = self._slot_offset(key_bytes)
+        header = offset + _SLOT_HEADER_OFFSET
+        generation = self._next_generation()
+
+        with self._locked(offset, self._slot_size):
+            # Record the invalidation against the slot, even if the key isn't
+            # in it, so that anyone who read the old value can't store it.
+            _SLOT_GENERATION.pack_into(self._mmap, offset, generation)
+
+            # Only clear the slot if it holds this key, to avoid evicting other
+            # entries. Clearing a torn slot is harmless.
+            payload = self._read_slot(offset)
+            if payload is not None:
+                (key_length,) = _KEY_LENGTH.unpack_from(payload)
+                key_end = _KEY_LENGTH.size + key_length
+                if payload[_KEY_LENGTH.size : key_end] != key_bytes:
+                    return
+
+            self._mmap[header : header + _SLOT_HEADER.size] = _SLOT_HEADER.pack(0, 0)
+
+    def invalidate_all(self):
+        """Remove all entries from the cache, in every process"""
+        generation = self._next_generation()
+        empty = _SLOT_HEADER.pack(0, 0)
+
+        with self._locked(_FILE_HEADER_SIZE, self._slot_count * self._slot_size):
+            for slot in range(self._slot_count):
+                offset = _FILE_HEADER_SIZE + slot * self._slot_size
+                header = offset + _SLOT_HEADER_OFFSET
+                _SLOT_GENERATION.pack_into(self._mmap, offset, generation)
+                self._mmap[header : header + _SLOT_HEADER.size] = empty
+
+    def close(self):
+        """Unmap the file and release our lock on it"""
+        self._mmap.close()
+        os.close(self._fd)
+
+    def __len__(self):
+        # This counts torn entries too, but checking every checksum would be
+        # too slow to do for each metrics collection.
+        count = 0
+        for slot in range(self._slot_count):
+            offset = _FILE_HEADER_SIZE + slot * self._slot_size
+            length, _ = _SLOT_HEADER.unpack_from(
+                self._mmap, offset + _SLOT_HEADER_OFFSET
+            )
+            if length:
+                count += 1
+        return count
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+from collections.abc import Mapping
+
+from synapse.util.caches import intern_string
+
+# The maximum number of maps that can be stacked on top of each other before we
+# copy the state into a new map, to bound the cost of lookups.
+MAX_STATE_MAP_DEPTH = 16
+
+
+class CompactStateMap(Mapping):
+    """A compact, read-mostly map from (type, state_key) to event_id, for
+    holding state in caches.
+
+    Rather than a dict keyed by tuples, the state is held as a dict from type
+    to a dict from state_key to event_id, and all of the strings are interned
+    so that they are shared with every other map holding the same state.
+
+    A map can also be built on top of another map (usually the state of the
+    previous state group), in which case it only holds its own entries and
+    looks everything else up in the base map. Entries can be added or
+    replaced with `update`, but never removed, and updates only ever touch
+    the map's own entries, so a base map is never changed through the maps
+    built on it.
+    """
+
+    __slots__ = ["_base", "_state", "_len", "_depth"]
+
+    # `__sizeof__` includes our own entries, so `estimate_size` shouldn't walk
+    # into the (shared) contents.
+    SIZEOF_INCLUDES_CONTENTS = True
+
+    def __init__(self, state=(), base=None):
+        """
+        Args:
+            state (Mapping[Tuple[str, str], str]|Iterable): the initial
+                entries, in any form accepted by `dict`. If this is a
+                CompactStateMap, and `base` is not given, the new map is built
+                on top of it rather than copying it.
+            base (CompactStateMap|None): the map to build this map on.
+        """
+        if base is None and isinstance(state, CompactStateMap):
+            base, state = state, ()
+
+        if base is not None and base._depth >= MAX_STATE_MAP_DEPTH:
+            # Start again with a flat copy of the base, so that lookups don't
+            # have to go through too many maps.
+            flattened = CompactStateMap()
+            flattened.update(base)
+            base = flattened
+
+        self._base = base
+        self._state = {}
+        self._len = len(base) if base is not None else 0
+        self._depth = base._depth + 1 if base is not None else 0
+
+        self.update(state)
+
+    def update(self, other=()):
+        """Adds or replaces entries in the map.
+
+        Args:
+            other (Mapping[Tuple[str, str], str]|Iterable): the entries to
+                add, as a mapping or an iterable of (key, value) pairs.
+        """
+        if isinstance(other, Mapping):
+            other = other.items()
+
+        for (typ, state_key), event_id in other:
+            existing = self.get((typ, state_key))
+            if existing == event_id:
+                # Avoid copying entries from the base map.
+                continue
+
+            if existing is None:
+                self._len += 1
+
+            state_keys = self._state.get(typ)
+            if state_keys is None:
+                state_keys = self._state[intern_string(typ)] = {}
+            state_keys[intern_string(state_key)] = intern_string(event_id)
+
+    def _layers(self):
+        """Yields this map's own state, then that of each map it is built on."""
+        state_map = self
+        while state_map is not None:
+            yield state_map._state
+            state_map = state_map._base
+
+    def _flatten(self):
+        """Returns the whole state as a dict from type to state_key to event_id.
+        """
+        result = {}
+        for layer in reversed(list(self._layers())):
+            for typ, state_keys in layer.items():
+                result.setdefault(typ, {}).update(state_keys)
+        return result
+
+    def __getitem__(self, key):
+        typ, state_key = key
+        for layer in self._layers():
+            state_keys = layer.get(typ)
+            if state_keys is not None and state_key in state_keys:
+                return state_keys[state_key]
+        raise KeyError(key)
+
+    def __iter__(self):
+        for typ, state_keys in self._flatten().items():
+            for state_key in state_keys:
+                yield (typ, state_key)
+
+    def __len__(self):
+        return self._len
+
+    def items(self):
+        return [
+            ((typ, state_key), event_id)
+            for typ, state_keys in self._flatten().items()
+            for state_key, event_id in state_keys.items()
+        ]
+
+    def __sizeof__(self):
+        # We only count our own entries: the strings are shared through
+        # interning and the base map is shared with other maps.
+        size = object.__sizeof__(self) + sys.getsizeof(self._state)
+        for state_keys in self._state.values():
+            size += sys.getsizeof(state_keys)
+        return size
+
+    def __repr__(self):
+        return "CompactStateMap(%r)" % (dict(self.items()),)
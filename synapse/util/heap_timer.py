@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import heapq
+import itertools
+
+
+class HeapTimer(object):
+    """Stores hashable objects that will be returned after their timers have
+    expired.
+
+    Only the earliest timer of each object is kept: inserting an object with a
+    later time than it already has does nothing, so objects are returned at
+    most once per expiry however often their timers are set. Callers which
+    fetch an object are expected to insert it again if it has later timers
+    which still need to fire.
+
+    Objects are kept in a heap ordered by expiry time, with superseded entries
+    skipped when they are fetched.
+    """
+
+    def __init__(self):
+        # Entries of (then, seq, obj). `seq` breaks ties, so that objects
+        # don't need to be comparable.
+        self._heap = []
+        self._seq = itertools.count()
+
+        # The current expiry time of each object. Entries in the heap which
+        # don't match are stale.
+        self._expiry_times = {}
+
+    def insert(self, now, obj, then):
+        """Inserts object into timer.
+
+        Args:
+            now (int): Current time in msec
+            obj (object): Object to be inserted
+            then (int): When to return the object strictly after.
+        """
+        current = self._expiry_times.get(obj)
+        if current is not None and current <= then:
+            return
+
+        self._expiry_times[obj] = then
+        heapq.heappush(self._heap, (then, next(self._seq), obj))
+
+        # Don't let stale entries build up too much.
+        if len(self._heap) > 2 * len(self._expiry_times) + 100:
+            self._heap = [
+                entry
+                for entry in self._heap
+                if self._expiry_times.get(entry[2]) == entry[0]
+            ]
+            heapq.heapify(self._heap)
+
+    def fetch(self, now):
+        """Fetch any objects that have timed out
+
+        Args:
+            now (ms): Current time in msec
+
+        Returns:
+            list: List of objects that have timed out
+        """
+        ret = []
+        while self._heap and self._heap[0][0] < now:
+            then, _, obj = heapq.heappop(self._heap)
+            if self._expiry_times.get(obj) == then:
+                del self._expiry_times[obj]
+                ret.append(obj)
+
+        return ret
+
+    def __len__(self):
+        return len(self._expiry_times)
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Encoding and decoding of JSON, using the fastest library available.
+
+If orjson is installed, it is used for encoding and decoding; otherwise we use
+the same library as canonicaljson (simplejson on CPython). Either way, the
+output is compact JSON which can contain frozendicts, and tuples (including
+namedtuples) are encoded as arrays.
+
+orjson is stricter than the other libraries (e.g. it rejects integers which
+don't fit in 64 bits, lone surrogates and non-string keys), so anything it
+can't handle is passed on to the fallback library, which gives the same
+results as before. orjson decodes large integers as floats rather than
+rejecting them, so JSON which might contain one is also decoded by the
+fallback library.
+
+This is not suitable for anything which needs canonical JSON, such as events
+which are to be hashed or signed: use `canonicaljson.encode_canonical_json`
+for those.
+"""
+
+import logging
+from typing import Any, Union
+
+from canonicaljson import json
+from frozendict import frozendict
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# To find numbers which might not fit in 64 bits, we map every digit to "0" and
+# everything else to " ", and look for a long run of "0"s. This also finds
+# long runs of digits in strings, which is harmless. It is much quicker than
+# searching with a regular expression.
+_DIGITS_TABLE = bytes(0x30 if 0x30 <= i <= 0x39 else 0x20 for i in range(256))
+_LONG_NUMBER = b"0" * 19
+
+
+def _default(obj):
+    """Converts the objects which the JSON libraries can't encode themselves
+    """
+    if type(obj) is frozendict:
+        # as in synapse.util.frozenutils, avoid copying the dict if we can.
+        return getattr(obj, "_dict", None) or dict(obj)
+    if isinstance(obj, tuple):
+        # namedtuples
+        return list(obj)
+    raise TypeError(
+        "Object of type %s is not JSON serializable" % obj.__class__.__name__
+    )
+
+
+class _FallbackJsonEncoder(object):
+    """Encodes JSON with the library used by canonicaljson."""
+
+    name = json.__name__
+
+    def __init__(self):
+        kwargs = {"separators": (",", ":"), "default": _default}
+        if json.__name__ == "simplejson":
+            # simplejson encodes namedtuples as objects by default.
+            kwargs["namedtuple_as_object"] = False
+        self._encoder = json.JSONEncoder(**kwargs)
+
+    def encode(self, obj: Any) -> str:
+        return self._encoder.encode(obj)
+
+    def encode_bytes(self, obj: Any) -> bytes:
+        return self._encoder.encode(obj).encode("utf-8")
+
+
+class _FallbackJsonDecoder(object):
+    """Decodes JSON with the library used by canonicaljson."""
+
+    name = json.__name__
+
+    def decode(self, s: Union[str, bytes]) -> Any:
+        if isinstance(s, (bytes, bytearray, memoryview)):
+            s = bytes(s).decode("utf-8")
+        return json.loads(s)
+
+
+class _OrjsonEncoder(_FallbackJsonEncoder):
+    name = "orjson"
+
+    def encode(self, obj: Any) -> str:
+        return self.encode_bytes(obj).decode("utf-8")
+
+    def encode_bytes(self, obj: Any) -> bytes:
+        try:
+            return orjson.dumps(obj, default=_default)
+        except TypeError:
+            return super().encode_bytes(obj)
+
+
+class _OrjsonDecoder(_FallbackJsonDecoder):
+    name = "orjson"
+
+    def decode(self, s: Union[str, bytes]) -> Any:
+        s_bytes = s.encode("utf-8", "surrogatepass") if isinstance(s, str) else s
+        if _LONG_NUMBER in bytes(s_bytes).translate(_DIGITS_TABLE):
+            return super().decode(s)
+
+        try:
+            return orjson.loads(s)
+        except ValueError:
+            # orjson.JSONDecodeError is a ValueError. If the fallback can't
+            # decode it either it will raise its own error.
+            return super().decode(s)
+
+
+if orjson is not None:
+    json_encoder = _OrjsonEncoder()
+    json_decoder = _OrjsonDecoder()
+else:
+    json_encoder = _FallbackJsonEncoder()
+    json_decoder = _FallbackJsonDecoder()
+
+logger.debug("Using %s for JSON", json_encoder.name)
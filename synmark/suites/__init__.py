@@ -1,3 +1,25 @@
-from . import logging
+from . import (
+    events,
+    events_eager,
+    json_decode,
+    json_encode_replication,
+    json_encode_sync,
+    logging,
+    presence_timeouts,
+    state_res,
+    state_res_reference,
+)
 
-SUITES = [(logging, 1000), (logging, 10000), (logging, None)]
+SUITES = [
+    (logging, 1000),
+    (logging, 10000),
+    (logging, None),
+    (events_eager, 10000),
+    (events, 10000),
+    (state_res_reference, 50000),
+    (state_res, 50000),
+    (json_decode, 10000),
+    (json_encode_sync, 10000),
+    (json_encode_replication, 10000),
+    (presence_timeouts, 100000),
+]
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks for constructing event objects.
+
+`main` measures constructing events lazily from their JSON, as they are when
+fetched from the database, and then reading the fields used by state
+resolution and auth. The `events_eager` suite measures the same thing, but
+decoding the JSON up front.
+
+Running this module directly also reports the memory used per event by each
+approach::
+
+    python -m synmark.suites.events
+"""
+
+import tracemalloc
+
+from canonicaljson import json
+from pyperf import perf_counter
+
+from synapse.api.room_versions import RoomVersions
+from synapse.events import make_event_from_dict, make_event_from_json
+
+
+def make_event_json(i):
+    """Returns the JSON for a typical membership event, and its header."""
+    event_id = "$event%d:example.com" % (i,)
+    user_id = "@user%d:example.com" % (i,)
+    event = {
+        "event_id": event_id,
+        "type": "m.room.member",
+        "state_key": user_id,
+        "room_id": "!room:example.com",
+        "sender": user_id,
+        "content": {
+            "membership": "join",
+            "displayname": "User %d" % (i,),
+            "avatar_url": "mxc://example.com/abcdefghijklmnopqrstuvwx%d" % (i,),
+        },
+        "prev_events": [["$prev%d:example.com" % (i,), {"sha256": "a" * 43}]],
+        "auth_events": [
+            ["$create:example.com", {"sha256": "b" * 43}],
+            ["$power_levels:example.com", {"sha256": "c" * 43}],
+            ["$join_rules:example.com", {"sha256": "d" * 43}],
+        ],
+        "depth": i,
+        "origin": "example.com",
+        "origin_server_ts": 1500000000000 + i,
+        "hashes": {"sha256": "e" * 43},
+        "signatures": {"example.com": {"ed25519:a_abcd": "f" * 86}},
+        "unsigned": {"age_ts": 1500000000000 + i},
+    }
+    header = {
+        "event_id": event_id,
+        "type": "m.room.member",
+        "state_key": user_id,
+        "room_id": "!room:example.com",
+        "sender": user_id,
+    }
+    return json.dumps(event), header
+
+
+def build_lazy(event_jsons):
+    return [
+        make_event_from_json(event_json, header, RoomVersions.V1)
+        for event_json, header in event_jsons
+    ]
+
+
+def build_eager(event_jsons):
+    return [
+        make_event_from_dict(json.loads(event_json), RoomVersions.V1)
+        for event_json, _ in event_jsons
+    ]
+
+
+def read_headers(events):
+    for event in events:
+        (event.type, event.state_key, event.sender)
+
+
+async def main(reactor, loops):
+    """Benchmark constructing `loops` events lazily and reading their headers."""
+    event_jsons = [make_event_json(i) for i in range(loops)]
+
+    start = perf_counter()
+    read_headers(build_lazy(event_jsons))
+    return perf_counter() - start
+
+
+def _measure(build, count):
+    """Returns the memory used per event (including the JSON which a lazy
+    event keeps a reference to) and the time taken to build each event.
+    """
+    tracemalloc.start()
+    event_jsons = [make_event_json(i) for i in range(count)]
+
+    start = perf_counter()
+    events = build(event_jsons)
+    read_headers(events)
+    elapsed = perf_counter() - start
+
+    del event_jsons
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size / len(events), elapsed * 1e6 / len(events)
+
+
+if __name__ == "__main__":
+    for name, build in (("eager", build_eager), ("lazy", build_lazy)):
+        per_event_bytes, per_event_us = _measure(build, 10000)
+        print(
+            "%-6s %8.0f bytes/event %8.2f us/event (with tracemalloc)"
+            % (name, per_event_bytes, per_event_us)
+        )
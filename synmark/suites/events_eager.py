@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from pyperf import perf_counter
+
+from synmark.suites.events import build_eager, make_event_json, read_headers
+
+
+async def main(reactor, loops):
+    """Benchmark constructing `loops` events eagerly and reading their headers.
+
+    This is the baseline for the `events` suite.
+    """
+    event_jsons = [make_event_json(i) for i in range(loops)]
+
+    start = perf_counter()
+    read_headers(build_eager(event_jsons))
+    return perf_counter() - start
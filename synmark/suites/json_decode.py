@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks for decoding event JSON, as when events are fetched from the
+database.
+
+`main` uses the JSON library picked by `synapse.util.json`. Running this module
+directly compares each of the libraries which are installed::
+
+    python -m synmark.suites.json_decode
+"""
+
+from pyperf import perf_counter
+
+from synapse.util.json import json_decoder
+from synmark.suites.events import make_event_json
+from synmark.suites.json_encode_sync import available_codecs
+
+
+def decode_events(decoder, event_jsons):
+    for event_json, _ in event_jsons:
+        decoder.decode(event_json)
+
+
+async def main(reactor, loops):
+    """Benchmark decoding `loops` events."""
+    event_jsons = [make_event_json(i) for i in range(loops)]
+
+    start = perf_counter()
+    decode_events(json_decoder, event_jsons)
+    return perf_counter() - start
+
+
+if __name__ == "__main__":
+    event_jsons = [make_event_json(i) for i in range(10000)]
+    for _, decoder in available_codecs():
+        start = perf_counter()
+        decode_events(decoder, event_jsons)
+        elapsed = perf_counter() - start
+        print("%-10s %8.2f us/event" % (decoder.name, elapsed * 1e6 / 10000))
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks for encoding replication RDATA lines.
+
+`main` uses the JSON library picked by `synapse.util.json`. Running this module
+directly compares each of the libraries which are installed::
+
+    python -m synmark.suites.json_encode_replication
+"""
+
+from pyperf import perf_counter
+
+from synapse.replication.tcp import commands
+from synapse.replication.tcp.commands import RdataCommand
+from synapse.replication.tcp.streams._base import ReceiptsStreamRow
+from synmark.suites.json_encode_sync import available_codecs
+
+
+def make_commands(count):
+    """Returns `count` RDATA commands for typical receipts."""
+    return [
+        RdataCommand(
+            "receipts",
+            i,
+            ReceiptsStreamRow(
+                room_id="!room%d:example.com" % (i % 100,),
+                receipt_type="m.read",
+                user_id="@user%d:example.com" % (i,),
+                event_id="$event%d:example.com" % (i,),
+                data={"ts": 1500000000000 + i},
+            ),
+        )
+        for i in range(count)
+    ]
+
+
+def encode_commands(rdata_commands):
+    for cmd in rdata_commands:
+        cmd.to_line()
+
+
+async def main(reactor, loops):
+    """Benchmark encoding `loops` RDATA lines."""
+    rdata_commands = make_commands(loops)
+
+    start = perf_counter()
+    encode_commands(rdata_commands)
+    return perf_counter() - start
+
+
+if __name__ == "__main__":
+    rdata_commands = make_commands(10000)
+    for encoder, _ in available_codecs():
+        # the commands use the module's encoder.
+        commands.json_encoder = encoder
+
+        start = perf_counter()
+        encode_commands(rdata_commands)
+        elapsed = perf_counter() - start
+        print("%-10s %8.2f us/line" % (encoder.name, elapsed * 1e6 / 10000))
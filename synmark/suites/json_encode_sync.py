@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks for encoding a /sync response, in the pieces it is streamed to
+the client in.
+
+`main` uses the JSON library picked by `synapse.util.json`. Running this module
+directly compares each of the libraries which are installed::
+
+    python -m synmark.suites.json_encode_sync
+"""
+
+from pyperf import perf_counter
+
+from synapse.http.server import STREAMING_JSON_DEPTH, iterencode_json
+from synapse.util import json as synapse_json
+from synapse.util.json import json_decoder, json_encoder
+from synmark.suites.events import make_event_json
+
+
+def available_codecs():
+    """Returns the (encoder, decoder) pairs for each JSON library which is
+    installed.
+    """
+    codecs = [
+        (synapse_json._FallbackJsonEncoder(), synapse_json._FallbackJsonDecoder())
+    ]
+    if synapse_json.orjson is not None:
+        codecs.append((synapse_json._OrjsonEncoder(), synapse_json._OrjsonDecoder()))
+    return codecs
+
+
+def make_sync_body(event_count):
+    """Returns a /sync response with `event_count` events, ten to a room."""
+    events = [json_decoder.decode(make_event_json(i)[0]) for i in range(event_count)]
+    rooms = {}
+    for i in range(0, event_count, 10):
+        rooms["!room%d:example.com" % (i,)] = {
+            "timeline": {
+                "events": events[i : i + 10],
+                "limited": True,
+                "prev_batch": "s%d_1_2_3" % (i,),
+            },
+            "state": {"events": []},
+            "ephemeral": {"events": []},
+            "account_data": {"events": []},
+            "unread_notifications": {"notification_count": 0},
+        }
+    return {"next_batch": "s1_2_3_4", "rooms": {"join": rooms}}
+
+
+def encode_sync_body(encoder, body):
+    return b"".join(iterencode_json(body, encoder.encode_bytes, STREAMING_JSON_DEPTH))
+
+
+async def main(reactor, loops):
+    """Benchmark encoding a /sync response with `loops` events."""
+    body = make_sync_body(loops)
+
+    start = perf_counter()
+    encode_sync_body(json_encoder, body)
+    return perf_counter() - start
+
+
+if __name__ == "__main__":
+    body = make_sync_body(10000)
+    for encoder, _ in available_codecs():
+        start = perf_counter()
+        encode_sync_body(encoder, body)
+        elapsed = perf_counter() - start
+        print("%-10s %8.2f us/event" % (encoder.name, elapsed * 1e6 / 10000))
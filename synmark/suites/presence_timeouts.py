@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks for the presence timeout handling, simulating ten minutes of a
+server with a given number of online users, each of whom syncs every 30
+seconds or so and is active every few minutes.
+
+`main` uses the timer used by the presence handler. Running this module
+directly compares it with the WheelTimer it replaced, for 100k users::
+
+    python -m synmark.suites.presence_timeouts
+"""
+
+import random
+
+from pyperf import perf_counter
+
+from synapse.api.constants import PresenceState
+from synapse.handlers.presence import (
+    handle_timeouts,
+    handle_update,
+    schedule_timeouts,
+)
+from synapse.storage.presence import UserPresenceState
+from synapse.util.heap_timer import HeapTimer
+from synapse.util.wheel_timer import WheelTimer
+
+# How often the presence handler checks for timeouts.
+TICK_MS = 5000
+
+# How long to simulate.
+DURATION_MS = 10 * 60 * 1000
+
+
+def simulate(timer, num_users, reschedule):
+    """Runs the simulation with the given timer.
+
+    Args:
+        timer (HeapTimer|WheelTimer)
+        num_users (int)
+        reschedule (bool): whether the later timeouts of users which haven't
+            changed need setting again after they are fetched, as they do
+            with a HeapTimer.
+
+    Returns:
+        float: the time taken, in seconds
+    """
+    rand = random.Random(0)
+    now = 10 * DURATION_MS
+
+    user_to_current_state = {}
+    for i in range(num_users):
+        user_id = "@user%d:test" % (i,)
+        state = UserPresenceState.default(user_id).copy_and_replace(
+            state=PresenceState.ONLINE,
+            last_active_ts=now - rand.randint(0, 60 * 1000),
+            last_user_sync_ts=now - rand.randint(0, 30 * 1000),
+            last_federation_update_ts=now,
+        )
+        state, _, _ = handle_update(state, state, True, timer, now)
+        user_to_current_state[user_id] = state
+
+    user_ids = list(user_to_current_state)
+
+    start = perf_counter()
+
+    for _ in range(DURATION_MS // TICK_MS):
+        now += TICK_MS
+
+        # About a sixth of the users sync in each tick, and a fiftieth of them
+        # do something.
+        for user_id in rand.sample(user_ids, num_users // 6):
+            prev_state = user_to_current_state[user_id]
+            new_state = prev_state.copy_and_replace(last_user_sync_ts=now)
+            if rand.random() < 0.12:
+                new_state = new_state.copy_and_replace(
+                    state=PresenceState.ONLINE, last_active_ts=now
+                )
+            new_state, _, _ = handle_update(prev_state, new_state, True, timer, now)
+            user_to_current_state[user_id] = new_state
+
+        states = [user_to_current_state[user_id] for user_id in set(timer.fetch(now))]
+        changes = handle_timeouts(states, lambda user_id: True, set(), now)
+
+        changed_user_ids = {state.user_id for state in changes}
+        for state in changes:
+            prev_state = user_to_current_state[state.user_id]
+            new_state, _, _ = handle_update(prev_state, state, True, timer, now)
+            user_to_current_state[state.user_id] = new_state
+
+        if reschedule:
+            for state in states:
+                if state.user_id not in changed_user_ids:
+                    schedule_timeouts(state, True, timer, now)
+
+    return perf_counter() - start
+
+
+async def main(reactor, loops):
+    """Benchmark ten minutes of presence timeouts for `loops` online users."""
+    return simulate(HeapTimer(), loops, reschedule=True)
+
+
+if __name__ == "__main__":
+    num_users = 100000
+    for name, timer, reschedule in (
+        ("HeapTimer", HeapTimer(), True),
+        ("WheelTimer", WheelTimer(), False),
+    ):
+        elapsed = simulate(timer, num_users, reschedule)
+        print(
+            "%-10s %8.2f s for %d users, %d timers left"
+            % (name, elapsed, num_users, len(timer))
+        )
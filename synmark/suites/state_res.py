@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks for the topological sort used by v2 state resolution.
+
+`main` measures sorting the auth graph of a large room's conflicted power
+events with the index-based sort. The `state_res_reference` suite measures the
+same thing with `lexicographical_topological_sort`.
+
+Running this module directly checks that both sorts give the same result::
+
+    python -m synmark.suites.state_res
+"""
+
+import random
+
+from pyperf import perf_counter
+
+from synapse.state.v2 import (
+    _indexed_lexicographical_topological_sort,
+    lexicographical_topological_sort,
+)
+
+
+def make_auth_graph(count, seed=0):
+    """Builds an auth graph resembling that of a large room, where each event
+    references a few earlier events, mostly recent ones.
+
+    Returns:
+        tuple[dict[str, set[str]], dict[str, tuple]]: the graph, as a map from
+        event ID to the IDs of its auth events, and the sort key of each event
+        (as used by `_reverse_topological_power_sort`).
+    """
+    rng = random.Random(seed)
+    event_ids = ["$event%d:example.com" % (i,) for i in range(count)]
+
+    graph = {}
+    keys = {}
+    for i, event_id in enumerate(event_ids):
+        auth_count = min(i, rng.randint(1, 4))
+        graph[event_id] = {
+            event_ids[max(0, i - 1 - int(rng.expovariate(0.05)))]
+            for _ in range(auth_count)
+        }
+        power_level = rng.choice((0, 0, 0, 50, 100))
+        keys[event_id] = (-power_level, 1500000000000 + i * 1000, event_id)
+
+    return graph, keys
+
+
+def sort_indexed(graph, keys):
+    nodes = list(graph)
+    node_to_index = {event_id: i for i, event_id in enumerate(nodes)}
+    edges = [[node_to_index[aid] for aid in graph[event_id]] for event_id in nodes]
+    node_keys = [keys[event_id] for event_id in nodes]
+
+    return [
+        nodes[i] for i in _indexed_lexicographical_topological_sort(edges, node_keys)
+    ]
+
+
+def sort_reference(graph, keys):
+    graph = {event_id: set(edges) for event_id, edges in graph.items()}
+    return list(lexicographical_topological_sort(graph, key=keys.__getitem__))
+
+
+async def main(reactor, loops):
+    """Benchmark sorting an auth graph of `loops` events."""
+    graph, keys = make_auth_graph(loops)
+
+    start = perf_counter()
+    sort_indexed(graph, keys)
+    return perf_counter() - start
+
+
+if __name__ == "__main__":
+    for count in (1000, 10000, 50000):
+        graph, keys = make_auth_graph(count)
+        assert sort_indexed(graph, keys) == sort_reference(graph, keys)
+        print("%d events: indexed sort matches the reference sort" % (count,))
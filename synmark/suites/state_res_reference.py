@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from pyperf import perf_counter
+
+from synmark.suites.state_res import make_auth_graph, sort_reference
+
+
+async def main(reactor, loops):
+    """Benchmark sorting an auth graph of `loops` events with the reference sort.
+
+    This is the baseline for the `state_res` suite.
+    """
+    graph, keys = make_auth_graph(loops)
+
+    start = perf_counter()
+    sort_reference(graph, keys)
+    return perf_counter() - start
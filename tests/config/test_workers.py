@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from synapse.config import ConfigError
+from synapse.config.workers import WorkerConfig
+
+from tests import unittest
+
+
+class WorkerConfigTestCase(unittest.TestCase):
+    def _parse(self, config):
+        worker_config = WorkerConfig()
+        worker_config.read_config(config)
+        return worker_config
+
+    def test_defaults(self):
+        worker_config = self._parse({})
+
+        self.assertEqual(worker_config.instance_name, "master")
+        self.assertEqual(worker_config.writers.events, ["master"])
+        self.assertEqual(
+            worker_config.get_event_writer_for_room("!room:test"), "master"
+        )
+        self.assertEqual(worker_config.main_store_writers, ["master"])
+
+    def test_event_writers(self):
+        worker_config = self._parse(
+            {
+                "worker_app": "synapse.app.generic_worker",
+                "worker_name": "persister1",
+                "instance_map": {
+                    "persister1": {"host": "localhost", "port": 8034},
+                    "persister2": {"host": "localhost", "port": 8035},
+                },
+                "stream_writers": {"events": ["persister1", "persister2"]},
+            }
+        )
+
+        self.assertEqual(worker_config.instance_name, "persister1")
+        self.assertEqual(worker_config.instance_map["persister2"].port, 8035)
+        self.assertEqual(
+            worker_config.main_store_writers, ["master", "persister1", "persister2"]
+        )
+
+        # rooms are shared out between the writers, always in the same way.
+        writers = {
+            worker_config.get_event_writer_for_room("!room%d:test" % (i,))
+            for i in range(20)
+        }
+        self.assertEqual(writers, {"persister1", "persister2"})
+        self.assertEqual(
+            worker_config.get_event_writer_for_room("!room:test"),
+            worker_config.get_event_writer_for_room("!room:test"),
+        )
+
+    def test_single_event_persister(self):
+        """A single event persister other than the main process still has to
+        send its positions, as the main process also writes to the streams.
+        """
+        config = {
+            "instance_map": {"persister1": {"host": "localhost", "port": 8034}},
+            "stream_writers": {"events": ["persister1"]},
+        }
+
+        worker_config = self._parse(config)
+        self.assertEqual(worker_config.main_store_writers, ["master", "persister1"])
+        self.assertFalse(worker_config.sends_writer_positions)
+
+        worker_config = self._parse(
+            dict(
+                config,
+                worker_app="synapse.app.generic_worker",
+                worker_name="persister1",
+            )
+        )
+        self.assertTrue(worker_config.sends_writer_positions)
+
+        worker_config = self._parse(
+            dict(
+                config,
+                worker_app="synapse.app.generic_worker",
+                worker_name="synchrotron1",
+            )
+        )
+        self.assertFalse(worker_config.sends_writer_positions)
+
+    def test_event_writer_must_be_in_instance_map(self):
+        with self.assertRaises(ConfigError):
+            self._parse({"stream_writers": {"events": ["master", "persister1"]}})
+
+        with self.assertRaises(ConfigError):
+            self._parse({"stream_writers": {"events": []}})
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from canonicaljson import json
+
+from synapse.api.room_versions import RoomVersions
+from synapse.events import make_event_from_dict, make_event_from_json
+
+from tests import unittest
+
+EVENT_V1 = {
+    "event_id": "$event:test",
+    "type": "m.room.member",
+    "state_key": "@user:test",
+    "room_id": "!room:test",
+    "sender": "@user:test",
+    "content": {"membership": "join"},
+    "prev_events": [["$prev:test", {"sha256": "abc"}]],
+    "auth_events": [["$auth:test", {"sha256": "def"}]],
+    "depth": 5,
+    "origin": "test",
+    "origin_server_ts": 1234,
+    "hashes": {"sha256": "ghi"},
+    "signatures": {"test": {"ed25519:a": "sig"}},
+    "unsigned": {"age_ts": 1000},
+}
+
+EVENT_V3 = {
+    "type": "m.room.message",
+    "room_id": "!room:test",
+    "sender": "@user:test",
+    "content": {"body": "hello", "msgtype": "m.text"},
+    "prev_events": ["$prev"],
+    "auth_events": ["$auth1", "$auth2"],
+    "depth": 5,
+    "origin": "test",
+    "origin_server_ts": 1234,
+    "hashes": {"sha256": "ghi"},
+    "signatures": {"test": {"ed25519:a": "sig"}},
+    "unsigned": {},
+}
+
+
+class CompactEventTestCase(unittest.TestCase):
+    def test_references_are_tuples(self):
+        event = make_event_from_dict(EVENT_V1)
+        self.assertIsInstance(event.prev_events, tuple)
+        self.assertEqual(event.prev_event_ids(), ["$prev:test"])
+        self.assertEqual(event.auth_event_ids(), ["$auth:test"])
+
+        event = make_event_from_dict(EVENT_V3, RoomVersions.V3)
+        self.assertIsInstance(event.auth_events, tuple)
+        self.assertEqual(event.prev_event_ids(), ["$prev"])
+        self.assertEqual(event.auth_event_ids(), ["$auth1", "$auth2"])
+
+    def test_no_instance_dict(self):
+        event = make_event_from_dict(EVENT_V1)
+        self.assertFalse(hasattr(event, "__dict__"))
+
+
+class LazyEventTestCase(unittest.TestCase):
+    def test_header_only(self):
+        header = {
+            "event_id": "$event:test",
+            "type": "m.room.member",
+            "state_key": "@user:test",
+            "room_id": "!room:test",
+            "sender": "@user:test",
+        }
+        event = make_event_from_json(json.dumps(EVENT_V1), header)
+
+        self.assertEqual(event.event_id, "$event:test")
+        self.assertEqual(event.type, "m.room.member")
+        self.assertEqual(event.state_key, "@user:test")
+        self.assertTrue(event.is_state())
+
+        # the body should not have been decoded yet
+        self.assertIsNotNone(event._lazy_json)
+
+        self.assertEqual(event.content, {"membership": "join"})
+        self.assertIsNone(event._lazy_json)
+        self.assertEqual(event.signatures, EVENT_V1["signatures"])
+        self.assertEqual(event.unsigned, {"age_ts": 1000})
+
+    def test_matches_eager_event(self):
+        eager = make_event_from_dict(EVENT_V3, RoomVersions.V3)
+        header = {
+            "event_id": eager.event_id,
+            "type": "m.room.message",
+            "room_id": "!room:test",
+            "sender": "@user:test",
+        }
+        lazy = make_event_from_json(json.dumps(EVENT_V3), header, RoomVersions.V3)
+
+        self.assertFalse(lazy.is_state())
+        self.assertEqual(lazy.event_id, eager.event_id)
+        self.assertEqual(lazy.get_pdu_json(), eager.get_pdu_json())
+        self.assertEqual(lazy.prev_event_ids(), eager.prev_event_ids())
+
+    def test_unsigned_setter(self):
+        header = {
+            "event_id": "$event:test",
+            "type": "m.room.member",
+            "state_key": "@user:test",
+            "room_id": "!room:test",
+            "sender": "@user:test",
+        }
+        event = make_event_from_json(json.dumps(EVENT_V1), header)
+        event.unsigned = {"foo": "bar"}
+
+        # decoding the body later must not clobber the new value
+        self.assertEqual(event.content, {"membership": "join"})
+        self.assertEqual(event.unsigned, {"foo": "bar"})
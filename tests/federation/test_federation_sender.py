@@ -17,6 +17,8 @@ from mock import Mock
 
 from twisted.internet import defer
 
+from synapse.rest import admin
+from synapse.rest.client.v1 import login, room
 from synapse.types import ReadReceipt
 
 from tests.unittest import HomeserverTestCase, override_config
@@ -147,3 +149,111 @@ class FederationSenderTestCases(HomeserverTestCase):
                 }
             ],
         )
+
+    @override_config(
+        {"send_federation": True, "federation_transaction_max_latency_ms": 500}
+    )
+    def test_batch_edus(self):
+        """EDUs queued within the batch window are sent in one transaction."""
+        mock_send_transaction = (
+            self.hs.get_federation_transport_client().send_transaction
+        )
+        mock_send_transaction.return_value = defer.succeed({})
+
+        sender = self.hs.get_federation_sender()
+
+        # Nothing is known about the destination yet, so the first EDU is
+        # sent straight away.
+        sender.build_and_send_edu("host2", "m.test", {"n": 1})
+        self.pump()
+        mock_send_transaction.assert_called_once()
+        mock_send_transaction.reset_mock()
+
+        # Pretend that the destination is slow, which gives it a batch window
+        # of 100ms.
+        queue = sender._get_per_destination_queue("host2")
+        queue._rtt_ms = 200.0
+
+        sender.build_and_send_edu("host2", "m.test", {"n": 2})
+        self.reactor.advance(0.05)
+        sender.build_and_send_edu("host2", "m.test", {"n": 3})
+        mock_send_transaction.assert_not_called()
+
+        self.reactor.advance(0.05)
+        mock_send_transaction.assert_called_once()
+        json_cb = mock_send_transaction.call_args[0][1]
+        data = json_cb()
+        self.assertEqual([edu["content"] for edu in data["edus"]], [{"n": 2}, {"n": 3}])
+
+
+class FederationCatchUpTestCases(HomeserverTestCase):
+    servlets = [
+        admin.register_servlets,
+        login.register_servlets,
+        room.register_servlets,
+    ]
+
+    def make_homeserver(self, reactor, clock):
+        return self.setup_test_homeserver(
+            federation_transport_client=Mock(spec=["send_transaction"])
+        )
+
+    def prepare(self, reactor, clock, hs):
+        self.store = hs.get_datastore()
+
+    def _get_stream_ordering(self, event_id):
+        return self.get_success(
+            self.store.db.simple_select_one_onecol(
+                table="events",
+                keyvalues={"event_id": event_id},
+                retcol="stream_ordering",
+            )
+        )
+
+    @override_config({"send_federation": True})
+    def test_catch_up(self):
+        """A destination which missed events is sent the latest event of the
+        room, and then leaves catch-up mode.
+        """
+        mock_send_transaction = (
+            self.hs.get_federation_transport_client().send_transaction
+        )
+        mock_send_transaction.return_value = defer.succeed({})
+
+        user_id = self.register_user("user", "pass")
+        tok = self.login("user", "pass")
+        room_id = self.helper.create_room_as(user_id, tok=tok)
+
+        event_id_1 = self.helper.send(room_id, "1", tok=tok)["event_id"]
+        event_id_2 = self.helper.send(room_id, "2", tok=tok)["event_id"]
+        stream_ordering_1 = self._get_stream_ordering(event_id_1)
+        stream_ordering_2 = self._get_stream_ordering(event_id_2)
+
+        # Pretend that host2 received the first event but missed the second.
+        self.get_success(
+            self.store.set_destination_last_successful_stream_ordering(
+                "host2", stream_ordering_1
+            )
+        )
+        self.get_success(
+            self.store.store_destination_rooms_entries(
+                ["host2"], room_id, stream_ordering_2
+            )
+        )
+
+        sender = self.hs.get_federation_sender()
+        sender.wake_destination("host2")
+        self.pump()
+
+        mock_send_transaction.assert_called_once()
+        json_cb = mock_send_transaction.call_args[0][1]
+        data = json_cb()
+        self.assertEqual([pdu["content"]["body"] for pdu in data["pdus"]], ["2"])
+
+        last_successful = self.get_success(
+            self.store.get_destination_last_successful_stream_ordering("host2")
+        )
+        self.assertEqual(last_successful, stream_ordering_2)
+
+        queue = sender._get_per_destination_queue("host2")
+        self.assertFalse(queue._catching_up)
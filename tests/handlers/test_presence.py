@@ -30,6 +30,7 @@ from synapse.handlers.presence import (
     SYNC_ONLINE_TIMEOUT,
     handle_timeout,
     handle_update,
+    schedule_timeouts,
 )
 from synapse.rest.client.v1 import room
 from synapse.storage.presence import UserPresenceState
@@ -414,6 +415,50 @@ class PresenceTimeoutTestCase(unittest.TestCase):
         self.assertEquals(state, new_state)
 
 
+class ScheduleTimeoutsTestCase(unittest.TestCase):
+    def test_next_timeout(self):
+        user_id = "@foo:bar"
+        now = 5000000
+
+        state = UserPresenceState.default(user_id)
+        state = state.copy_and_replace(
+            state=PresenceState.ONLINE,
+            last_active_ts=now - LAST_ACTIVE_GRANULARITY - 1,
+            last_user_sync_ts=now - SYNC_ONLINE_TIMEOUT - 1,
+            last_federation_update_ts=now,
+        )
+
+        timer = Mock()
+        schedule_timeouts(state, is_mine=True, timer=timer, now=now)
+
+        # The sync timeout has passed (e.g. because the user is still
+        # syncing), so the next timeout is the idle timer.
+        timer.insert.assert_called_once_with(
+            now=now, obj=user_id, then=state.last_active_ts + IDLE_TIMER
+        )
+
+    def test_remote(self):
+        user_id = "@foo:bar"
+        now = 5000000
+
+        state = UserPresenceState.default(user_id)
+        state = state.copy_and_replace(
+            state=PresenceState.ONLINE, last_federation_update_ts=now
+        )
+
+        timer = Mock()
+        schedule_timeouts(state, is_mine=False, timer=timer, now=now)
+        timer.insert.assert_called_once_with(
+            now=now, obj=user_id, then=now + FEDERATION_TIMEOUT
+        )
+
+    def test_offline(self):
+        timer = Mock()
+        state = UserPresenceState.default("@foo:bar")
+        schedule_timeouts(state, is_mine=True, timer=timer, now=5000000)
+        self.assertEqual(timer.insert.call_count, 0)
+
+
 class PresenceHandlerTestCase(unittest.HomeserverTestCase):
     def prepare(self, reactor, clock, hs):
         self.presence_handler = hs.get_presence_handler()
@@ -451,6 +496,32 @@ class PresenceHandlerTestCase(unittest.HomeserverTestCase):
         )
         self.assertEqual(state.state, PresenceState.OFFLINE)
 
+    def test_idle_while_syncing(self):
+        """Test that a user who keeps a sync open but stops being active goes
+        idle, even though their earlier timeouts pass without changing their
+        state.
+        """
+        user_id = "@test:test"
+
+        self.get_success(self.presence_handler.user_syncing(user_id))
+
+        # Step through time, so that the timeouts are checked regularly.
+        for _ in range(IDLE_TIMER // 5000 - 1):
+            self.reactor.advance(5)
+
+        state = self.get_success(
+            self.presence_handler.get_state(UserID.from_string(user_id))
+        )
+        self.assertEqual(state.state, PresenceState.ONLINE)
+
+        for _ in range(3):
+            self.reactor.advance(5)
+
+        state = self.get_success(
+            self.presence_handler.get_state(UserID.from_string(user_id))
+        )
+        self.assertEqual(state.state, PresenceState.UNAVAILABLE)
+
 
 class PresenceJoinTestCase(unittest.HomeserverTestCase):
     """Tests remote servers get told about presence of users in the room when
@@ -75,6 +75,11 @@ class TypingNotificationsTestCase(unittest.HomeserverTestCase):
                 "get_destination_retry_timings",
                 "get_devices_by_remote",
                 "maybe_store_room_on_invite",
+                # Bits that federation catch-up needs
+                "get_destination_last_successful_stream_ordering",
+                "set_destination_last_successful_stream_ordering",
+                "get_catch_up_room_events",
+                "store_destination_rooms_entries",
                 # Bits that user_directory needs
                 "get_user_directory_stream_pos",
                 "get_current_state_deltas",
@@ -116,6 +121,17 @@ class TypingNotificationsTestCase(unittest.HomeserverTestCase):
             (0, [])
         )
 
+        self.datastore.get_destination_last_successful_stream_ordering.return_value = defer.succeed(
+            None
+        )
+        self.datastore.set_destination_last_successful_stream_ordering.return_value = defer.succeed(
+            None
+        )
+        self.datastore.get_catch_up_room_events.return_value = defer.succeed(None)
+        self.datastore.store_destination_rooms_entries.return_value = defer.succeed(
+            None
+        )
+
         def get_received_txn_response(*args):
             return defer.succeed(None)
 
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from mock import Mock, patch
+
+from twisted.internet import defer
+
+from synapse.replication.tcp.streams._base import (
+    CachesStream,
+    coalesce_cache_invalidations,
+)
+
+from tests import unittest
+
+
+class CoalesceCacheInvalidationsTestCase(unittest.TestCase):
+    def test_single_row(self):
+        rows = coalesce_cache_invalidations([(1, "get_foo", ["a"], 1000)])
+        self.assertEqual(rows, [(1, "get_foo", ["a"], 1000, False)])
+
+    def test_coalesce(self):
+        rows = coalesce_cache_invalidations(
+            [
+                (1, "get_foo", ["a"], 1000),
+                (2, "get_bar", ["x", "y"], 1001),
+                (3, "get_foo", ["b"], 1002),
+                (4, "get_foo", ["a"], 1003),
+                (5, "get_baz", None, 1004),
+            ]
+        )
+
+        self.assertEqual(
+            rows,
+            [
+                (5, "get_baz", None, 1004, False),
+                (5, "get_foo", [["a"], ["b"]], 1003, True),
+                (5, "get_bar", ["x", "y"], 1001, False),
+            ],
+        )
+
+    def test_split_large_rows(self):
+        key = "x" * 1000
+        rows = coalesce_cache_invalidations(
+            [(i, "get_foo", [key, str(i)], 1000) for i in range(20)]
+        )
+
+        # the keys should have been split over several rows, none of which is
+        # too large to send.
+        self.assertGreater(len(rows), 1)
+        keys = []
+        for stream_id, cache_func, row_keys, _, is_bulk in rows:
+            self.assertEqual(stream_id, 19)
+            self.assertEqual(cache_func, "get_foo")
+            self.assertTrue(is_bulk)
+            self.assertLess(len(str(row_keys)), 16 * 1024)
+            keys.extend(row_keys)
+
+        self.assertEqual(keys, [[key, str(i)] for i in range(20)])
+
+    def test_parse_row(self):
+        row = CachesStream.parse_row(["get_foo", [["a"], ["b"]], 1000, True])
+        self.assertTrue(row.is_bulk)
+        self.assertEqual(row.keys, [["a"], ["b"]])
+
+        # rows without the bulk flag are single invalidations
+        row = CachesStream.parse_row(["get_foo", ["a"], 1000])
+        self.assertFalse(row.is_bulk)
+
+
+class CachesStreamTestCase(unittest.TestCase):
+    @patch("synapse.replication.tcp.streams._base.MAX_EVENTS_BEHIND", 10)
+    def test_fallen_behind(self):
+        """The stream falls behind if there are too many invalidations, even if
+        they would be coalesced into fewer rows.
+        """
+        store = Mock()
+        store.get_cache_stream_token.return_value = 20
+        store.get_all_updated_caches.return_value = defer.succeed(
+            [(i, "get_foo", ["a"], 1000) for i in range(1, 12)]
+        )
+        hs = Mock()
+        hs.get_datastore.return_value = store
+
+        stream = CachesStream(hs)
+        d = defer.ensureDeferred(stream.get_updates_since(0))
+        self.failureResultOf(d, Exception)
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from synapse.replication.tcp.protocol import (
+    _FRAME_HEADER,
+    ClientReplicationStreamProtocol,
+    _encode_frame,
+)
+from synapse.replication.tcp.resource import ReplicationStreamProtocolFactory
+from synapse.replication.tcp.streams._base import TypingStreamRow
+
+from tests import unittest
+from tests.replication.tcp.streams._base import TestReplicationClientHandler
+from tests.server import FakeTransport
+
+
+class BinaryFramesTestCase(unittest.HomeserverTestCase):
+    def connect(self, server_binary=True, client_binary=True):
+        server_factory = ReplicationStreamProtocolFactory(self.hs)
+        self.server = server_factory.buildProtocol(None)
+        self.server.SUPPORTS_BINARY_FRAMES = server_binary
+
+        self.test_handler = TestReplicationClientHandler()
+        self.client = ClientReplicationStreamProtocol(
+            "client", "test", self.clock, self.test_handler
+        )
+        self.client.SUPPORTS_BINARY_FRAMES = client_binary
+
+        self.client.makeConnection(FakeTransport(self.server, self.reactor))
+        self.server.makeConnection(FakeTransport(self.client, self.reactor))
+        self.pump(0.1)
+
+        self.server.replication_streams.add("typing")
+
+    def send_batch(self, rows, token):
+        for row in rows[:-1]:
+            self.server.stream_update("typing", None, row)
+        self.server.stream_update("typing", token, rows[-1])
+        self.pump(0.1)
+
+    def assert_received_batch(self, rows, token):
+        self.assertEqual(
+            self.test_handler.received_rdata_rows,
+            [("typing", token, TypingStreamRow(*row)) for row in rows],
+        )
+
+    def test_negotiated(self):
+        self.connect()
+        self.assertTrue(self.server.sending_frames)
+        self.assertFalse(self.client.sending_frames)
+        self.assertFalse(self.client.line_mode)
+
+        rows = [("!room%d:test" % (i,), ["@user:test"]) for i in range(3)]
+        self.send_batch(rows, 5)
+        self.assert_received_batch(rows, 5)
+
+        # the whole batch was sent in one frame
+        self.assertEqual(self.server.outbound_commands_counter["RDATA"], 3)
+        self.assertEqual(self.client.inbound_commands_counter["RDATA"], 3)
+
+    def test_old_client(self):
+        self.connect(client_binary=False)
+        self.assertFalse(self.server.sending_frames)
+        self.assertTrue(self.client.line_mode)
+
+        rows = [("!room%d:test" % (i,), ["@user:test"]) for i in range(3)]
+        self.send_batch(rows, 5)
+        self.assert_received_batch(rows, 5)
+
+    def test_old_server(self):
+        self.connect(server_binary=False)
+        self.assertFalse(self.server.sending_frames)
+        self.assertTrue(self.client.line_mode)
+
+        rows = [("!room:test", ["@user:test"])]
+        self.send_batch(rows, 5)
+        self.assert_received_batch(rows, 5)
+
+    def test_fallback_to_text(self):
+        """Rows which msgpack can't encode are sent in their text form"""
+        self.connect()
+
+        rows = [("!room:test", ["@user:test"]), ("!room:test", [2 ** 70])]
+        self.send_batch(rows, 5)
+        self.assert_received_batch(rows, 5)
+
+    def test_partial_frames(self):
+        self.connect()
+
+        payload = _encode_frame(["RDATA", "typing", 7, [["!room:test", []]]])
+        data = _FRAME_HEADER.pack(len(payload)) + payload
+        data += data
+
+        # deliver the two frames a byte at a time
+        for i in range(len(data)):
+            self.client.dataReceived(data[i : i + 1])
+        self.pump(0.1)
+
+        self.assertEqual(
+            self.test_handler.received_rdata_rows,
+            [("typing", 7, TypingStreamRow("!room:test", []))] * 2,
+        )
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+
+from twisted.internet import defer
+
+from synapse.logging.context import make_deferred_yieldable
+from synapse.replication.http import streams
+from synapse.replication.tcp.commands import UserSyncCommand
+from synapse.replication.tcp.pubsub import PubSubBus, PubSubReplicationClient
+
+from tests import unittest
+
+ROOM_ID = "!room:test"
+EVENT_ID = "$event:test"
+
+
+class LocalPubSubBus(PubSubBus):
+    """An in-process stand-in for a pub/sub broker such as Redis"""
+
+    def __init__(self, reactor):
+        self._reactor = reactor
+        self.subscribers = {}
+        self.published = []
+
+    def publish(self, channel, message):
+        self.published.append((channel, message))
+        for listener in self.subscribers.get(channel, []):
+            self._reactor.callLater(0, listener.on_message, message)
+
+    def subscribe(self, channel, listener):
+        self.subscribers.setdefault(channel, []).append(listener)
+        self._reactor.callLater(0, listener.on_subscribed)
+
+
+class TestPubSubClientHandler(object):
+    """Drop-in for ReplicationClientHandler which just collects what it's sent
+    """
+
+    def __init__(self, streams):
+        self.streams = streams
+        self.received_rdata_rows = []
+        self.connection = None
+        self.connected = False
+
+    def get_streams_to_replicate(self):
+        return dict(self.streams)
+
+    def get_currently_syncing_users(self):
+        return ["@syncing:test"]
+
+    def update_connection(self, connection):
+        self.connection = connection
+
+    def finished_connecting(self):
+        self.connected = True
+
+    async def on_rdata(self, stream_name, token, rows):
+        self.streams[stream_name] = token
+        for r in rows:
+            self.received_rdata_rows.append((stream_name, token, r.user_id))
+
+    async def on_position(self, stream_name, token):
+        self.streams[stream_name] = token
+
+
+class PubSubReplicationTestCase(unittest.HomeserverTestCase):
+    servlets = [streams.register_servlets]
+
+    def make_homeserver(self, reactor, clock):
+        self.bus = LocalPubSubBus(reactor)
+        return self.setup_test_homeserver(replication_pubsub_bus=self.bus)
+
+    def prepare(self, reactor, clock, hs):
+        self.store = hs.get_datastore()
+        self.streamer = hs.get_replication_streamer()
+
+        # Somewhere for the workers to start replicating receipts from
+        self.insert_receipt("@before:test")
+        self.start_token = self.store.get_max_receipt_stream_id()
+
+        # Calls to the HTTP replication endpoint are blocked until this fires
+        self.fetch_blocker = None
+
+    def insert_receipt(self, user_id):
+        self.get_success(
+            self.store.insert_receipt(ROOM_ID, "m.read", user_id, [EVENT_ID], {})
+        )
+
+    def replicate(self):
+        self.streamer.on_notifier_poke()
+        self.pump(0.1)
+
+    def make_worker(self):
+        handler = TestPubSubClientHandler({"receipts": self.start_token})
+        client = PubSubReplicationClient(self.hs, handler)
+        client._get_stream_updates = self._get_stream_updates
+        client.start()
+        return handler, client
+
+    async def _get_stream_updates(self, stream_name, from_token):
+        if self.fetch_blocker:
+            await make_deferred_yieldable(self.fetch_blocker)
+
+        updates, upto_token = await self.streamer.get_stream_updates(
+            stream_name, from_token
+        )
+        # as if it had been sent over HTTP
+        return json.loads(json.dumps({"updates": updates, "upto_token": upto_token}))
+
+    def published_rdata(self):
+        return [m for _, m in self.bus.published if m.startswith("RDATA receipts ")]
+
+    def test_catch_up_then_live(self):
+        self.insert_receipt("@missed:test")
+        self.replicate()
+
+        handlers = [self.make_worker()[0], self.make_worker()[0]]
+        self.pump(0.1)
+
+        for handler in handlers:
+            self.assertTrue(handler.connected)
+            self.assertEqual(
+                handler.received_rdata_rows,
+                [("receipts", self.start_token + 1, "@missed:test")],
+            )
+
+        self.insert_receipt("@live:test")
+        self.replicate()
+
+        for handler in handlers:
+            self.assertEqual(
+                [r[2] for r in handler.received_rdata_rows],
+                ["@missed:test", "@live:test"],
+            )
+
+        # each update was only published once, however many workers there are
+        self.assertEqual(len(self.published_rdata()), 3)
+
+    def test_updates_during_catch_up(self):
+        """Updates published while the worker is catching up are held back,
+        and not passed on twice.
+        """
+        self.fetch_blocker = defer.Deferred()
+        handler, _ = self.make_worker()
+        self.pump(0.1)
+
+        # this update is both published and returned by the catch up
+        self.insert_receipt("@first:test")
+        self.replicate()
+        self.assertEqual(handler.received_rdata_rows, [])
+
+        self.fetch_blocker.callback(None)
+        self.pump(0.1)
+
+        # this one is published after the catch up fetched its updates, but
+        # before the worker has finished catching up.
+        self.insert_receipt("@second:test")
+        self.replicate()
+
+        self.assertTrue(handler.connected)
+        self.assertEqual(
+            [r[2] for r in handler.received_rdata_rows],
+            ["@first:test", "@second:test"],
+        )
+
+    def test_worker_commands(self):
+        _, client = self.make_worker()
+        self.pump(0.1)
+
+        client.send_command(UserSyncCommand("@other:test", True, 1000))
+        self.pump(0.1)
+
+        # the worker told the master about the users syncing on it
+        presence = self.hs.get_presence_handler()
+        self.assertEqual(
+            presence.external_process_to_current_syncs[client.id()],
+            {"@syncing:test", "@other:test"},
+        )
+
+    def test_get_stream_updates_endpoint(self):
+        self.insert_receipt("@missed:test")
+        self.replicate()
+
+        request, channel = self.make_request(
+            "GET",
+            "/_synapse/replication/get_repl_stream_updates/receipts?from_token=%d"
+            % (self.start_token,),
+        )
+        self.render(request)
+        self.assertEqual(channel.code, 200, channel.result)
+
+        updates = channel.json_body["updates"]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(updates[0][0], self.start_token + 1)
+        self.assertEqual(channel.json_body["upto_token"], self.start_token + 1)
+
+        request, channel = self.make_request(
+            "GET", "/_synapse/replication/get_repl_stream_updates/bogus?from_token=0",
+        )
+        self.render(request)
+        self.assertEqual(channel.code, 400, channel.result)
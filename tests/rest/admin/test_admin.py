@@ -309,6 +309,7 @@ class PurgeRoomTestCase(unittest.HomeserverTestCase):
         # Test that the following tables have been purged of all rows related to the room.
         for table in (
             "current_state_events",
+            "destination_rooms",
             "event_backward_extremities",
             "event_forward_extremities",
             "event_json",
@@ -15,6 +15,8 @@
 # limitations under the License.
 import json
 
+from mock import patch
+
 import synapse.rest.admin
 from synapse.api.constants import EventContentFields, EventTypes
 from synapse.rest.client.v1 import login, room
@@ -22,6 +24,7 @@ from synapse.rest.client.v2_alpha import sync
 
 from tests import unittest
 from tests.server import TimedOutException
+from tests.unittest import override_config
 
 
 class FilterTestCase(unittest.HomeserverTestCase):
@@ -216,6 +219,9 @@ class SyncTypingTests(unittest.HomeserverTestCase):
     user_id = True
     hijack_auth = False
 
+    # The typing serial going backwards makes us repeat sync tokens, which would
+    # otherwise get us the responses we sent before.
+    @override_config({"sync_response_cache_duration": 0})
     def test_sync_backwards_typing(self):
         """
         If the typing serial goes backwards and the typing handler is then reset
@@ -324,3 +330,140 @@ class SyncTypingTests(unittest.HomeserverTestCase):
             "GET", sync_url % (access_token, next_batch)
         )
         self.assertRaises(TimedOutException, self.render, request)
+
+
+class SyncResponseCacheTestCase(unittest.HomeserverTestCase):
+    servlets = [
+        synapse.rest.admin.register_servlets_for_client_rest_resource,
+        room.register_servlets,
+        login.register_servlets,
+        sync.register_servlets,
+    ]
+
+    def prepare(self, reactor, clock, hs):
+        self.user_id = self.register_user("user", "pass")
+        self.tok = self.login("user", "pass")
+        self.room_id = self.helper.create_room_as(self.user_id, tok=self.tok)
+
+    def _sync(self, since=None):
+        url = "/sync?access_token=%s" % (self.tok,)
+        if since:
+            url += "&since=" + since
+
+        request, channel = self.make_request("GET", url)
+        self.render(request)
+        self.assertEqual(channel.code, 200, channel.json_body)
+        return channel.json_body
+
+    def _timeline_bodies(self, sync_body):
+        timeline = sync_body["rooms"]["join"].get(self.room_id, {}).get("timeline", {})
+        return [e["content"].get("body") for e in timeline.get("events", [])]
+
+    def test_repeated_sync_reuses_response(self):
+        since = self._sync()["next_batch"]
+
+        self.helper.send(self.room_id, body="first", tok=self.tok)
+        first = self._sync(since)
+        self.assertEqual(self._timeline_bodies(first), ["first"])
+
+        # Repeating the request gets the same response...
+        self.helper.send(self.room_id, body="second", tok=self.tok)
+        repeated = self._sync(since)
+        self.assertEqual(repeated["next_batch"], first["next_batch"])
+        self.assertEqual(self._timeline_bodies(repeated), ["first"])
+
+        # ... and the new event comes down in the next sync.
+        self.assertEqual(
+            self._timeline_bodies(self._sync(first["next_batch"])), ["second"]
+        )
+
+        # The response isn't kept forever.
+        self.reactor.advance(3 * 60)
+        self.assertEqual(self._timeline_bodies(self._sync(since)), ["first", "second"])
+
+    @override_config({"sync_response_cache_duration": 0})
+    def test_cache_disabled(self):
+        since = self._sync()["next_batch"]
+
+        self.helper.send(self.room_id, body="first", tok=self.tok)
+        self._sync(since)
+
+        self.helper.send(self.room_id, body="second", tok=self.tok)
+        self.assertEqual(self._timeline_bodies(self._sync(since)), ["first", "second"])
+
+    def test_initial_sync_not_reused(self):
+        self._sync()
+
+        self.helper.send(self.room_id, body="first", tok=self.tok)
+        self.assertEqual(self._timeline_bodies(self._sync())[-1:], ["first"])
+
+
+class InitialSyncRoomCacheTestCase(unittest.HomeserverTestCase):
+    servlets = [
+        synapse.rest.admin.register_servlets_for_client_rest_resource,
+        room.register_servlets,
+        login.register_servlets,
+        sync.register_servlets,
+    ]
+
+    def prepare(self, reactor, clock, hs):
+        self.user_id = self.register_user("user", "pass")
+        self.tok = self.login("user", "pass")
+        self.room_1 = self.helper.create_room_as(self.user_id, tok=self.tok)
+        self.room_2 = self.helper.create_room_as(self.user_id, tok=self.tok)
+
+        handler = hs.get_sync_handler()
+        patcher = patch.object(
+            handler, "_load_filtered_recents", wraps=handler._load_filtered_recents
+        )
+        self.load_filtered_recents = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _initial_sync(self):
+        self.load_filtered_recents.reset_mock()
+
+        request, channel = self.make_request(
+            "GET", "/sync?access_token=%s" % (self.tok,)
+        )
+        self.render(request)
+        self.assertEqual(channel.code, 200, channel.json_body)
+        return channel.json_body
+
+    def _loaded_rooms(self):
+        return {c[0][0] for c in self.load_filtered_recents.call_args_list}
+
+    def _event_ids(self, sync_body, room_id, section):
+        events = sync_body["rooms"]["join"][room_id][section]["events"]
+        return [e["event_id"] for e in events]
+
+    def _last_body(self, sync_body, room_id):
+        events = sync_body["rooms"]["join"][room_id]["timeline"]["events"]
+        return events[-1]["content"].get("body")
+
+    def test_unchanged_rooms_reused(self):
+        first = self._initial_sync()
+        self.assertEqual(self._loaded_rooms(), {self.room_1, self.room_2})
+
+        # Nothing has changed, so no rooms need loading.
+        second = self._initial_sync()
+        self.assertEqual(self._loaded_rooms(), set())
+        self.assertEqual(
+            self._event_ids(second, self.room_2, "timeline"),
+            self._event_ids(first, self.room_2, "timeline"),
+        )
+
+        # Only the room with a new event is loaded again.
+        self.helper.send(self.room_1, body="hello", tok=self.tok)
+        third = self._initial_sync()
+        self.assertEqual(self._loaded_rooms(), {self.room_1})
+        self.assertEqual(self._last_body(third, self.room_1), "hello")
+        self.assertEqual(
+            self._event_ids(third, self.room_2, "state"),
+            self._event_ids(first, self.room_2, "state"),
+        )
+
+    @override_config({"initial_sync_room_cache_duration": 0})
+    def test_cache_disabled(self):
+        self._initial_sync()
+        self._initial_sync()
+        self.assertEqual(self._loaded_rooms(), {self.room_1, self.room_2})
@@ -14,6 +14,7 @@
 # limitations under the License.
 
 import itertools
+import random
 
 from six.moves import zip
 
@@ -23,7 +24,11 @@ from synapse.api.constants import EventTypes, JoinRules, Membership
 from synapse.api.room_versions import RoomVersions
 from synapse.event_auth import auth_types_for_event
 from synapse.events import make_event_from_dict
-from synapse.state.v2 import lexicographical_topological_sort, resolve_events_with_store
+from synapse.state.v2 import (
+    _indexed_lexicographical_topological_sort,
+    lexicographical_topological_sort,
+    resolve_events_with_store,
+)
 from synapse.types import EventID
 
 from tests import unittest
@@ -474,6 +479,49 @@ class LexicographicalTestCase(unittest.TestCase):
         self.assertEqual(["o", "l", "n", "m", "p"], res)
 
 
+class IndexedLexicographicalTestCase(unittest.TestCase):
+    """Checks that the index-based sort gives the same results as
+    `lexicographical_topological_sort`.
+    """
+
+    def _assert_same_sort(self, graph, key):
+        nodes = list(graph)
+        node_to_index = {node: i for i, node in enumerate(nodes)}
+        edges = [[node_to_index[edge] for edge in graph[node]] for node in nodes]
+        keys = [key(node) for node in nodes]
+
+        res = [nodes[i] for i in _indexed_lexicographical_topological_sort(edges, keys)]
+
+        graph_copy = {node: set(edges) for node, edges in graph.items()}
+        expected = list(lexicographical_topological_sort(graph_copy, key=key))
+
+        self.assertEqual(expected, res)
+
+    def test_simple(self):
+        graph = {"l": {"o"}, "m": {"n", "o"}, "n": {"o"}, "o": set(), "p": {"o"}}
+        self._assert_same_sort(graph, key=lambda x: x)
+
+    def test_random_graphs(self):
+        rng = random.Random(0)
+        for _ in range(100):
+            nodes = ["$%d" % (i,) for i in range(rng.randint(1, 100))]
+
+            graph = {}
+            for i, node in enumerate(nodes):
+                edge_count = min(i, rng.randint(0, 4))
+                graph[node] = set(rng.sample(nodes[:i], edge_count))
+
+            # use keys with plenty of ties, broken by the node itself, as in
+            # state resolution.
+            power_levels = {node: rng.choice((0, 50, 100)) for node in nodes}
+            timestamps = {node: rng.randint(0, 10) for node in nodes}
+
+            def key(node):
+                return -power_levels[node], timestamps[node], node
+
+            self._assert_same_sort(graph, key)
+
+
 class SimpleParamStateTestCase(unittest.TestCase):
     def setUp(self):
         # We build up a simple DAG.
@@ -13,6 +13,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import random
+
 import tests.unittest
 import tests.utils
 
@@ -112,6 +114,12 @@ class EventFederationWorkerStoreTestCase(tests.unittest.HomeserverTestCase):
         self.assertTrue(r == [room2] or r == [room3])
 
     def test_auth_difference(self):
+        self._test_auth_difference(use_chain_cover_index=False)
+
+    def test_auth_difference_chain_cover_index(self):
+        self._test_auth_difference(use_chain_cover_index=True)
+
+    def _test_auth_difference(self, use_chain_cover_index):
         room_id = "@ROOM:local"
 
         # The silly auth graph we use to test the auth difference algorithm,
@@ -197,37 +205,146 @@ class EventFederationWorkerStoreTestCase(tests.unittest.HomeserverTestCase):
                 )
             )
 
+        if use_chain_cover_index:
+            self.get_success(
+                self.store.db.runInteraction(
+                    "index",
+                    self.store._add_chain_cover_index_txn,
+                    room_id,
+                    {e: ("m.test", e, auth_ids) for e, auth_ids in auth_graph.items()},
+                )
+            )
+
         # Now actually test that various combinations give the right result:
 
-        difference = self.get_success(
-            self.store.get_auth_chain_difference([{"a"}, {"b"}])
-        )
-        self.assertSetEqual(difference, {"a", "b"})
+        def assert_difference(state_sets, expected):
+            difference = self.get_success(
+                self.store.get_auth_chain_difference(state_sets)
+            )
+            self.assertSetEqual(difference, expected)
+
+            if use_chain_cover_index:
+                difference = self.get_success(
+                    self.store.db.runInteraction(
+                        "difference",
+                        self.store._get_auth_chain_difference_using_index_txn,
+                        state_sets,
+                    )
+                )
+                self.assertSetEqual(difference, expected)
+
+        assert_difference([{"a"}, {"b"}], {"a", "b"})
+        assert_difference([{"a"}, {"b"}, {"c"}], {"a", "b", "c", "e", "f"})
+        assert_difference([{"a", "c"}, {"b"}], {"a", "b", "c"})
+        assert_difference([{"a"}, {"b"}, {"d"}], {"a", "b", "d", "e"})
+        assert_difference([{"a"}, {"b"}, {"c"}, {"d"}], {"a", "b", "c", "d", "e", "f"})
+        assert_difference([{"a"}, {"b"}, {"e"}], {"a", "b"})
+        assert_difference([{"a"}], set())
+
+        auth_chain = self.get_success(self.store.get_auth_chain_ids(["a", "c"]))
+        self.assertCountEqual(auth_chain, ["e", "f", "g", "h", "i", "j", "k"])
+
+    def test_chain_cover_index_random_graphs(self):
+        """Checks the auth chain index against the auth chains worked out
+        directly, for random auth graphs added to the index out of order.
+        """
+        rng = random.Random(1234)
+        room_id = "!room:local"
+
+        # Build a random auth graph, where events often refer to the previous
+        # event with the same type and state key so that we build up chains.
+        auth_graph = {}
+        event_types = {}
+        latest_by_type = {}
+        for i in range(150):
+            event_id = "$event%d" % (i,)
+            state_key = "key%d" % (rng.randrange(5),)
+
+            auth_ids = set(rng.sample(list(auth_graph), min(len(auth_graph), 2)))
+            previous = latest_by_type.get(state_key)
+            if previous is not None:
+                auth_ids.add(previous)
+
+            auth_graph[event_id] = auth_ids
+            event_types[event_id] = ("m.test", state_key)
+            latest_by_type[state_key] = event_id
+
+        def get_auth_chain(event_ids):
+            chain = set()
+            front = set(event_ids)
+            while front:
+                front = set().union(*(auth_graph[e] for e in front)) - chain
+                chain.update(front)
+            return chain
+
+        def insert_events(txn, event_ids):
+            self.store.db.simple_insert_many_txn(
+                txn,
+                table="state_events",
+                values=[
+                    {
+                        "event_id": event_id,
+                        "room_id": room_id,
+                        "type": event_types[event_id][0],
+                        "state_key": event_types[event_id][1],
+                    }
+                    for event_id in event_ids
+                ],
+            )
+            self.store.db.simple_insert_many_txn(
+                txn,
+                table="event_auth",
+                values=[
+                    {"event_id": event_id, "room_id": room_id, "auth_id": auth_id}
+                    for event_id in event_ids
+                    for auth_id in auth_graph[event_id]
+                ],
+            )
+            self.store._add_chain_cover_index_txn(
+                txn,
+                room_id,
+                {
+                    event_id: event_types[event_id] + (auth_graph[event_id],)
+                    for event_id in event_ids
+                },
+            )
 
-        difference = self.get_success(
-            self.store.get_auth_chain_difference([{"a"}, {"b"}, {"c"}])
-        )
-        self.assertSetEqual(difference, {"a", "b", "c", "e", "f"})
+        # Add the events in batches in a random order, so that some events
+        # arrive before their auth events.
+        event_ids = list(auth_graph)
+        rng.shuffle(event_ids)
+        for i in range(0, len(event_ids), 10):
+            self.get_success(
+                self.store.db.runInteraction(
+                    "insert", insert_events, event_ids[i : i + 10]
+                )
+            )
 
-        difference = self.get_success(
-            self.store.get_auth_chain_difference([{"a", "c"}, {"b"}])
+        # Everything should have been added to the index by now.
+        rows = self.get_success(
+            self.store.db.simple_select_list(
+                "event_auth_chain_to_calculate", {}, ("event_id",)
+            )
         )
-        self.assertSetEqual(difference, {"a", "b", "c"})
+        self.assertEqual(rows, [])
 
-        difference = self.get_success(
-            self.store.get_auth_chain_difference([{"a"}, {"b"}, {"d"}])
-        )
-        self.assertSetEqual(difference, {"a", "b", "d", "e"})
+        for _ in range(50):
+            state_sets = [
+                set(rng.sample(list(auth_graph), rng.randrange(1, 4)))
+                for _ in range(rng.randrange(1, 4))
+            ]
 
-        difference = self.get_success(
-            self.store.get_auth_chain_difference([{"a"}, {"b"}, {"c"}, {"d"}])
-        )
-        self.assertSetEqual(difference, {"a", "b", "c", "d", "e", "f"})
+            auth_chains = [get_auth_chain(s) | s for s in state_sets]
+            expected = set().union(*auth_chains) - set.intersection(*auth_chains)
 
-        difference = self.get_success(
-            self.store.get_auth_chain_difference([{"a"}, {"b"}, {"e"}])
-        )
-        self.assertSetEqual(difference, {"a", "b"})
+            difference = self.get_success(
+                self.store.db.runInteraction(
+                    "difference",
+                    self.store._get_auth_chain_difference_using_index_txn,
+                    state_sets,
+                )
+            )
+            self.assertSetEqual(difference, expected)
 
-        difference = self.get_success(self.store.get_auth_chain_difference([{"a"}]))
-        self.assertSetEqual(difference, set())
+            auth_chain = self.get_success(self.store.get_auth_chain_ids(state_sets[0]))
+            self.assertSetEqual(set(auth_chain), get_auth_chain(state_sets[0]))
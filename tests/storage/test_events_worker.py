@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+from mock import Mock
+
+from synapse.rest import admin
+from synapse.rest.client.v1 import login, room
+
+from tests.unittest import HomeserverTestCase, override_config
+
+
+class LazyEventDecodingTestCase(HomeserverTestCase):
+    servlets = [
+        admin.register_servlets_for_client_rest_resource,
+        login.register_servlets,
+        room.register_servlets,
+    ]
+
+    def prepare(self, reactor, clock, hs):
+        self.store = hs.get_datastore()
+
+        self.user_id = self.register_user("user", "pass")
+        self.token = self.login("user", "pass")
+        self.room_id = self.helper.create_room_as(self.user_id, tok=self.token)
+
+    def _get_uncached_event(self, event_id):
+        self.store._get_event_cache.invalidate_all()
+        return self.get_success(self.store.get_event(event_id))
+
+    def test_message_is_lazy(self):
+        event_id = self.helper.send(self.room_id, body="hello", tok=self.token)[
+            "event_id"
+        ]
+
+        event = self._get_uncached_event(event_id)
+        self.assertEqual(event.event_id, event_id)
+        self.assertEqual(event.type, "m.room.message")
+        self.assertEqual(event.sender, self.user_id)
+        self.assertFalse(event.is_state())
+
+        # reading the header shouldn't have decoded the body
+        self.assertIsNotNone(event._lazy_json)
+
+        self.assertEqual(event.content["body"], "hello")
+        self.assertIsNone(event._lazy_json)
+
+    def test_state_event_is_lazy(self):
+        self.helper.send_state(
+            self.room_id, "m.room.topic", {"topic": "test"}, tok=self.token
+        )
+        state_ids = self.get_success(self.store.get_current_state_ids(self.room_id))
+        event_id = state_ids[("m.room.topic", "")]
+
+        event = self._get_uncached_event(event_id)
+        self.assertTrue(event.is_state())
+        self.assertEqual(event.state_key, "")
+        self.assertIsNotNone(event._lazy_json)
+
+        self.assertEqual(event.content, {"topic": "test"})
+
+    def test_rejected_state_event(self):
+        """Rejected events have no `state_events` row, so must be decoded up
+        front to find out whether they are state events.
+        """
+        self.helper.send_state(
+            self.room_id, "m.room.topic", {"topic": "test"}, tok=self.token
+        )
+        state_ids = self.get_success(self.store.get_current_state_ids(self.room_id))
+        event_id = state_ids[("m.room.topic", "")]
+
+        # make the event look like one which was rejected when it was persisted
+        self.get_success(
+            self.store.db.simple_delete(
+                table="state_events", keyvalues={"event_id": event_id}, desc="test"
+            )
+        )
+        self.get_success(
+            self.store.db.simple_insert(
+                table="rejections",
+                values={"event_id": event_id, "reason": "test", "last_check": "now"},
+                desc="test",
+            )
+        )
+
+        self.store._get_event_cache.invalidate_all()
+        event = self.get_success(self.store.get_event(event_id, allow_rejected=True))
+        self.assertTrue(event.is_state())
+        self.assertEqual(event.state_key, "")
+        self.assertEqual(event.rejected_reason, "test")
+
+    @override_config({"lazy_event_decoding": False})
+    def test_disabled(self):
+        event_id = self.helper.send(self.room_id, body="hello", tok=self.token)[
+            "event_id"
+        ]
+
+        event = self._get_uncached_event(event_id)
+        self.assertIsNone(event._lazy_json)
+        self.assertEqual(event.content["body"], "hello")
+
+
+class EventFetchTestCase(HomeserverTestCase):
+    servlets = [
+        admin.register_servlets_for_client_rest_resource,
+        login.register_servlets,
+        room.register_servlets,
+    ]
+
+    def prepare(self, reactor, clock, hs):
+        self.store = hs.get_datastore()
+
+        self.user_id = self.register_user("user", "pass")
+        self.token = self.login("user", "pass")
+        self.room_id = self.helper.create_room_as(self.user_id, tok=self.token)
+
+    @override_config({"event_fetch_threads": 1})
+    def test_events_built_by_fetcher(self):
+        event_ids = [
+            self.helper.send(self.room_id, body=str(i), tok=self.token)["event_id"]
+            for i in range(3)
+        ]
+
+        row_map = self.get_success(self.store._enqueue_events(event_ids))
+
+        for i, event_id in enumerate(event_ids):
+            event = row_map[event_id]["event"]
+            self.assertEqual(event.event_id, event_id)
+            self.assertEqual(event.content["body"], str(i))
+
+        # the fetcher thread should have finished
+        self.assertEqual(self.store._event_fetch_ongoing, 0)
+        self.assertEqual(self.store._event_fetch_list, [])
+
+
+class SharedEventCacheTestCase(HomeserverTestCase):
+    servlets = [
+        admin.register_servlets_for_client_rest_resource,
+        login.register_servlets,
+        room.register_servlets,
+    ]
+
+    def default_config(self, name="test"):
+        config = super().default_config(name)
+        config["shared_event_cache_path"] = os.path.join(self.mktemp(), "events")
+        config["shared_event_cache_size"] = "1M"
+        return config
+
+    def make_homeserver(self, reactor, clock):
+        config = self.default_config()
+        os.makedirs(os.path.dirname(config["shared_event_cache_path"]))
+        return self.setup_test_homeserver(config=config)
+
+    def prepare(self, reactor, clock, hs):
+        self.store = hs.get_datastore()
+
+        self.user_id = self.register_user("user", "pass")
+        self.token = self.login("user", "pass")
+        self.room_id = self.helper.create_room_as(self.user_id, tok=self.token)
+
+    def test_shared_cache_hit(self):
+        event_id = self.helper.send(self.room_id, body="hello", tok=self.token)[
+            "event_id"
+        ]
+
+        # loading the event from the database fills the shared cache
+        self.store._get_event_cache.invalidate_all()
+        self.get_success(self.store.get_event(event_id))
+        self.assertIsNotNone(self.store._shared_event_cache.get(event_id))
+
+        # ... so the next L1 miss shouldn't hit the database.
+        self.store._get_event_cache.invalidate_all()
+        self.store._enqueue_events = Mock(side_effect=AssertionError("db fetch"))
+        event = self.get_success(self.store.get_event(event_id))
+        self.assertEqual(event.event_id, event_id)
+        self.assertEqual(event.sender, self.user_id)
+        self.assertEqual(event.content["body"], "hello")
+
+    def test_invalidation(self):
+        event_id = self.helper.send(self.room_id, body="hello", tok=self.token)[
+            "event_id"
+        ]
+
+        self.store._get_event_cache.invalidate_all()
+        self.get_success(self.store.get_event(event_id))
+        self.assertIsNotNone(self.store._shared_event_cache.get(event_id))
+
+        # redacting the event should invalidate it in the shared cache too
+        request, channel = self.make_request(
+            "PUT",
+            "/rooms/%s/redact/%s/txn1" % (self.room_id, event_id),
+            access_token=self.token,
+            content="{}",
+        )
+        self.render(request)
+        self.assertEqual(200, channel.code, channel.json_body)
+        self.assertIsNone(self.store._shared_event_cache.get(event_id))
+
+        self.store._get_event_cache.invalidate_all()
+        event = self.get_success(self.store.get_event(event_id))
+        self.assertTrue(event.internal_metadata.is_redacted())
+        self.assertEqual(event.content, {})
+
+    def test_invalidated_during_fetch(self):
+        event_id = self.helper.send(self.room_id, body="hello", tok=self.token)[
+            "event_id"
+        ]
+        self.store._get_event_cache.invalidate_all()
+        self.store._shared_event_cache.invalidate(event_id)
+
+        # invalidate the event after its row has been read from the database,
+        # but before the fetcher has filled the shared cache
+        fetch_event_rows = self.store._fetch_event_rows
+
+        def _fetch_event_rows(txn, event_ids):
+            rows = fetch_event_rows(txn, event_ids)
+            self.store._invalidate_get_event_cache(event_id)
+            return rows
+
+        self.store._fetch_event_rows = _fetch_event_rows
+        self.get_success(self.store.get_event(event_id))
+
+        # the possibly stale row shouldn't have been added to the shared cache
+        self.assertIsNone(self.store._shared_event_cache.get(event_id))
+
+        # ... but later fetches should still fill it
+        self.store._fetch_event_rows = fetch_event_rows
+        self.store._get_event_cache.invalidate_all()
+        self.get_success(self.store.get_event(event_id))
+        self.assertIsNotNone(self.store._shared_event_cache.get(event_id))
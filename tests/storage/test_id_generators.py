@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from twisted.internet import defer
+
+from synapse.storage.util.id_generators import MultiWriterIdGenerator
+
+from tests.unittest import HomeserverTestCase
+from tests.utils import USE_POSTGRES_FOR_TESTS
+
+
+class MultiWriterIdGeneratorTestCase(HomeserverTestCase):
+    def prepare(self, reactor, clock, hs):
+        self.store = hs.get_datastore()
+        self.db = self.store.db
+
+        self.get_success(self.db.runInteraction("_setup_db", self._setup_db))
+
+    def _setup_db(self, txn):
+        txn.execute("CREATE TABLE foobar (stream_id BIGINT NOT NULL, data TEXT)")
+        txn.execute("INSERT INTO foobar VALUES (5, 'hello')")
+
+    def _create_id_generator(self, instance_name="master", writers=["master"]):
+        def _create(conn):
+            return MultiWriterIdGenerator(
+                conn,
+                self.db,
+                stream_name="test_stream",
+                instance_name=instance_name,
+                table="foobar",
+                id_column="stream_id",
+                sequence_name="foobar_seq",
+                writers=writers,
+            )
+
+        return self.get_success(self.db.runWithConnection(_create))
+
+    def _get_next(self, id_gen):
+        """Gets a new ID, returning it and a deferred which finishes with it."""
+        got_id = []
+        finish = defer.Deferred()
+
+        async def _get_next_async():
+            async with id_gen.get_next() as stream_id:
+                got_id.append(stream_id)
+                await finish
+
+        d = defer.ensureDeferred(_get_next_async())
+        self.pump()
+        return got_id[0], finish, d
+
+    def test_single_writer(self):
+        id_gen = self._create_id_generator()
+
+        self.assertEqual(id_gen.get_positions(), {"master": 5})
+        self.assertEqual(id_gen.get_current_token(), 5)
+
+        stream_id, finish, d = self._get_next(id_gen)
+        self.assertEqual(stream_id, 6)
+
+        # Not finished yet, so the token doesn't move.
+        self.assertEqual(id_gen.get_current_token(), 5)
+
+        finish.callback(None)
+        self.get_success(d)
+        self.assertEqual(id_gen.get_current_token(), 6)
+        self.assertEqual(id_gen.get_current_token_for_writer("master"), 6)
+
+    def test_out_of_order_finish(self):
+        id_gen = self._create_id_generator()
+
+        first_id, first_finish, first_d = self._get_next(id_gen)
+        second_id, second_finish, second_d = self._get_next(id_gen)
+        self.assertEqual((first_id, second_id), (6, 7))
+
+        # The token can't move past the first ID until it has finished.
+        second_finish.callback(None)
+        self.get_success(second_d)
+        self.assertEqual(id_gen.get_current_token(), 5)
+
+        first_finish.callback(None)
+        self.get_success(first_d)
+        self.assertEqual(id_gen.get_current_token(), 7)
+
+    def test_get_next_mult(self):
+        id_gen = self._create_id_generator()
+
+        async def _get_next_mult_async():
+            async with id_gen.get_next_mult(3) as stream_ids:
+                self.assertEqual(stream_ids, [6, 7, 8])
+                self.assertEqual(id_gen.get_current_token(), 5)
+
+        self.get_success(defer.ensureDeferred(_get_next_mult_async()))
+        self.assertEqual(id_gen.get_current_token(), 8)
+
+    def test_get_next_txn(self):
+        id_gen = self._create_id_generator()
+
+        def _get_next_txn(txn):
+            stream_id = id_gen.get_next_txn(txn)
+            self.assertEqual(stream_id, 6)
+
+            # Not finished until the transaction completes.
+            self.assertEqual(id_gen.get_current_token(), 5)
+
+        self.get_success(self.db.runInteraction("test", _get_next_txn))
+        self.assertEqual(id_gen.get_current_token(), 6)
+
+    def test_get_next_txn_failure(self):
+        id_gen = self._create_id_generator()
+
+        def _get_next_txn(txn):
+            id_gen.get_next_txn(txn)
+            raise Exception("Failed to persist")
+
+        self.get_failure(self.db.runInteraction("test", _get_next_txn), Exception)
+
+        # The ID is never going to be persisted, so the stream can move past it.
+        self.assertEqual(id_gen.get_current_token(), 6)
+
+    def test_multiple_writers_need_postgres(self):
+        if USE_POSTGRES_FOR_TESTS:
+            return
+
+        def _create(conn):
+            return MultiWriterIdGenerator(
+                conn,
+                self.db,
+                stream_name="test_stream",
+                instance_name="first",
+                table="foobar",
+                id_column="stream_id",
+                sequence_name="foobar_seq",
+                writers=["first", "second"],
+            )
+
+        self.get_failure(self.db.runWithConnection(_create), Exception)
+
+
+class PostgresMultiWriterIdGeneratorTestCase(MultiWriterIdGeneratorTestCase):
+    if not USE_POSTGRES_FOR_TESTS:
+        skip = "Requires Postgres"
+
+    def _setup_db(self, txn):
+        super(PostgresMultiWriterIdGeneratorTestCase, self)._setup_db(txn)
+        txn.execute("CREATE SEQUENCE foobar_seq START WITH 6")
+
+    def test_two_writers(self):
+        writers = ["first", "second"]
+        first_gen = self._create_id_generator("first", writers)
+        second_gen = self._create_id_generator("second", writers)
+
+        first_id, first_finish, first_d = self._get_next(first_gen)
+        second_id, second_finish, second_d = self._get_next(second_gen)
+        self.assertEqual((first_id, second_id), (6, 7))
+
+        second_finish.callback(None)
+        self.get_success(second_d)
+        self.assertEqual(second_gen.get_current_token_for_writer("second"), 7)
+
+        # The first writer hasn't finished, so the stream as a whole can't move
+        # on, even once the first generator hears of the second's position.
+        first_gen.advance("second", 7)
+        self.assertEqual(first_gen.get_current_token(), 5)
+
+        first_finish.callback(None)
+        self.get_success(first_d)
+
+        # The first writer is idle, so is as far along as anyone.
+        self.assertEqual(first_gen.get_positions(), {"first": 7, "second": 7})
+        self.assertEqual(first_gen.get_current_token(), 7)
+
+        # The second hasn't heard from the first yet.
+        self.assertEqual(second_gen.get_current_token(), 5)
+        second_gen.advance("first", 7)
+        self.assertEqual(second_gen.get_current_token(), 7)
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from twisted.internet import defer
+
+from synapse.logging.context import make_deferred_yieldable
+from synapse.storage.persist_events import _EventPeristenceQueue
+
+from tests import unittest
+from tests.server import get_clock
+
+
+class EventPersistenceQueueTestCase(unittest.TestCase):
+    def setUp(self):
+        self.reactor, self.clock = get_clock()
+
+        # The batches passed to the callback, and the deferreds which finish
+        # them.
+        self.batches = []
+        self.batch_deferreds = []
+
+    def _create_queue(self, batch_latency_ms=0):
+        def per_batch_callback(items):
+            self.batches.append(
+                {item.room_id: list(item.events_and_contexts) for item in items}
+            )
+            d = defer.Deferred()
+            self.batch_deferreds.append(d)
+            return make_deferred_yieldable(d)
+
+        return _EventPeristenceQueue(self.clock, per_batch_callback, batch_latency_ms)
+
+    def test_coalesces_rooms(self):
+        queue = self._create_queue()
+
+        d1 = queue.add_to_queue("!a:test", ["a1"], backfilled=False)
+        d2 = queue.add_to_queue("!b:test", ["b1"], backfilled=False)
+        queue.handle_queue()
+
+        self.assertEqual(self.batches, [{"!a:test": ["a1"], "!b:test": ["b1"]}])
+        self.assertFalse(d1.called)
+
+        self.batch_deferreds[0].callback(None)
+        self.assertTrue(d1.called)
+        self.assertTrue(d2.called)
+
+    def test_room_ordering(self):
+        queue = self._create_queue()
+
+        queue.add_to_queue("!a:test", ["a1"], backfilled=False)
+        queue.handle_queue()
+
+        # The room is already being persisted, so its next events have to wait
+        # for the first batch, but other rooms don't.
+        queue.add_to_queue("!a:test", ["a2"], backfilled=False)
+        queue.add_to_queue("!b:test", ["b1"], backfilled=False)
+        queue.handle_queue()
+
+        self.assertEqual(self.batches, [{"!a:test": ["a1"]}, {"!b:test": ["b1"]}])
+
+        self.batch_deferreds[0].callback(None)
+        self.assertEqual(self.batches[2], {"!a:test": ["a2"]})
+
+    def test_backfilled_not_mixed(self):
+        queue = self._create_queue()
+
+        queue.add_to_queue("!a:test", ["a1"], backfilled=False)
+        queue.add_to_queue("!b:test", ["b1"], backfilled=True)
+        queue.handle_queue()
+
+        self.assertEqual(self.batches, [{"!a:test": ["a1"]}, {"!b:test": ["b1"]}])
+
+    def test_latency_budget(self):
+        queue = self._create_queue(batch_latency_ms=10)
+
+        queue.add_to_queue("!a:test", ["a1"], backfilled=False)
+        queue.handle_queue()
+        self.reactor.advance(0.005)
+        self.assertEqual(self.batches, [])
+
+        queue.add_to_queue("!b:test", ["b1"], backfilled=False)
+        queue.handle_queue()
+        self.reactor.advance(0.005)
+        self.assertEqual(self.batches, [{"!a:test": ["a1"], "!b:test": ["b1"]}])
+
+    def test_full_batch_not_delayed(self):
+        queue = self._create_queue(batch_latency_ms=10)
+
+        queue.add_to_queue("!a:test", ["a%d" % (i,) for i in range(100)], False)
+        queue.handle_queue()
+        self.assertEqual(len(self.batches), 1)
+
+    def test_failed_batch_retried_by_room(self):
+        queue = self._create_queue()
+
+        d1 = queue.add_to_queue("!a:test", ["a1"], backfilled=False)
+        d2 = queue.add_to_queue("!b:test", ["b1"], backfilled=False)
+        queue.handle_queue()
+
+        self.batch_deferreds[0].errback(Exception("Failed"))
+        self.assertEqual(self.batches[1:], [{"!a:test": ["a1"]}])
+
+        self.batch_deferreds[1].errback(Exception("Failed"))
+        self.assertEqual(self.batches[2:], [{"!b:test": ["b1"]}])
+
+        self.batch_deferreds[2].callback(None)
+        self.failureResultOf(d1, Exception)
+        self.successResultOf(d2)
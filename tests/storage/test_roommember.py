@@ -114,6 +114,31 @@ class RoomMemberStoreTestCase(unittest.HomeserverTestCase):
         # It now knows about Charlie's server.
         self.assertEqual(self.store._known_servers_count, 2)
 
+    def test_hosts_sharing_room_with_user(self):
+        self.room = self.helper.create_room_as(self.u_alice, tok=self.t_alice)
+
+        hosts = self.get_success(
+            self.store.get_hosts_sharing_room_with_user(self.u_alice)
+        )
+        self.assertEqual(hosts, {"test"})
+
+        # The cached hosts are invalidated when someone joins one of the
+        # user's rooms.
+        self.inject_room_member(self.room, self.u_charlie.to_string(), Membership.JOIN)
+
+        hosts = self.get_success(
+            self.store.get_hosts_sharing_room_with_user(self.u_alice)
+        )
+        self.assertEqual(hosts, {"test", "elsewhere"})
+
+        # ... and when the user leaves the room.
+        self.helper.leave(self.room, self.u_alice, tok=self.t_alice)
+
+        hosts = self.get_success(
+            self.store.get_hosts_sharing_room_with_user(self.u_alice)
+        )
+        self.assertEqual(hosts, set())
+
 
 class CurrentStateMembershipUpdateTestCase(unittest.HomeserverTestCase):
     def prepare(self, reactor, clock, homeserver):
@@ -527,3 +527,71 @@ class StateStoreTestCase(tests.unittest.TestCase):
 
         self.assertEqual(is_all, True)
         self.assertDictEqual({(e5.type, e5.state_key): e5.event_id}, state_dict)
+
+
+class StateGroupCompactionTestCase(tests.unittest.HomeserverTestCase):
+    def prepare(self, reactor, clock, hs):
+        self.store = hs.get_datastore()
+        self.state_datastore = hs.get_storage().state.stores.state
+
+        # make sure the other background updates are out of the way
+        self._run_background_updates()
+
+    def _run_background_updates(self):
+        while not self.get_success(
+            self.store.db.updates.has_completed_background_updates()
+        ):
+            self.get_success(
+                self.store.db.updates.do_next_background_update(100), by=0.1
+            )
+
+    def _get_hops(self, state_group):
+        return self.get_success(
+            self.state_datastore.db.runInteraction(
+                "count_hops",
+                self.state_datastore._count_state_group_hops_txn,
+                state_group,
+            )
+        )
+
+    def _get_full_state(self, state_groups):
+        return self.get_success(
+            self.state_datastore._get_state_groups_from_groups(
+                state_groups, StateFilter.all()
+            )
+        )
+
+    def test_compaction(self):
+        # build a long chain of state groups, each adding a member
+        state = {(EventTypes.Create, ""): "$create"}
+        state_groups = []
+        prev_group = None
+        for i in range(150):
+            delta = {(EventTypes.Member, "@user%i:test" % (i,)): "$member%i" % (i,)}
+            state = dict(state)
+            state.update(delta)
+            prev_group = self.get_success(
+                self.state_datastore.store_state_group(
+                    "$event%i" % (i,), "!room:test", prev_group, delta, state
+                )
+            )
+            state_groups.append(prev_group)
+
+        states_before = self._get_full_state(state_groups)
+        self.assertGreater(self._get_hops(state_groups[99]), 60)
+
+        self.get_success(
+            self.store.db.simple_insert(
+                "background_updates",
+                {"update_name": "state_group_compaction", "progress_json": "{}"},
+            )
+        )
+        self.store.db.updates._all_done = False
+        self._run_background_updates()
+
+        # the state of each group is unchanged...
+        self.assertEqual(self._get_full_state(state_groups), states_before)
+
+        # ... but the chains are shorter.
+        for state_group in state_groups:
+            self.assertLessEqual(self._get_hops(state_group), 60)
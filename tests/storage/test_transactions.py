@@ -13,12 +13,20 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from synapse.rest import admin
+from synapse.rest.client.v1 import login, room
 from synapse.util.retryutils import MAX_RETRY_INTERVAL
 
 from tests.unittest import HomeserverTestCase
 
 
 class TransactionStoreTestCase(HomeserverTestCase):
+    servlets = [
+        admin.register_servlets,
+        login.register_servlets,
+        room.register_servlets,
+    ]
+
     def prepare(self, reactor, clock, homeserver):
         self.store = homeserver.get_datastore()
 
@@ -56,3 +64,82 @@ class TransactionStoreTestCase(HomeserverTestCase):
 
         d = self.store.get_destination_retry_timings("example.com")
         self.get_success(d)
+
+    def test_retry_timings_with_last_successful_stream_ordering(self):
+        """Tests that a destination which only has a last successful stream
+        ordering isn't treated as backing off.
+        """
+        d = self.store.set_destination_last_successful_stream_ordering(
+            "example.com", 10
+        )
+        self.get_success(d)
+
+        d = self.store.get_destination_retry_timings("example.com")
+        self.assertIsNone(self.get_success(d))
+
+        d = self.store.set_destination_retry_timings("example.com", 1000, 50, 100)
+        self.get_success(d)
+
+        d = self.store.get_destination_retry_timings("example.com")
+        r = self.get_success(d)
+        self.assert_dict(
+            {"retry_last_ts": 50, "retry_interval": 100, "failure_ts": 1000}, r
+        )
+
+        d = self.store.get_destination_last_successful_stream_ordering("example.com")
+        self.assertEqual(self.get_success(d), 10)
+
+    def test_catch_up_room_events(self):
+        """Tests that only the latest event of each room after the last
+        successful stream ordering is returned for catch-up.
+        """
+        user_id = self.register_user("user", "pass")
+        tok = self.login("user", "pass")
+
+        room_1 = self.helper.create_room_as(user_id, tok=tok)
+        room_2 = self.helper.create_room_as(user_id, tok=tok)
+
+        event_ids = [
+            self.helper.send(room_1, "1", tok=tok)["event_id"],
+            self.helper.send(room_2, "2", tok=tok)["event_id"],
+            self.helper.send(room_1, "3", tok=tok)["event_id"],
+        ]
+        orderings = [
+            self.get_success(
+                self.store.db.simple_select_one_onecol(
+                    table="events",
+                    keyvalues={"event_id": event_id},
+                    retcol="stream_ordering",
+                )
+            )
+            for event_id in event_ids
+        ]
+
+        for room_id, stream_ordering in zip((room_1, room_2, room_1), orderings):
+            self.get_success(
+                self.store.store_destination_rooms_entries(
+                    ["example.com"], room_id, stream_ordering
+                )
+            )
+
+        # We have never sent anything to the destination, so don't know what it
+        # missed.
+        d = self.store.get_catch_up_outstanding_destinations(None)
+        self.assertEqual(self.get_success(d), [])
+
+        d = self.store.set_destination_last_successful_stream_ordering(
+            "example.com", orderings[0]
+        )
+        self.get_success(d)
+
+        d = self.store.get_catch_up_outstanding_destinations(None)
+        self.assertEqual(self.get_success(d), ["example.com"])
+
+        d = self.store.get_catch_up_room_events("example.com", orderings[0])
+        self.assertEqual(
+            self.get_success(d),
+            [(event_ids[1], orderings[1]), (event_ids[2], orderings[2])],
+        )
+
+        d = self.store.get_catch_up_room_events("example.com", orderings[2])
+        self.assertEqual(self.get_success(d), [])
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from mock import Mock
+
+from twisted.internet import defer
+
+from synapse.api.constants import EventTypes
+
+from tests import unittest
+
+
+class NotifierWakeupTestCase(unittest.HomeserverTestCase):
+    def prepare(self, reactor, clock, hs):
+        self.notifier = hs.get_notifier()
+
+    def _wait_for_events(self, user_id, rooms):
+        """Starts waiting for new events for the given user, returning a
+        deferred which resolves with the user's token once they are woken.
+        """
+
+        async def callback(before_token, after_token):
+            if after_token.is_after(before_token):
+                return after_token
+
+        from_token = self.get_success(self.hs.get_event_sources().get_current_token())
+        d = defer.ensureDeferred(
+            self.notifier.wait_for_events(
+                user_id, 30000, callback, room_ids=rooms, from_token=from_token
+            )
+        )
+        self.assertNoResult(d)
+        return d
+
+    def test_wakeups_deferred(self):
+        d = self._wait_for_events("@user:test", ["!room:test"])
+        user_stream = self.notifier.user_to_user_stream["@user:test"]
+
+        self.notifier.on_new_event("typing_key", 1, rooms=["!room:test"])
+
+        # The stream knows about the event straight away, so new listeners
+        # won't wait for it, but the existing listeners are woken later.
+        self.assertEqual(user_stream.current_token.typing_key, 1)
+        self.assertNoResult(d)
+
+        self.reactor.advance(0)
+        self.assertEqual(self.successResultOf(d).typing_key, 1)
+
+    def test_wakeups_deduplicated(self):
+        d = self._wait_for_events("@user:test", ["!room:test"])
+        user_stream = self.notifier.user_to_user_stream["@user:test"]
+
+        self.notifier.on_new_event("typing_key", 1, rooms=["!room:test"])
+        self.notifier.on_new_event(
+            "typing_key", 2, users=["@user:test"], rooms=["!room:test"]
+        )
+        self.assertEqual(list(self.notifier._pending_wakeups), [user_stream])
+
+        self.reactor.advance(0)
+        self.assertEqual(self.successResultOf(d).typing_key, 2)
+
+    def test_wakeups_spread_out(self):
+        self.notifier.MAX_WAKEUPS_PER_ITERATION = 2
+
+        ds = [
+            self._wait_for_events("@user%d:test" % (i,), ["!room:test"])
+            for i in range(5)
+        ]
+
+        self.notifier.on_new_event("typing_key", 1, rooms=["!room:test"])
+
+        # Only the first two are woken in the first go, and the rest are left
+        # for later.
+        self.notifier._wakeup_call.cancel()
+        self.notifier._wake_pending_user_streams()
+        self.assertEqual(len([d for d in ds if d.called]), 2)
+        self.assertIsNotNone(self.notifier._wakeup_call)
+
+        self.reactor.advance(0)
+        self.assertEqual(len([d for d in ds if d.called]), 5)
+
+    def test_room_event_wakeups_kept(self):
+        """Streams queued for wake-up by one room event are still woken after
+        another room event is notified in the same iteration.
+        """
+        d1 = self._wait_for_events("@user1:test", ["!room1:test"])
+        d2 = self._wait_for_events("@user2:test", ["!room2:test"])
+
+        token = self.get_success(self.hs.get_event_sources().get_current_token())
+        stream_id = token.room_stream_id
+
+        for room_id in ("!room1:test", "!room2:test"):
+            stream_id += 1
+            event = Mock(type=EventTypes.Message, room_id=room_id)
+            self.notifier.on_new_room_event(event, stream_id, stream_id)
+
+        self.reactor.advance(0)
+        self.assertEqual(self.successResultOf(d1).room_stream_id, stream_id - 1)
+        self.assertEqual(self.successResultOf(d2).room_stream_id, stream_id)
@@ -17,6 +17,8 @@ import re
 
 from six import StringIO
 
+from canonicaljson import encode_canonical_json
+
 from twisted.internet.defer import Deferred
 from twisted.python.failure import Failure
 from twisted.test.proto_helpers import AccumulatingProtocol
@@ -27,6 +29,7 @@ from synapse.api.errors import Codes, RedirectException, SynapseError
 from synapse.http.server import (
     DirectServeResource,
     JsonResource,
+    iterencode_json,
     wrap_html_request_handler,
 )
 from synapse.http.site import SynapseSite, logger
@@ -167,6 +170,54 @@ class JsonResourceTests(unittest.TestCase):
         self.assertEqual(channel.json_body["error"], "Unrecognized request")
         self.assertEqual(channel.json_body["errcode"], "M_UNRECOGNIZED")
 
+    def test_stream_response(self):
+        """
+        Responses from callbacks registered with stream_response are written in
+        pieces, without a Content-Length.
+        """
+        body = {
+            "rooms": {
+                "!room%d:test" % (i,): {"events": [{"body": "x" * 100}] * 10}
+                for i in range(200)
+            }
+        }
+
+        def _callback(request, **kwargs):
+            return 200, body
+
+        res = JsonResource(self.homeserver, canonical_json=False)
+        res.register_paths(
+            "GET",
+            [re.compile("^/_matrix/foo$")],
+            _callback,
+            "test_servlet",
+            stream_response=True,
+        )
+
+        request, channel = make_request(self.reactor, b"GET", b"/_matrix/foo")
+        render(request, res, self.reactor)
+
+        self.assertEqual(channel.result["code"], b"200")
+        self.assertTrue(channel.result["done"])
+        self.assertFalse(channel.headers.hasHeader(b"Content-Length"))
+        self.assertEqual(channel.json_body, body)
+
+    def test_iterencode_json(self):
+        """
+        Encoding an object in pieces gives the same result as encoding it in
+        one go.
+        """
+        obj = {
+            "b": [1, {"z": None, "a": ["\N{SNOWMAN}", 2.5]}, []],
+            "a": {"c": {"d": {"e": {"f": True}}}, "": {}},
+        }
+
+        for depth in range(6):
+            encoded = b"".join(
+                iterencode_json(obj, encode_canonical_json, depth, sort_keys=True)
+            )
+            self.assertEqual(encoded, encode_canonical_json(obj), depth)
+
 
 class WrapHtmlRequestHandlerTests(unittest.TestCase):
     class TestResource(DirectServeResource):
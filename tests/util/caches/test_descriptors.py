@@ -18,7 +18,7 @@ from functools import partial
 
 import mock
 
-from twisted.internet import defer, reactor
+from twisted.internet import defer, reactor, task
 
 from synapse.api.errors import SynapseError
 from synapse.logging.context import (
@@ -26,6 +26,7 @@ from synapse.logging.context import (
     PreserveLoggingContext,
     make_deferred_yieldable,
 )
+from synapse.util import Clock
 from synapse.util.caches import descriptors
 from synapse.util.caches.descriptors import cached
 
@@ -352,6 +353,38 @@ class DescriptorTestCase(unittest.TestCase):
         d = obj.fn(1)
         self.failureResultOf(d, SynapseError)
 
+    def test_cache_expiry(self):
+        class Cls(object):
+            def __init__(self):
+                self.mock = mock.Mock()
+                self._clock = Clock(task.Clock())
+
+            @descriptors.cached(expiry_ms=1000)
+            def fn(self, arg1):
+                return self.mock(arg1)
+
+        obj = Cls()
+        reactor = obj._clock._reactor
+
+        obj.mock.return_value = "fish"
+        self.assertEqual(obj.fn(1).result, "fish")
+        self.assertEqual(obj.fn(2).result, "fish")
+        self.assertEqual(len(obj.fn.cache.cache), 2)
+
+        # keep accessing one of the entries, so that only the other goes idle
+        reactor.advance(0.6)
+        self.assertEqual(obj.fn(1).result, "fish")
+        reactor.advance(0.6)
+        self.assertEqual(len(obj.fn.cache.cache), 1)
+
+        obj.mock.reset_mock()
+        self.assertEqual(obj.fn(1).result, "fish")
+        obj.mock.assert_not_called()
+
+        # once nothing has been accessed for a while, the cache should be empty
+        reactor.advance(2)
+        self.assertEqual(len(obj.fn.cache.cache), 0)
+
 
 class CachedListDescriptorTestCase(unittest.TestCase):
     @defer.inlineCallbacks
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+from synapse.util.caches.mmapcache import SharedMmapCache
+
+from tests import unittest
+
+
+class SharedMmapCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        tempdir = self.mktemp()
+        os.mkdir(tempdir)
+        self.path = os.path.join(tempdir, "cache")
+
+    def _open(self, size=64 * 1024, slot_size=256):
+        cache = SharedMmapCache("test_cache", self.path, size, slot_size)
+        self.addCleanup(cache.close)
+        return cache
+
+    def test_get_set(self):
+        cache = self._open()
+        self.assertIsNone(cache.get("one"))
+
+        self.assertTrue(cache.set("one", b"1"))
+        self.assertTrue(cache.set("two", b"2"))
+        self.assertEqual(cache.get("one"), b"1")
+        self.assertEqual(cache.get("two"), b"2")
+        self.assertEqual(len(cache), 2)
+
+        self.assertTrue(cache.set("one", b"uno"))
+        self.assertEqual(cache.get("one"), b"uno")
+
+    def test_too_large(self):
+        cache = self._open()
+        self.assertFalse(cache.set("big", b"x" * 256))
+        self.assertIsNone(cache.get("big"))
+
+    def test_invalidate(self):
+        cache = self._open()
+        cache.set("one", b"1")
+        cache.set("two", b"2")
+
+        cache.invalidate("one")
+        self.assertIsNone(cache.get("one"))
+        self.assertEqual(cache.get("two"), b"2")
+
+        cache.invalidate_all()
+        self.assertIsNone(cache.get("two"))
+        self.assertEqual(len(cache), 0)
+
+    def test_collision(self):
+        # with a single slot, every key shares it
+        cache = self._open(size=1024, slot_size=512)
+        cache.set("one", b"1")
+        cache.set("two", b"2")
+        self.assertIsNone(cache.get("one"))
+
+        # invalidating a key which isn't there leaves the slot alone
+        cache.invalidate("one")
+        self.assertEqual(cache.get("two"), b"2")
+
+    def test_torn_entry(self):
+        cache = self._open()
+        cache.set("one", b"1")
+
+        # corrupt the payload, as a concurrent write might
+        offset = cache._slot_offset(b"one")
+        cache._mmap[offset + 16] ^= 0xFF
+        self.assertIsNone(cache.get("one"))
+
+    def test_shared(self):
+        cache1 = self._open()
+        cache2 = self._open()
+
+        cache1.set("one", b"1")
+        self.assertEqual(cache2.get("one"), b"1")
+
+        cache2.invalidate("one")
+        self.assertIsNone(cache1.get("one"))
+
+    def test_set_after_invalidation(self):
+        cache1 = self._open()
+        cache2 = self._open()
+
+        # another process invalidates the key after we read the value, but
+        # before we store it
+        generation = cache1.generation()
+        cache2.invalidate("one")
+        self.assertFalse(cache1.set("one", b"stale", generation=generation))
+        self.assertIsNone(cache2.get("one"))
+
+        # values read after the invalidation can be stored
+        generation = cache1.generation()
+        self.assertTrue(cache1.set("one", b"1", generation=generation))
+        self.assertEqual(cache2.get("one"), b"1")
+
+    def test_set_after_invalidation_of_other_key(self):
+        # with a single slot, every key shares it
+        cache = self._open(size=1024, slot_size=512)
+
+        # the invalidation is remembered even though the key wasn't cached,
+        # and another key is stored in the slot afterwards.
+        generation = cache.generation()
+        cache.invalidate("one")
+        cache.set("two", b"2")
+        self.assertFalse(cache.set("one", b"stale", generation=generation))
+        self.assertEqual(cache.get("two"), b"2")
+
+    def test_reset_when_unused(self):
+        cache = SharedMmapCache("test_cache", self.path, 64 * 1024, 256)
+        cache.set("one", b"1")
+        cache.close()
+
+        # nobody has the file open, so the entries should be thrown away
+        cache = self._open()
+        self.assertIsNone(cache.get("one"))
+
+    def test_mismatched_layout(self):
+        self._open()
+        with self.assertRaises(ValueError):
+            SharedMmapCache("test_cache", self.path, 64 * 1024, 512)
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from synapse.util.caches.memory import estimate_size
+from synapse.util.caches.state_map import MAX_STATE_MAP_DEPTH, CompactStateMap
+
+from tests import unittest
+
+CREATE = ("m.room.create", "")
+ALICE = ("m.room.member", "@alice:test")
+BOB = ("m.room.member", "@bob:test")
+
+
+class CompactStateMapTestCase(unittest.TestCase):
+    def test_mapping(self):
+        state = CompactStateMap({CREATE: "$create", ALICE: "$alice"})
+
+        self.assertEqual(len(state), 2)
+        self.assertEqual(state[ALICE], "$alice")
+        self.assertIn(CREATE, state)
+        self.assertNotIn(BOB, state)
+        self.assertIsNone(state.get(BOB))
+        self.assertEqual(dict(state), {CREATE: "$create", ALICE: "$alice"})
+        self.assertEqual(state, {CREATE: "$create", ALICE: "$alice"})
+
+    def test_base(self):
+        base = CompactStateMap({CREATE: "$create", ALICE: "$alice"})
+        state = CompactStateMap(base)
+        state.update({ALICE: "$alice2", BOB: "$bob"})
+
+        self.assertEqual(len(state), 3)
+        self.assertEqual(
+            dict(state), {CREATE: "$create", ALICE: "$alice2", BOB: "$bob"}
+        )
+
+        # the base map is unchanged
+        self.assertEqual(dict(base), {CREATE: "$create", ALICE: "$alice"})
+
+        # and only the changed entries are held by the new map
+        self.assertEqual(
+            state._state, {"m.room.member": {ALICE[1]: "$alice2", BOB[1]: "$bob"}}
+        )
+
+    def test_update_unchanged(self):
+        base = CompactStateMap({CREATE: "$create"})
+        state = CompactStateMap(base)
+        state.update({CREATE: "$create"})
+
+        self.assertEqual(len(state), 1)
+        self.assertEqual(state._state, {})
+
+    def test_depth_is_bounded(self):
+        state = CompactStateMap({CREATE: "$create"})
+        for i in range(MAX_STATE_MAP_DEPTH * 3):
+            state = CompactStateMap(state)
+            state.update({("m.room.member", "@user%i:test" % (i,)): "$%i" % (i,)})
+
+        self.assertLessEqual(state._depth, MAX_STATE_MAP_DEPTH)
+        self.assertEqual(len(state), MAX_STATE_MAP_DEPTH * 3 + 1)
+        self.assertEqual(state[CREATE], "$create")
+
+    def test_size_excludes_base(self):
+        base = CompactStateMap(
+            {("m.room.member", "@user%i:test" % (i,)): "$%i" % (i,) for i in range(50)}
+        )
+        state = CompactStateMap(base)
+        state.update({ALICE: "$alice"})
+
+        self.assertLess(estimate_size(state), estimate_size(base))
@@ -89,3 +89,22 @@ class DictCacheTestCase(unittest.TestCase):
             },
             c.value,
         )
+
+    def test_update_from(self):
+        seq = self.cache.sequence
+        self.cache.update(seq, "base", {"test": "1", "test2": "2"})
+
+        # a complete entry can be used as the base of another
+        seq = self.cache.sequence
+        self.assertTrue(self.cache.update_from(seq, "key", "base", {"test2": "3"}))
+
+        c = self.cache.get("key")
+        self.assertTrue(c.full)
+        self.assertEqual({"test": "1", "test2": "3"}, c.value)
+        self.assertEqual({"test": "1", "test2": "2"}, self.cache.get("base").value)
+
+        # ... but an incomplete one can't
+        seq = self.cache.sequence
+        self.cache.update(seq, "partial", {"test": "1"}, fetched_keys={"test"})
+        self.assertFalse(self.cache.update_from(seq, "key2", "partial", {}))
+        self.assertEqual((False, set(), {}), self.cache.get("key2"))
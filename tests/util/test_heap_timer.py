@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from synapse.util.heap_timer import HeapTimer
+
+from .. import unittest
+
+
+class HeapTimerTestCase(unittest.TestCase):
+    def test_single_insert_fetch(self):
+        timer = HeapTimer()
+
+        obj = object()
+        timer.insert(100, obj, 150)
+
+        self.assertListEqual(timer.fetch(101), [])
+        self.assertListEqual(timer.fetch(150), [])
+        self.assertListEqual(timer.fetch(151), [obj])
+        self.assertListEqual(timer.fetch(170), [])
+
+    def test_multi_insert(self):
+        timer = HeapTimer()
+
+        obj1 = object()
+        obj2 = object()
+        obj3 = object()
+        timer.insert(100, obj1, 150)
+        timer.insert(105, obj2, 130)
+        timer.insert(106, obj3, 160)
+        self.assertEqual(len(timer), 3)
+
+        self.assertListEqual(timer.fetch(110), [])
+        self.assertListEqual(timer.fetch(135), [obj2])
+        self.assertListEqual(timer.fetch(158), [obj1])
+        self.assertListEqual(timer.fetch(200), [obj3])
+        self.assertEqual(len(timer), 0)
+
+    def test_insert_past(self):
+        timer = HeapTimer()
+
+        obj = object()
+        timer.insert(100, obj, 50)
+        self.assertListEqual(timer.fetch(120), [obj])
+
+    def test_earliest_kept(self):
+        timer = HeapTimer()
+
+        timer.insert(100, "obj", 150)
+        timer.insert(100, "obj", 200)
+        timer.insert(100, "obj", 140)
+        self.assertEqual(len(timer), 1)
+
+        # The object is only returned once, for its earliest time.
+        self.assertListEqual(timer.fetch(145), ["obj"])
+        self.assertListEqual(timer.fetch(300), [])
+
+        # It can then be inserted again.
+        timer.insert(300, "obj", 350)
+        self.assertListEqual(timer.fetch(400), ["obj"])
+
+    def test_stale_entries_dropped(self):
+        timer = HeapTimer()
+
+        for then in range(1000, 0, -1):
+            timer.insert(0, "obj", then)
+
+        self.assertLess(len(timer._heap), 200)
+        self.assertListEqual(timer.fetch(2000), ["obj"])
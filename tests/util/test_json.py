@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import namedtuple
+
+from frozendict import frozendict
+
+from synapse.util import json as synapse_json
+
+from .. import unittest
+
+Row = namedtuple("Row", ("a", "b"))
+
+
+class JsonTestCase(unittest.TestCase):
+    def _codecs(self):
+        """Returns the (encoder, decoder) pairs to test: the fallback, and the
+        accelerated one if it is installed.
+        """
+        codecs = [
+            (synapse_json._FallbackJsonEncoder(), synapse_json._FallbackJsonDecoder())
+        ]
+        if synapse_json.orjson is not None:
+            codecs.append(
+                (synapse_json._OrjsonEncoder(), synapse_json._OrjsonDecoder())
+            )
+        return codecs
+
+    def test_round_trip(self):
+        obj = {
+            "content": frozendict({"body": "\N{SNOWMAN}", "n": [1, 2.5, None]}),
+            "row": Row(1, ("x", True)),
+            "big": 2 ** 70,
+            "": {},
+        }
+        expected = {
+            "content": {"body": "\N{SNOWMAN}", "n": [1, 2.5, None]},
+            "row": [1, ["x", True]],
+            "big": 2 ** 70,
+            "": {},
+        }
+
+        for encoder, decoder in self._codecs():
+            encoded = encoder.encode(obj)
+            self.assertIsInstance(encoded, str)
+            self.assertNotIn(" ", encoded)
+            self.assertEqual(decoder.decode(encoded), expected, encoder.name)
+            self.assertEqual(
+                decoder.decode(encoder.encode_bytes(obj)), expected, encoder.name
+            )
+
+    def test_decode_lenient(self):
+        """Things which only some libraries accept are still decoded."""
+        for _, decoder in self._codecs():
+            self.assertEqual(
+                decoder.decode(b'{"a": 123456789012345678901234}'),
+                {"a": 123456789012345678901234},
+            )
+            self.assertEqual(decoder.decode('["\\ud800"]'), ["\ud800"])
+
+    def test_decode_invalid(self):
+        for _, decoder in self._codecs():
+            with self.assertRaises(ValueError):
+                decoder.decode("{")
+
+    def test_encode_invalid(self):
+        for encoder, _ in self._codecs():
+            with self.assertRaises(TypeError):
+                encoder.encode({"a": object()})
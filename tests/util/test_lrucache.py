@@ -17,6 +17,7 @@
 from mock import Mock
 
 from synapse.util.caches.lrucache import LruCache
+from synapse.util.caches.memory import CacheMemoryBudget, estimate_size
 from synapse.util.caches.treecache import TreeCache
 
 from .. import unittest
@@ -255,3 +256,100 @@ class LruCacheSizedTestCase(unittest.TestCase):
         self.assertEquals(cache["key3"], [3])
         self.assertEquals(cache["key4"], [4])
         self.assertEquals(cache["key5"], [5, 6])
+
+
+class LruCacheMemoryBudgetTestCase(unittest.TestCase):
+    def test_memory_usage(self):
+        budget = CacheMemoryBudget(10 ** 9)
+        cache = LruCache(10)
+        budget.track("cache", cache)
+
+        cache["key1"] = "x" * 1000
+        self.assertGreaterEqual(cache.memory_usage(), 1000)
+        self.assertEquals(budget.total_bytes, cache.memory_usage())
+
+        # replacing the value should update the estimate
+        cache["key1"] = "x" * 10
+        self.assertLess(cache.memory_usage(), 1000)
+        self.assertEquals(budget.total_bytes, cache.memory_usage())
+
+        cache.pop("key1")
+        self.assertEquals(cache.memory_usage(), 0)
+        self.assertEquals(budget.total_bytes, 0)
+
+        cache["key1"] = "x" * 1000
+        cache["key2"] = "x" * 1000
+        cache.clear()
+        self.assertEquals(cache.memory_usage(), 0)
+        self.assertEquals(budget.total_bytes, 0)
+
+    def test_existing_entries_counted(self):
+        cache = LruCache(10)
+        cache["key1"] = "x" * 1000
+
+        budget = CacheMemoryBudget(10 ** 9)
+        budget.track("cache", cache)
+        self.assertGreaterEqual(budget.total_bytes, 1000)
+
+    def test_replace_tracked_cache(self):
+        budget = CacheMemoryBudget(10 ** 9)
+        cache1 = LruCache(10)
+        cache1["key1"] = "x" * 1000
+        budget.track("cache", cache1)
+
+        cache2 = LruCache(10)
+        cache2["key1"] = "x" * 100
+        budget.track("cache", cache2)
+
+        # only the replacement cache should be counted
+        self.assertEquals(budget.total_bytes, cache2.memory_usage())
+
+        # and the old cache should no longer affect the total
+        cache1.clear()
+        self.assertEquals(budget.total_bytes, cache2.memory_usage())
+
+    def test_evict_across_caches(self):
+        entry_size = estimate_size("key1") + estimate_size("x" * 1000)
+        budget = CacheMemoryBudget(entry_size * 3)
+
+        m = Mock()
+        cache1 = LruCache(10, evicted_callback=m)
+        cache2 = LruCache(10)
+        budget.track("cache1", cache1)
+        budget.track("cache2", cache2)
+
+        cache1["key1"] = "x" * 1000
+        cache2["key2"] = "x" * 1000
+        cache1["key3"] = "x" * 1000
+
+        # touch key1 so that key2, in the other cache, is now the oldest entry
+        cache1.get("key1")
+
+        cache2["key4"] = "x" * 1000
+
+        self.assertLessEqual(budget.total_bytes, budget.max_bytes)
+        self.assertEquals(cache1.get("key1"), "x" * 1000)
+        self.assertEquals(cache2.get("key2"), None)
+        self.assertEquals(cache1.get("key3"), "x" * 1000)
+        self.assertEquals(cache2.get("key4"), "x" * 1000)
+        self.assertEquals(m.call_count, 0)
+
+        # a large entry should push out everything older than it
+        cache2["key5"] = "x" * 2500
+        self.assertLessEqual(budget.total_bytes, budget.max_bytes)
+        self.assertEquals(len(cache1), 0)
+        self.assertEquals(m.call_count, 2)
+        self.assertEquals(cache2.get("key5"), "x" * 2500)
+
+    def test_estimate_size(self):
+        small = estimate_size({"a": "b"})
+        large = estimate_size({"a": ["b" * 1000, {"c": "d" * 1000}]})
+        self.assertGreater(large, small + 2000)
+
+        class Slotted(object):
+            __slots__ = ["value"]
+
+            def __init__(self, value):
+                self.value = value
+
+        self.assertGreater(estimate_size(Slotted("x" * 1000)), 1000)
@@ -453,7 +453,9 @@ class MockHttpResource(HttpServer):
 
         raise KeyError("No event can handle %s" % path)
 
-    def register_paths(self, method, path_patterns, callback, servlet_name):
+    def register_paths(
+        self, method, path_patterns, callback, servlet_name, stream_response=False
+    ):
         for path_pattern in path_patterns:
             self.callbacks.append((method, path_pattern, callback))
 